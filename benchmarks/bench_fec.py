@@ -0,0 +1,145 @@
+"""
+隧道前向纠错测试工具
+在回环地址上运行隧道客户端与对端，按链路模拟随机丢包和延迟，比较不同 FEC 设置下的端到端送达率，
+并测量 XOR 校验编码/恢复的吞吐量
+
+数据报从本地程序经隧道到对端，再经 UDP 回显原路返回，两个方向都经过有丢包的链路
+
+用法:
+    python benchmarks/bench_fec.py [--loss 0,0.01,0.05] [--packets 10000] [--rate 2000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding.health import start_udp_echo_server  # noqa: E402
+from bonding.scheduler import Link  # noqa: E402
+from bonding.tunnel import SOCKET_BUFFER, FecEncoder, TunnelClient, TunnelPeer, xor_payloads  # noqa: E402
+
+
+class LossyTransport:
+    """
+    包装数据报传输，按概率丢弃并附加固定延迟，模拟一条有损链路
+    """
+    def __init__(self, transport, loss, delay, rng):
+        self.transport = transport
+        self.loss = loss
+        self.delay = delay
+        self.rng = rng
+        self.dropped = 0
+
+    def sendto(self, data, addr=None):
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        args = (data,) if addr is None else (data, addr)
+        asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, *args)
+
+    def close(self):
+        self.transport.close()
+
+
+def enlarge_buffer(transport):
+    # 重排缓冲区放弃缺口时会一次交付一批包，回显服务和本地程序的套接字也需要足够的接收缓冲
+    transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+
+
+async def run_case(fec, losses, delays, packets, rate, seed):
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    echo = await start_udp_echo_server('127.0.0.1', 0)
+    enlarge_buffer(echo)
+    peer = TunnelPeer(('127.0.0.1', 0), echo.get_extra_info('sockname')[:2], fec=fec)
+    await peer.start()
+    links = [Link(f'link{i}', f'127.0.0.{i + 2}') for i in range(len(losses))]
+    client = TunnelClient(links, peer.listen, fec=fec)
+    await client.start()
+
+    # 上行：替换客户端各链路的套接字；下行：对端按路径编号经有损链路发送
+    for path, loss in enumerate(losses):
+        client._paths[path] = LossyTransport(client._paths[path], loss, delays[path], rng)
+    downlinks = [LossyTransport(peer._tunnel, loss, delays[path], rng) for path, loss in enumerate(losses)]
+    peer._sendto = lambda path, datagram: downlinks[path].sendto(datagram, peer._paths[path][0])
+
+    received = set()
+
+    class App(asyncio.DatagramProtocol):
+        def datagram_received(self, data, addr):
+            received.add(int.from_bytes(data[:4], 'big'))
+
+    app, _ = await loop.create_datagram_endpoint(App, remote_addr=client.listen)
+    enlarge_buffer(app)
+    padding = os.urandom(1196)
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    for i in range(packets):
+        app.sendto(i.to_bytes(4, 'big') + padding)
+        delay = start + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.sleep(max(delays) * 2 + 0.5)
+
+    stats = client.stats(), peer.stats()
+    app.close()
+    await client.stop()
+    await peer.stop()
+    echo.close()
+    return len(received), stats
+
+
+def bench_codec(size=1200, group=8, rounds=2000):
+    payloads = [os.urandom(size) for _ in range(group)]
+    encoder = FecEncoder(group)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for seq, payload in enumerate(payloads):
+            parity = encoder.add(seq, payload)
+    encode = size * group * rounds / (time.perf_counter() - start)
+
+    data = parity[1][4:]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        xor_payloads([data] + payloads[1:])
+    decode = size * group * rounds / (time.perf_counter() - start)
+    return encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loss', default='0,0.01,0.05', help="各链路丢包率，逗号分隔")
+    parser.add_argument('--delay', default='5,10,20', help="各链路单向延迟（毫秒），逗号分隔")
+    parser.add_argument('--packets', type=int, default=10000, help="每种设置发送的数据报数")
+    parser.add_argument('--rate', type=int, default=2000, help="发送速率（包/秒）")
+    parser.add_argument('--fec', default='off,auto,4', help="参与比较的 FEC 设置，逗号分隔")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    losses = [float(x) for x in args.loss.split(',')]
+    delays = [float(x) / 1000 for x in args.delay.split(',')]
+    if len(delays) != len(losses):
+        parser.error("--loss 与 --delay 的条数必须一致")
+
+    encode, decode = bench_codec()
+    print(f"XOR 编码 {encode / 1e6:.0f} MB/s，恢复 {decode / 1e6:.0f} MB/s（1200 字节 × 8 包/组）")
+    print(f"链路丢包率 {losses}，单向延迟 {[d * 1000 for d in delays]} ms，往返经过两次有损链路")
+    print(f"{'FEC':<6}{'送达率':>8}{'组大小':>8}{'校验包':>8}{'恢复':>8}{'迟到':>6}{'丢失':>6}{'重排峰值':>9}")
+    for setting in args.fec.split(','):
+        fec = int(setting) if setting.isdigit() else setting
+        delivered, (client, peer) = asyncio.run(run_case(fec, losses, delays, args.packets, args.rate, args.seed))
+        late = client['reorder']['late'] + peer['reorder']['late']
+        lost = client['reorder']['lost'] + peer['reorder']['lost']
+        depth = max(client['reorder']['max_depth'], peer['reorder']['max_depth'])
+        print(f"{setting:<6}{delivered / args.packets:>9.2%}{client['fec_group']:>9}"
+              f"{client['parity_sent'] + peer['parity_sent']:>10}{client['recovered'] + peer['recovered']:>9}"
+              f"{late:>7}{lost:>7}{depth:>10}")
+
+
+if __name__ == '__main__':
+    main()
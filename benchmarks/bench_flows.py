@@ -0,0 +1,134 @@
+"""
+流表基准测试
+在 100 万个流的规模上测量流表的插入、查找、空闲超时淘汰和满表 LRU 淘汰耗时，并报告进程常驻内存（RSS）的增量；
+同时给出每项一个 __slots__ 对象、放在 OrderedDict 中维护 LRU 的朴素实现的内存作对比
+
+流的键与调度器中相同，为 (客户端地址, 目标主机) 元组
+
+用法:
+    python benchmarks/bench_flows.py [--flows 1000000] [--links 4]
+"""
+
+import argparse
+import collections
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding.flows import FlowTable  # noqa: E402
+
+
+def rss():
+    """
+    当前进程的常驻内存（字节），无法获取时返回 None
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss 是峰值：Linux 以 KB 为单位，macOS 以字节为单位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def make_keys(count):
+    return [(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", f"host{i % 50000}.example.com") for i in range(count)]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16}{elapsed:>8.2f} s{elapsed / count * 1e9:>10.0f} ns/次")
+
+
+def bench_table(keys, links):
+    clock = FakeClock()
+    table = FlowTable(timeout=60, capacity=len(keys), clock=clock)
+    before = rss()
+
+    def insert():
+        for i, key in enumerate(keys):
+            table.put(key, i % links)
+            if not i & 1023:
+                clock.now += 0.001
+
+    timed("插入", len(keys), insert)
+    after = rss()
+    if before is not None and after is not None:
+        print(f"{'内存':<16}{(after - before) / 2 ** 20:>8.1f} MB{(after - before) / len(keys):>10.0f} B/流（含键）")
+    print(f"{'各链路流数':<16}{table.counts()}")
+
+    timed("查找", len(keys), lambda: [table.get(key) for key in keys])
+
+    # 一半的流保持活跃，另一半空闲超时；推进时间后由定时轮淘汰
+    clock.now += 30
+    half = keys[::2]
+    for key in half:
+        table.get(key)
+    clock.now += 31
+    evicted = []
+    timed("空闲淘汰", len(keys) - len(half), lambda: evicted.append(table.expire()))
+    print(f"{'':<16}淘汰 {evicted[0]}，剩余 {len(table)}")
+
+    # 表满后每插入一个新流淘汰一个最久未使用的流
+    table.capacity = len(table)
+    fresh = [(key[0], key[1] + '.new') for key in half]
+    timed("满表 LRU 淘汰", len(fresh), lambda: [table.put(key, 0) for key in fresh])
+    print(f"{'':<16}{table.stats()}")
+    return table
+
+
+class Entry:
+    __slots__ = ('link', 'seen', 'due')
+
+    def __init__(self, link, seen, due):
+        self.link = link
+        self.seen = seen
+        self.due = due
+
+
+def bench_ordered_dict(keys, links):
+    gc.collect()
+    before = rss()
+    table = collections.OrderedDict()
+    for i, key in enumerate(keys):
+        table[key] = Entry(i % links, time.monotonic(), i + 100000)
+    after = rss()
+    if before is not None and after is not None:
+        print(f"{'朴素实现内存':<16}{(after - before) / 2 ** 20:>8.1f} MB{(after - before) / len(keys):>10.0f} B/流（含键）")
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flows', type=int, default=1000000, help="流数")
+    parser.add_argument('--links', type=int, default=4, help="链路数")
+    args = parser.parse_args()
+
+    keys = make_keys(args.flows)
+    print(f"{args.flows} 个流，{args.links} 条链路")
+    table = bench_table(keys, args.links)
+    del table
+    gc.collect()
+    bench_ordered_dict(keys, args.links)
+
+
+if __name__ == '__main__':
+    main()
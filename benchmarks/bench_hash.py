@@ -0,0 +1,71 @@
+"""
+哈希调度基准测试
+比较朴素取模哈希与 Maglev 查找表的单次查找耗时，以及链路增减时的键迁移比例
+
+用法:
+    python benchmarks/bench_hash.py [--links 4] [--keys 100000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding.hashring import MaglevTable, hash_key  # noqa: E402
+from bonding.scheduler import Link, Scheduler  # noqa: E402
+
+
+def naive_mapping(links, keys):
+    return [links[hash_key(k) % len(links)].name for k in keys]
+
+
+def scheduler_mapping(links, keys):
+    scheduler = Scheduler(links, "dest_hash")
+    return [scheduler.select(dst=k).name for k in keys]
+
+
+def moved(before, after):
+    return sum(1 for a, b in zip(before, after) if a != b) / len(before)
+
+
+def time_lookup(func, keys, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for k in keys:
+            func(k)
+        best = min(best, time.perf_counter() - start)
+    return best / len(keys) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--links', type=int, default=4, help="链路数量")
+    parser.add_argument('--keys', type=int, default=100000, help="测试键数量")
+    args = parser.parse_args()
+
+    keys = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(args.keys)]
+    links = [Link(f"link{i}", f"127.0.0.{i + 2}", weight=10 * (i + 1)) for i in range(args.links)]
+
+    start = time.perf_counter()
+    table = MaglevTable([(l.name, l.effective_weight, l) for l in links])
+    build_ms = (time.perf_counter() - start) * 1000
+
+    scheduler = Scheduler(links, "dest_hash")
+    print(f"链路数: {args.links}  键数: {args.keys}  Maglev表大小: {table.size}  建表: {build_ms:.1f} ms")
+    print(f"查找耗时  朴素取模: {time_lookup(lambda k: links[hash_key(k) % len(links)], keys):7.0f} ns/op")
+    print(f"查找耗时  Maglev表: {time_lookup(table.lookup, keys):7.0f} ns/op")
+    print(f"查找耗时  调度器  : {time_lookup(lambda k: scheduler.select(dst=k), keys):7.0f} ns/op")
+
+    base_naive = naive_mapping(links, keys)
+    base_maglev = scheduler_mapping(links, keys)
+    for label, changed in (("移除一条链路", links[:-1]),
+                           ("增加一条链路", links + [Link("extra", "127.0.0.250", weight=25)])):
+        print(f"{label}  键迁移比例  朴素取模: {moved(base_naive, naive_mapping(changed, keys)):6.1%}  "
+              f"Maglev: {moved(base_maglev, scheduler_mapping(changed, keys)):6.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+负载均衡模式基准测试
+在回环地址上模拟多条带宽、延迟、丢包各不相同的链路，让大文件、大量小请求和两者混合的负载经叠加代理传输，
+比较各负载均衡模式（以及只用第一条链路的基准）的总吞吐量、请求耗时 p50/p99、各流公平性和代理 CPU 消耗
+
+模拟方式:
+    - 链路 i 对应源地址 127.0.0.(i+2)，代理绑定该地址连接目标；目标服务器按连接的来源地址识别链路
+    - 每条链路的下行由一个令牌桶限速，所有经过该链路的连接共享带宽；每个数据块再加上单向延迟后按序送达
+    - 丢包按快速重传折算：数据块中任一报文丢失时该块额外延迟一个往返（不模拟拥塞窗口减半）
+    - 客户端从 127.0.1.x 发起连接、访问 127.0.2.x 上的目标，分别模拟多台设备和多个网站，供两种哈希模式分流
+
+代理运行在独立线程的事件循环中，CPU 时间只统计该线程；结果可用 --json 保存，便于回归比较
+
+用法:
+    python benchmarks/bench_modes.py [--links 50:10:0,30:25:0.001,20:40:0.005] [--modes round_robin,least_conn]
+                                     [--workloads bulk,small,mixed] [--json result.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding.proxy import BondingProxy  # noqa: E402
+from bonding.scheduler import MODES, Link, Scheduler  # noqa: E402
+
+
+CHUNK = 16 * 1024
+BURST = 64 * 1024
+MSS = 1448
+REQUEST = struct.Struct('!Q')
+WORKLOADS = ('bulk', 'small', 'mixed')
+
+
+class EmulatedLink:
+    """
+    一条模拟链路的下行：令牌桶限速、固定单向延迟和随机丢包
+
+    Args:
+        name: 链路名
+        ip: 代理出站绑定的源地址
+        rate: 带宽（Mbit/s）
+        delay: 单向延迟（秒）
+        loss: 报文丢失率
+        rng: 随机数发生器
+    """
+    def __init__(self, name, ip, rate, delay, loss, rng):
+        self.name = name
+        self.ip = ip
+        self.rate = rate
+        self.delay = delay
+        self.loss = loss
+        self.rng = rng
+        self.bytes = 0
+        self._clock = 0.0
+
+    async def consume(self, size):
+        """
+        等待令牌桶放行 size 字节；桶深 BURST，并发连接按到达顺序排队
+        """
+        now = asyncio.get_running_loop().time()
+        bytes_per_second = self.rate * 1e6 / 8
+        start = max(self._clock, now - BURST / bytes_per_second)
+        self._clock = start + size / bytes_per_second
+        self.bytes += size
+        if self._clock > now:
+            await asyncio.sleep(self._clock - now)
+
+    def transit(self, size):
+        """
+        一个数据块的传输延迟：单向延迟，块中有报文丢失时再加一个往返
+        """
+        packets = -(-size // MSS)
+        if self.loss and self.rng.random() < 1 - (1 - self.loss) ** packets:
+            return 3 * self.delay
+        return self.delay
+
+
+class Origin:
+    """
+    目标服务器：读取 8 字节的请求长度，经连接所属的模拟链路返回这么多字节
+    """
+    def __init__(self, links):
+        self.links = {link.ip: link for link in links}
+        self.payload = memoryview(os.urandom(CHUNK))
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        link = self.links[writer.get_extra_info('peername')[0]]
+        try:
+            size, = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+            # 代理到目标的握手在回环上瞬间完成，补上握手往返和请求的单向延迟
+            await asyncio.sleep(3 * link.delay)
+            release = 0.0
+            left = size
+            while left:
+                n = min(CHUNK, left)
+                await link.consume(n)
+                release = max(release, loop.time() + link.transit(n))
+                loop.call_at(release, writer.write, self.payload[:n])
+                left -= n
+            await asyncio.sleep(max(0.0, release - loop.time()))
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class ProxyThread:
+    """
+    在独立线程的事件循环中运行叠加代理
+    """
+    def __init__(self, links, mode):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.proxy = BondingProxy(Scheduler(links, mode), port=0, relay_mode='stream')
+
+    async def call(self, coro):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def start(self):
+        self.thread.start()
+        await self.call(self.proxy.start())
+
+    async def cpu(self):
+        async def thread_time():
+            return time.thread_time()
+        return await self.call(thread_time())
+
+    async def stop(self):
+        await self.call(self.proxy.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+async def fetch(proxy_port, source, target, size):
+    """
+    从 source 经 SOCKS5 代理向 target 请求 size 字节
+
+    Returns:
+        从发起连接到收完数据的耗时（秒）
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port, local_addr=(source, 0))
+    try:
+        writer.write(b'\x05\x01\x00')
+        await reader.readexactly(2)
+        writer.write(b'\x05\x01\x00\x01' + socket.inet_aton(target[0]) + struct.pack('!H', target[1]))
+        reply = await reader.readexactly(10)
+        if reply[1] != 0:
+            raise RuntimeError(f"SOCKS5 连接 {target[0]} 失败: {reply[1]}")
+        writer.write(REQUEST.pack(size))
+        received = 0
+        while received < size:
+            data = await reader.read(256 * 1024)
+            if not data:
+                break
+            received += len(data)
+    finally:
+        writer.close()
+    if received != size:
+        raise RuntimeError(f"收到 {received} 字节，应为 {size}")
+    return loop.time() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def jain_index(values):
+    """
+    Jain 公平性指数：各流吞吐量完全相同时为 1，只有一个流有吞吐时为 1/n
+    """
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values)) if values else 1.0
+
+
+async def run_case(args, emulated, targets, mode, workload):
+    links = [Link(link.name, link.ip, speed=link.rate) for link in emulated]
+    thread = ProxyThread(links[:1] if mode == 'single' else links, 'round_robin' if mode == 'single' else mode)
+    await thread.start()
+    for link in emulated:
+        link.bytes = 0
+    port = thread.proxy.port
+    clients = [f"127.0.1.{i + 1}" for i in range(args.clients)]
+
+    def endpoints(i):
+        # 客户端和目标交错组合，避免第 i 个客户端总是访问第 i 个目标
+        return clients[i % len(clients)], targets[i // len(clients) % len(targets)]
+
+    bulk = []
+    small = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bulk_flow(i):
+        size = args.bulk_size * 1024 * 1024
+        elapsed = await fetch(port, *endpoints(i), size)
+        bulk.append(size / elapsed)
+
+    async def small_flow(i):
+        async with semaphore:
+            small.append(await fetch(port, *endpoints(i), args.small_size * 1024))
+
+    jobs = []
+    if workload in ('bulk', 'mixed'):
+        jobs += [bulk_flow(i) for i in range(args.bulk_flows)]
+    if workload in ('small', 'mixed'):
+        jobs += [small_flow(i) for i in range(args.small_requests)]
+
+    cpu = await thread.cpu()
+    start = time.perf_counter()
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - start
+    cpu = await thread.cpu() - cpu
+    await thread.stop()
+
+    total = sum(link.bytes for link in emulated)
+    result = {
+        'mode': mode,
+        'workload': workload,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_mbps': round(total * 8 / elapsed / 1e6, 2),
+        'cpu_s': round(cpu, 3),
+        'cpu_s_per_gb': round(cpu / (total / 1e9), 2) if total else None,
+        'link_share': {link.name: round(link.bytes / total, 3) if total else 0.0 for link in emulated},
+    }
+    if bulk:
+        result['fairness'] = round(jain_index(bulk), 3)
+    if small:
+        result['p50_ms'] = round(percentile(small, 0.5) * 1000, 1)
+        result['p99_ms'] = round(percentile(small, 0.99) * 1000, 1)
+    return result
+
+
+def parse_links(spec):
+    """
+    解析链路参数：逗号分隔的 带宽Mbit/s:单向延迟ms:丢包率
+    """
+    links = []
+    for item in spec.split(","):
+        rate, delay, loss = (item.split(':') + ['0', '0'])[:3]
+        links.append((float(rate), float(delay) / 1000, float(loss)))
+    return links
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    emulated = [EmulatedLink(f"link{i}", f"127.0.0.{i + 2}", rate, delay, loss, rng)
+                for i, (rate, delay, loss) in enumerate(parse_links(args.links))]
+    origin = Origin(emulated)
+    servers = [await asyncio.start_server(origin.handle, f"127.0.2.{i + 1}", 0) for i in range(args.targets)]
+    targets = [server.sockets[0].getsockname()[:2] for server in servers]
+
+    results = []
+    print(f"{'模式':<13}{'负载':<7}{'Mbit/s':>9}{'相对单链路':>10}{'p50 ms':>9}{'p99 ms':>9}{'公平性':>8}"
+          f"{'CPU s/GB':>10}  链路分担")
+    baseline = {}
+    for mode in ['single'] + args.modes.split(','):
+        for workload in args.workloads.split(','):
+            result = await run_case(args, emulated, targets, mode, workload)
+            if mode == 'single':
+                baseline[workload] = result['throughput_mbps']
+            result['speedup'] = round(result['throughput_mbps'] / baseline[workload], 2) \
+                if baseline.get(workload) else None
+            results.append(result)
+            share = ' '.join(f"{v:.0%}" for v in result['link_share'].values())
+            print(f"{mode:<13}{workload:<7}{result['throughput_mbps']:>9.1f}{result['speedup'] or 0:>10.2f}"
+                  f"{result.get('p50_ms', '-'):>9}{result.get('p99_ms', '-'):>9}{result.get('fairness', '-'):>8}"
+                  f"{result['cpu_s_per_gb'] or 0:>10.2f}  {share}")
+
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'links': [{'name': link.name, 'rate_mbps': link.rate, 'delay_ms': link.delay * 1000, 'loss': link.loss}
+                  for link in emulated],
+        'params': {key: value for key, value in vars(args).items() if key != 'json'},
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--links', default='50:10:0,30:25:0.001,20:40:0.005',
+                        help="模拟链路，逗号分隔的 带宽Mbit/s:单向延迟ms:丢包率")
+    parser.add_argument('--modes', default='round_robin,source_hash,dest_hash,least_conn,weighted',
+                        help="参与比较的负载均衡模式，逗号分隔；single（只用第一条链路）总是作为基准运行")
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help="负载类型: bulk、small、mixed，逗号分隔")
+    parser.add_argument('--bulk-flows', type=int, default=8, help="大文件负载的并发流数")
+    parser.add_argument('--bulk-size', type=int, default=4, help="每个大文件流的数据量（MB）")
+    parser.add_argument('--small-requests', type=int, default=300, help="小请求负载的请求数")
+    parser.add_argument('--small-size', type=int, default=32, help="每个小请求的响应大小（KB）")
+    parser.add_argument('--concurrency', type=int, default=32, help="小请求的并发数")
+    parser.add_argument('--clients', type=int, default=4, help="模拟的客户端设备数（源地址个数）")
+    parser.add_argument('--targets', type=int, default=4, help="模拟的目标网站数（目标地址个数）")
+    parser.add_argument('--seed', type=int, default=1, help="丢包随机数种子")
+    parser.add_argument('--json', metavar='FILE', help="把结果以 JSON 写入文件，- 表示标准输出")
+    args = parser.parse_args()
+    for mode in args.modes.split(','):
+        if mode not in MODES:
+            parser.error(f"未知的模式: {mode}")
+    for workload in args.workloads.split(','):
+        if workload not in WORKLOADS:
+            parser.error(f"未知的负载: {workload}")
+    if sys.platform != 'linux':
+        print("需要 127.0.0.x 回环地址（Linux）", file=sys.stderr)
+        return 1
+
+    report = asyncio.run(run(args))
+    if args.json == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+转发基准测试
+在回环地址上通过叠加代理传输数据，比较各转发方式的吞吐量和每 GB 消耗的 CPU 时间
+
+发送端和接收端运行在独立线程中，CPU 时间只统计代理所在的事件循环线程
+
+用法:
+    python benchmarks/bench_relay.py [--size 1024] [--modes stream,buffer,splice]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding.proxy import BondingProxy  # noqa: E402
+from bonding.relay import HAS_SPLICE  # noqa: E402
+from bonding.scheduler import Link, Scheduler  # noqa: E402
+
+
+BLOCK = 256 * 1024
+
+
+def sink_server():
+    """
+    接收并丢弃数据，连接结束后把收到的字节数写回给对端
+    """
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve():
+        conn, _ = server.accept()
+        buf = bytearray(BLOCK)
+        total = 0
+        while True:
+            n = conn.recv_into(buf)
+            if not n:
+                break
+            total += n
+        conn.sendall(struct.pack('!Q', total))
+        conn.close()
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def send_through(proxy_port, target_port, size, result):
+    sock = socket.create_connection(('127.0.0.1', proxy_port))
+    sock.sendall(b'\x05\x01\x00')
+    sock.recv(2)
+    sock.sendall(b'\x05\x01\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', target_port))
+    reply = sock.recv(10)
+    if reply[1] != 0:
+        raise RuntimeError("SOCKS5 连接失败")
+
+    data = memoryview(os.urandom(BLOCK))
+    left = size
+    while left:
+        n = min(left, BLOCK)
+        sock.sendall(data[:n])
+        left -= n
+    sock.shutdown(socket.SHUT_WR)
+    received = b''
+    while len(received) < 8:
+        chunk = sock.recv(8 - len(received))
+        if not chunk:
+            break
+        received += chunk
+    sock.close()
+    result.append(struct.unpack('!Q', received)[0])
+
+
+async def run_mode(mode, size):
+    link = Link('lo', '127.0.0.1')
+    proxy = BondingProxy(Scheduler([link]), port=0, relay_mode=mode)
+    await proxy.start()
+    target = sink_server()
+    result = []
+    loop = asyncio.get_running_loop()
+
+    cpu = time.thread_time()
+    start = time.perf_counter()
+    await loop.run_in_executor(None, send_through, proxy.port, target, size, result)
+    elapsed = time.perf_counter() - start
+    cpu = time.thread_time() - cpu
+
+    await proxy.stop()
+    if result != [size]:
+        raise RuntimeError(f"{mode}: 接收端收到 {result} 字节，应为 {size}")
+    return elapsed, cpu, link.bytes_sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024, help="每种方式传输的数据量（MB）")
+    parser.add_argument('--modes', default='stream,buffer' + (',splice' if HAS_SPLICE else ''),
+                        help="参与比较的转发方式，逗号分隔")
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    gb = size / 1e9
+    print(f"{'方式':<10}{'Gbit/s':>10}{'CPU 秒/GB':>12}{'耗时 s':>10}")
+    for mode in args.modes.split(','):
+        elapsed, cpu, counted = asyncio.run(run_mode(mode, size))
+        if counted != size:
+            raise RuntimeError(f"{mode}: 链路统计 {counted} 字节，应为 {size}")
+        print(f"{mode:<10}{size * 8 / elapsed / 1e9:>10.2f}{cpu / gb:>12.3f}{elapsed:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+流量整形测试工具
+在单个事件循环中模拟大量连接经同一条限速链路转发，比较:
+    - sleep:  每个数据块各自计算等待时间并 asyncio.sleep（逐块定时器的做法）
+    - fifo:   shaper.Shaper，合并定时器，先到先得
+    - fair:   shaper.Shaper，合并定时器，按连接公平排队
+测量总速率相对限速的误差、大流量连接之间的 Jain 公平指数、交互连接（偶尔发送少量数据）的等待延迟、
+定时器唤醒次数和 CPU 时间；另经回环地址上的叠加代理检查端到端限速，并检查流量配额的标记、避让和跨日归零
+
+用法:
+    python benchmarks/bench_shaper.py [--flows 1000] [--rate 1000] [--duration 5] [--interactive 20]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding.engine import BondingEngine  # noqa: E402
+from bonding.profiles import UsageStore  # noqa: E402
+from bonding.relay import CHUNK_SIZE  # noqa: E402
+from bonding.scheduler import MBIT, Link, Scheduler  # noqa: E402
+from bonding.shaper import QuotaTracker, Shaper, TokenBucket  # noqa: E402
+
+
+INTERACTIVE_SIZE = 512
+INTERACTIVE_INTERVAL = 0.05
+END_TO_END_LIMIT = 25
+
+
+class SleepFlow:
+    """
+    对照组：共用一个令牌桶，令牌不足时每个数据块各自 sleep 到预计的放行时间
+    """
+    wakeups = 0
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    async def consume(self, direction, count):
+        loop = asyncio.get_running_loop()
+        while not self.bucket.take(count, loop.time()):
+            SleepFlow.wakeups += 1
+            await asyncio.sleep(self.bucket.delay())
+
+
+def jain(values):
+    """
+    Jain 公平指数：各值相等时为 1，只有一个非零时为 1/n
+    """
+    total = sum(values)
+    return total * total / (len(values) * sum(v * v for v in values)) if total else 0.0
+
+
+async def bulk(flow, counts, index, stop):
+    while not stop.is_set():
+        await flow.consume('recv', CHUNK_SIZE)
+        counts[index] += CHUNK_SIZE
+
+
+async def interactive(flow, delays, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await flow.consume('recv', INTERACTIVE_SIZE)
+        delays.append(loop.time() - start)
+        await asyncio.sleep(INTERACTIVE_INTERVAL)
+
+
+async def simulate(kind, args):
+    loop = asyncio.get_running_loop()
+    link = Link('metered', '127.0.0.2')
+    if kind == 'sleep':
+        SleepFlow.wakeups = 0
+        bucket = TokenBucket(args.rate * MBIT, now=loop.time())
+        make_flow = lambda: SleepFlow(bucket)  # noqa: E731
+        shaper = None
+    else:
+        shaper = Shaper({link.name: args.rate}, fair=kind == 'fair')
+        make_flow = lambda: shaper.flow(link)  # noqa: E731
+
+    stop = asyncio.Event()
+    counts = [0] * args.flows
+    delays = []
+    tasks = [asyncio.ensure_future(bulk(make_flow(), counts, i, stop)) for i in range(args.flows)]
+    tasks += [asyncio.ensure_future(interactive(make_flow(), delays, stop)) for _ in range(args.interactive)]
+    # 跳过开始时的突发和排队建立过程，只统计稳定阶段
+    await asyncio.sleep(1.0)
+    base = list(counts)
+    skipped = len(delays)
+    cpu = time.process_time()
+    wakeups = SleepFlow.wakeups if shaper is None else shaper.wakeups
+    start = loop.time()
+    await asyncio.sleep(args.duration)
+    elapsed = loop.time() - start
+    cpu = time.process_time() - cpu
+    wakeups = (SleepFlow.wakeups if shaper is None else shaper.wakeups) - wakeups
+    sent = [c - b for c, b in zip(counts, base)]
+    delays = delays[skipped:]
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    rate = (sum(sent) + len(delays) * INTERACTIVE_SIZE) / elapsed
+    delays.sort()
+    return {
+        'rate': rate / MBIT,
+        'error': rate / (args.rate * MBIT) - 1,
+        'jain': jain(sent),
+        'p50': delays[len(delays) // 2] * 1000 if delays else None,
+        'p99': delays[int(len(delays) * 0.99)] * 1000 if delays else None,
+        'served': len(delays),
+        'wakeups': wakeups / elapsed,
+        'cpu': cpu / elapsed,
+    }
+
+
+def print_simulation(results, args):
+    print(f"{args.flows} 条大流量连接 + {args.interactive} 条交互连接，限速 {args.rate} Mbit/s，统计 {args.duration} 秒")
+    print(f"{'方式':<8}{'速率 Mbit/s':>12}{'误差':>8}{'Jain':>8}{'交互 p50':>10}{'交互 p99':>10}"
+          f"{'完成':>7}{'唤醒/秒':>9}{'CPU':>7}")
+    for kind, r in results.items():
+        p50 = f"{r['p50']:.1f}ms" if r['p50'] is not None else "-"
+        p99 = f"{r['p99']:.1f}ms" if r['p99'] is not None else "-"
+        print(f"{kind:<8}{r['rate']:>12.1f}{r['error']:>+8.1%}{r['jain']:>8.3f}{p50:>10}{p99:>10}"
+              f"{r['served']:>7}{r['wakeups']:>9.0f}{r['cpu']:>7.0%}")
+
+
+async def serve_data(size):
+    async def handle(reader, writer):
+        block = b'x' * CHUNK_SIZE
+        left = size
+        try:
+            while left > 0:
+                writer.write(block[:left])
+                left -= min(left, CHUNK_SIZE)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def socks_download(proxy, port):
+    with socket.create_connection(proxy) as sock:
+        sock.sendall(b'\x05\x01\x00')
+        sock.recv(2)
+        sock.sendall(b'\x05\x01\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', port))
+        if sock.recv(10)[1] != 0:
+            raise OSError("代理连接目标失败")
+        total = 0
+        while True:
+            data = sock.recv(1 << 16)
+            if not data:
+                return total
+            total += len(data)
+
+
+async def end_to_end(args):
+    """
+    两条回环"链路"各限速 END_TO_END_LIMIT Mbit/s，经叠加代理并发下载，总速率应接近两者之和
+    """
+    limit = END_TO_END_LIMIT
+    size = int(limit * MBIT * 2)
+    server = await serve_data(size)
+    port = server.sockets[0].getsockname()[1]
+    interfaces = [{'name': 'lo-a', 'ip': '127.0.0.2'}, {'name': 'lo-b', 'ip': '127.0.0.3'}]
+    engine = BondingEngine(interfaces, 'round_robin', port=0, relay='buffer',
+                           limits={'lo-a': limit, 'lo-b': limit}, fair=True)
+    engine.start()
+    loop = asyncio.get_running_loop()
+    try:
+        start = time.perf_counter()
+        totals = await asyncio.gather(*(loop.run_in_executor(None, socks_download, engine.address, port)
+                                        for _ in range(4)))
+        elapsed = time.perf_counter() - start
+        shaper = engine.status()['shaping']['shaper']
+    finally:
+        engine.stop()
+        server.close()
+        await server.wait_closed()
+    rate = sum(totals) * 8 / elapsed / 1e6
+    print(f"\n经代理下载（2 条链路各限速 {limit:g} Mbit/s，4 条连接）: {sum(totals) / 1048576:.1f} MB，"
+          f"{elapsed:.2f} 秒，{rate:.1f} Mbit/s（上限 {2 * limit:g}），放行 {shaper['grants']} 块，"
+          f"唤醒 {shaper['wakeups']} 次")
+    return abs(rate / (2 * limit) - 1) < 0.15 and sum(totals) == 4 * size
+
+
+def quota_checks():
+    """
+    用临时目录中的用量文件检查配额标记、调度避让、全部接近配额时的退路和跨日归零
+
+    Returns:
+        [(是否通过, 说明)]
+    """
+    checks = []
+
+    def check(condition, text):
+        checks.append((bool(condition), text))
+
+    with tempfile.TemporaryDirectory() as directory:
+        links = [Link('hotspot', '10.0.0.2'), Link('fiber', '10.0.1.2')]
+        interfaces = [{'name': 'hotspot', 'mac': 'aa:bb'}, {'name': 'fiber', 'mac': 'cc:dd'}]
+        scheduler = Scheduler(links, 'weighted')
+        changes = []
+        today = time.mktime((2026, 3, 30, 12, 0, 0, 0, 0, -1))
+        tracker = QuotaTracker(links, interfaces, {'hotspot': {'day': 1 << 20, 'month': 10 << 20}},
+                               lambda: changes.append(True), UsageStore(directory))
+        tracker.sample(today)
+        links[0].bytes_recv = 900 << 10
+        tracker.sample(today)
+        check(not links[0].capped, "用量低于配额的 95% 时不标记")
+        links[0].bytes_recv = 1000 << 10
+        tracker.sample(today)
+        check(links[0].capped and changes, "接近日配额时标记并通知刷新")
+        check({scheduler.select().name for _ in range(20)} == {'fiber'}, "新连接避开接近配额的链路")
+        check(scheduler.candidates() == [links[1]], "低延迟选路同样避开")
+        links[1].capped = True
+        check(scheduler.select() is not None, "全部接近配额时仍可选路")
+        links[1].capped = False
+        check(UsageStore(directory).get('aa:bb', today)['day_bytes'] == 1000 << 10, "用量写入文件")
+        tracker.sample(today + 86400)
+        check(not links[0].capped, "跨日后日用量归零并取消标记")
+        check(tracker.store.get('aa:bb', today + 86400)['month_bytes'] == 1000 << 10, "跨日不影响同月的月用量")
+        check(tracker.store.get('aa:bb', today + 2 * 86400)['month_bytes'] == 0, "跨月后月用量归零")
+    return checks
+
+
+async def main_async(args):
+    results = {}
+    for kind in ('sleep', 'fifo', 'fair'):
+        results[kind] = await simulate(kind, args)
+    print_simulation(results, args)
+    return results, await end_to_end(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flows', type=int, default=1000, help="大流量连接数")
+    parser.add_argument('--rate', type=float, default=1000, help="模拟链路的限速（Mbit/s）")
+    parser.add_argument('--duration', type=float, default=5, help="统计时长（秒）")
+    parser.add_argument('--interactive', type=int, default=20, help="交互连接数")
+    args = parser.parse_args()
+
+    results, accurate = asyncio.run(main_async(args))
+    fair, fifo = results['fair'], results['fifo']
+    shaping = [
+        (abs(fair['error']) < 0.05 and abs(fifo['error']) < 0.05, "合并定时器的总速率误差在 5% 以内"),
+        (fair['wakeups'] <= 1 / 0.01 + 1, "每秒唤醒次数不超过时间片数"),
+        (fair['jain'] > 0.95, "公平排队时大流量连接之间公平"),
+        (fair['p99'] is not None and (fifo['p99'] is None or fair['p99'] < fifo['p99'] / 10),
+         "公平排队时交互连接的等待远低于先到先得"),
+        (accurate, "经代理的端到端速率符合限速"),
+    ]
+    failures = 0
+    for title, checks in (("流量配额", quota_checks()), ("整形", shaping)):
+        print(f"\n{title}:")
+        for condition, text in checks:
+            print(f"  {'通过' if condition else '失败'}  {text}")
+            failures += not condition
+    print(f"\n{failures} 项失败" if failures else "\n全部通过")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
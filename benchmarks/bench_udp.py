@@ -0,0 +1,205 @@
+"""
+批量数据报收发测试工具
+在回环地址上以最快速度发送 UDP 数据报，比较不同收发方式每秒送达的数据报数（pps）:
+    - asyncio:   asyncio 的数据报传输，每个数据报一次系统调用
+    - batch N:   datagram.BatchSocket，recvmmsg/sendmmsg 每次最多 N 个数据报，关闭 GSO/GRO
+    - gso N:     同上，另开启 UDP_SEGMENT/UDP_GRO，同长数据报合成一条消息
+每种方式统计送达速率、丢失比例、平均每次系统调用收发的数据报数和每个数据报的 CPU 时间，
+并检查数据报内容与顺序；另在隧道客户端与对端之间（两条回环链路，经 UDP 回显往返）比较逐个收发与批量收发
+
+用法:
+    python benchmarks/bench_udp.py [--sizes 64,1200] [--batches 1,8,32,64] [--duration 2] [--burst 64] [--window 512]
+"""
+
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding import datagram  # noqa: E402
+from bonding.health import start_udp_echo_server  # noqa: E402
+from bonding.scheduler import Link  # noqa: E402
+from bonding.tunnel import HEADER, SOCKET_BUFFER, TunnelClient, TunnelPeer  # noqa: E402
+
+
+SEQ = struct.Struct('!Q')
+WARMUP = 0.5
+STALL = 0.05
+
+
+class Counter:
+    """
+    接收端：按序号检查数据报没有重复、乱序或长度错误
+    """
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.bad = 0
+        self.last = -1
+
+    def __call__(self, data, addr):
+        seq = SEQ.unpack_from(data)[0]
+        if seq <= self.last or len(data) != self.size:
+            self.bad += 1
+        self.last = seq
+        self.count += 1
+
+
+async def open_pair(batch, gso, on_datagram):
+    rx = await datagram.open_endpoint(on_datagram, local_addr=('127.0.0.1', 0), batch=batch, buffer=SOCKET_BUFFER)
+    tx = await datagram.open_endpoint(lambda data, addr: None, remote_addr=rx.get_extra_info('sockname'),
+                                      batch=batch, buffer=SOCKET_BUFFER)
+    if isinstance(tx, datagram.BatchSocket) and not gso:
+        tx.gso = False
+        rx.get_extra_info('socket').setsockopt(datagram.SOL_UDP, datagram.UDP_GRO, 0)
+    return rx, tx
+
+
+async def blast(send, size, burst, window, duration, received):
+    """
+    每轮事件循环最多发出 burst 个数据报，在途（已发未收到）不超过 window 个，预热 WARMUP 秒后统计 duration 秒；
+    在途数据报 STALL 秒没有进展时按丢失计，重新打开窗口
+
+    Returns:
+        {'pps': 送达速率, 'loss': 丢失比例（等在途数据报到达后计算）, 'cpu': 每个送达数据报的 CPU 微秒}
+    """
+    filler = bytes(size - SEQ.size)
+    loop = asyncio.get_running_loop()
+    seq = 0
+    lost = 0
+    progress = (0, loop.time())
+    for length in (WARMUP, duration):
+        first, base, start, cpu = seq, received(), loop.time(), time.process_time()
+        end = start + length
+        while loop.time() < end:
+            done = received()
+            if done != progress[0]:
+                progress = (done, loop.time())
+            elif loop.time() - progress[1] > STALL:
+                lost = seq - done
+                progress = (done, loop.time())
+            for _ in range(min(burst, window - (seq - lost - done))):
+                send(SEQ.pack(seq) + filler)
+                seq += 1
+            await asyncio.sleep(0)
+    got, elapsed, cpu = received() - base, loop.time() - start, time.process_time() - cpu
+    await asyncio.sleep(0.2)
+    return {'pps': got / elapsed, 'loss': max(0.0, 1 - (received() - base) / (seq - first)),
+            'cpu': cpu / max(got, 1) * 1e6}
+
+
+async def measure(name, batch, gso, size, args):
+    counter = Counter(size)
+    rx, tx = await open_pair(batch, gso, counter)
+    try:
+        result = await blast(tx.sendto, size, args.burst, args.window, args.duration, lambda: counter.count)
+        io = datagram.io_stats([rx, tx])
+    finally:
+        rx.close()
+        tx.close()
+    result.update(name=name, bad=counter.bad,
+                  recv_batch=io['received'] / max(io['recv_calls'], 1) if io else 1.0,
+                  send_batch=io['sent'] / max(io['send_calls'], 1) if io else 1.0)
+    return result
+
+
+def print_results(size, results):
+    print(f"\n{size} 字节数据报")
+    print(f"{'方式':<10}{'送达 kpps':>10}{'丢失':>8}{'每次收':>8}{'每次发':>8}{'CPU/包':>10}{'错误':>6}")
+    for r in results:
+        print(f"{r['name']:<10}{r['pps'] / 1000:>10.1f}{r['loss']:>8.1%}{r['recv_batch']:>8.1f}{r['send_batch']:>8.1f}"
+              f"{r['cpu']:>8.2f}us{r['bad']:>6}")
+
+
+async def tunnel_rate(batch, size, args):
+    """
+    本地程序经隧道（两条回环链路）发到对端，再由 UDP 回显原路返回，统计每秒回到本地程序的数据报数
+    """
+    echo = await start_udp_echo_server('127.0.0.1', 0)
+    peer = TunnelPeer(('127.0.0.1', 0), echo.get_extra_info('sockname')[:2], fec='off', batch=batch)
+    await peer.start()
+    client = TunnelClient([Link('lo-a', '127.0.0.2'), Link('lo-b', '127.0.0.3')], peer.listen, fec='off', batch=batch)
+    await client.start()
+    replies = [0]
+
+    def on_reply(data, addr):
+        replies[0] += 1
+
+    app = await datagram.open_endpoint(on_reply, remote_addr=client.listen, buffer=SOCKET_BUFFER)
+    try:
+        result = await blast(app.sendto, size - HEADER.size, args.burst, args.window, args.duration,
+                             lambda: replies[0])
+        result['io'] = client.stats()['io']
+    finally:
+        app.close()
+        await client.stop()
+        await peer.stop()
+        echo.close()
+    return result
+
+
+async def main_async(args):
+    tables = {}
+    for size in args.sizes:
+        results = [await measure('asyncio', 0, False, size, args)]
+        if datagram.HAS_MMSG:
+            for batch in args.batches:
+                results.append(await measure(f'batch {batch}', batch, False, size, args))
+            results.append(await measure(f'gso {max(args.batches)}', max(args.batches), True, size, args))
+        print_results(size, results)
+        tables[size] = results
+
+    size = max(args.sizes)
+    print(f"\n隧道往返（{size} 字节隧道报文，2 条回环链路，经 UDP 回显返回）")
+    tunnels = {}
+    for name, batch in (('逐个收发', 0), (f'批量 {datagram.BATCH}', datagram.BATCH)):
+        if batch and not datagram.HAS_MMSG:
+            continue
+        r = tunnels[batch] = await tunnel_rate(batch, size, args)
+        per_call = ''
+        if r['io']:
+            per_call = (f"  每次收 {r['io']['received'] / max(r['io']['recv_calls'], 1):.1f}"
+                        f"  每次发 {r['io']['sent'] / max(r['io']['send_calls'], 1):.1f}")
+        print(f"  {name:<10}{r['pps'] / 1000:>8.1f} kpps  丢失 {r['loss']:.1%}  CPU {r['cpu']:.2f}us/包{per_call}")
+    return tables, tunnels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='64,1200', help="数据报长度（字节），逗号分隔")
+    parser.add_argument('--batches', default='1,8,32,64', help="比较的批量大小，逗号分隔")
+    parser.add_argument('--duration', type=float, default=2, help="每种方式的统计时长（秒）")
+    parser.add_argument('--burst', type=int, default=64, help="每轮事件循环最多发出的数据报数")
+    parser.add_argument('--window', type=int, default=512, help="最多在途的数据报数")
+    args = parser.parse_args()
+    args.sizes = [max(int(s), SEQ.size + HEADER.size) for s in args.sizes.split(',')]
+    args.batches = [int(b) for b in args.batches.split(',')]
+    if not datagram.HAS_MMSG:
+        print("本平台没有 recvmmsg/sendmmsg，只测量逐个收发", file=sys.stderr)
+
+    tables, tunnels = asyncio.run(main_async(args))
+    failures = 0
+    print()
+    checks = [(all(r['bad'] == 0 for results in tables.values() for r in results), "数据报内容和顺序正确")]
+    if datagram.HAS_MMSG:
+        for size, results in tables.items():
+            base, best = results[0]['pps'], max(r['pps'] for r in results[1:])
+            checks.append((best > base * 1.5, f"{size} 字节时批量收发的送达速率至少是逐个收发的 1.5 倍"
+                                             f"（{best / base:.1f} 倍）"))
+            checks.append((results[-1]['recv_batch'] > 1 and results[-1]['send_batch'] > 1,
+                           f"{size} 字节时每次系统调用收发多个数据报"))
+        checks.append((tunnels[datagram.BATCH]['pps'] > tunnels[0]['pps'],
+                       f"隧道批量收发快于逐个收发（{tunnels[datagram.BATCH]['pps'] / tunnels[0]['pps']:.1f} 倍）"))
+    for condition, text in checks:
+        print(f"  {'通过' if condition else '失败'}  {text}")
+        failures += not condition
+    print(f"\n{failures} 项失败" if failures else "\n全部通过")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+MPTCP 模式端到端测试
+在独立的网络命名空间中用 veth 接口模拟多条限速的上行链路，另一个命名空间运行目标服务器，
+经叠加代理下载同一份数据，比较:
+    - 普通 TCP 代理（单条连接只走一条链路）
+    - MPTCP 代理访问支持 MPTCP 的服务器（子流分布在全部链路上）
+    - MPTCP 代理访问只支持普通 TCP 的服务器（内核自动回退，连接照常完成）
+并检查子流统计、回退计数，以及停止后路径管理器端点、子流上限和策略路由是否恢复原状
+
+需要 root、iproute2 和 tc；未在命名空间中运行时会经 unshare -n 重新执行自身，不影响本机网络
+
+用法:
+    sudo python benchmarks/netns_mptcp.py [--links 2] [--rate 20] [--size 8] [--workers 1]
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding import mptcp  # noqa: E402
+from bonding.engine import BondingEngine  # noqa: E402
+
+
+INSIDE = 'BONDING_NETNS_TEST'
+SERVER = '203.0.113.1'
+MPTCP_PORT = 5000
+TCP_PORT = 5001
+
+SERVER_CODE = '''
+import socket, sys, threading
+size = int(sys.argv[1])
+def serve(proto, port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM, proto)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((sys.argv[2], port))
+    listener.listen()
+    block = b"x" * 65536
+    while True:
+        conn, _ = listener.accept()
+        left = size
+        while left > 0:
+            left -= conn.send(block[:left])
+        conn.close()
+threading.Thread(target=serve, args=(6, int(sys.argv[4])), daemon=True).start()
+print("ready", flush=True)
+serve(262, int(sys.argv[3]))
+'''
+
+
+def ip(*args, netns=None):
+    prefix = ['ip', 'netns', 'exec', netns] if netns else []
+    return subprocess.run(prefix + ['ip', *args], check=True, capture_output=True, text=True).stdout
+
+
+def setup(count, rate, netns):
+    """
+    创建服务器命名空间和 count 对 veth：up{i}（10.9.i.2/24）在本命名空间作为叠加接口，
+    对端 gw{i}（10.9.i.1）在服务器命名空间作为网关，其下行（服务器到客户端）限速 rate Mbit/s；
+    另按源地址为各接口配置路由（表 10+i，优先级 500），模拟普通 TCP 代理运行所需的多出口主机
+
+    Returns:
+        接口字典列表
+    """
+    ip('link', 'set', 'lo', 'up')
+    ip('netns', 'add', netns)
+    ip('link', 'set', 'lo', 'up', netns=netns)
+    ip('addr', 'add', f'{SERVER}/32', 'dev', 'lo', netns=netns)
+    ip('mptcp', 'limits', 'set', 'subflows', '8', 'add_addr_accepted', '8', netns=netns)
+    interfaces = []
+    for i in range(count):
+        ip('link', 'add', f'up{i}', 'type', 'veth', 'peer', 'name', f'gw{i}')
+        ip('link', 'set', f'gw{i}', 'netns', netns)
+        ip('addr', 'add', f'10.9.{i}.2/24', 'dev', f'up{i}')
+        ip('link', 'set', f'up{i}', 'up')
+        ip('addr', 'add', f'10.9.{i}.1/24', 'dev', f'gw{i}', netns=netns)
+        ip('link', 'set', f'gw{i}', 'up', netns=netns)
+        ip('route', 'add', 'default', 'via', f'10.9.{i}.1', 'dev', f'up{i}', 'table', str(10 + i))
+        ip('rule', 'add', 'from', f'10.9.{i}.2', 'table', str(10 + i), 'priority', '500')
+        subprocess.run(['ip', 'netns', 'exec', netns, 'tc', 'qdisc', 'add', 'dev', f'gw{i}', 'root', 'tbf',
+                        'rate', f'{rate}mbit', 'burst', '64kb', 'latency', '50ms'], check=True)
+        interfaces.append({'name': f'up{i}', 'ip': f'10.9.{i}.2', 'gateway': f'10.9.{i}.1',
+                           'ipv4': [(f'10.9.{i}.2', 24)]})
+    return interfaces
+
+
+def socks_download(proxy, host, port):
+    """
+    经 SOCKS5 代理下载，直到服务器关闭连接
+
+    Returns:
+        (字节数, 耗时秒)
+    """
+    with socket.create_connection(proxy) as sock:
+        sock.sendall(b'\x05\x01\x00')
+        sock.recv(2)
+        sock.sendall(b'\x05\x01\x00\x01' + socket.inet_aton(host) + struct.pack('!H', port))
+        if sock.recv(10)[1] != 0:
+            raise OSError("代理连接目标失败")
+        start = time.perf_counter()
+        total = 0
+        while True:
+            data = sock.recv(1 << 16)
+            if not data:
+                break
+            total += len(data)
+        return total, time.perf_counter() - start
+
+
+def download(interfaces, use_mptcp, port, workers):
+    engine = BondingEngine(interfaces, 'round_robin', port=0, mptcp=use_mptcp, workers=workers)
+    engine.start()
+    try:
+        size, elapsed = socks_download(engine.address, SERVER, port)
+        time.sleep(0.2)
+        return size, elapsed, engine.status()
+    finally:
+        engine.stop()
+
+
+class Checker:
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, condition, text, detail=''):
+        print(f"  {'通过' if condition else '失败'}  {text}" + (f"  ({detail})" if detail else ''))
+        if not condition:
+            self.failures += 1
+
+
+def pm_state():
+    return ip('mptcp', 'endpoint', 'show'), ip('mptcp', 'limits', 'show'), ip('-4', 'rule', 'show')
+
+
+def run(args, interfaces, checker):
+    expected = args.size * 1024 * 1024
+    baseline = pm_state()
+    results = {}
+    for name, use_mptcp, port in (('tcp', False, MPTCP_PORT), ('mptcp', True, MPTCP_PORT),
+                                  ('fallback', True, TCP_PORT)):
+        size, elapsed, status = download(interfaces, use_mptcp, port, args.workers)
+        results[name] = status
+        rate = size * 8 / elapsed / 1e6
+        print(f"{name:<10}{size / 1048576:>6.1f} MB  {elapsed:>6.2f} s  {rate:>7.1f} Mbit/s")
+        checker.check(size == expected, "数据完整", size)
+        if name == 'tcp':
+            results['tcp_rate'] = rate
+        elif name == 'mptcp':
+            links = status['metrics']['links']
+            counts = {n: links[n]['mptcp'] for n in links}
+            checker.check(all(c['subflows'] >= 1 and c['bytes_recv'] > 0 for c in counts.values()),
+                          "每条链路都有子流并承载了数据",
+                          {n: (c['subflows'], c['bytes_recv']) for n, c in counts.items()})
+            checker.check(sum(c['fallbacks'] for c in counts.values()) == 0, "没有回退")
+            checker.check(rate > results['tcp_rate'] * 1.3, "吞吐量高于单链路",
+                          f"{rate / results['tcp_rate']:.2f} 倍")
+        else:
+            counts = [c['mptcp'] for c in status['metrics']['links'].values()]
+            checker.check(sum(c['fallbacks'] for c in counts) == 1, "对端不支持时回退为普通 TCP")
+            checker.check(sum(c['subflows'] for c in counts) == 1, "只有一条子流")
+    checker.check(pm_state() == baseline, "停止后端点、子流上限和策略路由已恢复")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--links', type=int, default=2, help="模拟的上行链路数")
+    parser.add_argument('--rate', type=int, default=20, help="每条链路的下行带宽（Mbit/s）")
+    parser.add_argument('--size', type=int, default=8, help="下载的数据量（MB）")
+    parser.add_argument('--workers', type=int, default=1, help="代理工作进程数")
+    args = parser.parse_args()
+    if not mptcp.HAS_MPTCP or shutil.which('ip') is None or shutil.which('tc') is None:
+        print("需要 Linux、iproute2 和 tc", file=sys.stderr)
+        return 1
+    if not mptcp.available():
+        print("本机内核未启用 MPTCP（sysctl net.mptcp.enabled=1）", file=sys.stderr)
+        return 1
+    if os.environ.get(INSIDE) is None:
+        if shutil.which('unshare') is None:
+            print("需要 unshare（util-linux）", file=sys.stderr)
+            return 1
+        return subprocess.call(['unshare', '-n', sys.executable, *sys.argv], env=dict(os.environ, **{INSIDE: '1'}))
+
+    netns = f'bonding-mptcp-{os.getpid()}'
+    server = None
+    try:
+        interfaces = setup(args.links, args.rate, netns)
+        server = subprocess.Popen(['ip', 'netns', 'exec', netns, sys.executable, '-c', SERVER_CODE,
+                                   str(args.size * 1024 * 1024), SERVER, str(MPTCP_PORT), str(TCP_PORT)],
+                                  stdout=subprocess.PIPE, text=True)
+        server.stdout.readline()
+        checker = Checker()
+        run(args, interfaces, checker)
+    finally:
+        if server is not None:
+            server.kill()
+            server.wait()
+        subprocess.run(['ip', 'netns', 'del', netns], capture_output=True)
+    print(f"\n{checker.failures} 项失败" if checker.failures else "\n全部通过")
+    return 1 if checker.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+内核路由模式测试
+在独立的网络命名空间中用 veth 接口模拟多条上行链路，启用 offload.PolicyRouter 后用 ip 命令检查:
+    - 每个接口的路由表、"from 源地址"/"fwmark" 规则和多路径默认路由是否按预期下发
+    - 按源地址、标记和四层哈希查询路由时选中的出口接口，以及多路径哈希策略
+    - 链路下线和权重变化后多路径路由是否被改写
+    - 停止后以及中途下发失败时，规则、路由和 sysctl 是否全部恢复原状
+    - 启动时只清除本工具异常退出后残留的规则和路由，同一编号范围内别人配置的保持不变
+
+需要 root 和 iproute2；未在命名空间中运行时会经 unshare -n 重新执行自身，不影响本机路由
+
+用法:
+    sudo python benchmarks/netns_offload.py [--links 3] [--flows 400]
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bonding import offload  # noqa: E402
+from bonding.engine import BondingEngine  # noqa: E402
+from bonding.scheduler import Link  # noqa: E402
+
+
+INSIDE = 'BONDING_NETNS_TEST'
+DESTINATION = '198.51.100.7'
+
+
+def ip(*args):
+    return subprocess.run(['ip', *args], check=True, capture_output=True, text=True).stdout
+
+
+def read_sysctl(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def setup(count):
+    """
+    创建 count 对 veth：up{i}（10.9.i.2/24）作为叠加接口，对端 gw{i}（10.9.i.1）作为网关
+
+    Returns:
+        接口字典列表
+    """
+    ip('link', 'set', 'lo', 'up')
+    interfaces = []
+    for i in range(count):
+        name = f'up{i}'
+        ip('link', 'add', name, 'type', 'veth', 'peer', 'name', f'gw{i}')
+        ip('addr', 'add', f'10.9.{i}.2/24', 'dev', name)
+        ip('addr', 'add', f'10.9.{i}.1/24', 'dev', f'gw{i}')
+        ip('link', 'set', name, 'up')
+        ip('link', 'set', f'gw{i}', 'up')
+        interfaces.append({'name': name, 'ip': f'10.9.{i}.2', 'gateway': f'10.9.{i}.1',
+                           'ipv4': [(f'10.9.{i}.2', 24)]})
+    return interfaces
+
+
+def route_device(*selectors):
+    output = ip('-4', 'route', 'get', DESTINATION, *selectors)
+    return re.search(r'\bdev (\S+)', output).group(1)
+
+
+def spread(flows):
+    """
+    用不同的四层端口查询 flows 次路由，统计各出口接口被选中的次数
+    """
+    return Counter(route_device('ipproto', 'tcp', 'sport', str(20000 + n), 'dport', '443') for n in range(flows))
+
+
+def multipath_devices(table):
+    return re.findall(r'dev (\S+) weight (\d+)', ip('-4', 'route', 'show', 'table', str(table)))
+
+
+class Checker:
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, condition, text, detail=''):
+        print(f"  {'通过' if condition else '失败'}  {text}" + (f"  ({detail})" if detail else ''))
+        if not condition:
+            self.failures += 1
+
+
+def rules():
+    return [line for line in ip('-4', 'rule', 'show').splitlines()
+            if offload.PRIORITY_BASE <= int(line.split(':')[0]) < offload.PRIORITY_BASE + offload.MAX_LINKS * 2 + 2]
+
+
+async def test_router(interfaces, flows, checker):
+    print("启用与查询:")
+    baseline_rules = rules()
+    baseline_policy = read_sysctl(offload.HASH_POLICY)
+    links = [Link.from_interface(i) for i in interfaces]
+    router = offload.PolicyRouter(links, interfaces, 'round_robin')
+    await router.start()
+
+    installed = rules()
+    checker.check(len(installed) == 2 * len(interfaces) + 2, "规则条数", f"{len(installed)} 条")
+    checker.check(any('suppress_prefixlength 0' in line for line in installed), "主表 suppress_prefixlength 规则")
+    devices = multipath_devices(offload.TABLE_BASE)
+    checker.check(sorted(d for d, _ in devices) == [i['name'] for i in interfaces], "多路径下一跳", devices)
+    checker.check(read_sysctl(offload.HASH_POLICY) == str(offload.HASH_L4), "四层哈希策略")
+    for slot, interface in enumerate(interfaces):
+        checker.check(route_device('from', interface['ip']) == interface['name'], f"from {interface['ip']}")
+        checker.check(route_device('mark', hex(offload.FWMARK_BASE + slot)) == interface['name'],
+                      f"mark {hex(offload.FWMARK_BASE + slot)}")
+    checker.check(' via ' not in ip('-4', 'route', 'get', '10.9.1.9'), "局域网地址走直连路由")
+    counts = spread(flows)
+    checker.check(set(counts) == {i['name'] for i in interfaces} and min(counts.values()) > flows / len(interfaces) / 2,
+                  f"{flows} 条连接的分布", dict(counts))
+
+    print("链路变化:")
+    links[-1].up = False
+    router.refresh()
+    devices = multipath_devices(offload.TABLE_BASE)
+    checker.check(interfaces[-1]['name'] not in (d for d, _ in devices), "下线链路移出多路径路由", devices)
+    links[-1].up = True
+    router.mode = 'weighted'
+    for n, link in enumerate(links):
+        link.effective_weight = 10.0 * (n + 1)
+    router.refresh()
+    weights = [int(w) for _, w in multipath_devices(offload.TABLE_BASE)]
+    checker.check(weights == sorted(weights) and weights[-1] == offload.WEIGHT_STEPS, "加权模式按权重分级", weights)
+
+    await router.stop()
+    print("停止:")
+    checker.check(rules() == baseline_rules, "规则已撤销")
+    checker.check(multipath_devices(offload.TABLE_BASE) == [], "多路径路由已撤销")
+    checker.check(all(not ip('-4', 'route', 'show', 'table', str(router.link_table(s))).strip()
+                      for s in range(len(interfaces))), "接口路由表已撤销")
+    checker.check(read_sysctl(offload.HASH_POLICY) == baseline_policy, "哈希策略已恢复", baseline_policy)
+
+
+async def test_rollback(interfaces, checker):
+    print("下发失败时回滚:")
+    baseline_rules = rules()
+    broken = [dict(i) for i in interfaces]
+    broken[-1]['gateway'] = '10.99.0.1'  # 不在任何直连网段内，内核拒绝该网关
+    router = offload.PolicyRouter([Link.from_interface(i) for i in broken], broken, 'source_hash')
+    try:
+        await router.start()
+    except OSError as e:
+        checker.check(True, "启用失败", e)
+    else:
+        checker.check(False, "启用失败")
+        await router.stop()
+    checker.check(rules() == baseline_rules, "已下发的规则全部撤销")
+    checker.check(all(not ip('-4', 'route', 'show', 'table', str(router.link_table(s))).strip()
+                      for s in range(len(interfaces))), "已下发的路由全部撤销")
+
+
+async def test_ownership(interfaces, checker):
+    print("清除残留:")
+    foreign_rule = str(offload.PRIORITY_BASE + offload.MAX_LINKS - 1)
+    foreign_table = str(offload.TABLE_BASE + offload.MAX_LINKS)
+    ip('rule', 'add', 'priority', foreign_rule, 'from', '10.77.0.1', 'lookup', foreign_table)
+    ip('route', 'add', '10.77.0.0/24', 'dev', interfaces[0]['name'], 'table', foreign_table)
+    baseline_rules = rules()
+    links = [Link.from_interface(i) for i in interfaces]
+    crashed = offload.PolicyRouter(links, interfaces, 'round_robin')
+    await crashed.start()
+    # 模拟异常退出：不撤销已下发的变更
+    crashed._transaction = None
+    await crashed.stop()
+    router = offload.PolicyRouter(links, interfaces, 'round_robin')
+    try:
+        await router.start()
+    except OSError as e:
+        checker.check(False, "残留的规则和路由被清除后重新启用", e)
+    else:
+        checker.check(True, "残留的规则和路由被清除后重新启用")
+        checker.check(f'proto {offload.RTPROT_BONDING}' in ip('-4', 'route', 'show', 'table', str(offload.TABLE_BASE)),
+                      "下发的路由带本工具的来源协议号")
+        await router.stop()
+    checker.check(rules() == baseline_rules, "其它来源的规则保留，本工具的规则已撤销")
+    checker.check('10.77.0.0/24' in ip('-4', 'route', 'show', 'table', foreign_table), "其它来源的路由保留")
+    ip('rule', 'del', 'priority', foreign_rule)
+    ip('route', 'flush', 'table', foreign_table)
+
+
+def test_engine(interfaces, checker):
+    print("经叠加引擎启用:")
+    engine = BondingEngine(interfaces, 'dest_hash', offload=True)
+    engine.start()
+    try:
+        status = engine.status()
+        checker.check(status['listen'] is None and status['relay'] == 'kernel', "不监听代理端口")
+        checker.check(status['offload']['hash'] == 'l3', "目标哈希模式使用三层哈希")
+        checker.check(read_sysctl(offload.HASH_POLICY) == str(offload.HASH_L3), "三层哈希策略")
+    finally:
+        engine.stop()
+    checker.check(rules() == [], "停止后规则已撤销")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--links', type=int, default=3, help="模拟的上行链路数")
+    parser.add_argument('--flows', type=int, default=400, help="统计分布时查询的连接数")
+    args = parser.parse_args()
+    if not offload.HAS_OFFLOAD or shutil.which('ip') is None:
+        print("需要 Linux 和 iproute2", file=sys.stderr)
+        return 1
+    if os.environ.get(INSIDE) is None:
+        if shutil.which('unshare') is None:
+            print("需要 unshare（util-linux）", file=sys.stderr)
+            return 1
+        return subprocess.call(['unshare', '-n', sys.executable, *sys.argv], env=dict(os.environ, **{INSIDE: '1'}))
+
+    interfaces = setup(args.links)
+    checker = Checker()
+    asyncio.run(test_router(interfaces, args.flows, checker))
+    asyncio.run(test_rollback(interfaces, checker))
+    asyncio.run(test_ownership(interfaces, checker))
+    test_engine(interfaces, checker)
+    print(f"\n{checker.failures} 项失败" if checker.failures else "\n全部通过")
+    return 1 if checker.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+网络叠加引擎
+与图形界面无关的多网卡负载均衡数据面，可被GUI、命令行或守护进程复用
+"""
+
+__version__ = "0.1"
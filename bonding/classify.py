@@ -0,0 +1,91 @@
+"""
+低延迟流量分类
+按端口和 DSCP 把游戏、语音、SSH 等小流量的交互式流识别出来，走 RTT 最低的链路或在两条链路上重复发送；
+其余流量仍交给负载均衡调度器
+
+规则在构造时编译成按端口（65536 项）和按 DSCP（64 项）索引的查找表，热路径上每次分类只做两次下标访问
+"""
+
+ACTIONS = ("bulk", "fastest", "duplicate")
+BULK, FASTEST, DUPLICATE = range(3)
+
+# 常见的交互式流量：SSH、DNS、SIP、STUN/TURN（语音和游戏的 NAT 穿透）、Xbox Live、Steam/Source 游戏，
+# 以及 DSCP EF（语音）、AF41（视频会议）、CS6/CS7（网络控制）
+DEFAULT_RULES = (
+    "22,53,5060-5061,3478-3481,3074,27015-27030:fastest",
+    "dscp=46,34,48,56:fastest",
+)
+
+
+def _parse_numbers(text, limit):
+    ranges = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        low, sep, high = part.partition('-')
+        try:
+            low = int(low)
+            high = int(high) if sep else low
+        except ValueError:
+            raise ValueError(f"无效的端口或 DSCP: {part}") from None
+        if not 0 <= low <= high < limit:
+            raise ValueError(f"超出范围: {part}")
+        ranges.append((low, high))
+    return ranges
+
+
+def parse_rule(spec):
+    """
+    解析一条规则
+
+    格式为 "端口列表[:动作]" 或 "dscp=值列表[:动作]"，列表以逗号分隔，端口可写范围（如 27015-27030）；
+    动作为 fastest（走 RTT 最低的链路，默认）、duplicate（在两条最快的链路上重复发送）或 bulk（按普通流量调度）
+
+    Returns:
+        (端口范围列表, DSCP 范围列表, 动作编号)
+    """
+    body, sep, action = spec.rpartition(':')
+    if not sep:
+        body, action = spec, 'fastest'
+    if action not in ACTIONS:
+        raise ValueError(f"未知的动作: {action}")
+    body = body.strip()
+    if body.lower().startswith('dscp='):
+        return [], _parse_numbers(body[5:], 64), ACTIONS.index(action)
+    return _parse_numbers(body, 65536), [], ACTIONS.index(action)
+
+
+class Classifier:
+    """
+    流量分类器
+    后面的规则覆盖前面的规则；DSCP 命中的规则优先于端口规则
+
+    Args:
+        specs: 规则字符串列表，见 parse_rule；'default' 展开为 DEFAULT_RULES
+    """
+    def __init__(self, specs=()):
+        self.specs = []
+        self._ports = bytearray(65536)
+        self._dscp = bytearray(64)
+        for spec in specs:
+            for rule in (DEFAULT_RULES if spec == 'default' else (spec,)):
+                self.add(rule)
+
+    def add(self, spec):
+        ports, dscps, action = parse_rule(spec)
+        for low, high in ports:
+            self._ports[low:high + 1] = bytes([action]) * (high - low + 1)
+        for low, high in dscps:
+            self._dscp[low:high + 1] = bytes([action]) * (high - low + 1)
+        self.specs.append(spec)
+
+    def classify(self, port=0, dscp=0):
+        """
+        返回流量的动作编号：BULK、FASTEST 或 DUPLICATE
+
+        Args:
+            port: 目标端口（隧道中为本地程序的端口）
+            dscp: 数据包的 DSCP 值（0~63），未知时为 0
+        """
+        return self._dscp[dscp] or self._ports[port]
@@ -0,0 +1,644 @@
+"""
+命令行界面
+不加载 tkinter，可在服务器和路由器上无界面运行；叠加引擎运行在守护进程中，
+命令行通过本地控制接口与其通信
+
+用法:
+    python -m bonding list
+    python -m bonding enable --mode weighted --iface eth0 --iface wlan0 --save 家里
+    python -m bonding enable --profile 家里
+    python -m bonding status --json
+    python -m bonding disable
+    python -m bonding run --daemon
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from .control import DEFAULT_CONTROL, ControlClient, ControlError
+
+
+MODES = ("round_robin", "source_hash", "dest_hash", "least_conn", "weighted")
+RELAY_MODES = ("auto", "stream", "buffer", "splice")
+
+
+def _control_address(text):
+    host, _, port = text.rpartition(':')
+    return (host or DEFAULT_CONTROL[0], int(port))
+
+
+def _print_json(data):
+    json.dump(data, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write('\n')
+
+
+def _save_cache(records):
+    from .discovery import KIND_LOOPBACK
+    from .monitor import interface_key
+    from .profiles import ProfileStore
+
+    try:
+        ProfileStore().save_cache({interface_key(r): r.to_dict() for r in records if r.kind != KIND_LOOPBACK})
+    except OSError:
+        pass
+
+
+def cmd_list(args):
+    from .discovery import discover
+
+    records = discover(include_loopback=args.all)
+    _save_cache(records)
+    if args.json:
+        _print_json([r.to_dict() for r in records])
+        return 0
+    print(f"{'名称':<16}{'类型':<6}{'状态':<6}{'IPv4':<18}{'网关':<16}{'MTU':>6}{'速率':>8}  MAC")
+    for r in records:
+        d = r.to_dict()
+        speed = f"{r.speed}M" if r.speed else '-'
+        print(f"{r.name:<16}{r.kind:<6}{d['status']:<6}{r.ip or '-':<18}{r.gateway or '-':<16}"
+              f"{r.mtu:>6}{speed:>8}  {r.mac or '-'}")
+    return 0
+
+
+def _spawn_daemon(args):
+    command = [sys.executable, '-m', 'bonding', '--control', f"{args.control[0]}:{args.control[1]}", 'run']
+    kwargs = {'stdin': subprocess.DEVNULL, 'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL,
+              'cwd': os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}
+    if args.log:
+        kwargs['stdout'] = kwargs['stderr'] = open(args.log, 'ab')
+        command += ['--log', args.log]
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    process = subprocess.Popen(command, **kwargs)
+
+    client = ControlClient(args.control, timeout=1.0)
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline:
+        if client.alive():
+            client.close()
+            return process.pid
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    raise ControlError("守护进程启动失败")
+
+
+def _client(args, start=False):
+    client = ControlClient(args.control)
+    if not client.alive():
+        if not start:
+            raise ControlError("叠加服务未运行，请先执行 run --daemon 或 enable")
+        _spawn_daemon(args)
+    return client
+
+
+def _profile_interfaces(store, profile):
+    """
+    先用缓存的发现结果解析档案接口，不完整时再做一次实时发现
+    """
+    from .profiles import resolve_profile
+
+    cached, _ = store.load_cache()
+    matched, missing = resolve_profile(profile, list(cached.values()))
+    if missing:
+        from .discovery import discover
+
+        matched, missing = resolve_profile(profile, [r.to_dict() for r in discover(include_loopback=True)])
+    if missing:
+        from .service import ServiceError, resolve_interfaces
+
+        try:
+            matched += resolve_interfaces([e['id'] for e in profile['interfaces'] if e['name'] in missing])
+        except ServiceError:
+            raise ControlError(f"以下接口当前不可用: {', '.join(missing)}") from None
+    return matched
+
+
+def _enable_flags(args):
+    """
+    命令行上显式给出的叠加选项（未给出的为 None）
+    """
+    return {
+        'mode': args.mode,
+        'listen': args.listen,
+        'probe': args.probe,
+        'probe_interval': args.probe_interval,
+        'latency': args.latency,
+        'sticky': args.sticky,
+        'dns': args.dns,
+        'pool': args.pool,
+        'race': None if args.race is None else args.race / 1000,
+        'offload': args.offload,
+        'mptcp': args.mptcp,
+        'limits': _limits(args.limit) if args.limit else None,
+        'quotas': _quotas(args.quota) if args.quota else None,
+        'fair': args.fair,
+    }
+
+
+def _enable_params(args):
+    """
+    合并叠加选项：内置默认值 < 配置档案 < 命令行显式给出的选项；限速和配额按接口合并
+    """
+    from .profiles import ProfileStore, make_profile
+
+    settings = make_profile([])
+    store = None
+    interfaces = args.iface
+    if args.profile:
+        store = ProfileStore()
+        profile = store.get(args.profile)
+        if profile is None:
+            raise ControlError(f"找不到配置档案: {args.profile}")
+        settings.update((key, profile[key]) for key in settings if key in profile)
+        if not args.iface:
+            interfaces = _profile_interfaces(store, profile)
+    for key, value in _enable_flags(args).items():
+        if value is None:
+            continue
+        if key in ('limits', 'quotas'):
+            value = {**(settings[key] or {}), **value}
+        settings[key] = value
+
+    params = {
+        'interfaces': interfaces,
+        'mode': settings['mode'],
+        'listen': settings['listen'],
+        'probe': settings['probe'],
+        'probe_interval': settings['probe_interval'],
+        'relay': args.relay,
+        'workers': args.workers,
+        'latency': settings['latency'],
+        'sticky': settings['sticky'],
+        'dns': settings['dns'],
+        'pool': settings['pool'],
+        'race': settings['race'],
+        'offload': settings['offload'],
+        'mptcp': settings['mptcp'],
+        'limits': settings['limits'],
+        'quotas': settings['quotas'],
+        'fair': settings['fair'],
+        'metrics': args.metrics,
+        'trace': args.trace,
+        'trace_sample': args.trace_sample,
+    }
+    if args.save:
+        from .service import resolve_interfaces
+
+        if interfaces and isinstance(interfaces[0], str):
+            params['interfaces'] = resolve_interfaces(interfaces)
+        (store or ProfileStore()).put(args.save, make_profile(
+            params['interfaces'], params['mode'], params['probe'], params['probe_interval'], params['listen'],
+            enabled=True, latency=params['latency'], sticky=params['sticky'], dns=params['dns'],
+            pool=params['pool'], race=params['race'], offload=params['offload'], mptcp=params['mptcp'],
+            limits=params['limits'], quotas=params['quotas'], fair=params['fair']))
+    return params
+
+
+def _print_status(status):
+    if not status['running']:
+        print("网络叠加未启用")
+        return
+    workers = f"    工作进程: {status['workers']}" if status.get('workers', 1) > 1 else ""
+    print(f"叠加模式: {status['mode']}    转发方式: {status.get('relay', '-')}    代理地址: {status['listen'] or '-'}{workers}")
+    if status.get('offload'):
+        offload = status['offload']
+        weights = ' '.join(f"{name}={weight}" for name, weight in offload['weights'].items())
+        print(f"内核路由: 多路径表 {offload['table']}    哈希 {offload['hash'].upper()}    下一跳权重 {weights}")
+    if status.get('flows'):
+        flows = status['flows']
+        print(f"流表: {flows['flows']} / {flows['capacity']}    空闲淘汰 {flows['evicted_idle']}    "
+              f"满表淘汰 {flows['evicted_lru']}")
+    if status.get('resolver'):
+        dns = status['resolver']
+        print(f"DNS 缓存: {dns['cached']} 条    命中 {dns['hits']}    查询 {dns['misses']}    合并 {dns['coalesced']}")
+    if status.get('metrics_listen') or status.get('trace'):
+        endpoint = f"http://{status['metrics_listen']}/metrics" if status.get('metrics_listen') else "-"
+        print(f"指标端点: {endpoint}    连接跟踪: {status.get('trace') or '-'}")
+    if status.get('pool'):
+        pool = status['pool']
+        print(f"预连接池: 空闲 {pool['idle']} / {pool['size']}    命中率 {pool['hit_rate']:.0%}"
+              f"（{pool['hits']} / {pool['hits'] + pool['misses']}）")
+    mptcp = status.get('mptcp')
+    if mptcp:
+        counts = [entry['mptcp'] for entry in status['metrics']['links'].values()]
+        endpoints = ' '.join(f"{name}={i}" for name, i in (mptcp['endpoints'] or {}).items()) or "沿用系统配置"
+        print(f"MPTCP: {'已启用' if mptcp['available'] else '内核未启用，使用普通 TCP'}    "
+              f"连接 {sum(c['connections'] for c in counts)}    回退 {sum(c['fallbacks'] for c in counts)}    "
+              f"端点 {endpoints}")
+    shaping = status.get('shaping')
+    if shaping:
+        from .shaper import PERIOD_NAMES, format_size
+
+        limits = ' '.join(f"{name}={rate:g}Mbit/s" for name, rate in shaping['limits'].items()) or "-"
+        print(f"整形: 限速 {limits}    {'公平排队' if shaping['fair'] else '先到先得'}")
+        for name, periods in shaping['quotas'].items():
+            usage = '    '.join(f"{PERIOD_NAMES[period]} {format_size(entry['used'])} / {format_size(entry['limit'])}"
+                                 for period, entry in periods.items())
+            print(f"流量配额: {name}  {usage}")
+    for link in status['links']:
+        state = "正常" if link['up'] else "故障"
+        if link.get('capped'):
+            state += "（配额将满）"
+        rtt = f"{link['rtt'] * 1000:.0f}ms" if link['rtt'] is not None else "-"
+        print(f"  {link['name']:<16}{link['ip']:<18}{state}  延迟 {rtt:<7}丢包 {link['loss']:.0%}  "
+              f"活动 {link['active']} / 累计 {link['total']}  流 {link.get('flows', 0)}  {_format_race(link)}"
+              f"↑ {link['bytes_sent']} B  ↓ {link['bytes_recv']} B{_format_subflows(status, link)}")
+
+
+def _format_race(link):
+    if link.get('connect_time') is None:
+        return ""
+    return f"握手 {link['connect_time'] * 1000:.0f}ms 竞速胜/负 {link['races_won']}/{link['races_lost']}  "
+
+
+def _format_subflows(status, link):
+    if not status.get('mptcp'):
+        return ""
+    subflows = status['metrics']['links'][link['name']]['mptcp']
+    return f"  子流 {subflows['subflows']} ↑ {subflows['bytes_sent']} B ↓ {subflows['bytes_recv']} B"
+
+
+def cmd_enable(args):
+    if not args.iface and not args.profile:
+        raise ControlError("请用 --iface 指定接口或用 --profile 指定配置档案")
+    client = _client(args, start=True)
+    status = client.call('enable', **_enable_params(args))
+    _print_status(status)
+    return 0
+
+
+def cmd_disable(args):
+    client = _client(args)
+    client.call('disable')
+    print("网络叠加已禁用")
+    return 0
+
+
+def cmd_status(args):
+    client = ControlClient(args.control)
+    try:
+        status = client.call('status')
+    except ControlError:
+        status = {'running': False, 'mode': None, 'listen': None, 'links': [], 'daemon': False}
+    if args.json:
+        _print_json(status)
+    else:
+        _print_status(status)
+    return 0
+
+
+def cmd_profiles(args):
+    from .profiles import ProfileStore
+
+    store = ProfileStore()
+    if args.delete:
+        store.delete(args.delete)
+        print(f"已删除配置档案 {args.delete}")
+        return 0
+    if args.json:
+        _print_json({'last': store.last, 'profiles': store.profiles})
+        return 0
+    for name in store.names():
+        profile = store.profiles[name]
+        mark = '*' if name == store.last else ' '
+        names = ', '.join(i['name'] for i in profile.get('interfaces', []))
+        print(f"{mark} {name:<12}{profile.get('mode', '-'):<14}{names}")
+    return 0
+
+
+def cmd_stop(args):
+    _client(args).call('shutdown')
+    print("叠加服务已退出")
+    return 0
+
+
+def cmd_run(args):
+    if args.daemon:
+        if ControlClient(args.control).alive():
+            print("叠加服务已在运行")
+            return 0
+        pid = _spawn_daemon(args)
+        print(f"叠加服务已在后台启动 (PID {pid})，控制接口 {args.control[0]}:{args.control[1]}")
+        if args.iface or args.profile:
+            return cmd_enable(args)
+        return 0
+
+    import asyncio
+
+    from .control import run_daemon
+
+    enable = _enable_params(args) if args.iface or args.profile else None
+    try:
+        asyncio.run(run_daemon(args.control, enable))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_download(args):
+    from .downloader import download
+    from .scheduler import Link
+    from .service import resolve_interfaces
+
+    links = [Link.from_interface(i) for i in resolve_interfaces(args.iface)]
+    started = time.monotonic()
+    last = [0.0]
+
+    def progress(done, total):
+        now = time.monotonic()
+        if now - last[0] >= 0.5 or done == total:
+            last[0] = now
+            percent = f"{done / total:6.1%}" if total else ""
+            rate = done / max(now - started, 1e-6) / 1048576
+            sys.stderr.write(f"\r{percent} {done / 1048576:.1f} MB  {rate:.1f} MB/s")
+
+    size = download(args.url, links, args.output, progress=progress)
+    sys.stderr.write('\n')
+    print(f"已下载 {size} 字节到 {args.output}，用时 {time.monotonic() - started:.1f} 秒")
+    return 0
+
+
+def _format_reorder(stats):
+    reorder = stats['reorder']
+    text = (f"发送 {stats['sent']}  接收 {stats['received']}  重排深度 {reorder['depth']}（峰值 {reorder['max_depth']}）  "
+            f"乱序 {reorder['reordered']}  迟到丢弃 {reorder['late']}  丢失 {reorder['lost']}  "
+            f"FEC 组 {stats['fec_group'] or '-'}  校验 {stats['parity_sent']}  恢复 {stats['recovered']}  "
+            f"重复发送 {stats['duplicated']}  重复丢弃 {reorder['duplicates']}")
+    io = stats.get('io')
+    if io:
+        text += (f"  每次收 {io['received'] / max(io['recv_calls'], 1):.1f} 个"
+                 f"  每次发 {io['sent'] / max(io['send_calls'], 1):.1f} 个")
+    return text
+
+
+def _run_tunnel(endpoint, interval):
+    import asyncio
+
+    async def run():
+        await endpoint.start()
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                print(_format_reorder(endpoint.stats()), file=sys.stderr)
+        finally:
+            await endpoint.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_tunnel(args):
+    from .scheduler import Link
+    from .service import parse_address, resolve_interfaces
+    from .tunnel import DEFAULT_PORT, TunnelClient
+
+    links = [Link.from_interface(i) for i in resolve_interfaces(args.iface)]
+    client = TunnelClient(links, parse_address(args.peer, DEFAULT_PORT), parse_address(args.listen, DEFAULT_PORT),
+                          mode=args.mode, window=args.window, delay=args.delay / 1000, fec=args.fec,
+                          classifier=_classifier(args.latency), batch=args.batch)
+    return _run_tunnel(client, args.stats)
+
+
+def cmd_tunnel_peer(args):
+    from .service import parse_address
+    from .tunnel import DEFAULT_PORT, TunnelPeer
+
+    peer = TunnelPeer(parse_address(args.listen, DEFAULT_PORT), parse_address(args.target, DEFAULT_PORT),
+                      window=args.window, delay=args.delay / 1000, fec=args.fec,
+                      classifier=_classifier(args.latency), batch=args.batch)
+    return _run_tunnel(peer, args.stats)
+
+
+def _classifier(rules):
+    from .classify import Classifier
+
+    return Classifier(rules) if rules else None
+
+
+def _metrics_address(text):
+    # 只给端口时监听回环地址，指标不应默认暴露到局域网
+    return f"127.0.0.1:{text}" if text.isdigit() else text
+
+
+def _trace_sample(text):
+    value = float(text)
+    if not 0 < value <= 1:
+        raise argparse.ArgumentTypeError("抽样比例应在 0 到 1 之间")
+    return value
+
+
+def _dns_server(text):
+    from .resolver import server_address
+
+    if text != 'auto':
+        try:
+            server_address(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"无效的 DNS 服务器地址: {text}") from None
+    return text
+
+
+def _latency_rule(text):
+    from .classify import parse_rule
+
+    if text != 'default':
+        try:
+            parse_rule(text)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e)) from None
+    return text
+
+
+def _fec_setting(text):
+    if text in ('auto', 'off'):
+        return text
+    try:
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("应为 auto、off 或每组包数") from None
+
+
+def _limit_setting(text):
+    name, sep, rate = text.rpartition('=')
+    try:
+        rate = float(rate)
+    except ValueError:
+        rate = 0
+    if not sep or not name or rate <= 0:
+        raise argparse.ArgumentTypeError(f"无效的限速: {text}（应为 接口名=Mbit/s，如 wlan0=20）")
+    return name, rate
+
+
+def _quota_setting(text):
+    from .shaper import parse_quota
+
+    name, sep, quota = text.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"无效的流量配额: {text}（应为 接口名=大小/周期，如 wlan0=2G/day）")
+    try:
+        return (name,) + parse_quota(quota)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def _limits(settings):
+    return dict(settings or [])
+
+
+def _quotas(settings):
+    quotas = {}
+    for name, period, count in settings or []:
+        quotas.setdefault(name, {})[period] = count
+    return quotas
+
+
+def _add_tunnel_options(parser):
+    parser.add_argument('--fec', type=_fec_setting, default='auto',
+                        help="前向纠错：auto 按链路丢包率自动调整（默认）、off 关闭，或固定的每组包数")
+    parser.add_argument('--window', type=int, default=512, help="重排缓冲区最多缓存的乱序包数")
+    parser.add_argument('--delay', type=float, default=50, help="等待缺失包的最长时间（毫秒）")
+    parser.add_argument('--stats', type=float, default=5.0, help="输出统计的间隔（秒）")
+    parser.add_argument('--latency', type=_latency_rule, action='append', metavar='RULE',
+                        help="低延迟分类规则，可重复指定；命中的数据报走 RTT 最低的路径，动作为 duplicate 时"
+                             "在两条最快的路径上重复发送，如 27015-27030:duplicate 或 dscp=46")
+    parser.add_argument('--batch', type=int, default=32,
+                        help="每次系统调用最多收发的数据报数（Linux 上用 recvmmsg/sendmmsg），0 表示逐个收发")
+
+
+def _add_enable_options(parser):
+    # 可由配置档案提供的选项默认为 None，未在命令行给出时由 _enable_params 依次取档案和内置默认值
+    parser.add_argument('--mode', choices=MODES, help="负载均衡模式，默认 round_robin")
+    parser.add_argument('--iface', action='append', default=[],
+                        help="参与叠加的接口（名称、IP、MAC），可重复指定")
+    parser.add_argument('--profile', help="使用已保存的配置档案")
+    parser.add_argument('--save', metavar='NAME', help="把本次配置保存为配置档案")
+    parser.add_argument('--listen', help="代理监听地址，默认 127.0.0.1:1080")
+    parser.add_argument('--probe', help="健康检查探测，如 udp:1.2.3.4:7、tcp:223.5.5.5:53、icmp")
+    parser.add_argument('--probe-interval', type=float, help="探测间隔（秒），默认 0.5")
+    parser.add_argument('--relay', choices=RELAY_MODES, default='auto',
+                        help="数据转发方式：splice（Linux 零拷贝）、buffer（复用缓冲区）、stream，默认自动选择")
+    parser.add_argument('--latency', type=_latency_rule, action='append', metavar='RULE',
+                        help="低延迟分类规则，命中的连接走 RTT 最低的链路，可重复指定；"
+                             "如 22,27015-27030 或 dscp=46，default 为内置的游戏/语音/SSH 规则")
+    parser.add_argument('--sticky', type=float, metavar='SECONDS',
+                        help="流保持：同一客户端到同一目标的连接在空闲超过该时间前沿用同一条链路，默认 0 不保持")
+    parser.add_argument('--dns', type=_dns_server, action='append', metavar='SERVER',
+                        help="经出口链路解析目标域名，可重复指定：auto 使用各接口自己的 DNS 服务器，"
+                             "或给出共用的服务器地址（如 223.5.5.5、127.0.0.1:5353）；默认使用系统解析")
+    parser.add_argument('--pool', type=int, metavar='N',
+                        help="预连接池：在各链路上为最常访问的目标预先建立最多 N 条连接（按链路权重分配），默认 0 关闭")
+    parser.add_argument('--race', type=float, metavar='MS',
+                        help="多链路竞速连接：选中的链路在该时间（毫秒，建议 250）内未连上时，同时在下一条最快的链路上连接，"
+                             "先连上者胜出；默认 0 关闭")
+    parser.add_argument('--offload', action='store_true', default=None,
+                        help="内核路由模式：不经代理，下发策略路由和多路径默认路由由内核按链路分流（仅 Linux，需要 root）")
+    parser.add_argument('--mptcp', action='store_true', default=None,
+                        help="MPTCP 模式：代理的出站连接使用 Multipath TCP，单条连接经全部接口的子流传输，"
+                             "对端不支持时自动退回普通 TCP（仅 Linux，配置路径管理器需要 root）")
+    parser.add_argument('--limit', type=_limit_setting, action='append', metavar='IFACE=MBIT',
+                        help="接口限速（Mbit/s，上下行各自计算），可重复指定，如 wlan0=20；仅对经代理的流量生效")
+    parser.add_argument('--quota', type=_quota_setting, action='append', metavar='IFACE=SIZE/PERIOD',
+                        help="接口流量配额，周期为 day 或 month，可重复指定，如 wlan0=2G/day、wlan0=30G/month；"
+                             "用量接近配额时新连接不再使用该接口")
+    parser.add_argument('--fair', action='store_true', default=None,
+                        help="限速接口上的连接公平排队，大下载不会挤占交互连接")
+    parser.add_argument('--metrics', type=_metrics_address, metavar='[HOST:]PORT',
+                        help="在该地址以 Prometheus 文本格式提供运行指标（GET /metrics），如 9108；默认不提供")
+    parser.add_argument('--trace', type=os.path.abspath, metavar='FILE',
+                        help="抽样记录连接的选路、耗时和流量，每条连接一行 JSON，文件超过 10 MB 时轮换")
+    parser.add_argument('--trace-sample', type=_trace_sample, default=0.01, metavar='RATE',
+                        help="被跟踪连接的抽样比例，默认 0.01")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="代理工作进程数，大于 1 时以 SO_REUSEPORT 多进程监听（仅 Linux）")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='network_bonding', description="网络叠加工具命令行")
+    parser.add_argument('--control', type=_control_address, default=DEFAULT_CONTROL,
+                        help="守护进程控制接口地址，默认 127.0.0.1:1081")
+    parser.add_argument('-v', '--verbose', action='store_true', help="输出调试日志")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('list', help="列出网络接口")
+    p.add_argument('--json', action='store_true', help="以 JSON 输出")
+    p.add_argument('--all', action='store_true', help="包含回环接口")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser('enable', help="启用网络叠加（必要时自动启动守护进程）")
+    _add_enable_options(p)
+    p.add_argument('--log', help="守护进程日志文件")
+    p.set_defaults(func=cmd_enable)
+
+    p = sub.add_parser('disable', help="禁用网络叠加")
+    p.set_defaults(func=cmd_disable)
+
+    p = sub.add_parser('status', help="查看叠加状态")
+    p.add_argument('--json', action='store_true', help="以 JSON 输出")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser('run', help="运行叠加服务")
+    p.add_argument('--daemon', action='store_true', help="在后台运行")
+    p.add_argument('--log', help="日志文件")
+    _add_enable_options(p)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('profiles', help="列出或删除配置档案")
+    p.add_argument('--delete', metavar='NAME', help="删除指定档案")
+    p.add_argument('--json', action='store_true', help="以 JSON 输出")
+    p.set_defaults(func=cmd_profiles)
+
+    p = sub.add_parser('stop', help="退出守护进程")
+    p.set_defaults(func=cmd_stop)
+
+    p = sub.add_parser('download', help="通过多个接口并发下载文件")
+    p.add_argument('url')
+    p.add_argument('output')
+    p.add_argument('--iface', action='append', required=True, help="参与下载的接口，可重复指定")
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser('tunnel', help="逐包叠加隧道客户端：把本地 UDP 流量分摊到多个接口发往隧道对端")
+    p.add_argument('--peer', required=True, help="隧道对端地址 host:port")
+    p.add_argument('--iface', action='append', required=True, help="参与叠加的接口，可重复指定")
+    p.add_argument('--listen', default="127.0.0.1:1082", help="本地 UDP 入口地址，默认 127.0.0.1:1082")
+    p.add_argument('--mode', choices=("round_robin", "weighted"), default='round_robin', help="逐包分摊方式")
+    _add_tunnel_options(p)
+    p.set_defaults(func=cmd_tunnel)
+
+    p = sub.add_parser('tunnel-peer', help="逐包叠加隧道对端：重排后转发给目标 UDP 服务")
+    p.add_argument('--listen', default="0.0.0.0:1082", help="隧道监听地址，默认 0.0.0.0:1082")
+    p.add_argument('--target', required=True, help="转发目标 host:port，例如 WireGuard 服务端")
+    _add_tunnel_options(p)
+    p.set_defaults(func=cmd_tunnel_peer)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    level = logging.DEBUG if args.verbose else logging.INFO
+    if getattr(args, 'log', None) and args.command == 'run' and not args.daemon:
+        logging.basicConfig(level=level, filename=args.log, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    else:
+        logging.basicConfig(level=level if args.command in ('run', 'tunnel', 'tunnel-peer') else logging.WARNING,
+                            format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        return args.func(args)
+    except ControlError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    except Exception as e:
+        if args.verbose:
+            raise
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
@@ -0,0 +1,264 @@
+"""
+本地控制接口
+守护进程在回环地址上提供按行分隔的 JSON 请求/应答协议，命令行和图形界面作为瘦客户端连接
+
+回环地址上的端口本机任何程序都能连接（包括浏览器中的网页发出的 HTTP 请求），因此:
+    - 守护进程每次启动生成随机令牌，写入配置目录中只有当前用户可读的文件，每个请求都必须带上它
+    - 收到不是 JSON 的行（例如 HTTP 请求行）或令牌不符时立即断开连接
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import socket
+import tempfile
+
+from .profiles import config_dir
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONTROL = ('127.0.0.1', 1081)
+
+
+def token_path(port, directory=None):
+    """
+    控制接口令牌文件的路径，按端口区分，便于同时运行多个守护进程
+    """
+    return os.path.join(directory or config_dir(), f'control-{port}.token')
+
+
+def write_token(path):
+    """
+    生成新令牌并写入 path（权限 0600，先写临时文件再替换）
+
+    Returns:
+        令牌字符串
+    """
+    token = secrets.token_hex(16)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.token')
+    try:
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            f.write(token)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return token
+
+
+def read_token(path):
+    """
+    读取令牌文件，不存在时返回 None
+    """
+    try:
+        with open(path, encoding='ascii') as f:
+            return f.read().strip() or None
+    except (OSError, ValueError):
+        return None
+
+
+class ControlError(Exception):
+    """
+    守护进程返回错误或无法连接时抛出
+    """
+
+
+class ControlServer:
+    """
+    控制接口服务端
+    每行一个请求 {"cmd": ..., "token": ..., 参数...}，应答 {"ok": true, "result": ...} 或 {"ok": false, "error": ...}
+
+    Args:
+        token_dir: 令牌文件所在目录，默认为配置目录
+    """
+    def __init__(self, service, host=DEFAULT_CONTROL[0], port=DEFAULT_CONTROL[1], token_dir=None):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.token_dir = token_dir
+        self.token = None
+        self._token_path = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._token_path = token_path(self.port, self.token_dir)
+        try:
+            self.token = write_token(self._token_path)
+        except OSError:
+            self._server.close()
+            self._server = None
+            raise
+        log.info("控制接口已监听 %s:%d", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            # 只删除自己写的令牌，新的守护进程可能已经占用了同一端口
+            if read_token(self._token_path) == self.token:
+                try:
+                    os.unlink(self._token_path)
+                except OSError:
+                    pass
+
+    async def dispatch(self, request):
+        """
+        执行一条控制命令
+
+        Returns:
+            命令结果（可 JSON 序列化）
+        """
+        cmd = request.pop('cmd', None)
+        service = self.service
+        if cmd == 'ping':
+            return 'pong'
+        if cmd == 'status':
+            return service.status()
+        if cmd == 'enable':
+            return await service.enable(**request)
+        if cmd == 'disable':
+            await service.disable()
+            return service.status()
+        if cmd == 'set_weight':
+            service.set_weight(request['name'], request.get('weight'))
+            return service.status()
+        if cmd == 'update_links':
+            service.update_links(request['interfaces'])
+            return None
+        if cmd == 'shutdown':
+            service.request_stop()
+            return None
+        raise ValueError(f"未知命令: {cmd}")
+
+    def _authorized(self, request):
+        token = request.pop('token', None)
+        return isinstance(token, str) and hmac.compare_digest(token.encode('utf-8'), self.token.encode('ascii'))
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    # 不是本协议的客户端（例如网页发来的 HTTP 请求），不应答，直接断开
+                    log.debug("控制接口收到无效请求，已断开")
+                    break
+                if not isinstance(request, dict) or not self._authorized(request):
+                    log.warning("控制接口收到令牌无效的请求，已断开")
+                    writer.write(json.dumps({'ok': False, 'error': "控制接口令牌无效"},
+                                            ensure_ascii=False).encode('utf-8') + b'\n')
+                    await writer.drain()
+                    break
+                try:
+                    reply = {'ok': True, 'result': await self.dispatch(request)}
+                except Exception as e:
+                    log.debug("控制命令失败", exc_info=True)
+                    reply = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError: 行超过 StreamReader 的长度上限
+            pass
+        finally:
+            writer.close()
+
+
+class ControlClient:
+    """
+    控制接口客户端（阻塞式）
+    令牌在每次连接时从 token_dir（默认为配置目录）中按端口读取，守护进程重启后无需重建客户端
+    """
+    def __init__(self, address=DEFAULT_CONTROL, timeout=5.0, token_dir=None):
+        self.address = tuple(address)
+        self.timeout = timeout
+        self.token_dir = token_dir
+        self._token = None
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        self._token = read_token(token_path(self.address[1], self.token_dir))
+        if self._token is None:
+            raise ControlError(f"叠加服务未运行（找不到控制接口令牌 {token_path(self.address[1], self.token_dir)}）")
+        try:
+            self._sock = socket.create_connection(self.address, self.timeout)
+        except OSError as e:
+            raise ControlError(f"无法连接叠加服务 {self.address[0]}:{self.address[1]}: {e}") from None
+        self._file = self._sock.makefile('rb')
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+    def call(self, cmd, **params):
+        """
+        发送一条命令并等待应答
+
+        Raises:
+            ControlError: 连接失败或守护进程返回错误
+        """
+        if self._sock is None:
+            self._connect()
+        params['cmd'] = cmd
+        params['token'] = self._token
+        try:
+            self._sock.sendall(json.dumps(params, ensure_ascii=False).encode('utf-8') + b'\n')
+            line = self._file.readline()
+        except OSError as e:
+            self.close()
+            raise ControlError(f"与叠加服务通信失败: {e}") from None
+        if not line:
+            self.close()
+            raise ControlError("叠加服务已断开")
+        reply = json.loads(line)
+        if not reply.get('ok'):
+            raise ControlError(reply.get('error', '未知错误'))
+        return reply.get('result')
+
+    def alive(self):
+        """
+        守护进程是否在运行
+        """
+        try:
+            return self.call('ping') == 'pong'
+        except ControlError:
+            return False
+
+
+async def run_daemon(control=DEFAULT_CONTROL, enable=None):
+    """
+    守护进程主体：启动控制接口（并写入令牌文件），可选地立即启用叠加，直到收到 shutdown 命令
+
+    Args:
+        control: 控制接口地址 (host, port)
+        enable: 启动后立即执行的 enable 参数字典（可选）
+    """
+    from .service import BondingService
+
+    service = BondingService()
+    server = ControlServer(service, *control)
+    await server.start()
+    try:
+        if enable:
+            await service.enable(**enable)
+        await service.wait_stopped()
+    finally:
+        await server.stop()
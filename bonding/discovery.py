@@ -0,0 +1,440 @@
+"""
+网络接口发现
+可插拔的后端：Linux 直接读取 rtnetlink、/sys/class/net 和 /proc/net/route，
+Windows 调用 GetAdaptersAddresses，均返回结构化的接口记录，不依赖本地化的命令输出
+"""
+
+import socket
+import sys
+import threading
+
+from . import netlink
+
+
+KIND_WIRED = '有线'
+KIND_WIRELESS = '无线'
+KIND_LOOPBACK = '回环'
+KIND_VIRTUAL = '虚拟'
+
+STATUS_CONNECTED = '已连接'
+STATUS_DISCONNECTED = '未连接'
+
+
+class InterfaceInfo:
+    """
+    网络接口记录
+    ipv4/ipv6 为 (地址, 前缀长度) 列表，speed 单位为 Mbit/s，未知时为 None；dns 为该接口的 DNS 服务器列表
+    """
+    __slots__ = ('name', 'index', 'kind', 'mac', 'guid', 'mtu', 'speed', 'up',
+                 'ipv4', 'ipv6', 'gateway', 'gateway6', 'metric', 'dns')
+
+    def __init__(self, name, index=0, kind=KIND_WIRED, mac='', guid='', mtu=0, speed=None, up=False):
+        self.name = name
+        self.index = index
+        self.kind = kind
+        self.mac = mac
+        self.guid = guid
+        self.mtu = mtu
+        self.speed = speed
+        self.up = up
+        self.ipv4 = []
+        self.ipv6 = []
+        self.gateway = ''
+        self.gateway6 = ''
+        self.metric = None
+        self.dns = []
+
+    @property
+    def ip(self):
+        """
+        首选 IPv4 地址，没有时为空字符串
+        """
+        return self.ipv4[0][0] if self.ipv4 else ''
+
+    @property
+    def connected(self):
+        return self.up and bool(self.ipv4)
+
+    def to_dict(self):
+        """
+        转换为界面使用的接口字典，兼容原 ipconfig 解析结果的键
+        """
+        return {
+            'name': self.name,
+            'type': self.kind,
+            'ip': self.ip,
+            'gateway': self.gateway,
+            'status': STATUS_CONNECTED if self.connected else STATUS_DISCONNECTED,
+            'index': self.index,
+            'mac': self.mac,
+            'guid': self.guid,
+            'mtu': self.mtu,
+            'speed': self.speed,
+            'metric': self.metric,
+            'ipv4': [list(a) for a in self.ipv4],
+            'ipv6': [list(a) for a in self.ipv6],
+            'dns': list(self.dns),
+        }
+
+    def __repr__(self):
+        return f"InterfaceInfo({self.name!r}, ip={self.ip!r}, up={self.up})"
+
+
+class DiscoveryBackend:
+    """
+    发现后端基类
+    """
+    name = 'base'
+
+    def interfaces(self):
+        """
+        Returns:
+            InterfaceInfo 列表
+        """
+        raise NotImplementedError
+
+
+def _read_sys(name, attr):
+    try:
+        with open(f'/sys/class/net/{name}/{attr}') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _hex_ipv4(value):
+    return socket.inet_ntoa(int(value, 16).to_bytes(4, 'little'))
+
+
+class LinuxBackend(DiscoveryBackend):
+    """
+    Linux 后端
+    链路和地址来自 rtnetlink，速率和类型来自 /sys/class/net，默认网关来自 /proc/net/route，
+    各接口的 DNS 服务器来自 systemd-resolved 的运行时状态（未使用 systemd-resolved 时为空）
+    """
+    name = 'linux'
+
+    def __init__(self):
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _query(self, msg_type):
+        with self._lock:
+            if self._sock is None:
+                self._sock = netlink.open_socket()
+            try:
+                return netlink.dump(self._sock, msg_type)
+            except OSError:
+                self._sock.close()
+                self._sock = None
+                raise
+
+    def interfaces(self):
+        records = {}
+        for _, body in self._query(netlink.RTM_GETLINK):
+            record = self.link_record(body)
+            records[record.index] = record
+
+        for _, body in self._query(netlink.RTM_GETADDR):
+            family, prefixlen, index, addr = netlink.parse_addr(body)
+            record = records.get(index)
+            if record is None or addr is None:
+                continue
+            if family == socket.AF_INET:
+                record.ipv4.append((addr, prefixlen))
+            elif family == socket.AF_INET6:
+                record.ipv6.append((addr, prefixlen))
+
+        by_name = {r.name: r for r in records.values()}
+        self._read_routes(by_name)
+        self._read_routes6(by_name)
+        self._read_dns(records)
+        return sorted(records.values(), key=lambda r: r.index)
+
+    def link_record(self, body):
+        """
+        由 RTM_NEWLINK 负载构造接口记录（不含地址）
+        """
+        index, flags, attrs = netlink.parse_link(body)
+        name = netlink.attr_str(attrs.get(netlink.IFLA_IFNAME, b''))
+        raw_mac = attrs.get(netlink.IFLA_ADDRESS, b'')
+        mtu = netlink.attr_u32(attrs[netlink.IFLA_MTU]) if netlink.IFLA_MTU in attrs else 0
+
+        if flags & netlink.IFF_LOOPBACK:
+            kind = KIND_LOOPBACK
+        elif _read_sys(name, 'wireless') is not None or _read_sys(name, 'phy80211/name') is not None:
+            kind = KIND_WIRELESS
+        elif _read_sys(name, 'device/uevent') is None:
+            kind = KIND_VIRTUAL
+        else:
+            kind = KIND_WIRED
+
+        speed = _read_sys(name, 'speed')
+        try:
+            speed = int(speed) if speed is not None and int(speed) > 0 else None
+        except ValueError:
+            speed = None
+
+        record = InterfaceInfo(
+            name,
+            index=index,
+            kind=kind,
+            mac=':'.join(f'{b:02x}' for b in raw_mac),
+            mtu=mtu,
+            speed=speed,
+            up=bool(flags & netlink.IFF_UP) and bool(flags & netlink.IFF_LOWER_UP),
+        )
+        record.guid = record.mac if any(raw_mac) else name
+        return record
+
+    @staticmethod
+    def _read_routes(by_name):
+        try:
+            with open('/proc/net/route') as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            return
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 8 or fields[1] != '00000000' or fields[7] != '00000000':
+                continue
+            record = by_name.get(fields[0])
+            metric = int(fields[6])
+            if record is not None and (record.metric is None or metric < record.metric):
+                record.gateway = _hex_ipv4(fields[2])
+                record.metric = metric
+
+    @staticmethod
+    def _read_dns(records):
+        for index, record in records.items():
+            try:
+                with open(f'/run/systemd/resolve/netif/{index}') as f:
+                    lines = f.readlines()
+            except OSError:
+                continue
+            for line in lines:
+                if line.startswith('SERVERS='):
+                    # 条目可能带端口或 SNI 名称（如 1.1.1.1#cloudflare-dns.com），只取地址
+                    record.dns = [s.split('#')[0] for s in line[8:].split()]
+
+    @staticmethod
+    def _read_routes6(by_name):
+        try:
+            with open('/proc/net/ipv6_route') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 10 or fields[1] != '00' or int(fields[0], 16) or not int(fields[4], 16):
+                continue
+            record = by_name.get(fields[9])
+            if record is not None and not record.gateway6:
+                record.gateway6 = socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[4]))
+
+
+class WindowsBackend(DiscoveryBackend):
+    """
+    Windows 后端
+    通过 ctypes 调用 iphlpapi!GetAdaptersAddresses，与系统语言无关，也不需要启动子进程
+    """
+    name = 'windows'
+
+    AF_INET6 = 23
+    GAA_FLAGS = 0x2 | 0x4 | 0x80
+    ERROR_BUFFER_OVERFLOW = 111
+    IF_TYPE_ETHERNET = 6
+    IF_TYPE_LOOPBACK = 24
+    IF_TYPE_WIRELESS = 71
+    OPER_STATUS_UP = 1
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+
+        class SocketAddress(ctypes.Structure):
+            _fields_ = [('lpSockaddr', ctypes.c_void_p), ('iSockaddrLength', ctypes.c_int)]
+
+        class UnicastAddress(ctypes.Structure):
+            pass
+        UnicastAddress._fields_ = [
+            ('Length', wintypes.ULONG), ('Flags', wintypes.DWORD),
+            ('Next', ctypes.POINTER(UnicastAddress)), ('Address', SocketAddress),
+            ('PrefixOrigin', ctypes.c_int), ('SuffixOrigin', ctypes.c_int), ('DadState', ctypes.c_int),
+            ('ValidLifetime', wintypes.ULONG), ('PreferredLifetime', wintypes.ULONG),
+            ('LeaseLifetime', wintypes.ULONG), ('OnLinkPrefixLength', ctypes.c_ubyte),
+        ]
+
+        class GatewayAddress(ctypes.Structure):
+            pass
+        GatewayAddress._fields_ = [
+            ('Length', wintypes.ULONG), ('Reserved', wintypes.DWORD),
+            ('Next', ctypes.POINTER(GatewayAddress)), ('Address', SocketAddress),
+        ]
+
+        class Adapter(ctypes.Structure):
+            pass
+        Adapter._fields_ = [
+            ('Length', wintypes.ULONG), ('IfIndex', wintypes.DWORD),
+            ('Next', ctypes.POINTER(Adapter)), ('AdapterName', ctypes.c_char_p),
+            ('FirstUnicastAddress', ctypes.POINTER(UnicastAddress)),
+            ('FirstAnycastAddress', ctypes.c_void_p), ('FirstMulticastAddress', ctypes.c_void_p),
+            ('FirstDnsServerAddress', ctypes.POINTER(GatewayAddress)), ('DnsSuffix', ctypes.c_wchar_p),
+            ('Description', ctypes.c_wchar_p), ('FriendlyName', ctypes.c_wchar_p),
+            ('PhysicalAddress', ctypes.c_ubyte * 8), ('PhysicalAddressLength', wintypes.ULONG),
+            ('Flags', wintypes.ULONG), ('Mtu', wintypes.ULONG), ('IfType', wintypes.DWORD),
+            ('OperStatus', ctypes.c_int), ('Ipv6IfIndex', wintypes.DWORD),
+            ('ZoneIndices', wintypes.ULONG * 16), ('FirstPrefix', ctypes.c_void_p),
+            ('TransmitLinkSpeed', ctypes.c_uint64), ('ReceiveLinkSpeed', ctypes.c_uint64),
+            ('FirstWinsServerAddress', ctypes.c_void_p),
+            ('FirstGatewayAddress', ctypes.POINTER(GatewayAddress)),
+            ('Ipv4Metric', wintypes.ULONG), ('Ipv6Metric', wintypes.ULONG),
+        ]
+
+        self._ctypes = ctypes
+        self._adapter = Adapter
+        self._get = ctypes.windll.iphlpapi.GetAdaptersAddresses
+        self._get.argtypes = [wintypes.ULONG, wintypes.ULONG, ctypes.c_void_p,
+                              ctypes.POINTER(Adapter), ctypes.POINTER(wintypes.ULONG)]
+        self._get.restype = wintypes.ULONG
+        self._size = 16 * 1024
+
+    def _sockaddr(self, address):
+        raw = self._ctypes.string_at(address.lpSockaddr, address.iSockaddrLength)
+        family = int.from_bytes(raw[:2], 'little')
+        if family == socket.AF_INET:
+            return socket.AF_INET, socket.inet_ntop(socket.AF_INET, raw[4:8])
+        if family == self.AF_INET6:
+            return socket.AF_INET6, socket.inet_ntop(socket.AF_INET6, raw[8:24])
+        return None, None
+
+    def interfaces(self):
+        ctypes = self._ctypes
+        while True:
+            buf = ctypes.create_string_buffer(self._size)
+            size = ctypes.c_ulong(self._size)
+            result = self._get(0, self.GAA_FLAGS, None,
+                               ctypes.cast(buf, ctypes.POINTER(self._adapter)), ctypes.byref(size))
+            if result == self.ERROR_BUFFER_OVERFLOW:
+                self._size = size.value + 1024
+                continue
+            if result != 0:
+                raise OSError(result, "GetAdaptersAddresses 调用失败")
+            break
+
+        records = []
+        node = ctypes.cast(buf, ctypes.POINTER(self._adapter))
+        while node:
+            adapter = node.contents
+            if adapter.IfType == self.IF_TYPE_LOOPBACK:
+                kind = KIND_LOOPBACK
+            elif adapter.IfType == self.IF_TYPE_WIRELESS:
+                kind = KIND_WIRELESS
+            elif adapter.IfType == self.IF_TYPE_ETHERNET:
+                kind = KIND_WIRED
+            else:
+                kind = KIND_VIRTUAL
+            speed = adapter.TransmitLinkSpeed
+            record = InterfaceInfo(
+                adapter.FriendlyName or '',
+                index=adapter.IfIndex,
+                kind=kind,
+                mac='-'.join(f'{b:02X}' for b in adapter.PhysicalAddress[:adapter.PhysicalAddressLength]),
+                guid=(adapter.AdapterName or b'').decode('ascii', 'replace'),
+                mtu=adapter.Mtu,
+                speed=speed // 1000000 if 0 < speed < (1 << 63) else None,
+                up=adapter.OperStatus == self.OPER_STATUS_UP,
+            )
+            record.metric = adapter.Ipv4Metric
+
+            unicast = adapter.FirstUnicastAddress
+            while unicast:
+                family, addr = self._sockaddr(unicast.contents.Address)
+                if family == socket.AF_INET:
+                    record.ipv4.append((addr, unicast.contents.OnLinkPrefixLength))
+                elif family == socket.AF_INET6:
+                    record.ipv6.append((addr, unicast.contents.OnLinkPrefixLength))
+                unicast = unicast.contents.Next
+
+            gateway = adapter.FirstGatewayAddress
+            while gateway:
+                family, addr = self._sockaddr(gateway.contents.Address)
+                if family == socket.AF_INET and not record.gateway:
+                    record.gateway = addr
+                elif family == socket.AF_INET6 and not record.gateway6:
+                    record.gateway6 = addr
+                gateway = gateway.contents.Next
+
+            # IP_ADAPTER_DNS_SERVER_ADDRESS 与网关地址结构布局相同
+            server = adapter.FirstDnsServerAddress
+            while server:
+                family, addr = self._sockaddr(server.contents.Address)
+                if addr:
+                    record.dns.append(addr)
+                server = server.contents.Next
+
+            records.append(record)
+            node = adapter.Next
+        return records
+
+
+class GenericBackend(DiscoveryBackend):
+    """
+    通用后端
+    仅能列出接口名称和索引，用于没有专用后端的平台
+    """
+    name = 'generic'
+
+    def interfaces(self):
+        return [InterfaceInfo(name, index=index) for index, name in socket.if_nameindex()]
+
+
+_backends = [
+    ('linux', LinuxBackend),
+    ('win32', WindowsBackend),
+]
+_backend = None
+
+
+def register_backend(platform_prefix, factory):
+    """
+    注册发现后端，优先于内置后端匹配
+
+    Args:
+        platform_prefix: 与 sys.platform 前缀匹配的平台名，如 'linux'、'win32'
+        factory: 无参可调用对象，返回 DiscoveryBackend 实例
+    """
+    global _backend
+    _backends.insert(0, (platform_prefix, factory))
+    _backend = None
+
+
+def get_backend():
+    """
+    返回当前平台的发现后端（单例）
+    """
+    global _backend
+    if _backend is None:
+        for prefix, factory in _backends:
+            if sys.platform.startswith(prefix):
+                _backend = factory()
+                break
+        else:
+            _backend = GenericBackend()
+    return _backend
+
+
+def discover(include_loopback=False):
+    """
+    枚举本机网络接口
+
+    Args:
+        include_loopback: 是否包含回环接口
+
+    Returns:
+        InterfaceInfo 列表
+    """
+    records = get_backend().interfaces()
+    if not include_loopback:
+        records = [r for r in records if r.kind != KIND_LOOPBACK]
+    return records
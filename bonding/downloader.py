@@ -0,0 +1,357 @@
+"""
+多链路并发下载
+把一个 HTTP(S) 对象按字节范围拆分，通过所有选中的网络接口并行获取，直接写入预分配的输出文件
+"""
+
+import collections
+import http.client
+import logging
+import ssl
+import threading
+import time
+import urllib.parse
+
+
+log = logging.getLogger(__name__)
+
+READ_BUFFER = 256 * 1024
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class DownloadError(Exception):
+    """
+    下载无法完成时抛出
+    """
+
+
+class ByteRange:
+    """
+    待下载的字节区间 [start, end)，pos 为已写入文件的位置
+    """
+    __slots__ = ('start', 'pos', 'end')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.pos = start
+        self.end = end
+
+    @property
+    def remaining(self):
+        return self.end - self.pos
+
+    def __repr__(self):
+        return f"ByteRange({self.pos}-{self.end})"
+
+
+class LinkState:
+    """
+    单条链路在本次下载中的状态：吞吐量估计、失败次数、已下载字节数
+    """
+    __slots__ = ('link', 'rate', 'failures', 'bytes', 'alive', 'current')
+
+    def __init__(self, link):
+        self.link = link
+        self.current = None
+        self.rate = 0.0
+        self.failures = 0
+        self.bytes = 0
+        self.alive = True
+
+    def observe(self, nbytes, seconds, alpha=0.3):
+        """
+        以指数加权移动平均更新吞吐量估计（字节/秒）
+        """
+        if seconds <= 0:
+            return
+        sample = nbytes / seconds
+        self.rate = sample if self.rate == 0 else (1 - alpha) * self.rate + alpha * sample
+
+
+def _split_url(url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise DownloadError(f"不支持的协议: {parts.scheme}")
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return parts, path
+
+
+class RangeDownloader:
+    """
+    多链路分段下载器
+    分段大小随各链路实测吞吐量自适应，空闲的快链路会接走慢链路剩余的尾部，
+    某条链路断开时其未完成的区间会重新分配给其它链路
+    """
+    def __init__(self, url, links, path, min_chunk=256 * 1024, max_chunk=32 * 1024 * 1024,
+                 chunk_seconds=2.0, timeout=15.0, max_failures=3, progress=None):
+        if not links:
+            raise ValueError("至少需要一个网络接口")
+        self.url = url
+        self.path = path
+        self.states = [LinkState(link) for link in links]
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.chunk_seconds = chunk_seconds
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.progress = progress
+
+        self.size = None
+        self.validator = None
+        self._cond = threading.Condition()
+        self._cursor = 0
+        self._returned = collections.deque()
+        self._inflight = set()
+        self._done = 0
+        self._error = None
+        self._ssl_context = None
+
+    def _connect(self, parts, link):
+        port = parts.port
+        host = parts.hostname
+        if parts.scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout,
+                                               source_address=(link.ip, 0),
+                                               context=self._ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout,
+                                          source_address=(link.ip, 0))
+
+    def _probe(self):
+        """
+        用第一条可用链路请求首字节，获取最终URL、对象大小以及服务器是否支持分段
+
+        Returns:
+            是否支持 Range 请求
+        """
+        url = self.url
+        last_error = None
+        for state in self.states:
+            try:
+                for _ in range(MAX_REDIRECTS + 1):
+                    parts, path = _split_url(url)
+                    conn = self._connect(parts, state.link)
+                    try:
+                        conn.request('GET', path, headers={'Range': 'bytes=0-0'})
+                        resp = conn.getresponse()
+                        if resp.status in REDIRECT_CODES:
+                            url = urllib.parse.urljoin(url, resp.getheader('Location', ''))
+                            continue
+                        self.url = url
+                        self.validator = resp.getheader('ETag') or resp.getheader('Last-Modified')
+                        if resp.status == 206:
+                            total = resp.getheader('Content-Range', '').rpartition('/')[2]
+                            if total.isdigit():
+                                self.size = int(total)
+                                return True
+                        elif resp.status != 200:
+                            raise DownloadError(f"服务器返回 {resp.status} {resp.reason}")
+                        length = resp.getheader('Content-Length')
+                        self.size = int(length) if length and length.isdigit() else None
+                        return False
+                    finally:
+                        conn.close()
+                raise DownloadError("重定向次数过多")
+            except (OSError, http.client.HTTPException) as e:
+                last_error = e
+                log.debug("链路 %s 探测失败: %s", state.link.name, e)
+        raise DownloadError(f"所有链路均无法连接: {last_error}")
+
+    def run(self):
+        """
+        执行下载，阻塞直到完成
+
+        Returns:
+            下载的字节数
+
+        Raises:
+            DownloadError: 所有链路都失败或服务器行为异常
+        """
+        ranged = self._probe()
+        if not ranged or not self.size:
+            return self._run_single()
+
+        with open(self.path, 'wb') as f:
+            f.truncate(self.size)
+
+        threads = [threading.Thread(target=self._worker, args=(state,), daemon=True,
+                                    name=f"download-{state.link.name}")
+                   for state in self.states]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+        if self._done != self.size:
+            raise DownloadError(f"下载未完成: {self._done}/{self.size} 字节，所有链路均已失败")
+        return self.size
+
+    def _run_single(self):
+        """
+        服务器不支持分段时退化为单链路顺序下载
+        """
+        parts, path = _split_url(self.url)
+        for state in self.states:
+            conn = self._connect(parts, state.link)
+            try:
+                conn.request('GET', path)
+                resp = conn.getresponse()
+                if resp.status != 200:
+                    raise DownloadError(f"服务器返回 {resp.status} {resp.reason}")
+                buf = bytearray(READ_BUFFER)
+                view = memoryview(buf)
+                total = 0
+                with open(self.path, 'wb') as f:
+                    while True:
+                        n = resp.readinto(buf)
+                        if not n:
+                            break
+                        f.write(view[:n])
+                        total += n
+                        state.bytes += n
+                        if self.progress is not None:
+                            self.progress(total, self.size)
+                return total
+            except (OSError, http.client.HTTPException) as e:
+                log.warning("链路 %s 下载失败: %s", state.link.name, e)
+            finally:
+                conn.close()
+        raise DownloadError("所有链路均下载失败")
+
+    def _chunk_size(self, state):
+        alive = sum(1 for s in self.states if s.alive) or 1
+        size = int(state.rate * self.chunk_seconds) if state.rate else self.min_chunk
+        unassigned = self.size - self._cursor
+        size = min(size, max(self.min_chunk, unassigned // alive))
+        return max(self.min_chunk, min(size, self.max_chunk))
+
+    def _steal(self, state):
+        """
+        从剩余最多的在途区间中切走尾部，按两条链路的速度比例分配
+        """
+        victim = max(self._inflight, key=lambda r: r.remaining, default=None)
+        if victim is None or victim.remaining < 2 * self.min_chunk:
+            return None
+        owner = next((s for s in self.states if s.current is victim), None)
+        owner_rate = owner.rate if owner is not None else 0.0
+        my_rate = state.rate or owner_rate or 1.0
+        share = my_rate / (my_rate + (owner_rate or my_rate))
+        cut = victim.end - max(self.min_chunk, int(victim.remaining * share))
+        if cut <= victim.pos:
+            return None
+        stolen = ByteRange(cut, victim.end)
+        victim.end = cut
+        return stolen
+
+    def _next_range(self, state):
+        with self._cond:
+            while True:
+                if not state.alive:
+                    return None
+                if self._returned:
+                    r = self._returned.popleft()
+                elif self._cursor < self.size:
+                    start = self._cursor
+                    self._cursor = min(self.size, start + self._chunk_size(state))
+                    r = ByteRange(start, self._cursor)
+                else:
+                    r = self._steal(state)
+                if r is not None:
+                    self._inflight.add(r)
+                    return r
+                if not self._inflight:
+                    return None
+                self._cond.wait(0.5)
+
+    def _finish_range(self, r, failed):
+        with self._cond:
+            self._inflight.discard(r)
+            if failed and r.remaining > 0:
+                self._returned.append(ByteRange(r.pos, r.end))
+            self._cond.notify_all()
+
+    def _worker(self, state):
+        parts, path = _split_url(self.url)
+        headers = {}
+        if self.validator:
+            headers['If-Range'] = self.validator
+        buf = bytearray(READ_BUFFER)
+        view = memoryview(buf)
+        conn = None
+        with open(self.path, 'r+b') as f:
+            while True:
+                r = self._next_range(state)
+                if r is None:
+                    break
+                state.current = r
+                requested_end = r.end
+                started = time.monotonic()
+                got = 0
+                try:
+                    if conn is None:
+                        conn = self._connect(parts, state.link)
+                    headers['Range'] = f"bytes={r.pos}-{requested_end - 1}"
+                    conn.request('GET', path, headers=headers)
+                    resp = conn.getresponse()
+                    if resp.status != 206:
+                        resp.close()
+                        raise DownloadError(f"服务器返回 {resp.status}，对象可能已变化")
+                    f.seek(r.pos)
+                    while True:
+                        with self._cond:
+                            want = r.remaining
+                        if want <= 0:
+                            break
+                        n = resp.readinto(view[:min(want, READ_BUFFER)])
+                        if not n:
+                            raise ConnectionError("连接提前关闭")
+                        with self._cond:
+                            n = min(n, r.remaining)
+                            r.pos += n
+                            self._done += n
+                        f.write(view[:n])
+                        got += n
+                        state.bytes += n
+                        if self.progress is not None:
+                            self.progress(self._done, self.size)
+                    if r.end != requested_end:
+                        conn.close()
+                        conn = None
+                    state.observe(got, time.monotonic() - started)
+                    state.failures = 0
+                    self._finish_range(r, failed=False)
+                except DownloadError as e:
+                    self._error = e
+                    for s in self.states:
+                        s.alive = False
+                    self._finish_range(r, failed=True)
+                    break
+                except (OSError, http.client.HTTPException) as e:
+                    log.warning("链路 %s 下载中断: %s", state.link.name, e)
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                    state.failures += 1
+                    if state.failures >= self.max_failures:
+                        state.alive = False
+                    self._finish_range(r, failed=True)
+                    time.sleep(min(2.0, 0.2 * state.failures))
+                finally:
+                    state.current = None
+        if conn is not None:
+            conn.close()
+
+
+def download(url, links, path, **kwargs):
+    """
+    便捷函数：通过多条链路下载 url 到 path
+
+    Returns:
+        下载的字节数
+    """
+    return RangeDownloader(url, links, path, **kwargs).run()
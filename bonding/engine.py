@@ -0,0 +1,378 @@
+"""
+叠加引擎
+把调度器和代理组合在一起，并在后台线程中运行独立的 asyncio 事件循环
+"""
+
+import asyncio
+import errno
+import logging
+import threading
+
+from .classify import Classifier
+from .estimator import LinkEstimator
+from .flows import FlowTable
+from .health import HealthChecker, probe_from_spec
+from .metrics import TRACE_SAMPLE, Metrics, MetricsServer, Tracer, exposition
+from .proxy import BondingProxy
+from .relay import resolve_mode
+from .resolver import make_resolver
+from .scheduler import Link, Scheduler
+from .shaper import QuotaTracker, Shaper
+
+
+log = logging.getLogger(__name__)
+
+
+class BondingEngine:
+    """
+    网络叠加引擎
+    与界面无关，GUI 通过 start()/stop() 控制，也可在已有事件循环中直接 await serve()
+
+    Args:
+        interfaces: 参与叠加的接口字典列表
+        mode: 负载均衡模式
+        host, port: 代理监听地址
+        probe: 健康检查探测器或探测配置字符串（如 'udp:1.2.3.4:7'），None 表示不检查
+        probe_interval: 探测间隔（秒）
+        on_link_change: 链路上下线时的回调 on_link_change(link, up)，在引擎线程中调用
+        relay: 数据转发方式，见 relay.RELAY_MODES
+        workers: 代理工作进程数，大于 1 时启用多进程模式（见 workers.WorkerPool），
+            本进程只负责健康检查、权重估计和状态汇总
+        latency: 低延迟分类规则列表（见 classify.Classifier），命中的连接走 RTT 最低的链路，None 表示不分类
+        sticky: 流保持的空闲超时（秒），同一客户端到同一目标的连接在此期间沿用同一条链路；0 表示不保持。
+            多进程模式下每个工作进程各有一张流表
+        dns: DNS 配置列表（见 resolver.make_resolver），设置后目标域名经出口链路解析；None 表示使用系统解析
+        pool: 预连接池的空闲连接上限（见 pool.ConnectionPool），按链路权重分配；0 表示不预连接
+        race: 多链路竞速连接的错开时间（秒，RFC 8305 建议 0.25），0 表示不竞速
+        metrics: Prometheus 指标端点的监听地址 (host, port)，None 表示不提供；指标总会记录，也出现在 status() 中
+        trace: 连接跟踪文件路径（见 metrics.Tracer），None 表示不跟踪；多进程模式下每个工作进程写 路径.编号
+        trace_sample: 被跟踪连接的抽样比例
+        offload: 为真时不运行代理，改为下发 Linux 策略路由由内核转发（见 offload.PolicyRouter），
+            健康检查和权重估计照常运行并随时改写多路径路由；代理相关的选项（latency、sticky、dns 等）不起作用
+        mptcp: 代理的出站连接使用 MPTCP（Linux），并配置内核路径管理器在每个接口上建立子流（见 mptcp.PathManager）；
+            没有权限配置时沿用系统现有的 MPTCP 端点
+        limits: {接口名: 限速 Mbit/s}，代理转发经该接口的流量时上下行各自限速（见 shaper.Shaper），None 表示不限速；
+            多进程模式下每个工作进程分得 1/workers
+        quotas: {接口名: {'day': 字节, 'month': 字节}}，按日/按月的流量配额，用量保存在配置目录中；
+            接近配额的接口不再分配新连接（见 shaper.QuotaTracker），None 表示不限
+        fair: 限速接口上的连接公平排队，避免大下载挤占交互连接
+    """
+    def __init__(self, interfaces, mode="round_robin", host="127.0.0.1", port=1080,
+                 probe=None, probe_interval=0.5, on_link_change=None, relay="auto", workers=1, latency=None,
+                 sticky=0, dns=None, pool=0, race=0.0, metrics=None, trace=None, trace_sample=TRACE_SAMPLE,
+                 offload=False, mptcp=False, limits=None, quotas=None, fair=False):
+        self.latency = list(latency or [])
+        self.sticky = sticky
+        self.dns = list(dns or [])
+        self.race = race
+        self.metrics_address = tuple(metrics) if metrics else None
+        self.trace = trace
+        self.offload = offload
+        self.mptcp = mptcp
+        if offload and workers > 1:
+            raise ValueError("内核路由模式不使用代理工作进程")
+        if offload and mptcp:
+            raise ValueError("内核路由模式不经过代理，不能与 MPTCP 模式同时使用")
+        self.limits = {name: float(rate) for name, rate in (limits or {}).items()}
+        self.quotas = {name: dict(periods) for name, periods in (quotas or {}).items()}
+        self.fair = fair
+        names = {i['name'] for i in interfaces}
+        for name in list(self.limits) + list(self.quotas):
+            if name not in names:
+                raise ValueError(f"限速或配额指定的接口不在叠加接口中: {name}")
+        if any(rate <= 0 for rate in self.limits.values()):
+            raise ValueError("限速必须大于0")
+        if offload and self.limits:
+            raise ValueError("内核路由模式不经过代理，不能限速")
+        resolver = make_resolver(self.dns, interfaces)
+        classifier = Classifier(self.latency) if self.latency else None
+        self.table = None
+        if workers > 1:
+            from .workers import LinkTable, WorkerPool, init_table, shared_links
+
+            self.table = LinkTable(len(interfaces), workers)
+            init_table(self.table, interfaces)
+            self.links = shared_links(self.table, interfaces)
+        else:
+            self.links = [Link.from_interface(i) for i in interfaces]
+        flows = FlowTable(sticky) if sticky and self.table is None else None
+        self.scheduler = Scheduler(self.links, mode, flows)
+        self.metrics = Metrics([link.name for link in self.links], mode)
+        if offload:
+            from .offload import PolicyRouter
+
+            self.proxy = PolicyRouter(self.links, interfaces, mode)
+        elif self.table is not None:
+            self.proxy = WorkerPool(self.table, interfaces, mode, host, port, resolve_mode(relay), workers,
+                                    self.latency, sticky, self.dns, pool, race, trace, trace_sample, mptcp,
+                                    self.limits, fair)
+        else:
+            self.proxy = BondingProxy(self.scheduler, host, port, relay_mode=relay, classifier=classifier,
+                                      resolver=resolver, pool_size=pool, race_delay=race, metrics=self.metrics,
+                                      tracer=Tracer(trace, trace_sample) if trace else None, mptcp=mptcp,
+                                      shaper=Shaper(self.limits, fair) if self.limits else None)
+        self.path_manager = None
+        if mptcp:
+            from .mptcp import PathManager
+
+            self.path_manager = PathManager(interfaces)
+        self.quota = QuotaTracker(self.links, interfaces, self.quotas, self._refresh) if self.quotas else None
+        self.estimator = LinkEstimator(self.links)
+        if isinstance(probe, str):
+            probe = probe_from_spec(probe)
+        self.on_link_change = on_link_change
+        self.health = None
+        if probe is not None:
+            self.health = HealthChecker(self.links, probe, interval=probe_interval, on_change=self._link_changed,
+                                        metrics=self.metrics)
+        self.metrics_server = None
+        if self.metrics_address is not None:
+            self.metrics_server = MetricsServer(self.metrics_text, *self.metrics_address)
+        self.loop = None
+        self._thread = None
+        self._stopping = None
+        self._serving = False
+
+    @property
+    def mode(self):
+        return self.scheduler.mode
+
+    @property
+    def address(self):
+        return self.proxy.host, self.proxy.port
+
+    @property
+    def running(self):
+        return self._serving
+
+    async def serve(self, on_started=None):
+        """
+        启动代理并一直运行，直到 shutdown() 被调用
+
+        Args:
+            on_started: 监听成功后调用的回调（可选）
+        """
+        self.loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._configure_paths()
+        try:
+            await self.proxy.start()
+        except BaseException:
+            self._release_paths()
+            raise
+        if self.metrics_server is not None:
+            try:
+                await self.metrics_server.start()
+            except BaseException:
+                await self.proxy.stop()
+                self._release_paths()
+                raise
+        self.estimator.start()
+        if self.health is not None:
+            self.health.start()
+        if self.quota is not None:
+            self.quota.start()
+        self._serving = True
+        try:
+            if on_started is not None:
+                on_started()
+            await self._stopping.wait()
+        finally:
+            self._serving = False
+            if self.quota is not None:
+                await self.quota.stop()
+            if self.health is not None:
+                await self.health.stop()
+            await self.estimator.stop()
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+            await self.proxy.stop()
+            self._release_paths()
+
+    def _configure_paths(self):
+        from .mptcp import available
+
+        if self.path_manager is None:
+            return
+        if not available():
+            # 代理会退回普通 TCP，也就不需要路径管理器
+            self.path_manager = None
+            return
+        try:
+            self.path_manager.start()
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.EACCES):
+                raise
+            log.warning("没有权限配置 MPTCP 路径管理器，沿用系统现有的 MPTCP 端点（ip mptcp endpoint）")
+            self.path_manager = None
+
+    def _release_paths(self):
+        if self.path_manager is not None:
+            self.path_manager.stop()
+
+    def shutdown(self):
+        """
+        线程安全地通知 serve() 退出
+        """
+        if self.loop is not None and self._stopping is not None:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+
+    def start(self, timeout=5.0):
+        """
+        在后台线程中启动引擎，监听成功后返回
+
+        Raises:
+            OSError: 监听端口失败
+            TimeoutError: timeout 秒内未能开始监听（已通知后台线程退出）
+        """
+        started = threading.Event()
+        abandoned = threading.Event()
+        errors = []
+
+        def on_started():
+            if abandoned.is_set():
+                # start() 已按超时返回失败，这时才监听成功也要立即退出
+                self._stopping.set()
+            started.set()
+
+        def run():
+            try:
+                asyncio.run(self.serve(on_started))
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                started.set()
+
+        self._thread = threading.Thread(target=run, name="bonding-engine", daemon=True)
+        self._thread.start()
+        if not started.wait(timeout):
+            abandoned.set()
+            self.shutdown()
+            self._thread.join(timeout)
+            self._thread = None
+            if errors:
+                raise errors[0]
+            raise TimeoutError(f"叠加引擎在 {timeout:g} 秒内未能开始监听")
+        if errors:
+            self._thread.join()
+            self._thread = None
+            raise errors[0]
+
+    def stop(self, timeout=5.0):
+        """
+        停止引擎并等待后台线程退出
+        """
+        self.shutdown()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _refresh(self):
+        self.scheduler.refresh()
+        if self.table is not None:
+            self.table.bump()
+        if self.offload:
+            self.proxy.refresh()
+
+    def _link_changed(self, link, up):
+        self._refresh()
+        if self.on_link_change is not None:
+            self.on_link_change(link, up)
+
+    def set_weight(self, name, weight):
+        """
+        设置某个接口的手动权重（Mbit/s），None 表示恢复自动估计
+        """
+        for link in self.links:
+            if link.name == name:
+                link.weight = weight
+                link.effective_weight = self.estimator.weight(link)
+        self._refresh()
+
+    def update_links(self, interfaces):
+        """
+        接口地址变化时更新对应链路的源地址和网关（按名称匹配），新连接立即使用新地址
+        """
+        for interface in interfaces:
+            for link in self.links:
+                if link.name == interface['name'] and interface.get('ip'):
+                    link.ip = interface['ip']
+                    link.gateway = interface.get('gateway', link.gateway)
+        self._refresh()
+
+    def _pool(self):
+        # 多进程模式下各工作进程各有一个预连接池，WorkerPool.pool 只是容量
+        return self.proxy.pool if self.table is None and not self.offload else None
+
+    def collect_metrics(self):
+        """
+        返回本进程的指标；多进程模式下为主进程（探测、上下线）与各工作进程（调度、连接）的汇总
+        """
+        if self.table is None:
+            return self.metrics
+        names = self.metrics.names
+        parts = [self.metrics] + [Metrics(names, self.mode, self.table.metrics_buffer(w))
+                                  for w in range(self.table.workers)]
+        return Metrics.merged(names, self.mode, parts)
+
+    def metrics_text(self):
+        """
+        Prometheus 文本格式的指标
+        """
+        flows = self.scheduler.flows
+        pool = self._pool()
+        return exposition(self.collect_metrics(), self.links, flows.stats() if flows is not None else None,
+                          pool.stats() if pool is not None else None, self.mptcp,
+                          self.quota.status() if self.quota is not None else None)
+
+    def _mptcp_status(self):
+        from .mptcp import available
+
+        if not self.mptcp:
+            return None
+        return {
+            'available': available(),
+            'endpoints': self.path_manager.status()['endpoints'] if self.path_manager is not None else None,
+        }
+
+    def _shaping_status(self):
+        if not self.limits and self.quota is None:
+            return None
+        shaper = getattr(self.proxy, 'shaper', None)
+        return {
+            'limits': dict(self.limits),
+            'fair': self.fair,
+            'quotas': self.quota.status() if self.quota is not None else {},
+            'shaper': shaper.stats() if shaper is not None else None,
+        }
+
+    def status(self):
+        """
+        返回当前运行状态的字典快照
+        """
+        host, port = self.address
+        counts = self.scheduler.flow_counts()
+        resolver = getattr(self.proxy, 'resolver', None)
+        pool = self._pool()
+        return {
+            'running': self.running,
+            'mode': self.mode,
+            'listen': f"{host}:{port}" if port is not None else None,
+            'relay': self.proxy.relay_mode,
+            'latency': list(self.latency),
+            'sticky': self.sticky,
+            'flows': self.scheduler.flows.stats() if self.scheduler.flows is not None else None,
+            'dns': list(self.dns),
+            'race': self.race,
+            'resolver': resolver.stats() if resolver is not None else None,
+            'pool': pool.stats() if pool is not None else None,
+            'metrics_listen': (f"{self.metrics_address[0]}:{self.metrics_server.port}"
+                               if self.metrics_server is not None else None),
+            'trace': self.trace,
+            'metrics': self.collect_metrics().snapshot(),
+            'workers': self.table.workers if self.table is not None else 1,
+            'offload': self.proxy.status() if self.offload else None,
+            'mptcp': self._mptcp_status(),
+            'shaping': self._shaping_status(),
+            'links': [dict(link.snapshot(), flows=counts.get(link.name, 0)) for link in self.links],
+        }
@@ -0,0 +1,72 @@
+"""
+链路能力估计
+周期性采样各链路的流量计数，用指数加权移动平均估计吞吐量，
+并结合探测得到的RTT计算加权调度使用的权重
+"""
+
+import asyncio
+import time
+
+from .scheduler import DEFAULT_CAPACITY, MBIT
+
+
+class LinkEstimator:
+    """
+    链路吞吐量与权重估计器
+
+    权重以 字节/秒 为单位：手动设置了 weight（Mbit/s）的链路直接使用该值；
+    否则取近期吞吐量峰值（缓慢衰减），尚无测量时取接口标称速率或默认值，
+    再按 reference_rtt / (reference_rtt + rtt) 对高延迟链路打折
+    """
+    def __init__(self, links, interval=1.0, alpha=0.3, peak_decay=0.98, reference_rtt=0.05,
+                 min_rate=16 * 1024):
+        self.links = links
+        self.interval = interval
+        self.alpha = alpha
+        self.peak_decay = peak_decay
+        self.reference_rtt = reference_rtt
+        self.min_rate = min_rate
+        self._last = {}
+        self._task = None
+
+    def sample(self, now=None):
+        """
+        采样一次计数器并刷新每条链路的 throughput/peak/effective_weight
+        """
+        now = time.monotonic() if now is None else now
+        for link in self.links:
+            total = link.bytes_sent + link.bytes_recv
+            previous = self._last.get(link.name)
+            self._last[link.name] = (now, total)
+            if previous is not None and now > previous[0]:
+                rate = (total - previous[1]) / (now - previous[0])
+                link.throughput = (1 - self.alpha) * link.throughput + self.alpha * rate
+                link.peak = max(link.throughput, link.peak * self.peak_decay)
+            link.effective_weight = self.weight(link)
+
+    def weight(self, link):
+        if link.weight:
+            return float(link.weight * MBIT)
+        if link.peak >= self.min_rate:
+            capacity = link.peak
+        elif link.speed:
+            capacity = link.speed * MBIT
+        else:
+            capacity = DEFAULT_CAPACITY
+        if link.rtt is not None:
+            capacity *= self.reference_rtt / (self.reference_rtt + link.rtt)
+        return capacity
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,234 @@
+"""
+流表
+记录每个流（客户端地址 + 目标）最近使用的出口链路，让同一个流的后续连接保持在同一条链路上；
+哈希模式在链路增减后也不会把已有的流迁走
+
+负载下流表可能有几十万项，因此:
+    - 表项按列存放在 array 中（链路序号、最近活动时间、定时轮刻度、LRU 前后指针），
+      各列合计每项约 30 字节，删除的槽位放入空闲链表复用
+    - 空闲超时由定时轮驱动：每个表项挂在到期刻度的桶里，推进时只检查到期的桶，
+      期间被访问过的表项延后重新挂入，不做全表扫描
+    - 表项数达到上限时淘汰最久未使用的表项（数组实现的双向链表，访问时移到尾部）
+    - 按链路维护表项计数，查询某条链路上的流数为 O(1)
+"""
+
+import time
+from array import array
+
+
+DEFAULT_CAPACITY = 262144
+DEFAULT_TIMEOUT = 300.0
+WHEEL_SIZE = 256
+
+_NIL = -1
+
+
+class FlowTable:
+    """
+    有界流表
+
+    Args:
+        timeout: 空闲超时（秒），超过该时间未访问的表项被淘汰
+        capacity: 表项上限，达到后按 LRU 淘汰
+        tick: 定时轮刻度（秒），到期时间精度为一个刻度；默认取 timeout 的 1/64
+        clock: 时间函数，默认 time.monotonic
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, capacity=DEFAULT_CAPACITY, tick=None, clock=time.monotonic):
+        if capacity < 1:
+            raise ValueError("流表容量至少为 1")
+        self.timeout = timeout
+        self.capacity = capacity
+        self.tick = tick or max(timeout / 64, 0.001)
+        self.clock = clock
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        self._index = {}
+        self._keys = []
+        self._link = array('h')
+        self._seen = array('d')
+        self._due = array('q')
+        self._prev = array('i')
+        self._next = array('i')
+        self._free = _NIL
+        self._head = _NIL
+        self._tail = _NIL
+        self._counts = []
+        self._wheel = [array('i') for _ in range(WHEEL_SIZE)]
+        self._now_tick = int(clock() / self.tick)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key):
+        """
+        查找流的链路序号并刷新其活动时间
+
+        Returns:
+            链路序号，不存在或已超时时返回 None
+        """
+        now = self._advance()
+        slot = self._index.get(key)
+        if slot is None:
+            return None
+        self._seen[slot] = now
+        self._move_to_tail(slot)
+        return self._link[slot]
+
+    def put(self, key, link):
+        """
+        记录流使用的链路序号；表满时先淘汰最久未使用的表项
+        """
+        now = self._advance()
+        slot = self._index.get(key)
+        if slot is not None:
+            self._count(self._link[slot], -1)
+            self._link[slot] = link
+            self._count(link, 1)
+            self._seen[slot] = now
+            self._move_to_tail(slot)
+            return
+        if len(self._index) >= self.capacity:
+            self._evict(self._head)
+            self.evicted_lru += 1
+        slot = self._allocate(key, link, now)
+        self._index[key] = slot
+        self._count(link, 1)
+        self._append(slot)
+        self._schedule(slot, now + self.timeout)
+
+    def remove(self, key):
+        """
+        删除一个流，返回是否存在
+        """
+        slot = self._index.get(key)
+        if slot is None:
+            return False
+        self._evict(slot)
+        return True
+
+    def count(self, link):
+        """
+        返回某条链路上的流数
+        """
+        return self._counts[link] if link < len(self._counts) else 0
+
+    def counts(self):
+        """
+        返回各链路的流数列表，下标为链路序号
+        """
+        return list(self._counts)
+
+    def expire(self):
+        """
+        推进定时轮并淘汰所有已超时的表项（查找和插入时会自动推进，空闲时可定期调用）
+
+        Returns:
+            本次淘汰的表项数
+        """
+        before = self.evicted_idle
+        self._advance()
+        return self.evicted_idle - before
+
+    def stats(self):
+        return {
+            'flows': len(self._index),
+            'capacity': self.capacity,
+            'evicted_idle': self.evicted_idle,
+            'evicted_lru': self.evicted_lru,
+        }
+
+    def _count(self, link, delta):
+        counts = self._counts
+        if link >= len(counts):
+            counts.extend([0] * (link + 1 - len(counts)))
+        counts[link] += delta
+
+    def _allocate(self, key, link, now):
+        slot = self._free
+        if slot != _NIL:
+            self._free = self._next[slot]
+            self._keys[slot] = key
+            self._link[slot] = link
+            self._seen[slot] = now
+            return slot
+        self._keys.append(key)
+        self._link.append(link)
+        self._seen.append(now)
+        self._due.append(_NIL)
+        self._prev.append(_NIL)
+        self._next.append(_NIL)
+        return len(self._keys) - 1
+
+    def _evict(self, slot):
+        del self._index[self._keys[slot]]
+        self._count(self._link[slot], -1)
+        self._unlink(slot)
+        self._keys[slot] = None
+        self._due[slot] = _NIL
+        self._next[slot] = self._free
+        self._free = slot
+
+    def _append(self, slot):
+        self._prev[slot] = self._tail
+        self._next[slot] = _NIL
+        if self._tail != _NIL:
+            self._next[self._tail] = slot
+        else:
+            self._head = slot
+        self._tail = slot
+
+    def _unlink(self, slot):
+        prev, next_ = self._prev[slot], self._next[slot]
+        if prev != _NIL:
+            self._next[prev] = next_
+        else:
+            self._head = next_
+        if next_ != _NIL:
+            self._prev[next_] = prev
+        else:
+            self._tail = prev
+
+    def _move_to_tail(self, slot):
+        if slot != self._tail:
+            self._unlink(slot)
+            self._append(slot)
+
+    def _schedule(self, slot, deadline):
+        # 超出一圈的到期时间先挂在最远的桶里，到时再重新挂入
+        due = min(max(int(deadline / self.tick) + 1, self._now_tick + 1), self._now_tick + WHEEL_SIZE - 1)
+        self._due[slot] = due
+        self._wheel[due % WHEEL_SIZE].append(slot)
+
+    def _advance(self):
+        now = self.clock()
+        target = int(now / self.tick)
+        if target <= self._now_tick:
+            return now
+        # 停顿超过一圈时每个桶只需处理一次
+        start = max(self._now_tick + 1, target - WHEEL_SIZE + 1)
+        self._now_tick = target
+        # 未到期的表项等本轮推进结束后再挂回：否则可能挂进本轮稍后要处理的桶，随旧桶一起被丢弃
+        later = []
+        for tick in range(start, target + 1):
+            index = tick % WHEEL_SIZE
+            bucket = self._wheel[index]
+            if not bucket:
+                continue
+            self._wheel[index] = array('i')
+            for slot in bucket:
+                # 表项被删除、槽位被复用或已重新挂到别的桶时，这里的引用已经失效
+                due = self._due[slot]
+                if due == _NIL or due > target or due % WHEEL_SIZE != index:
+                    continue
+                deadline = self._seen[slot] + self.timeout
+                if deadline <= now:
+                    self._evict(slot)
+                    self.evicted_idle += 1
+                else:
+                    later.append((slot, deadline))
+        for slot, deadline in later:
+            self._schedule(slot, deadline)
+        return now
@@ -0,0 +1,79 @@
+"""
+一致性哈希查找表
+Maglev 风格的加权查找表：按链路容量分配槽位，查找为一次取模加一次下标访问，
+成员变化时只有约 1/n 的键会改变映射
+"""
+
+import hashlib
+import zlib
+
+
+DEFAULT_TABLE_SIZE = 5003
+
+
+def hash_key(key):
+    """
+    稳定的32位键哈希（不受 PYTHONHASHSEED 影响）
+    """
+    return zlib.crc32(key.encode('utf-8', 'surrogatepass'))
+
+
+def _permutation(name, size):
+    digest = hashlib.blake2b(name.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    offset = int.from_bytes(digest[:8], 'little') % size
+    skip = int.from_bytes(digest[8:], 'little') % (size - 1) + 1
+    return offset, skip
+
+
+class MaglevTable:
+    """
+    加权 Maglev 查找表
+
+    Args:
+        members: [(名称, 权重, 对象)]，名称用于生成各成员稳定的槽位排列
+        size: 表大小，必须为质数，且应远大于成员数
+    """
+    def __init__(self, members, size=DEFAULT_TABLE_SIZE):
+        self.size = size
+        self.members = list(members)
+        self.table = self._build()
+
+    def _build(self):
+        size = self.size
+        members = [m for m in self.members if m[1] > 0]
+        if not members:
+            return []
+        max_weight = max(m[1] for m in members)
+        perms = [_permutation(m[0], size) for m in members]
+        nexts = [0] * len(members)
+        credits = [0.0] * len(members)
+        table = [None] * size
+        filled = 0
+        while True:
+            for i, member in enumerate(members):
+                credits[i] += member[1] / max_weight
+                while credits[i] >= 1.0:
+                    credits[i] -= 1.0
+                    offset, skip = perms[i]
+                    slot = (offset + nexts[i] * skip) % size
+                    while table[slot] is not None:
+                        nexts[i] += 1
+                        slot = (offset + nexts[i] * skip) % size
+                    table[slot] = member[2]
+                    nexts[i] += 1
+                    filled += 1
+                    if filled == size:
+                        return table
+
+    def lookup(self, key):
+        """
+        Returns:
+            key 映射到的对象，表为空时为 None
+        """
+        table = self.table
+        if not table:
+            return None
+        return table[hash_key(key) % self.size]
+
+    def slot(self, key):
+        return hash_key(key) % self.size
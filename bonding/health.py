@@ -0,0 +1,338 @@
+"""
+链路健康检查
+通过每个叠加接口周期性发送轻量探测（UDP回显、TCP连接或ICMP ping），
+维护滚动的RTT/丢包/抖动窗口，并带滞回地标记链路上下线
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import socket
+import struct
+import time
+
+from .datagram import open_endpoint
+from .proxy import link_family
+
+
+log = logging.getLogger(__name__)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+class ProbeError(Exception):
+    """
+    探测配置错误
+    """
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.pending = {}
+
+    def datagram_received(self, data, addr):
+        if len(data) >= 8:
+            waiter = self.pending.pop(struct.unpack_from('!Q', data)[0], None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.monotonic())
+
+    def error_received(self, exc):
+        for waiter in self.pending.values():
+            if not waiter.done():
+                waiter.set_exception(exc)
+        self.pending.clear()
+
+
+class UdpEchoProbe:
+    """
+    UDP回显探测
+    每条链路保持一个绑定源地址的UDP套接字，按序号匹配回显报文；链路地址变化后重新绑定
+    """
+    kind = 'udp'
+
+    def __init__(self, host, port=7):
+        self.host = host
+        self.port = port
+        self._endpoints = {}
+
+    async def _endpoint(self, link):
+        ip = link.ip
+        endpoint = self._endpoints.get(link.name)
+        if endpoint is not None and (endpoint[0] != ip or endpoint[1].is_closing()):
+            endpoint[1].close()
+            endpoint = None
+        if endpoint is None:
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                _ProbeProtocol,
+                local_addr=(ip, 0),
+                remote_addr=(self.host, self.port),
+                family=link_family(ip),
+            )
+            endpoint = self._endpoints[link.name] = (ip, transport, protocol)
+        return endpoint[1:]
+
+    async def probe(self, link, seq):
+        transport, protocol = await self._endpoint(link)
+        waiter = asyncio.get_running_loop().create_future()
+        protocol.pending[seq] = waiter
+        sent = time.monotonic()
+        transport.sendto(struct.pack('!Q', seq))
+        try:
+            return await waiter - sent
+        finally:
+            protocol.pending.pop(seq, None)
+
+    def close(self):
+        for _, transport, _ in self._endpoints.values():
+            transport.close()
+        self._endpoints.clear()
+
+
+class TcpConnectProbe:
+    """
+    TCP连接探测
+    测量从链路源地址到目标的三次握手时间
+    """
+    kind = 'tcp'
+
+    def __init__(self, host, port=443):
+        self.host = host
+        self.port = port
+
+    async def probe(self, link, seq):
+        sent = time.monotonic()
+        _, writer = await asyncio.open_connection(
+            self.host, self.port, family=link_family(link.ip), local_addr=(link.ip, 0))
+        rtt = time.monotonic() - sent
+        writer.close()
+        return rtt
+
+    def close(self):
+        pass
+
+
+class IcmpProbe:
+    """
+    ICMP ping探测
+    使用无需管理员权限的 ICMP 数据报套接字（Linux 需在 net.ipv4.ping_group_range 范围内），
+    host 为 None 时 ping 链路的默认网关
+    """
+    kind = 'icmp'
+
+    def __init__(self, host=None):
+        self.host = host
+        self._sockets = {}
+        self._pending = {}
+
+    def _socket(self, link):
+        ip = link.ip
+        entry = self._sockets.get(link.name)
+        if entry is not None and entry[0] != ip:
+            self._close(entry[1])
+            entry = None
+        if entry is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            sock.setblocking(False)
+            sock.bind((ip, 0))
+            asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable, sock)
+            entry = self._sockets[link.name] = (ip, sock)
+        return entry[1]
+
+    @staticmethod
+    def _close(sock):
+        asyncio.get_running_loop().remove_reader(sock.fileno())
+        sock.close()
+
+    def _on_readable(self, sock):
+        try:
+            data = sock.recv(2048)
+        except OSError:
+            return
+        if len(data) >= 8 and data[0] == ICMP_ECHO_REPLY:
+            waiter = self._pending.pop((sock.fileno(), struct.unpack_from('!H', data, 6)[0]), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.monotonic())
+
+    async def probe(self, link, seq):
+        target = self.host or link.gateway
+        if not target:
+            raise ProbeError(f"链路 {link.name} 没有默认网关")
+        sock = self._socket(link)
+        seq &= 0xFFFF
+        waiter = asyncio.get_running_loop().create_future()
+        key = (sock.fileno(), seq)
+        self._pending[key] = waiter
+        packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, 0, seq) + os.urandom(8)
+        sent = time.monotonic()
+        sock.sendto(packet, (target, 0))
+        try:
+            return await waiter - sent
+        finally:
+            self._pending.pop(key, None)
+
+    def close(self):
+        for _, sock in self._sockets.values():
+            self._close(sock)
+        self._sockets.clear()
+
+
+def probe_from_spec(spec):
+    """
+    由字符串创建探测器
+
+    Args:
+        spec: 'udp:主机:端口'、'tcp:主机:端口'、'icmp' 或 'icmp:主机'
+
+    Returns:
+        探测器实例
+    """
+    kind, _, rest = spec.partition(':')
+    if kind == 'icmp':
+        return IcmpProbe(rest or None)
+    host, _, port = rest.rpartition(':')
+    if kind not in ('udp', 'tcp') or not host or not port.isdigit():
+        raise ProbeError(f"无法识别的探测配置: {spec}")
+    host = host.strip('[]')
+    return UdpEchoProbe(host, int(port)) if kind == 'udp' else TcpConnectProbe(host, int(port))
+
+
+class LinkHealth:
+    """
+    单条链路的滚动探测窗口
+    samples 中每项为RTT（秒），None 表示该次探测失败
+    """
+    __slots__ = ('link', 'samples', 'successes', 'failures', 'changed_at')
+
+    def __init__(self, link, window):
+        self.link = link
+        self.samples = collections.deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.changed_at = time.monotonic()
+
+    def record(self, rtt):
+        """
+        记录一次探测结果并刷新链路上的RTT/丢包/抖动
+        """
+        self.samples.append(rtt)
+        if rtt is None:
+            self.failures += 1
+            self.successes = 0
+        else:
+            self.successes += 1
+            self.failures = 0
+
+        rtts = [s for s in self.samples if s is not None]
+        link = self.link
+        link.loss = 1.0 - len(rtts) / len(self.samples)
+        link.rtt = sum(rtts) / len(rtts) if rtts else None
+        if len(rtts) > 1:
+            link.jitter = sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+        else:
+            link.jitter = None
+
+
+class HealthChecker:
+    """
+    健康检查器
+    一次探测失败即把链路标记为可疑，新连接立即避开它（仍有其它健康链路时）；
+    连续 fall 次失败或窗口丢包率超过 max_loss 时下线链路，
+    连续 rise 次成功且丢包率回落后才重新上线，避免链路抖动时来回切换；
+    传入 metrics（metrics.Metrics）时记录每次探测的 RTT 和上下线次数
+    """
+    def __init__(self, links, probe, interval=0.5, timeout=None, window=20,
+                 rise=3, fall=2, max_loss=0.5, on_change=None, metrics=None):
+        self.links = links
+        self.probe = probe
+        self.interval = interval
+        self.timeout = timeout if timeout is not None else interval * 0.8
+        self.rise = rise
+        self.fall = fall
+        self.max_loss = max_loss
+        self.on_change = on_change
+        self.metrics = metrics
+        self.health = {link.name: LinkHealth(link, window) for link in links}
+        self._tasks = []
+        self._seq = 0
+
+    def start(self):
+        """
+        在当前事件循环中为每条链路启动探测任务
+        """
+        self._tasks = [asyncio.ensure_future(self._run(self.health[link.name])) for link in self.links]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.probe.close()
+
+    async def probe_once(self, health):
+        """
+        对一条链路执行一次探测并更新状态
+
+        Returns:
+            RTT（秒），失败时为 None
+        """
+        self._seq += 1
+        try:
+            rtt = await asyncio.wait_for(self.probe.probe(health.link, self._seq), self.timeout)
+        except (OSError, asyncio.TimeoutError, ProbeError) as e:
+            log.debug("链路 %s 探测失败: %s", health.link.name, e)
+            rtt = None
+        health.record(rtt)
+        if self.metrics is not None:
+            self.metrics.probed(health.link, rtt)
+        self._update_state(health)
+        return rtt
+
+    def _update_state(self, health):
+        link = health.link
+        link.suspect = health.failures > 0
+        if link.up and (health.failures >= self.fall or
+                        (len(health.samples) >= self.fall and link.loss > self.max_loss)):
+            self._set_state(health, False)
+        elif not link.up and health.successes >= self.rise and link.loss <= self.max_loss:
+            self._set_state(health, True)
+
+    def _set_state(self, health, up):
+        health.link.up = up
+        health.changed_at = time.monotonic()
+        log.info("链路 %s %s", health.link.name, "恢复" if up else "故障")
+        if self.metrics is not None:
+            self.metrics.link_changed(health.link, up)
+        if self.on_change is not None:
+            self.on_change(health.link, up)
+
+    async def _run(self, health):
+        loop = asyncio.get_running_loop()
+        next_at = loop.time()
+        while True:
+            await self.probe_once(health)
+            next_at += self.interval
+            delay = next_at - loop.time()
+            if delay < 0:
+                next_at = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+
+async def start_udp_echo_server(host="0.0.0.0", port=7):
+    """
+    启动一个UDP回显服务，可部署在远端作为 UdpEchoProbe 的探测目标，也可用于本地测试
+    回显服务要同时应答很多客户端的探测，Linux 上用批量收发（见 datagram）
+
+    Returns:
+        传输对象，调用 close() 停止
+    """
+    transport = None
+
+    def echo(data, addr):
+        transport.sendto(data, addr)
+
+    transport = await open_endpoint(echo, local_addr=(host, port))
+    return transport
@@ -0,0 +1,418 @@
+"""
+运行指标
+记录调度决策、出站连接、链路探测和故障切换的计数与耗时分布，以 Prometheus 文本格式和状态字典导出，
+并可按比例抽样把单条连接的经过写入滚动的跟踪文件
+
+所有计数和直方图放在一块扁平的 'd' 数组中，只由所属事件循环写入，记录时不加锁；
+多进程模式下每个工作进程写共享内存中自己的一段（见 workers.LinkTable），主进程读取时逐项求和
+"""
+
+import array
+import asyncio
+import bisect
+import json
+import logging
+import logging.handlers
+import random
+import time
+
+
+log = logging.getLogger(__name__)
+
+# 直方图桶的上界（秒），另有一个 +Inf 桶
+DECISION_BOUNDS = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 5e-3)
+LATENCY_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+# 调度决策的来源：按负载均衡模式选路，或低延迟流量选 RTT 最低的链路
+MODE, LATENCY = range(2)
+
+# 每条链路的计数
+_LINK_COUNTERS = ('connect_errors', 'failovers', 'recoveries', 'probe_failures')
+# 每条链路的 MPTCP 计数：以该链路为第一条子流的连接数和其中退回普通 TCP 的个数，以及该链路上的子流数和子流流量
+_MPTCP_COUNTERS = ('connections', 'fallbacks', 'subflows', 'bytes_sent', 'bytes_recv')
+
+TRACE_SAMPLE = 0.01
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+
+def _histogram_size(bounds):
+    # 各桶计数（含 +Inf）、总和、样本数
+    return len(bounds) + 3
+
+
+class Metrics:
+    """
+    一个进程（或工作进程）的指标
+
+    Args:
+        names: 链路名列表，顺序即槽位
+        mode: 负载均衡模式，作为调度决策计数的标签
+        buffer: 存放指标的可写 'd' 序列（如共享内存的 memoryview），None 时自行分配
+    """
+    def __init__(self, names, mode, buffer=None):
+        self.names = list(names)
+        self.mode = mode
+        self.slots = {name: i for i, name in enumerate(self.names)}
+        count = len(self.names)
+        self._decisions = 0
+        self._counters = self._decisions + count * 2
+        self._decision_seconds = self._counters + count * len(_LINK_COUNTERS)
+        self._connect_seconds = self._decision_seconds + _histogram_size(DECISION_BOUNDS)
+        self._probe_seconds = self._connect_seconds + count * _histogram_size(LATENCY_BOUNDS)
+        self._mptcp = self._probe_seconds + count * _histogram_size(LATENCY_BOUNDS)
+        self.data = buffer if buffer is not None else array.array('d', bytes(8 * self.size(count)))
+
+    @staticmethod
+    def size(count):
+        """
+        count 条链路的指标占用的 'd' 元素个数
+        """
+        return count * (2 + len(_LINK_COUNTERS) + len(_MPTCP_COUNTERS)) + _histogram_size(DECISION_BOUNDS) \
+            + 2 * count * _histogram_size(LATENCY_BOUNDS)
+
+    @classmethod
+    def merged(cls, names, mode, parts):
+        """
+        把多个进程的指标逐项相加，得到一份只读的汇总
+        """
+        metrics = cls(names, mode)
+        data = metrics.data
+        for part in parts:
+            for i, value in enumerate(part.data):
+                data[i] += value
+        return metrics
+
+    def _observe(self, offset, bounds, value):
+        data = self.data
+        data[offset + bisect.bisect_left(bounds, value)] += 1
+        offset += len(bounds) + 1
+        data[offset] += value
+        data[offset + 1] += 1
+
+    def _count(self, field, link):
+        self.data[self._counters + self.slots[link.name] * len(_LINK_COUNTERS) + field] += 1
+
+    def decision(self, link, kind, elapsed):
+        """
+        记录一次调度决策
+
+        Args:
+            link: 选中的 Link
+            kind: MODE 或 LATENCY
+            elapsed: 决策耗时（秒）
+        """
+        self.data[self._decisions + self.slots[link.name] * 2 + kind] += 1
+        self._observe(self._decision_seconds, DECISION_BOUNDS, elapsed)
+
+    def connected(self, link, elapsed):
+        self._observe(self._connect_seconds + self.slots[link.name] * _histogram_size(LATENCY_BOUNDS),
+                      LATENCY_BOUNDS, elapsed)
+
+    def connect_error(self, link):
+        self._count(0, link)
+
+    def link_changed(self, link, up):
+        self._count(2 if up else 1, link)
+
+    def probed(self, link, rtt):
+        """
+        记录一次健康检查探测，rtt 为 None 表示探测失败
+        """
+        if rtt is None:
+            self._count(3, link)
+        else:
+            self._observe(self._probe_seconds + self.slots[link.name] * _histogram_size(LATENCY_BOUNDS),
+                          LATENCY_BOUNDS, rtt)
+
+    def mptcp_closed(self, link, fallback, subflows):
+        """
+        记录一条结束的 MPTCP 连接
+
+        Args:
+            link: 第一条子流所在的 Link
+            fallback: 对端不支持 MPTCP、连接退回了普通 TCP
+            subflows: [(子流所在的 Link, 发送字节, 接收字节)]，Link 为 None（不经叠加接口）的子流不计
+        """
+        data = self.data
+        base = self._mptcp + self.slots[link.name] * len(_MPTCP_COUNTERS)
+        data[base] += 1
+        if fallback:
+            data[base + 1] += 1
+        for sublink, sent, recv in subflows:
+            if sublink is None:
+                continue
+            base = self._mptcp + self.slots[sublink.name] * len(_MPTCP_COUNTERS)
+            data[base + 2] += 1
+            data[base + 3] += sent
+            data[base + 4] += recv
+
+    def _histogram(self, offset, bounds):
+        data = self.data
+        buckets = []
+        total = 0
+        for i, bound in enumerate(bounds + ('+Inf',)):
+            total += int(data[offset + i])
+            buckets.append([bound, total])
+        return {'buckets': buckets, 'sum': data[offset + len(bounds) + 1],
+                'count': int(data[offset + len(bounds) + 2])}
+
+    def snapshot(self):
+        """
+        返回可 JSON 序列化的指标字典，直方图的桶为累计计数 [上界, 样本数]，最后一个桶的上界为 '+Inf'
+        """
+        data = self.data
+        links = {}
+        for slot, name in enumerate(self.names):
+            base = self._counters + slot * len(_LINK_COUNTERS)
+            entry = {field: int(data[base + i]) for i, field in enumerate(_LINK_COUNTERS)}
+            entry['decisions'] = {self.mode: int(data[self._decisions + slot * 2 + MODE]),
+                                  'latency': int(data[self._decisions + slot * 2 + LATENCY])}
+            size = _histogram_size(LATENCY_BOUNDS)
+            entry['connect_seconds'] = self._histogram(self._connect_seconds + slot * size, LATENCY_BOUNDS)
+            entry['probe_rtt_seconds'] = self._histogram(self._probe_seconds + slot * size, LATENCY_BOUNDS)
+            base = self._mptcp + slot * len(_MPTCP_COUNTERS)
+            entry['mptcp'] = {field: int(data[base + i]) for i, field in enumerate(_MPTCP_COUNTERS)}
+            links[name] = entry
+        return {
+            'decision_seconds': self._histogram(self._decision_seconds, DECISION_BOUNDS),
+            'links': links,
+        }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Exposition:
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name, labels, value):
+        text = ','.join(f'{key}="{_label(v)}"' for key, v in labels.items())
+        self.lines.append(f"{name}{{{text}}} {_number(value)}" if text else f"{name} {_number(value)}")
+
+    def histogram(self, name, labels, histogram):
+        for bound, count in histogram['buckets']:
+            self.sample(name + '_bucket', dict(labels, le=_number(bound)), count)
+        self.sample(name + '_sum', labels, histogram['sum'])
+        self.sample(name + '_count', labels, histogram['count'])
+
+
+def exposition(metrics, links, flows=None, pool=None, mptcp=False, quotas=None):
+    """
+    生成 Prometheus 文本格式（0.0.4）的指标
+
+    Args:
+        metrics: Metrics（多进程模式下为汇总）
+        links: Link 列表，提供流量、连接数和上下线状态
+        flows: 流表统计字典（可选）
+        pool: 预连接池统计字典（可选）
+        mptcp: 是否输出 MPTCP 连接和子流的指标
+        quotas: 流量配额用量（见 shaper.QuotaTracker.status()，可选）
+
+    Returns:
+        文本
+    """
+    snapshot = metrics.snapshot()
+    out = _Exposition()
+    out.family('bonding_link_up', 'gauge', "链路是否可用")
+    for link in links:
+        out.sample('bonding_link_up', {'link': link.name}, 1 if link.up else 0)
+    out.family('bonding_link_weight_bytes_per_second', 'gauge', "链路的有效权重（字节/秒）")
+    for link in links:
+        out.sample('bonding_link_weight_bytes_per_second', {'link': link.name}, link.effective_weight)
+    out.family('bonding_link_bytes_total', 'counter', "经链路转发的字节数")
+    for link in links:
+        out.sample('bonding_link_bytes_total', {'link': link.name, 'direction': 'sent'}, link.bytes_sent)
+        out.sample('bonding_link_bytes_total', {'link': link.name, 'direction': 'recv'}, link.bytes_recv)
+    out.family('bonding_link_connections_total', 'counter', "经链路建立的连接数")
+    for link in links:
+        out.sample('bonding_link_connections_total', {'link': link.name}, link.total)
+    out.family('bonding_link_active_connections', 'gauge', "链路上正在转发的连接数")
+    for link in links:
+        out.sample('bonding_link_active_connections', {'link': link.name}, link.active)
+
+    out.family('bonding_scheduler_decisions_total', 'counter', "调度决策次数，mode 为负载均衡模式或 latency（低延迟选路）")
+    for name, entry in snapshot['links'].items():
+        for mode, count in entry['decisions'].items():
+            out.sample('bonding_scheduler_decisions_total', {'link': name, 'mode': mode}, count)
+    for field, help_text in (('connect_errors', "出站连接失败次数"), ('failovers', "链路被判定故障的次数"),
+                             ('recoveries', "链路恢复的次数"), ('probe_failures', "健康检查探测失败次数")):
+        name = f"bonding_link_{field}_total"
+        out.family(name, 'counter', help_text)
+        for link_name, entry in snapshot['links'].items():
+            out.sample(name, {'link': link_name}, entry[field])
+
+    out.family('bonding_scheduler_decision_seconds', 'histogram', "一次调度决策的耗时")
+    out.histogram('bonding_scheduler_decision_seconds', {}, snapshot['decision_seconds'])
+    out.family('bonding_connect_seconds', 'histogram', "出站 TCP 连接的建立耗时")
+    for name, entry in snapshot['links'].items():
+        out.histogram('bonding_connect_seconds', {'link': name}, entry['connect_seconds'])
+    out.family('bonding_probe_rtt_seconds', 'histogram', "健康检查探测的往返时间")
+    for name, entry in snapshot['links'].items():
+        out.histogram('bonding_probe_rtt_seconds', {'link': name}, entry['probe_rtt_seconds'])
+
+    if flows is not None:
+        out.family('bonding_flows', 'gauge', "流表中的流数")
+        out.sample('bonding_flows', {}, flows['flows'])
+    if pool is not None:
+        out.family('bonding_pool_requests_total', 'counter', "预连接池的取用次数，result 为 hit 或 miss")
+        out.sample('bonding_pool_requests_total', {'result': 'hit'}, pool['hits'])
+        out.sample('bonding_pool_requests_total', {'result': 'miss'}, pool['misses'])
+    if mptcp:
+        for field, help_text in (('connections', "以链路为第一条子流的 MPTCP 连接数"),
+                                 ('fallbacks', "对端不支持 MPTCP、退回普通 TCP 的连接数"),
+                                 ('subflows', "已结束连接在链路上的子流数")):
+            name = f"bonding_mptcp_{field}_total"
+            out.family(name, 'counter', help_text)
+            for link_name, entry in snapshot['links'].items():
+                out.sample(name, {'link': link_name}, entry['mptcp'][field])
+        out.family('bonding_mptcp_subflow_bytes_total', 'counter', "已结束连接经链路上的子流发送和接收的字节数（按子流采样的比例拆分）")
+        for link_name, entry in snapshot['links'].items():
+            out.sample('bonding_mptcp_subflow_bytes_total', {'link': link_name, 'direction': 'sent'},
+                       entry['mptcp']['bytes_sent'])
+            out.sample('bonding_mptcp_subflow_bytes_total', {'link': link_name, 'direction': 'recv'},
+                       entry['mptcp']['bytes_recv'])
+    if quotas is not None:
+        out.family('bonding_link_capped', 'gauge', "链路是否因接近流量配额而不再分配新连接")
+        for link in links:
+            out.sample('bonding_link_capped', {'link': link.name}, 1 if link.capped else 0)
+        for field, help_text in (('used', "本周期已用的流量"), ('limit', "流量配额")):
+            name = f"bonding_quota_{field}_bytes"
+            out.family(name, 'gauge', help_text)
+            for link_name, periods in quotas.items():
+                for period, entry in periods.items():
+                    out.sample(name, {'link': link_name, 'period': period}, entry[field])
+    return '\n'.join(out.lines) + '\n'
+
+
+class MetricsServer:
+    """
+    在本地提供 Prometheus 抓取端点：GET /metrics 返回 render() 生成的文本
+
+    Args:
+        render: 无参函数，返回指标文本
+        host, port: 监听地址
+    """
+    def __init__(self, render, host="127.0.0.1", port=9108):
+        self.render = render
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        log.info("指标端点已监听 http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            parts = head.split(b'\r\n', 1)[0].split()
+            if len(parts) == 3 and parts[0] == b'GET' and parts[1].split(b'?')[0] in (b'/metrics', b'/'):
+                status, body = b'200 OK', self.render().encode('utf-8')
+            else:
+                status, body = b'404 Not Found', b'not found\n'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            log.exception("生成指标失败")
+        finally:
+            writer.close()
+
+
+class FlowLink:
+    """
+    转发被跟踪的连接时代替 Link 传给 relay.relay()：流量照常计入链路，同时累计到本条连接
+    """
+    __slots__ = ('link', 'sent', 'recv')
+
+    def __init__(self, link):
+        self.link = link
+        self.sent = 0
+        self.recv = 0
+
+    @property
+    def bytes_sent(self):
+        return self.link.bytes_sent
+
+    @bytes_sent.setter
+    def bytes_sent(self, value):
+        self.sent += value - self.link.bytes_sent
+        self.link.bytes_sent = value
+
+    @property
+    def bytes_recv(self):
+        return self.link.bytes_recv
+
+    @bytes_recv.setter
+    def bytes_recv(self, value):
+        self.recv += value - self.link.bytes_recv
+        self.link.bytes_recv = value
+
+
+class Tracer:
+    """
+    按比例抽样记录连接的经过，每条连接结束时写一行 JSON 到滚动文件
+
+    Args:
+        path: 跟踪文件路径，超过 max_bytes 后轮换，保留 backups 个旧文件
+        sample: 抽样比例（0~1）
+    """
+    def __init__(self, path, sample=TRACE_SAMPLE, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        self.path = path
+        self.sample = sample
+        self.traced = 0
+        self._handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                             encoding='utf-8', delay=True)
+        self._random = random.random
+
+    def begin(self, client, host, port):
+        """
+        开始一条连接，未被抽中时返回 None；抽中时返回记录字典，由调用方填入选路结果后交给 finish()
+        """
+        if self._random() >= self.sample:
+            return None
+        return {'ts': round(time.time(), 6), 'client': client, 'host': host, 'port': port,
+                'start': time.perf_counter()}
+
+    def finish(self, flow, counter=None, error=None):
+        """
+        连接结束（或建立失败）时写出记录
+
+        Args:
+            flow: begin() 返回的记录
+            counter: 转发时使用的 FlowLink，提供本条连接的流量
+            error: 建立连接失败的异常
+        """
+        flow['duration_ms'] = round((time.perf_counter() - flow.pop('start')) * 1000, 3)
+        if counter is not None:
+            flow['sent'] = counter.sent
+            flow['recv'] = counter.recv
+        if error is not None:
+            flow['error'] = str(error) or type(error).__name__
+        self.traced += 1
+        self._handler.handle(logging.makeLogRecord({'msg': json.dumps(flow, ensure_ascii=False)}))
+
+    def close(self):
+        self._handler.close()
@@ -0,0 +1,158 @@
+"""
+网络接口变化监视
+常驻线程订阅内核的链路/地址/路由变化事件（Linux 上为 rtnetlink 多播组），
+只把发生变化的接口推送给回调，无需整表重扫或启动子进程
+"""
+
+import select
+import socket
+import sys
+import threading
+
+from . import netlink
+from .discovery import KIND_LOOPBACK, get_backend
+
+
+LINUX_GROUPS = (netlink.RTMGRP_LINK | netlink.RTMGRP_IPV4_IFADDR | netlink.RTMGRP_IPV6_IFADDR
+                | netlink.RTMGRP_IPV4_ROUTE | netlink.RTMGRP_IPV6_ROUTE)
+
+
+def interface_key(record):
+    """
+    接口在一次系统运行期间的唯一标识，用作界面行ID
+    """
+    return str(record.index)
+
+
+def diff(old, new):
+    """
+    比较前后两次快照
+
+    Args:
+        old: {key: 接口字典}
+        new: {key: 接口字典}
+
+    Returns:
+        (新增的key列表, 变化的key列表, 移除的key列表)
+    """
+    added = [k for k in new if k not in old]
+    removed = [k for k in old if k not in new]
+    changed = [k for k in new if k in old and new[k] != old[k]]
+    return added, changed, removed
+
+
+class InterfaceMonitor:
+    """
+    接口变化监视器
+    回调签名为 callback(snapshot, added, changed, removed)，在监视线程中调用，
+    snapshot 为 {key: 接口字典} 的完整最新状态，其余三个参数为 key 列表；
+    监视线程异常退出时调用 on_error(exc)；
+    initial 为上次保存的快照（如启动缓存），首次比对只推送与它不同的部分
+    """
+    def __init__(self, callback, include_loopback=False, resync_interval=30.0, debounce=0.005,
+                 on_error=None, initial=None):
+        self.callback = callback
+        self.on_error = on_error
+        self.include_loopback = include_loopback
+        self.resync_interval = resync_interval
+        self.debounce = debounce
+        self.snapshot = dict(initial or {})
+        self._thread = None
+        self._running = False
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+
+    def start(self):
+        self._running = True
+        if sys.platform.startswith('linux'):
+            target = self._run_linux
+        elif sys.platform == 'win32':
+            target = self._run_windows
+        else:
+            target = self._run_polling
+        self._thread = threading.Thread(target=self._run, args=(target,), name="interface-monitor", daemon=True)
+        self._thread.start()
+
+    def _run(self, target):
+        try:
+            target()
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            self.on_error(e)
+
+    def stop(self):
+        self._running = False
+        self.rescan()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def rescan(self):
+        """
+        请求立即重新比对一次（线程安全）
+        """
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _scan(self):
+        records = get_backend().interfaces()
+        current = {interface_key(r): r.to_dict() for r in records
+                   if self.include_loopback or r.kind != KIND_LOOPBACK}
+        added, changed, removed = diff(self.snapshot, current)
+        self.snapshot = current
+        if added or changed or removed:
+            self.callback(dict(current), added, changed, removed)
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _run_linux(self):
+        sock = netlink.open_socket(LINUX_GROUPS)
+        sock.setblocking(False)
+        try:
+            self._scan()
+            while self._running:
+                ready, _, _ = select.select([sock, self._wake_r], [], [], self.resync_interval)
+                if not self._running:
+                    break
+                while ready:
+                    self._drain_wake()
+                    try:
+                        while sock.recv(1 << 16):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    except OSError:
+                        pass
+                    ready, _, _ = select.select([sock, self._wake_r], [], [], self.debounce)
+                self._scan()
+        finally:
+            sock.close()
+
+    def _run_windows(self):
+        import ctypes
+
+        notify = ctypes.windll.iphlpapi.NotifyAddrChange
+
+        def wait_changes():
+            while self._running:
+                notify(None, None)
+                self.rescan()
+
+        threading.Thread(target=wait_changes, name="interface-notify", daemon=True).start()
+        self._run_polling(interval=2.0)
+
+    def _run_polling(self, interval=2.0):
+        self._scan()
+        while self._running:
+            select.select([self._wake_r], [], [], interval)
+            self._drain_wake()
+            if self._running:
+                self._scan()
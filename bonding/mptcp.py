@@ -0,0 +1,396 @@
+"""
+MPTCP 模式（Linux）
+代理的出站连接使用 IPPROTO_MPTCP 套接字：第一条子流从调度器选中的链路发起，内核路径管理器再从其它叠加接口
+各建立一条子流，单条 TCP 连接因此同时使用全部链路，拥塞控制和重传都在内核中完成
+
+    - PathManager 经 generic netlink（mptcp_pm）为每个接口添加 subflow 端点并调高子流上限，
+      同时为每个接口下发独立路由表和 "from 接口地址" 规则（见 offload.add_uplink_routes），
+      保证每条子流从其源地址对应的接口发出；停止时全部撤销
+    - 对端不支持 MPTCP 时内核在握手阶段自动退回普通 TCP，连接照常可用，只记为一次回退；
+      本机内核未启用 MPTCP 时代理直接使用普通 TCP 套接字
+    - 连接期间定期读取 MPTCP_INFO 和各子流的 tcp_info（见 SubflowTracker），连接结束时按子流的源地址
+      把流量记入对应链路（见 metrics.Metrics.mptcp_closed）
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import socket
+import struct
+import sys
+
+from . import netlink, offload
+
+
+log = logging.getLogger(__name__)
+
+HAS_MPTCP = sys.platform.startswith('linux')
+
+IPPROTO_MPTCP = getattr(socket, 'IPPROTO_MPTCP', 262)
+SOL_MPTCP = 284
+MPTCP_INFO = 1
+MPTCP_TCPINFO = 2
+MPTCP_SUBFLOW_ADDRS = 3
+MPTCP_INFO_FLAG_FALLBACK = 0x1
+
+# generic netlink 路径管理器（include/uapi/linux/mptcp_pm.h）
+MPTCP_PM_NAME = 'mptcp_pm'
+MPTCP_PM_VER = 1
+MPTCP_PM_CMD_ADD_ADDR = 1
+MPTCP_PM_CMD_DEL_ADDR = 2
+MPTCP_PM_CMD_GET_ADDR = 3
+MPTCP_PM_CMD_SET_LIMITS = 5
+MPTCP_PM_CMD_GET_LIMITS = 6
+MPTCP_PM_ATTR_ADDR = 1
+MPTCP_PM_ATTR_RCV_ADD_ADDRS = 2
+MPTCP_PM_ATTR_SUBFLOWS = 3
+MPTCP_PM_ADDR_ATTR_FAMILY = 1
+MPTCP_PM_ADDR_ATTR_ID = 2
+MPTCP_PM_ADDR_ATTR_ADDR4 = 3
+MPTCP_PM_ADDR_ATTR_FLAGS = 6
+MPTCP_PM_ADDR_ATTR_IF_IDX = 7
+MPTCP_PM_ADDR_FLAG_SUBFLOW = 0x2
+MPTCP_PM_ADDR_MAX = 8
+
+MPTCP_INFO_HEAD = struct.Struct('=6B2xI')
+SUBFLOW_DATA = struct.Struct('=IIII')
+SOCKADDR_STORAGE = 128
+# struct tcp_info 中 tcpi_rtt（微秒）、tcpi_bytes_acked 和 tcpi_bytes_received 的偏移
+_TCPI_RTT = struct.Struct('=I')
+_TCPI_RTT_OFFSET = 68
+_TCPI_BYTES = struct.Struct('=QQ')
+_TCPI_BYTES_OFFSET = 120
+_TCP_INFO_SIZE = 256
+
+_MAX_SUBFLOWS = 16
+SAMPLE_INTERVAL = 0.5
+_available = None
+_libc = None
+
+
+def available():
+    """
+    本机内核是否可以创建 MPTCP 套接字（net.mptcp.enabled 为 1），结果缓存
+    """
+    global _available
+    if _available is None:
+        try:
+            socket.socket(socket.AF_INET, socket.SOCK_STREAM, IPPROTO_MPTCP).close()
+            _available = True
+        except OSError:
+            _available = False
+    return _available
+
+
+def open_socket(family, local_ip):
+    """
+    创建绑定到 local_ip 的非阻塞 MPTCP 套接字，本机不支持时返回 None，由调用方改用普通 TCP
+    """
+    if not available():
+        return None
+    sock = socket.socket(family, socket.SOCK_STREAM, IPPROTO_MPTCP)
+    try:
+        sock.setblocking(False)
+        sock.bind((local_ip, 0))
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def connect(sock, address):
+    """
+    非阻塞地连接 open_socket() 创建的套接字
+    loop.sock_connect() 会按套接字协议重新解析地址，而 getaddrinfo 不认识 IPPROTO_MPTCP，所以自行等待可写
+    """
+    error = sock.connect_ex(address)
+    if error == errno.EINPROGRESS:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        loop.add_writer(sock.fileno(), lambda: waiter.done() or waiter.set_result(None))
+        try:
+            await waiter
+        finally:
+            loop.remove_writer(sock.fileno())
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if error:
+        raise OSError(error, os.strerror(error))
+
+
+def _getsockopt(sock, option, size, count):
+    # MPTCP_TCPINFO/MPTCP_SUBFLOW_ADDRS 要求调用方在缓冲区开头填好 mptcp_subflow_data，
+    # socket.getsockopt() 只能传入未初始化的缓冲区，这里经 ctypes 直接调用 libc
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    length = SUBFLOW_DATA.size + size * count
+    buffer = ctypes.create_string_buffer(SUBFLOW_DATA.pack(SUBFLOW_DATA.size, 0, 0, size), length)
+    optlen = ctypes.c_uint32(length)
+    if _libc.getsockopt(sock.fileno(), SOL_MPTCP, option, buffer, ctypes.byref(optlen)) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, errno.errorcode.get(code, str(code)))
+    _, subflows, _, size_user = SUBFLOW_DATA.unpack_from(buffer.raw)
+    return buffer.raw, min(subflows, count), size_user
+
+
+def _sockaddr_ip(data, offset):
+    family = struct.unpack_from('=H', data, offset)[0]
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, data[offset + 4:offset + 8])
+    if family == socket.AF_INET6:
+        return socket.inet_ntop(socket.AF_INET6, data[offset + 8:offset + 24])
+    return None
+
+
+def connection_info(sock):
+    """
+    读取一条 MPTCP 连接及其当前各子流的状态
+
+    Returns:
+        {'fallback': 是否已退回普通 TCP,
+         'subflows': [{'local', 'remote', 'rtt_ms', 'sent', 'recv'}]}，sent/recv 为该子流已被确认的发送字节数和接收字节数
+
+    Raises:
+        OSError: 不是 MPTCP 套接字或已关闭
+    """
+    try:
+        head = sock.getsockopt(SOL_MPTCP, MPTCP_INFO, 64)
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.ENOPROTOOPT):
+            raise
+        # 退回普通 TCP 后连接不再响应 SOL_MPTCP 选项，唯一的"子流"就是连接本身
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, _TCP_INFO_SIZE)
+        try:
+            remote = sock.getpeername()[0]
+        except OSError:
+            remote = None
+        return {'fallback': True, 'subflows': [_subflow(sock.getsockname()[0], remote, info, 0, len(info))]}
+    flags = MPTCP_INFO_HEAD.unpack_from(head.ljust(MPTCP_INFO_HEAD.size, b'\0'))[6]
+    info, count, tcp_size = _getsockopt(sock, MPTCP_TCPINFO, _TCP_INFO_SIZE, _MAX_SUBFLOWS)
+    addrs, addr_count, addr_size = _getsockopt(sock, MPTCP_SUBFLOW_ADDRS, 2 * SOCKADDR_STORAGE, _MAX_SUBFLOWS)
+    subflows = []
+    for i in range(min(count, addr_count)):
+        addr = SUBFLOW_DATA.size + i * addr_size
+        subflows.append(_subflow(_sockaddr_ip(addrs, addr), _sockaddr_ip(addrs, addr + SOCKADDR_STORAGE),
+                                 info, SUBFLOW_DATA.size + i * tcp_size, tcp_size))
+    return {'fallback': bool(flags & MPTCP_INFO_FLAG_FALLBACK), 'subflows': subflows}
+
+
+def _subflow(local, remote, info, base, size):
+    rtt = _TCPI_RTT.unpack_from(info, base + _TCPI_RTT_OFFSET)[0] if size >= _TCPI_RTT_OFFSET + _TCPI_RTT.size else 0
+    sent = recv = 0
+    if size >= _TCPI_BYTES_OFFSET + _TCPI_BYTES.size:
+        sent, recv = _TCPI_BYTES.unpack_from(info, base + _TCPI_BYTES_OFFSET)
+    return {'local': local, 'remote': remote, 'rtt_ms': rtt / 1000, 'sent': sent, 'recv': recv}
+
+
+class SubflowTracker:
+    """
+    跟踪进行中的 MPTCP 连接的子流流量
+
+    连接结束时内核已经拆除了子流，读不到各子流的统计，所以连接期间每 interval 秒采样一次，
+    同一子流取见过的最大值（中途关闭的子流也保留）。结束时按采样得到的比例拆分 relay() 精确计数的总流量，
+    不足一次采样的短连接全部记在第一条子流所在的链路上
+
+    Args:
+        interval: 采样间隔（秒）
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._active = {}
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for sock in self._active:
+            sock.close()
+        self._active.clear()
+
+    def add(self, writer):
+        """
+        开始跟踪出站连接，返回交给 finish() 的句柄；不是 MPTCP 套接字时返回 None
+        relay() 结束时会关闭原套接字，这里复制一份描述符，保留到 finish() 读完最后一次统计为止
+        """
+        sock = writer.get_extra_info('socket')
+        if sock is None or sock.proto != IPPROTO_MPTCP:
+            return None
+        handle = socket.socket(sock.family, sock.type, sock.proto, os.dup(sock.fileno()))
+        self._active[handle] = {'fallback': False, 'subflows': {}}
+        return handle
+
+    def finish(self, handle, local, sent, recv):
+        """
+        结束跟踪
+
+        Args:
+            handle: add() 返回的句柄
+            local: 第一条子流的源地址
+            sent, recv: 连接的总发送和接收字节数
+
+        Returns:
+            connection_info() 格式的字典，各子流的 sent/recv 为拆分后的字节数
+        """
+        self._sample(handle)
+        handle.close()
+        state = self._active.pop(handle)
+        subflows = [dict(s) for s in state['subflows'].values()]
+        for field, total in (('sent', sent), ('recv', recv)):
+            sampled = sum(s[field] for s in subflows)
+            for s in subflows:
+                s[field] = round(total * s[field] / sampled) if sampled else 0
+            if not sampled:
+                first = next((s for s in subflows if s['local'] == local), None)
+                if first is None:
+                    first = {'local': local, 'remote': None, 'rtt_ms': 0.0, 'sent': 0, 'recv': 0}
+                    subflows.insert(0, first)
+                first[field] = total
+        return {'fallback': state['fallback'], 'subflows': subflows}
+
+    def _sample(self, handle):
+        try:
+            info = connection_info(handle)
+        except OSError:
+            return
+        state = self._active[handle]
+        state['fallback'] = state['fallback'] or info['fallback']
+        for subflow in info['subflows']:
+            # 回退的连接只有一条"子流"，关闭后读不到对端地址，只按源地址区分
+            key = subflow['local'] if info['fallback'] else (subflow['local'], subflow['remote'])
+            seen = state['subflows'].get(key)
+            if seen is None:
+                state['subflows'][key] = subflow
+            else:
+                seen['rtt_ms'] = subflow['rtt_ms']
+                seen['sent'] = max(seen['sent'], subflow['sent'])
+                seen['recv'] = max(seen['recv'], subflow['recv'])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for handle in list(self._active):
+                self._sample(handle)
+
+
+def _addr_attrs(uplink=None, endpoint_id=None):
+    attrs = b''
+    if uplink is not None:
+        attrs += netlink.pack_attr(MPTCP_PM_ADDR_ATTR_FAMILY, struct.pack('=H', socket.AF_INET))
+        attrs += netlink.pack_attr(MPTCP_PM_ADDR_ATTR_ADDR4, socket.inet_aton(uplink.ip))
+        attrs += netlink.pack_attr(MPTCP_PM_ADDR_ATTR_IF_IDX, struct.pack('=i', uplink.index))
+        attrs += netlink.pack_attr(MPTCP_PM_ADDR_ATTR_FLAGS, struct.pack('=I', MPTCP_PM_ADDR_FLAG_SUBFLOW))
+    if endpoint_id is not None:
+        attrs += netlink.pack_attr(MPTCP_PM_ADDR_ATTR_ID, bytes([endpoint_id]))
+    return netlink.pack_attr(MPTCP_PM_ATTR_ADDR | netlink.NLA_F_NESTED, attrs)
+
+
+class PathManager:
+    """
+    配置内核 MPTCP 路径管理器：每个叠加接口一个 subflow 端点，子流上限为接口数减一，
+    并下发按源地址选择接口的策略路由；已存在的同地址端点保留不动，停止时只撤销本对象添加的部分
+
+    Args:
+        interfaces: 接口字典列表，需要 name、ip，可选 index、gateway、ipv4
+        table: 第一个接口的路由表编号减一（与 offload.PolicyRouter 相同的编号范围，两者不会同时使用）
+        priority: 第一条规则的优先级
+    """
+    def __init__(self, interfaces, table=offload.TABLE_BASE, priority=offload.PRIORITY_BASE):
+        if not HAS_MPTCP:
+            raise ValueError("MPTCP 模式仅支持 Linux")
+        if len(interfaces) > MPTCP_PM_ADDR_MAX:
+            raise ValueError(f"MPTCP 模式最多支持 {MPTCP_PM_ADDR_MAX} 个接口")
+        self.uplinks = [offload.Uplink(i) for i in interfaces]
+        self.table = table
+        self.priority = priority
+        self.endpoints = {}
+        self._transaction = None
+        self._route = None
+        self._genl = None
+        self._family = None
+
+    def start(self):
+        """
+        下发端点、子流上限和策略路由，任一步失败时撤销已完成的步骤
+
+        Raises:
+            OSError: 内核不支持 MPTCP 路径管理器或没有权限
+        """
+        self._route = netlink.open_socket()
+        self._genl = netlink.open_socket(protocol=netlink.NETLINK_GENERIC)
+        transaction = offload.Transaction(self._route)
+        try:
+            self._family = netlink.resolve_family(self._genl, MPTCP_PM_NAME)
+            offload.flush(self._route, self.table, self.priority)
+            for slot, uplink in enumerate(self.uplinks):
+                offload.add_uplink_routes(transaction, uplink, self.table + 1 + slot, self.priority + slot)
+            limits = self._limits()
+            subflows = max(limits.get(MPTCP_PM_ATTR_SUBFLOWS, 0), len(self.uplinks) - 1)
+            self._set_limits({MPTCP_PM_ATTR_SUBFLOWS: min(subflows, MPTCP_PM_ADDR_MAX)})
+            transaction.defer(self._set_limits, limits)
+            existing = self._endpoints()
+            for uplink in self.uplinks:
+                if uplink.ip in existing:
+                    continue
+                self._pm(MPTCP_PM_CMD_ADD_ADDR, _addr_attrs(uplink))
+                endpoint_id = self._endpoints()[uplink.ip]
+                transaction.defer(self._pm, MPTCP_PM_CMD_DEL_ADDR, _addr_attrs(endpoint_id=endpoint_id))
+                self.endpoints[uplink.name] = endpoint_id
+        except BaseException:
+            transaction.rollback()
+            self._close()
+            raise
+        self._transaction = transaction
+        log.info("MPTCP 路径已配置: %s", ', '.join(f"{u.name}({u.ip})" for u in self.uplinks))
+
+    def stop(self):
+        """
+        撤销 start() 的全部变更
+        """
+        if self._transaction is not None:
+            self._transaction.rollback()
+            self._transaction = None
+            self.endpoints = {}
+            log.info("MPTCP 路径配置已撤销")
+        self._close()
+
+    def _close(self):
+        for sock in (self._route, self._genl):
+            if sock is not None:
+                sock.close()
+        self._route = self._genl = None
+
+    def _pm(self, cmd, attrs=b'', flags=netlink.NLM_F_REQUEST | netlink.NLM_F_ACK):
+        return netlink.request(self._genl, self._family, netlink.genl_message(cmd, MPTCP_PM_VER, attrs), flags)
+
+    def _limits(self):
+        replies = self._pm(MPTCP_PM_CMD_GET_LIMITS, flags=netlink.NLM_F_REQUEST)
+        attrs = netlink.parse_attrs(replies[0][1], netlink.GENLMSGHDR.size)
+        return {key: netlink.attr_u32(attrs[key]) for key in (MPTCP_PM_ATTR_RCV_ADD_ADDRS, MPTCP_PM_ATTR_SUBFLOWS)
+                if key in attrs}
+
+    def _set_limits(self, limits):
+        self._pm(MPTCP_PM_CMD_SET_LIMITS,
+                 b''.join(netlink.pack_attr(key, struct.pack('=I', value)) for key, value in limits.items()))
+
+    def _endpoints(self):
+        # {端点地址: 端点编号}
+        endpoints = {}
+        for _, body in self._pm(MPTCP_PM_CMD_GET_ADDR, flags=netlink.NLM_F_REQUEST | netlink.NLM_F_DUMP):
+            nested = netlink.parse_attrs(body, netlink.GENLMSGHDR.size).get(MPTCP_PM_ATTR_ADDR)
+            if nested is None:
+                continue
+            attrs = netlink.parse_attrs(nested)
+            if MPTCP_PM_ADDR_ATTR_ADDR4 in attrs and MPTCP_PM_ADDR_ATTR_ID in attrs:
+                endpoints[netlink.attr_ip(attrs[MPTCP_PM_ADDR_ATTR_ADDR4])] = attrs[MPTCP_PM_ADDR_ATTR_ID][0]
+        return endpoints
+
+    def status(self):
+        return {'endpoints': dict(self.endpoints), 'interfaces': [u.name for u in self.uplinks]}
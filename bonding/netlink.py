@@ -0,0 +1,380 @@
+"""
+rtnetlink 最小实现
+仅依赖标准库 socket/struct，用于在 Linux 上直接查询和订阅链路、地址、路由信息，
+以及下发内核策略路由模式（见 offload）所需的路由和规则；另有查询 generic netlink 协议族的最少部分（见 mptcp）
+"""
+
+import os
+import socket
+import struct
+
+
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_NEWRULE = 32
+RTM_DELRULE = 33
+RTM_GETRULE = 34
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_OPERSTATE = 16
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_PREFSRC = 7
+RTA_MULTIPATH = 9
+RTA_TABLE = 15
+
+RTN_UNICAST = 1
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RT_SCOPE_NOWHERE = 255
+RT_TABLE_DEFAULT = 253
+RT_TABLE_MAIN = 254
+RT_TABLE_LOCAL = 255
+RTPROT_STATIC = 4
+
+FRA_SRC = 2
+FRA_PRIORITY = 6
+FRA_FWMARK = 10
+FRA_SUPPRESS_PREFIXLEN = 14
+FRA_TABLE = 15
+FRA_FWMASK = 16
+FRA_PROTOCOL = 21
+FR_ACT_TO_TBL = 1
+
+NLA_F_NESTED = 0x8000
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+IFF_RUNNING = 0x40
+IFF_LOWER_UP = 0x10000
+
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTMSG = struct.Struct('=BBBBBBBBI')
+RTATTR = struct.Struct('=HH')
+FIB_RULE_HDR = struct.Struct('=BBBBBBBBI')
+RTNEXTHOP = struct.Struct('=HBBi')
+GENLMSGHDR = struct.Struct('=BBxx')
+
+
+class NetlinkError(OSError):
+    """
+    内核通过 NLMSG_ERROR 返回的错误
+    """
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def parse_messages(data):
+    """
+    解析一次 recv 得到的 netlink 消息序列
+
+    Yields:
+        (消息类型, 标志, 序号, 负载)
+    """
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        yield msg_type, flags, seq, data[offset + NLMSGHDR.size:offset + length]
+        offset += align(length)
+
+
+def parse_attrs(data, offset=0):
+    """
+    解析 rtattr 列表
+
+    Returns:
+        {属性类型: 原始字节}
+    """
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type & 0x3FFF] = data[offset + RTATTR.size:offset + length]
+        offset += align(length)
+    return attrs
+
+
+def pack_attr(attr_type, value):
+    """
+    打包一个 rtattr，自动补齐到4字节边界
+    """
+    length = RTATTR.size + len(value)
+    return RTATTR.pack(length, attr_type) + value + b'\0' * (align(length) - length)
+
+
+def pack_message(msg_type, flags, seq, payload):
+    return NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags, seq, 0) + payload
+
+
+def attr_str(value):
+    return value.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def attr_u32(value):
+    return struct.unpack('=I', value[:4])[0]
+
+
+def attr_ip(value):
+    family = socket.AF_INET6 if len(value) == 16 else socket.AF_INET
+    return socket.inet_ntop(family, value)
+
+
+def open_socket(groups=0, protocol=NETLINK_ROUTE):
+    """
+    打开 rtnetlink 套接字
+
+    Args:
+        groups: 需要订阅的多播组位掩码，0 表示只做查询
+        protocol: netlink 协议，generic netlink 为 NETLINK_GENERIC
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_CLOEXEC, protocol)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind((0, groups))
+    return sock
+
+
+def request(sock, msg_type, payload, flags=NLM_F_REQUEST, seq=None):
+    """
+    发送请求并收集全部应答，直到 NLMSG_DONE 或 ACK
+
+    Returns:
+        [(消息类型, 负载)]
+
+    Raises:
+        NetlinkError: 内核返回错误
+    """
+    if seq is None:
+        seq = int.from_bytes(os.urandom(4), 'little') & 0x7FFFFFFF
+    sock.send(pack_message(msg_type, flags, seq, payload))
+    replies = []
+    while True:
+        data = sock.recv(1 << 16)
+        for reply_type, reply_flags, reply_seq, body in parse_messages(data):
+            if reply_seq != seq:
+                continue
+            if reply_type == NLMSG_DONE:
+                return replies
+            if reply_type == NLMSG_ERROR:
+                errno = -struct.unpack_from('=i', body)[0]
+                if errno:
+                    raise NetlinkError(errno, os.strerror(errno))
+                return replies
+            replies.append((reply_type, body))
+            if not reply_flags & NLM_F_MULTI and not flags & NLM_F_ACK:
+                return replies
+
+
+def dump(sock, msg_type, family=socket.AF_UNSPEC):
+    """
+    以 NLM_F_DUMP 方式查询全部链路、地址或路由
+    """
+    if msg_type == RTM_GETLINK:
+        payload = IFINFOMSG.pack(family, 0, 0, 0, 0)
+    elif msg_type == RTM_GETADDR:
+        payload = IFADDRMSG.pack(family, 0, 0, 0, 0)
+    else:
+        payload = RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)
+    return request(sock, msg_type, payload, NLM_F_REQUEST | NLM_F_DUMP)
+
+
+def parse_link(body):
+    """
+    解析 RTM_NEWLINK/RTM_DELLINK 负载
+
+    Returns:
+        (接口索引, 接口标志, 属性字典)
+    """
+    _, _, index, flags, _ = IFINFOMSG.unpack_from(body)
+    return index, flags, parse_attrs(body, IFINFOMSG.size)
+
+
+def parse_addr(body):
+    """
+    解析 RTM_NEWADDR/RTM_DELADDR 负载
+
+    Returns:
+        (地址族, 前缀长度, 接口索引, 地址字符串)
+    """
+    family, prefixlen, _, _, index = IFADDRMSG.unpack_from(body)
+    attrs = parse_attrs(body, IFADDRMSG.size)
+    raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    return family, prefixlen, index, attr_ip(raw) if raw else None
+
+
+def parse_route(body):
+    """
+    解析 RTM_NEWROUTE 负载
+
+    Returns:
+        (路由表编号, 来源协议 rtm_protocol, 属性字典)
+    """
+    _, _, _, _, table, protocol, _, _, _ = RTMSG.unpack_from(body)
+    attrs = parse_attrs(body, RTMSG.size)
+    if RTA_TABLE in attrs:
+        table = attr_u32(attrs[RTA_TABLE])
+    return table, protocol, attrs
+
+
+def parse_rule(body):
+    """
+    解析 RTM_NEWRULE 负载
+
+    Returns:
+        (优先级, 路由表编号, 来源协议)；内核早于 4.17 时不报告规则的来源协议，为 0
+    """
+    table = FIB_RULE_HDR.unpack_from(body)[4]
+    attrs = parse_attrs(body, FIB_RULE_HDR.size)
+    if FRA_TABLE in attrs:
+        table = attr_u32(attrs[FRA_TABLE])
+    protocol = attrs[FRA_PROTOCOL][0] if attrs.get(FRA_PROTOCOL) else 0
+    return attr_u32(attrs[FRA_PRIORITY]) if FRA_PRIORITY in attrs else 0, table, protocol
+
+
+def _u32(value):
+    return struct.pack('=I', value)
+
+
+def route_message(table, dst=None, dst_len=0, oif=None, gateway=None, prefsrc=None, nexthops=None,
+                  protocol=RTPROT_STATIC):
+    """
+    构造 IPv4 单播路由的 RTM_NEWROUTE 负载
+
+    Args:
+        table: 路由表编号
+        dst, dst_len: 目的网段，None 表示默认路由
+        oif: 出接口索引
+        gateway: 网关地址，None 表示直连（scope link）
+        prefsrc: 首选源地址
+        nexthops: 多路径下一跳列表 [(接口索引, 网关或 None, 权重 1~256)]，给出时忽略 oif/gateway
+        protocol: 来源协议 rtm_protocol，用于区分路由由谁下发
+    """
+    scope = RT_SCOPE_LINK if gateway is None and not nexthops else RT_SCOPE_UNIVERSE
+    payload = RTMSG.pack(socket.AF_INET, dst_len, 0, 0, table if table < 256 else 0,
+                         protocol, scope, RTN_UNICAST, 0)
+    payload += pack_attr(RTA_TABLE, _u32(table))
+    if dst is not None:
+        payload += pack_attr(RTA_DST, socket.inet_aton(dst))
+    if prefsrc is not None:
+        payload += pack_attr(RTA_PREFSRC, socket.inet_aton(prefsrc))
+    if nexthops:
+        hops = b''
+        for index, hop_gateway, weight in nexthops:
+            attrs = pack_attr(RTA_GATEWAY, socket.inet_aton(hop_gateway)) if hop_gateway else b''
+            hops += RTNEXTHOP.pack(RTNEXTHOP.size + len(attrs), 0, weight - 1, index) + attrs
+        payload += pack_attr(RTA_MULTIPATH, hops)
+    else:
+        if oif is not None:
+            payload += pack_attr(RTA_OIF, _u32(oif))
+        if gateway is not None:
+            payload += pack_attr(RTA_GATEWAY, socket.inet_aton(gateway))
+    return payload
+
+
+def route_key(table, dst=None, dst_len=0, protocol=0):
+    """
+    构造按 表 + 目的网段（+ 来源协议，非 0 时）匹配的 RTM_DELROUTE 负载，删除时不关心下一跳（多路径路由可能已被替换过）
+    """
+    payload = RTMSG.pack(socket.AF_INET, dst_len, 0, 0, table if table < 256 else 0, protocol, RT_SCOPE_NOWHERE,
+                         0, 0)
+    payload += pack_attr(RTA_TABLE, _u32(table))
+    if dst is not None:
+        payload += pack_attr(RTA_DST, socket.inet_aton(dst))
+    return payload
+
+
+def rule_message(priority, table, src=None, src_len=0, fwmark=None, suppress_prefixlen=None, protocol=None):
+    """
+    构造 IPv4 策略路由规则的 RTM_NEWRULE/RTM_DELRULE 负载：匹配的流量查 table
+
+    Args:
+        priority: 规则优先级
+        table: 路由表编号
+        src, src_len: 匹配的源网段
+        fwmark: 匹配的防火墙标记（全掩码）
+        suppress_prefixlen: 查表结果的前缀长度不大于该值时视为未命中（0 即忽略该表的默认路由）
+        protocol: 来源协议（FRA_PROTOCOL，内核 4.17 起支持）
+    """
+    payload = FIB_RULE_HDR.pack(socket.AF_INET, 0, src_len, 0, table if table < 256 else 0, 0, 0, FR_ACT_TO_TBL, 0)
+    payload += pack_attr(FRA_PRIORITY, _u32(priority)) + pack_attr(FRA_TABLE, _u32(table))
+    if src is not None:
+        payload += pack_attr(FRA_SRC, socket.inet_aton(src))
+    if fwmark is not None:
+        payload += pack_attr(FRA_FWMARK, _u32(fwmark)) + pack_attr(FRA_FWMASK, _u32(0xFFFFFFFF))
+    if suppress_prefixlen is not None:
+        payload += pack_attr(FRA_SUPPRESS_PREFIXLEN, struct.pack('=i', suppress_prefixlen))
+    if protocol is not None:
+        payload += pack_attr(FRA_PROTOCOL, bytes([protocol]))
+    return payload
+
+
+def genl_message(cmd, version, attrs=b''):
+    """
+    构造 generic netlink 负载：genlmsghdr 加属性
+    """
+    return GENLMSGHDR.pack(cmd, version) + attrs
+
+
+def resolve_family(sock, name):
+    """
+    查询 generic netlink 协议族的编号
+
+    Args:
+        sock: NETLINK_GENERIC 套接字
+        name: 协议族名称，如 'mptcp_pm'
+
+    Raises:
+        NetlinkError: 内核没有该协议族（ENOENT）
+    """
+    replies = request(sock, GENL_ID_CTRL,
+                      genl_message(CTRL_CMD_GETFAMILY, 1, pack_attr(CTRL_ATTR_FAMILY_NAME, name.encode() + b'\0')))
+    attrs = parse_attrs(replies[0][1], GENLMSGHDR.size)
+    return struct.unpack('=H', attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
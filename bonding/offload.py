@@ -0,0 +1,346 @@
+"""
+内核策略路由模式
+把叠加接口和负载均衡模式翻译成 Linux 策略路由，数据转发完全由内核完成，不经过 Python:
+    - 每个接口一张路由表（默认路由经该接口的网关），"from 接口地址" 和 "fwmark 标记" 两条规则查该表，
+      绑定了源地址或打了标记（SO_MARK、iptables MARK）的流量固定走对应接口，健康检查探测也因此走对的接口
+    - 一条 "lookup main suppress_prefixlength 0" 规则让局域网等直连路由仍按主表走
+    - 其余流量查多路径表：一条 ECMP 默认路由，每个可用接口一个下一跳，加权模式按链路权重分配
+    - 源/目标IP哈希模式使用三层哈希（同一对地址之间的连接走同一接口），其它模式使用四层哈希（按连接分散）；
+      内核哈希总是同时包含源和目标地址，最小连接数模式也只能近似为按连接哈希
+
+全部变更经 rtnetlink 逐条下发并记录撤销操作，任一步失败时按相反顺序撤销已完成的步骤；停止时整体撤销。
+下发的路由和规则都带本工具专用的来源协议号 RTPROT_BONDING（ip route/rule 显示为 proto 98），
+清除残留时只删除带该协议号的条目，同一编号范围内其它程序或管理员配置的路由不受影响。
+只支持 IPv4，需要 root（CAP_NET_ADMIN）。可以在网络命名空间中用 veth 接口测试，见 benchmarks/netns_offload.py
+"""
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import sys
+
+from . import netlink
+from .stats import read_proc_net_dev
+
+
+log = logging.getLogger(__name__)
+
+HAS_OFFLOAD = sys.platform.startswith('linux') and hasattr(socket, 'AF_NETLINK')
+
+TABLE_BASE = 100
+PRIORITY_BASE = 1000
+FWMARK_BASE = 0x6200
+MAX_LINKS = 64
+# 未分配给其它路由守护进程的来源协议号（见 /etc/iproute2/rt_protos）
+RTPROT_BONDING = 98
+
+# 相对 PRIORITY_BASE 的规则优先级
+_MARK_OFFSET = MAX_LINKS
+_MAIN_OFFSET = 2 * MAX_LINKS
+_RULE_SPAN = _MAIN_OFFSET + 2
+
+HASH_POLICY = '/proc/sys/net/ipv4/fib_multipath_hash_policy'
+HASH_L3, HASH_L4 = 0, 1
+
+WEIGHT_STEPS = 16
+SYNC_INTERVAL = 2.0
+
+_CHANGE = netlink.NLM_F_REQUEST | netlink.NLM_F_ACK
+_CREATE = _CHANGE | netlink.NLM_F_CREATE | netlink.NLM_F_EXCL
+
+
+def hash_policy(mode):
+    """
+    负载均衡模式对应的内核多路径哈希策略
+    """
+    return HASH_L3 if mode in ('source_hash', 'dest_hash') else HASH_L4
+
+
+def route_weights(links, mode):
+    """
+    计算多路径默认路由中各链路的下一跳权重
+
+    只包含在线且未接近流量配额的链路（都不满足时依次放宽，避免没有默认路由）；加权模式按有效权重分成 WEIGHT_STEPS 级，
+    量化是为了权重估计小幅波动时不必反复改写路由，其它模式各链路相同
+
+    Returns:
+        {链路名: 权重}，按链路顺序
+    """
+    up = [link for link in links if link.up]
+    candidates = [link for link in up if not link.capped] or up or list(links)
+    if mode != 'weighted':
+        return {link.name: 1 for link in candidates}
+    top = max(link.effective_weight for link in candidates) or 1.0
+    return {link.name: max(1, round(WEIGHT_STEPS * link.effective_weight / top)) for link in candidates}
+
+
+class Transaction:
+    """
+    一组按顺序下发的路由变更
+    每成功一步记录其撤销操作，rollback() 按相反顺序撤销；撤销时单步失败只记录日志，继续撤销其余步骤
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self._undo = []
+
+    def __len__(self):
+        return len(self._undo)
+
+    def add_route(self, table, dst=None, dst_len=0, **route):
+        netlink.request(self.sock, netlink.RTM_NEWROUTE,
+                        netlink.route_message(table, dst, dst_len, protocol=RTPROT_BONDING, **route), _CREATE)
+        self.defer(netlink.request, self.sock, netlink.RTM_DELROUTE,
+                   netlink.route_key(table, dst, dst_len, RTPROT_BONDING), _CHANGE)
+
+    def add_rule(self, priority, table, **rule):
+        payload = netlink.rule_message(priority, table, protocol=RTPROT_BONDING, **rule)
+        netlink.request(self.sock, netlink.RTM_NEWRULE, payload, _CREATE)
+        self.defer(netlink.request, self.sock, netlink.RTM_DELRULE, payload, _CHANGE)
+
+    def set_sysctl(self, path, value):
+        with open(path) as f:
+            previous = f.read().strip()
+        _write_sysctl(path, value)
+        self.defer(_write_sysctl, path, previous)
+
+    def defer(self, undo, *args):
+        """
+        登记一步已完成变更的撤销操作 undo(*args)，本类之外的变更（如 MPTCP 路径端点）也由此一并回滚
+        """
+        self._undo.append((undo, args))
+
+    def rollback(self):
+        while self._undo:
+            undo, args = self._undo.pop()
+            try:
+                undo(*args)
+            except OSError as e:
+                log.warning("撤销路由变更失败: %s", e)
+
+
+def _write_sysctl(path, value):
+    with open(path, 'w') as f:
+        f.write(f"{value}\n")
+
+
+def add_uplink_routes(transaction, uplink, table, priority):
+    """
+    为一个接口下发独立的路由表（直连网段和经其网关的默认路由）和 "from 接口地址" 规则，
+    绑定了该接口源地址的流量因此总是从该接口发出
+
+    Args:
+        transaction: Transaction
+        uplink: Uplink
+        table: 该接口的路由表编号
+        priority: 规则优先级
+    """
+    if uplink.network is not None:
+        transaction.add_route(table, uplink.network, uplink.prefix, oif=uplink.index, prefsrc=uplink.ip)
+    transaction.add_route(table, oif=uplink.index, gateway=uplink.gateway, prefsrc=uplink.ip)
+    transaction.add_rule(priority, table, src=uplink.ip, src_len=32)
+
+
+def flush(sock, table=TABLE_BASE, priority=PRIORITY_BASE):
+    """
+    删除上次运行异常退出时残留的本模块（或 mptcp）的变更：从 priority 起的规则和从 table 起的路由表中
+    带 RTPROT_BONDING 来源协议的条目；其它来源的规则和路由即使编号在范围内也保留
+    （内核早于 4.17 时规则不带来源协议，残留的规则无法识别，需要手动删除）
+    """
+    end = priority + _RULE_SPAN
+    tables = range(table, table + 1 + MAX_LINKS)
+    stale = []
+    for _, body in netlink.dump(sock, netlink.RTM_GETRULE, socket.AF_INET):
+        rule_priority, _, protocol = netlink.parse_rule(body)
+        if priority <= rule_priority < end and protocol == RTPROT_BONDING:
+            stale.append((netlink.RTM_DELRULE, body))
+    for _, body in netlink.dump(sock, netlink.RTM_GETROUTE, socket.AF_INET):
+        route_table, protocol, _ = netlink.parse_route(body)
+        if route_table in tables and protocol == RTPROT_BONDING:
+            stale.append((netlink.RTM_DELROUTE, body))
+    for action, body in stale:
+        try:
+            netlink.request(sock, action, body, _CHANGE)
+        except OSError as e:
+            log.debug("清除残留路由失败: %s", e)
+    if stale:
+        log.info("已清除 %d 条残留的规则和路由", len(stale))
+
+
+class Uplink:
+    """
+    下发路由所需的接口信息：接口索引、地址、网关和直连网段
+    """
+    __slots__ = ('name', 'index', 'ip', 'gateway', 'network', 'prefix')
+
+    def __init__(self, interface):
+        self.name = interface['name']
+        self.ip = interface['ip']
+        self.gateway = interface.get('gateway') or None
+        self.index = interface.get('index') or 0
+        if not self.index:
+            try:
+                self.index = socket.if_nametoindex(self.name)
+            except OSError:
+                raise ValueError(f"找不到网络接口 {self.name}，内核路由模式需要接口名称") from None
+        self.network = None
+        self.prefix = 0
+        for address, prefix in interface.get('ipv4') or []:
+            if address == self.ip and prefix < 32:
+                network = ipaddress.ip_network(f"{address}/{prefix}", strict=False)
+                self.network, self.prefix = str(network.network_address), prefix
+
+
+class PolicyRouter:
+    """
+    内核策略路由后端，对叠加引擎提供与 BondingProxy 相同的 start()/stop()/host/port/relay_mode 接口
+    链路上下线或权重变化时由引擎调用 refresh() 改写多路径路由；
+    后台任务定期把接口计数器（/proc/net/dev）写入链路的流量统计，供权重估计和状态显示使用
+
+    Args:
+        links: Link 列表
+        interfaces: 接口字典列表，顺序与 links 一致；需要 name、ip，可选 index、gateway、ipv4
+        mode: 负载均衡模式
+        table: 多路径表编号，各接口的表依次为 table+1、table+2……
+        priority: 第一条规则的优先级，共占用 priority 起的 2 * MAX_LINKS + 2 个优先级
+        fwmark: 第一个接口的防火墙标记，其余接口依次加 1
+    """
+    relay_mode = 'kernel'
+
+    def __init__(self, links, interfaces, mode, table=TABLE_BASE, priority=PRIORITY_BASE, fwmark=FWMARK_BASE):
+        if not HAS_OFFLOAD:
+            raise ValueError("内核路由模式仅支持 Linux")
+        if len(interfaces) > MAX_LINKS:
+            raise ValueError(f"内核路由模式最多支持 {MAX_LINKS} 个接口")
+        if table <= netlink.RT_TABLE_LOCAL and table + MAX_LINKS >= netlink.RT_TABLE_DEFAULT:
+            # 各接口的表和多路径表都由本对象独占，不能覆盖内核的 default/main/local 表
+            raise ValueError(f"路由表编号 {table}~{table + MAX_LINKS} 与系统路由表冲突")
+        self.links = list(links)
+        self.uplinks = [Uplink(i) for i in interfaces]
+        self.mode = mode
+        self.table = table
+        self.priority = priority
+        self.fwmark = fwmark
+        self.host = None
+        self.port = None
+        self.weights = {}
+        self._sock = None
+        self._transaction = None
+        self._task = None
+        self._baseline = {}
+
+    async def start(self):
+        """
+        清除上次异常退出残留的规则和路由，然后下发全部路由状态
+
+        Raises:
+            OSError: 下发失败（已撤销全部变更），常见原因是没有 root 权限
+        """
+        self._sock = netlink.open_socket()
+        try:
+            self.flush()
+            self._apply()
+        except BaseException:
+            self._sock.close()
+            self._sock = None
+            raise
+        self._task = asyncio.ensure_future(self._run())
+        log.info("内核路由已启用: 多路径表 %d，%s 哈希，权重 %s", self.table,
+                 "三层" if hash_policy(self.mode) == HASH_L3 else "四层", self.weights)
+
+    async def stop(self):
+        """
+        撤销 start() 下发的全部变更
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._transaction is not None:
+            self._transaction.rollback()
+            self._transaction = None
+            log.info("内核路由已撤销")
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def link_table(self, slot):
+        return self.table + 1 + slot
+
+    def _apply(self):
+        transaction = Transaction(self._sock)
+        try:
+            for slot, uplink in enumerate(self.uplinks):
+                add_uplink_routes(transaction, uplink, self.link_table(slot), self.priority + slot)
+                transaction.add_rule(self.priority + _MARK_OFFSET + slot, self.link_table(slot),
+                                     fwmark=self.fwmark + slot)
+            transaction.add_rule(self.priority + _MAIN_OFFSET, netlink.RT_TABLE_MAIN, suppress_prefixlen=0)
+            weights = route_weights(self.links, self.mode)
+            transaction.add_route(self.table, nexthops=self._nexthops(weights))
+            transaction.add_rule(self.priority + _MAIN_OFFSET + 1, self.table)
+            transaction.set_sysctl(HASH_POLICY, hash_policy(self.mode))
+        except BaseException as e:
+            log.debug("下发第 %d 步路由变更失败: %s，正在撤销", len(transaction) + 1, e)
+            transaction.rollback()
+            raise
+        self.weights = weights
+        self._transaction = transaction
+
+    def _nexthops(self, weights):
+        by_name = {link.name: uplink for link, uplink in zip(self.links, self.uplinks)}
+        return [(by_name[name].index, by_name[name].gateway, weight) for name, weight in weights.items()]
+
+    def refresh(self):
+        """
+        按当前的上下线状态和权重改写多路径默认路由；与已下发的相同时不做任何事
+        内核以一条 NLM_F_REPLACE 消息原子地替换整条路由，失败时保留旧路由，下次同步时重试
+        """
+        if self._transaction is None:
+            return
+        weights = route_weights(self.links, self.mode)
+        if weights == self.weights:
+            return
+        try:
+            netlink.request(self._sock, netlink.RTM_NEWROUTE,
+                            netlink.route_message(self.table, nexthops=self._nexthops(weights),
+                                                  protocol=RTPROT_BONDING),
+                            _CHANGE | netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE)
+        except OSError as e:
+            log.warning("更新多路径路由失败: %s", e)
+            return
+        log.info("多路径路由已更新: %s", weights)
+        self.weights = weights
+
+    def flush(self):
+        """
+        删除本对象使用的优先级范围和各路由表中本工具下发的规则和路由（上次运行异常退出时的残留）
+        """
+        flush(self._sock, self.table, self.priority)
+
+    def sample(self):
+        """
+        把接口计数器相对启用时的增量写入链路的流量统计
+        """
+        counters = read_proc_net_dev()
+        for link, uplink in zip(self.links, self.uplinks):
+            counter = counters.get(uplink.name)
+            if counter is None:
+                continue
+            recv, _, sent, _ = counter
+            base_recv, base_sent = self._baseline.setdefault(uplink.name, (recv, sent))
+            link.bytes_recv = recv - base_recv
+            link.bytes_sent = sent - base_sent
+
+    async def _run(self):
+        while True:
+            self.sample()
+            self.refresh()
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    def status(self):
+        return {
+            'table': self.table,
+            'hash': 'l3' if hash_policy(self.mode) == HASH_L3 else 'l4',
+            'weights': dict(self.weights),
+            'fwmarks': {uplink.name: self.fwmark + slot for slot, uplink in enumerate(self.uplinks)},
+        }
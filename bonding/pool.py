@@ -0,0 +1,190 @@
+"""
+出站连接预热池
+高 RTT 链路（如手机热点）上每条新连接都要先等一次 TCP 握手。连接池统计近期最常访问的目标，
+提前在各链路上建立好到这些目标的 TCP 连接；代理为新请求选好链路后，若池里有该链路到该目标的空闲连接，
+直接拿来使用，省掉握手的往返
+
+代理转发的是 SOCKS5/CONNECT 隧道，TLS 在客户端与目标之间端到端进行，用过的连接无法交给下一个请求，
+所以池中只放从未使用过的新连接，空闲超过 max_age 就关闭重建，以免被服务器的空闲超时断开
+"""
+
+import asyncio
+import collections
+import logging
+import math
+import time
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 16
+MAX_AGE = 20.0
+INTERVAL = 1.0
+DECAY = 0.9
+MIN_DEMAND = 1.0
+HOT = 8
+BACKOFF = 30.0
+
+
+class ConnectionPool:
+    """
+    按 (链路, 目标主机, 端口) 分组的预连接池
+
+    空闲连接总数上限为 size，按链路的有效权重分给各链路（每条可用链路至少 1 个）；
+    每条链路的份额再按各热门目标的近期请求数分配，请求数按 DECAY 每秒衰减
+
+    Args:
+        connect: 建立连接的协程函数 connect(link, host, port) -> (reader, writer)
+        links: 参与叠加的 Link 列表
+        size: 所有链路合计的空闲连接上限
+        max_age: 空闲连接的最长保留时间（秒）
+    """
+    def __init__(self, connect, links, size=DEFAULT_SIZE, max_age=MAX_AGE):
+        self.connect = connect
+        self.links = list(links)
+        self.size = size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.demand = collections.Counter()
+        self._idle = {}
+        self._warming = collections.Counter()
+        self._failed = {}
+        self._tasks = set()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for queue in self._idle.values():
+            for _, _, writer in queue:
+                writer.close()
+        self._idle.clear()
+
+    def take(self, link, host, port):
+        """
+        取出一条该链路到该目标的空闲连接，并记录一次对该目标的请求
+
+        Returns:
+            (reader, writer)，没有可用的空闲连接时返回 None
+        """
+        self.demand[(host, port)] += 1
+        queue = self._idle.get((link.name, host, port))
+        now = time.monotonic()
+        while queue:
+            created, reader, writer = queue.popleft()
+            # 服务器可能已经关闭了这条连接；主动发来的数据（如 SSH 横幅）留在 reader 中，转发时一并交给客户端
+            if now - created < self.max_age and not reader.at_eof() and not writer.is_closing():
+                self.hits += 1
+                return reader, writer
+            writer.close()
+        self.misses += 1
+        return None
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'size': self.size,
+            'idle': sum(len(queue) for queue in self._idle.values()),
+            'warming': sum(self._warming.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'idle_per_link': {link.name: sum(len(q) for key, q in self._idle.items() if key[0] == link.name)
+                              for link in self.links},
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(INTERVAL)
+            try:
+                self.maintain()
+            except Exception:
+                log.exception("维护连接池失败")
+
+    def targets(self):
+        """
+        计算每组 (链路名, 主机, 端口) 应保持的空闲连接数
+
+        Returns:
+            {(链路名, 主机, 端口): 连接数}
+        """
+        hot = [(key, count) for key, count in self.demand.most_common(HOT) if count >= MIN_DEMAND]
+        links = [link for link in self.links if link.up and not link.suspect]
+        if not hot or not links:
+            return {}
+        total_weight = sum(max(link.effective_weight, 1.0) for link in links)
+        total_demand = sum(count for _, count in hot)
+        targets = {}
+        for link in links:
+            share = max(link.effective_weight, 1.0) / total_weight
+            budget = max(1, int(self.size * share))
+            for (host, port), count in hot:
+                want = min(budget, math.ceil(budget * count / total_demand))
+                if want:
+                    targets[(link.name, host, port)] = want
+                    budget -= want
+                if not budget:
+                    break
+        return targets
+
+    def maintain(self):
+        """
+        衰减请求计数，关闭过期或已断开的空闲连接，并为热门目标补足预连接
+        """
+        for key in list(self.demand):
+            self.demand[key] *= DECAY
+            if self.demand[key] < 0.01:
+                del self.demand[key]
+
+        now = time.monotonic()
+        targets = self.targets()
+        for key in list(self._idle):
+            queue = self._idle[key]
+            keep = targets.get(key, 0)
+            fresh = collections.deque()
+            for entry in queue:
+                created, reader, writer = entry
+                if len(fresh) < keep and now - created < self.max_age \
+                        and not reader.at_eof() and not writer.is_closing():
+                    fresh.append(entry)
+                else:
+                    writer.close()
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+
+        self._failed = {key: until for key, until in self._failed.items() if until > now}
+        by_name = {link.name: link for link in self.links}
+        for key, want in targets.items():
+            if self._failed.get(key, 0) > now:
+                continue
+            missing = want - len(self._idle.get(key, ())) - self._warming[key]
+            for _ in range(missing):
+                self._warming[key] += 1
+                task = asyncio.ensure_future(self._warm(key, by_name[key[0]]))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _warm(self, key, link):
+        _, host, port = key
+        try:
+            reader, writer = await self.connect(link, host, port)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug("预连接 %s:%d（%s）失败: %s", host, port, link.name, e)
+            self._failed[key] = time.monotonic() + BACKOFF
+            return
+        finally:
+            self._warming[key] -= 1
+            if not self._warming[key]:
+                del self._warming[key]
+        self._idle.setdefault(key, collections.deque()).append((time.monotonic(), reader, writer))
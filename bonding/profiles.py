@@ -0,0 +1,210 @@
+"""
+叠加配置档案
+保存叠加接口（按 MAC/GUID 等稳定标识，而不是列表位置或IP）、模式、权重和探测设置，
+并缓存最近一次接口发现结果，使程序启动时无需等待扫描即可恢复状态
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+DEFAULT_PROFILE = "默认"
+
+
+def config_dir():
+    """
+    配置目录：Windows 为 %APPDATA%\\network_bonding，其它平台为 ~/.config/network_bonding
+    可通过环境变量 NETWORK_BONDING_HOME 覆盖
+    """
+    override = os.environ.get('NETWORK_BONDING_HOME')
+    if override:
+        return override
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    return os.path.join(base, 'network_bonding')
+
+
+def interface_id(interface):
+    """
+    接口的稳定标识，优先使用 GUID，其次 MAC，最后是名称
+    """
+    return interface.get('guid') or interface.get('mac') or interface['name']
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _read_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def make_profile(interfaces, mode="round_robin", probe=None, probe_interval=0.5,
+                 listen="127.0.0.1:1080", enabled=False, latency=None, sticky=0,
+                 dns=None, pool=0, race=0.0, offload=False, mptcp=False, limits=None, quotas=None,
+                 fair=False):
+    """
+    由接口字典列表构造档案字典，接口只保留稳定标识、名称和手动权重；限速和流量配额按接口名称保存
+    """
+    return {
+        'mode': mode,
+        'interfaces': [{'id': interface_id(i), 'name': i['name'], 'weight': i.get('weight')}
+                       for i in interfaces],
+        'probe': probe,
+        'probe_interval': probe_interval,
+        'listen': listen,
+        'enabled': enabled,
+        'latency': latency,
+        'sticky': sticky,
+        'dns': dns,
+        'pool': pool,
+        'race': race,
+        'offload': offload,
+        'mptcp': mptcp,
+        'limits': dict(limits or {}),
+        'quotas': dict(quotas or {}),
+        'fair': fair,
+    }
+
+
+def resolve_profile(profile, interfaces):
+    """
+    按稳定标识把档案中的接口映射到当前的接口字典，标识找不到时再按名称匹配
+
+    Args:
+        profile: 档案字典
+        interfaces: 当前接口字典列表（可以来自缓存）
+
+    Returns:
+        (匹配到的接口字典列表（附带档案中的权重）, 缺失的档案接口名称列表)
+    """
+    by_id = {interface_id(i): i for i in interfaces}
+    by_name = {i['name']: i for i in interfaces}
+    matched = []
+    missing = []
+    for entry in profile.get('interfaces', []):
+        current = by_id.get(entry['id']) or by_name.get(entry['name'])
+        if current is None:
+            missing.append(entry['name'])
+        else:
+            matched.append(dict(current, weight=entry.get('weight')))
+    return matched, missing
+
+
+class ProfileStore:
+    """
+    档案存储
+    profiles.json 保存全部档案和最近使用的档案名，discovery.json 缓存最近一次接口发现结果
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or config_dir()
+        self.path = os.path.join(self.directory, 'profiles.json')
+        self.cache_path = os.path.join(self.directory, 'discovery.json')
+        data = _read_json(self.path, {})
+        self.profiles = data.get('profiles', {})
+        self.last = data.get('last')
+
+    def save(self):
+        _write_json(self.path, {'last': self.last, 'profiles': self.profiles})
+
+    def names(self):
+        return sorted(self.profiles)
+
+    def get(self, name=None):
+        """
+        返回指定档案，name 为空时返回最近使用的档案，不存在时为 None
+        """
+        return self.profiles.get(name or self.last)
+
+    def put(self, name, profile):
+        """
+        保存档案并设为最近使用
+        """
+        self.profiles[name] = profile
+        self.last = name
+        self.save()
+
+    def delete(self, name):
+        self.profiles.pop(name, None)
+        if self.last == name:
+            self.last = None
+        self.save()
+
+    def load_cache(self):
+        """
+        读取缓存的接口发现结果
+
+        Returns:
+            ({key: 接口字典}, 缓存时间戳)，没有缓存时为 ({}, None)
+        """
+        data = _read_json(self.cache_path, {})
+        return data.get('interfaces', {}), data.get('time')
+
+    def save_cache(self, snapshot):
+        _write_json(self.cache_path, {'time': time.time(), 'interfaces': snapshot})
+
+
+class UsageStore:
+    """
+    接口流量用量
+    usage.json 按接口稳定标识保存当天和当月已用的字节数，跨越日期或月份时对应的计数归零，
+    叠加重启后按日/按月的配额仍从已用量接着计算
+    """
+    def __init__(self, directory=None):
+        self.path = os.path.join(directory or config_dir(), 'usage.json')
+        self.entries = _read_json(self.path, {})
+
+    def save(self):
+        _write_json(self.path, self.entries)
+
+    def get(self, key, now=None):
+        """
+        返回接口的用量 {'day': 日期, 'day_bytes': 字节, 'month': 月份, 'month_bytes': 字节}，
+        已跨日或跨月的计数先归零
+
+        Args:
+            key: 接口稳定标识（见 interface_id）
+            now: 本地时间戳，默认为当前时间
+        """
+        moment = time.localtime(now)
+        day = time.strftime('%Y-%m-%d', moment)
+        month = time.strftime('%Y-%m', moment)
+        entry = self.entries.setdefault(key, {'day': day, 'day_bytes': 0, 'month': month, 'month_bytes': 0})
+        if entry['day'] != day:
+            entry['day'], entry['day_bytes'] = day, 0
+        if entry['month'] != month:
+            entry['month'], entry['month_bytes'] = month, 0
+        return entry
+
+    def add(self, key, count, now=None):
+        """
+        把 count 字节计入接口当天和当月的用量
+
+        Returns:
+            更新后的用量字典
+        """
+        entry = self.get(key, now)
+        entry['day_bytes'] += count
+        entry['month_bytes'] += count
+        return entry
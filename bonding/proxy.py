@@ -0,0 +1,458 @@
+"""
+叠加代理
+本地 SOCKS5 / HTTP CONNECT 代理，每条出站连接绑定到调度器选出的网络接口源地址
+"""
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import struct
+import time
+
+from . import mptcp
+from .classify import BULK
+from .metrics import LATENCY, MODE, FlowLink
+from .pool import ConnectionPool
+from .relay import relay, resolve_mode
+
+
+log = logging.getLogger(__name__)
+
+SOCKS_VERSION = 5
+SOCKS_CMD_CONNECT = 1
+SOCKS_ATYP_IPV4 = 1
+SOCKS_ATYP_DOMAIN = 3
+SOCKS_ATYP_IPV6 = 4
+
+SOCKS_REP_SUCCESS = 0
+SOCKS_REP_FAILURE = 1
+SOCKS_REP_NETWORK_UNREACHABLE = 3
+SOCKS_REP_HOST_UNREACHABLE = 4
+SOCKS_REP_REFUSED = 5
+SOCKS_REP_CMD_NOT_SUPPORTED = 7
+SOCKS_REP_ATYP_NOT_SUPPORTED = 8
+
+
+class ProxyError(Exception):
+    """
+    客户端请求无法处理时抛出，reply 为应返回给客户端的错误码
+    """
+    def __init__(self, message, reply=SOCKS_REP_FAILURE):
+        super().__init__(message)
+        self.reply = reply
+
+
+def link_family(ip):
+    """
+    根据接口地址返回对应的地址族
+    """
+    return socket.AF_INET6 if ':' in ip else socket.AF_INET
+
+
+def _socks_address(sockname):
+    if sockname and ':' in sockname[0]:
+        return bytes([SOCKS_ATYP_IPV6]) + ipaddress.IPv6Address(sockname[0]).packed + struct.pack('!H', sockname[1])
+    if sockname:
+        return bytes([SOCKS_ATYP_IPV4]) + socket.inet_aton(sockname[0]) + struct.pack('!H', sockname[1])
+    return bytes([SOCKS_ATYP_IPV4]) + b'\x00' * 6
+
+
+def _socks_reply(code, sockname=None):
+    return bytes([SOCKS_VERSION, code, 0]) + _socks_address(sockname)
+
+
+def _error_reply(exc):
+    if isinstance(exc, ConnectionRefusedError):
+        return SOCKS_REP_REFUSED
+    if isinstance(exc, (asyncio.TimeoutError, socket.gaierror)):
+        return SOCKS_REP_HOST_UNREACHABLE
+    return SOCKS_REP_NETWORK_UNREACHABLE
+
+
+def _discard_connection(task):
+    # 竞速中被取消的尝试可能恰好已经连上，关闭多余的连接并取走异常
+    if not task.cancelled():
+        if task.exception() is None:
+            task.result()[1].close()
+
+
+class BondingProxy:
+    """
+    叠加代理服务器
+    同一端口同时接受 SOCKS5 和 HTTP CONNECT 请求
+
+    Args:
+        relay_mode: 数据转发方式，见 relay.RELAY_MODES，auto 会在构造时解析为实际方式
+        reuse_port: 以 SO_REUSEPORT 监听，供多进程模式下多个进程共用同一端口
+        classifier: classify.Classifier，按目标端口识别低延迟连接并走 RTT 最低的链路；
+            TCP 连接无法在两条链路上重复发送，duplicate 规则在这里等同于 fastest
+        resolver: resolver.Resolver，经出口链路解析目标域名；None 时使用系统解析
+        pool_size: 预连接池的空闲连接上限（见 pool.ConnectionPool），0 表示不预连接
+        race_delay: 多链路竞速连接的错开时间（秒），0 表示只在调度器选中的链路上连接，见 _race()
+        metrics: metrics.Metrics，记录调度决策、连接耗时和连接失败；None 表示不记录
+        tracer: metrics.Tracer，抽样记录单条连接的经过；None 表示不跟踪
+        mptcp: 出站连接使用 MPTCP 套接字（见 mptcp），连接结束时按子流把流量记入 metrics；
+            本机内核未启用 MPTCP 时在 start() 中退回普通 TCP
+        shaper: shaper.Shaper，按链路限速并可按连接公平排队；None 表示不整形
+    """
+    def __init__(self, scheduler, host="127.0.0.1", port=1080, connect_timeout=10.0, relay_mode="auto",
+                 reuse_port=False, classifier=None, resolver=None, pool_size=0, race_delay=0.0,
+                 metrics=None, tracer=None, mptcp=False, shaper=None):
+        self.scheduler = scheduler
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.relay_mode = resolve_mode(relay_mode)
+        self.reuse_port = reuse_port
+        self.classifier = classifier
+        self.resolver = resolver
+        self.race_delay = race_delay
+        self.metrics = metrics
+        self.tracer = tracer
+        self.mptcp = mptcp
+        self.subflows = None
+        self.shaper = shaper
+        self.pool = ConnectionPool(self.open_connection, scheduler.links, pool_size) if pool_size else None
+        self._server = None
+        self._clients = set()
+
+    async def start(self):
+        """
+        开始监听，port 为 0 时由系统分配端口并回写到 self.port
+        """
+        if self.mptcp and not mptcp.available():
+            log.warning("本机内核未启用 MPTCP（net.mptcp.enabled），出站连接改用普通 TCP")
+            self.mptcp = False
+        if self.mptcp:
+            self.subflows = mptcp.SubflowTracker()
+            self.subflows.start()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port,
+                                                  reuse_port=self.reuse_port or None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.pool is not None:
+            self.pool.start()
+        log.info("叠加代理已监听 %s:%d", self.host, self.port)
+
+    async def stop(self):
+        """
+        停止监听并断开所有仍在转发的连接
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self.pool is not None:
+            await self.pool.close()
+        if self.tracer is not None:
+            self.tracer.close()
+        clients = list(self._clients)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        if self.subflows is not None:
+            await self.subflows.stop()
+            self.subflows = None
+
+    async def open_connection(self, link, host, port):
+        """
+        从指定链路的源地址发起出站连接
+
+        Args:
+            link: 出口 Link
+            host: 目标主机名或IP
+            port: 目标端口
+
+        Returns:
+            (StreamReader, StreamWriter)
+        """
+        return await asyncio.wait_for(self._open(link, host, port), self.connect_timeout)
+
+    async def _open(self, link, host, port):
+        family = link_family(link.ip)
+        if self.resolver is None:
+            return await self._open_address(link, host, port, family)
+        error = None
+        for address in await self.resolver.resolve(link, host, family):
+            try:
+                return await self._open_address(link, address, port, family)
+            except OSError as e:
+                error = e
+        raise error
+
+    async def _open_address(self, link, host, port, family):
+        if not self.mptcp:
+            return await asyncio.open_connection(host, port, family=family, local_addr=(link.ip, 0))
+        # asyncio 不能指定套接字协议，MPTCP 套接字自行创建和连接后再交给流对象
+        loop = asyncio.get_running_loop()
+        error = None
+        for *_, address in await loop.getaddrinfo(host, port, family=family, type=socket.SOCK_STREAM):
+            sock = mptcp.open_socket(family, link.ip)
+            try:
+                await mptcp.connect(sock, address)
+            except OSError as e:
+                sock.close()
+                error = e
+                continue
+            except BaseException:
+                sock.close()
+                raise
+            return await asyncio.open_connection(sock=sock)
+        raise error
+
+    async def _handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            first = await reader.readexactly(1)
+            if first[0] == SOCKS_VERSION:
+                await self._handle_socks5(reader, writer)
+            else:
+                await self._handle_http(first, reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+        except asyncio.CancelledError:
+            # 由 stop() 取消，这里是任务最外层，正常结束即可，避免 asyncio 把取消当作异常记录
+            writer.close()
+        except Exception:
+            log.exception("处理客户端连接失败")
+            writer.close()
+        finally:
+            self._clients.discard(task)
+
+    async def _connect(self, client_writer, host, port, flow=None):
+        """
+        选出链路并建立出站连接；flow 为被抽样跟踪的连接记录时，把选路结果和耗时写入其中
+
+        Returns:
+            (Link, reader, writer)
+        """
+        decided = time.perf_counter()
+        if self.classifier is not None and self.classifier.classify(port) != BULK:
+            link = self.scheduler.fastest()[0]
+            kind = LATENCY
+        else:
+            src = (client_writer.get_extra_info('peername') or ('',))[0]
+            link = self.scheduler.select(src, host)
+            kind = MODE
+        decided = time.perf_counter() - decided
+        if self.metrics is not None:
+            self.metrics.decision(link, kind, decided)
+        if flow is not None:
+            flow.update(link=link.name, kind='latency' if kind == LATENCY else self.scheduler.mode,
+                        decision_us=round(decided * 1e6, 2))
+        self.scheduler.acquire(link)
+        try:
+            pooled = self.pool.take(link, host, port) if self.pool is not None else None
+            start = time.monotonic()
+            if pooled is not None:
+                remote_reader, remote_writer = pooled
+            elif self.race_delay > 0 and len(self.scheduler.links) > 1:
+                winner, remote_reader, remote_writer = await asyncio.wait_for(
+                    self._race(link, host, port), self.connect_timeout)
+                if winner is not link:
+                    self.scheduler.release(link)
+                    self.scheduler.acquire(winner)
+                    self.scheduler.pin((client_writer.get_extra_info('peername') or ('',))[0], host, winner)
+                    link = winner
+            else:
+                try:
+                    remote_reader, remote_writer = await self.open_connection(link, host, port)
+                except (OSError, asyncio.TimeoutError):
+                    if self.metrics is not None:
+                        self.metrics.connect_error(link)
+                    raise
+                elapsed = time.monotonic() - start
+                self.scheduler.record_connect(link, elapsed)
+                if self.metrics is not None:
+                    self.metrics.connected(link, elapsed)
+        except BaseException:
+            self.scheduler.release(link)
+            raise
+        if flow is not None:
+            flow.update(link=link.name, pooled=pooled is not None,
+                        connect_ms=round((time.monotonic() - start) * 1000, 3))
+        return link, remote_reader, remote_writer
+
+    async def _relay(self, reader, writer, remote_reader, remote_writer, link, flow):
+        handle = self.subflows.add(remote_writer) if self.subflows is not None else None
+        throttle = self.shaper.flow(link) if self.shaper is not None else None
+        if flow is None and handle is None:
+            await relay(reader, writer, remote_reader, remote_writer, link, self.relay_mode, throttle)
+            return
+        counter = FlowLink(link)
+        try:
+            await relay(reader, writer, remote_reader, remote_writer, counter, self.relay_mode, throttle)
+        finally:
+            if handle is not None:
+                self._mptcp_closed(self.subflows.finish(handle, link.ip, counter.sent, counter.recv), link, flow)
+            if flow is not None:
+                self.tracer.finish(flow, counter)
+
+    def _mptcp_closed(self, info, link, flow):
+        """
+        把已结束的 MPTCP 连接的子流统计（见 mptcp.SubflowTracker.finish）记入指标和跟踪记录
+        """
+        by_ip = {candidate.ip: candidate for candidate in self.scheduler.links}
+        for subflow in info['subflows']:
+            sublink = by_ip.get(subflow['local'])
+            subflow['link'] = sublink.name if sublink is not None else None
+        if self.metrics is not None:
+            self.metrics.mptcp_closed(link, info['fallback'], [(by_ip.get(s['local']), s['sent'], s['recv'])
+                                                               for s in info['subflows']])
+        if flow is not None:
+            flow['mptcp'] = info
+
+    def _begin_trace(self, writer, host, port):
+        if self.tracer is None:
+            return None
+        return self.tracer.begin((writer.get_extra_info('peername') or ('',))[0], host, port)
+
+    async def _race(self, link, host, port):
+        """
+        按 RFC 8305（Happy Eyeballs）的思路在多条链路间竞速建立连接，地址族换成链路
+        先在调度器选中的链路上发起连接，race_delay 内未完成（或已失败）时再在延迟估计最低的下一条链路上发起，
+        依此类推；最先完成握手的连接胜出，其余尝试被取消。胜负和握手耗时记入链路，改进低延迟选路的估计
+
+        Returns:
+            (胜出的 Link, reader, writer)
+        """
+        order = iter([l for l in self.scheduler.fastest(len(self.scheduler.links)) if l is not link])
+        pending = {}
+        attempts = 0
+        error = None
+        next_link = link
+        try:
+            while True:
+                if next_link is not None:
+                    task = asyncio.ensure_future(self._open(next_link, host, port))
+                    pending[task] = (next_link, time.monotonic())
+                    attempts += 1
+                    next_link = next(order, None)
+                if not pending:
+                    raise error
+                done, _ = await asyncio.wait(pending, timeout=self.race_delay if next_link is not None else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                for task in done:
+                    attempt, start = pending.pop(task)
+                    elapsed = time.monotonic() - start
+                    if task.exception() is not None:
+                        error = task.exception()
+                        self.scheduler.record_connect(attempt, elapsed, completed=False)
+                        if self.metrics is not None:
+                            self.metrics.connect_error(attempt)
+                    elif winner is None:
+                        winner = attempt, task.result()
+                        self.scheduler.record_connect(attempt, elapsed)
+                        if self.metrics is not None:
+                            self.metrics.connected(attempt, elapsed)
+                    else:
+                        # 同一轮里先后完成的多余连接直接关闭
+                        task.result()[1].close()
+                if winner is not None:
+                    attempt, (reader, writer) = winner
+                    if attempts > 1:
+                        attempt.races_won += 1
+                    for loser, start in pending.values():
+                        loser.races_lost += 1
+                        self.scheduler.record_connect(loser, time.monotonic() - start, completed=False)
+                    return attempt, reader, writer
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_discard_connection)
+
+    async def _handle_socks5(self, reader, writer):
+        nmethods = (await reader.readexactly(1))[0]
+        methods = await reader.readexactly(nmethods)
+        if 0 not in methods:
+            writer.write(bytes([SOCKS_VERSION, 0xFF]))
+            await writer.drain()
+            writer.close()
+            return
+        writer.write(bytes([SOCKS_VERSION, 0]))
+
+        try:
+            host, port = await self._read_socks_request(reader)
+        except ProxyError as e:
+            writer.write(_socks_reply(e.reply))
+            await writer.drain()
+            writer.close()
+            return
+
+        flow = self._begin_trace(writer, host, port)
+        try:
+            link, remote_reader, remote_writer = await self._connect(writer, host, port, flow)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug("连接 %s:%d 失败: %s", host, port, e)
+            if flow is not None:
+                self.tracer.finish(flow, error=e)
+            writer.write(_socks_reply(_error_reply(e)))
+            await writer.drain()
+            writer.close()
+            return
+
+        try:
+            writer.write(_socks_reply(SOCKS_REP_SUCCESS, remote_writer.get_extra_info('sockname')))
+            await writer.drain()
+            await self._relay(reader, writer, remote_reader, remote_writer, link, flow)
+        finally:
+            self.scheduler.release(link)
+
+    async def _read_socks_request(self, reader):
+        ver, cmd, _, atyp = await reader.readexactly(4)
+        if ver != SOCKS_VERSION:
+            raise ProxyError("SOCKS版本错误")
+        if atyp == SOCKS_ATYP_IPV4:
+            host = socket.inet_ntoa(await reader.readexactly(4))
+        elif atyp == SOCKS_ATYP_DOMAIN:
+            length = (await reader.readexactly(1))[0]
+            host = (await reader.readexactly(length)).decode('idna')
+        elif atyp == SOCKS_ATYP_IPV6:
+            host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+        else:
+            raise ProxyError("不支持的地址类型", SOCKS_REP_ATYP_NOT_SUPPORTED)
+        port = struct.unpack('!H', await reader.readexactly(2))[0]
+        if cmd != SOCKS_CMD_CONNECT:
+            raise ProxyError("仅支持CONNECT命令", SOCKS_REP_CMD_NOT_SUPPORTED)
+        return host, port
+
+    async def _handle_http(self, first, reader, writer):
+        head = first + await reader.readuntil(b'\r\n\r\n')
+        request_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+        parts = request_line.split()
+        if len(parts) != 3 or parts[0].upper() != 'CONNECT':
+            writer.write(b"HTTP/1.1 405 Method Not Allowed\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        host, _, port = parts[1].rpartition(':')
+        host = host.strip('[]')
+        try:
+            port = int(port)
+        except ValueError:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        flow = self._begin_trace(writer, host, port)
+        try:
+            link, remote_reader, remote_writer = await self._connect(writer, host, port, flow)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug("连接 %s:%d 失败: %s", host, port, e)
+            if flow is not None:
+                self.tracer.finish(flow, error=e)
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        try:
+            writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            await writer.drain()
+            await self._relay(reader, writer, remote_reader, remote_writer, link, flow)
+        finally:
+            self.scheduler.release(link)
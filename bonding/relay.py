@@ -0,0 +1,250 @@
+"""
+数据转发
+在客户端连接与出站连接之间双向搬运字节，并累计链路流量
+
+转发方式:
+    stream: 经由 asyncio 流读写，每个数据块都会分配新的 bytes
+    buffer: 接管底层套接字，用预分配的缓冲区 recv_into 后直接发送，不再逐块分配内存
+    splice: Linux 下经由管道 os.splice，数据不进入用户态
+    auto:   splice 可用时使用 splice，否则使用 buffer
+
+传入 throttle（shaper.Flow）时，每个数据块在写出前先取得令牌，等待期间不再读取，由 TCP 流控向对端施加背压
+
+不稳定的链路上读写可能因连接重置、超时（ETIMEDOUT）、主机不可达等失败，这些都按该方向的数据流结束处理
+"""
+
+import asyncio
+import errno
+import os
+import socket
+import sys
+
+
+CHUNK_SIZE = 64 * 1024
+
+RELAY_MODES = ("auto", "stream", "buffer", "splice")
+
+HAS_SPLICE = sys.platform.startswith('linux') and hasattr(os, 'splice')
+
+
+def resolve_mode(mode):
+    """
+    把 auto 解析为当前平台可用的最快方式，splice 不可用时退回 buffer
+
+    Args:
+        mode: RELAY_MODES 之一
+
+    Returns:
+        实际使用的转发方式
+    """
+    if mode not in RELAY_MODES:
+        raise ValueError(f"未知的转发方式: {mode}")
+    if mode in ('auto', 'splice'):
+        return 'splice' if HAS_SPLICE else 'buffer'
+    return mode
+
+
+async def pipe(reader, writer, link, direction, throttle=None):
+    """
+    单向转发，直到读端关闭
+
+    Args:
+        reader: 数据来源 StreamReader
+        writer: 数据去向 StreamWriter
+        link: 计入流量统计的 Link
+        direction: 'sent' 表示上行（客户端到远端），'recv' 表示下行
+        throttle: shaper.Flow，写出前取得令牌；None 表示不整形
+    """
+    attr = 'bytes_sent' if direction == 'sent' else 'bytes_recv'
+    try:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            if throttle is not None:
+                await throttle.consume(direction, len(data))
+            writer.write(data)
+            setattr(link, attr, getattr(link, attr) + len(data))
+            await writer.drain()
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        try:
+            if writer.can_write_eof():
+                writer.write_eof()
+        except OSError:
+            pass
+
+
+def _detach(reader, writer):
+    """
+    停止流对象读取并取出其中已缓冲但尚未消费的数据，返回 (复制的套接字, 缓冲数据)
+    复制文件描述符是为了不与仍持有原套接字的传输对象冲突，关闭时两者各自释放
+    """
+    transport = writer.transport
+    transport.pause_reading()
+    # StreamReader 没有公开取出缓冲区的接口，握手阶段之后残留的数据只能从这里拿
+    pending = bytes(reader._buffer)
+    reader._buffer.clear()
+    sock = socket.socket(fileno=os.dup(transport.get_extra_info('socket').fileno()))
+    sock.setblocking(False)
+    return sock, pending
+
+
+def _shutdown_write(sock):
+    try:
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+async def _wait_fd(loop, fd, writable=False):
+    waiter = loop.create_future()
+    add, remove = (loop.add_writer, loop.remove_writer) if writable else (loop.add_reader, loop.remove_reader)
+    add(fd, waiter.set_result, None)
+    try:
+        await waiter
+    finally:
+        remove(fd)
+
+
+async def pipe_buffer(src, dst, link, direction, pending=b'', throttle=None):
+    """
+    单向转发（buffer 方式），复用同一块缓冲区，每个数据块不再分配内存
+
+    Args:
+        src: 数据来源套接字（非阻塞）
+        dst: 数据去向套接字（非阻塞）
+        link: 计入流量统计的 Link
+        direction: 'sent' 或 'recv'
+        pending: 接管前已读入、需要先发送的数据
+        throttle: shaper.Flow，发送前取得令牌；None 表示不整形
+    """
+    loop = asyncio.get_running_loop()
+    attr = 'bytes_sent' if direction == 'sent' else 'bytes_recv'
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    try:
+        if pending:
+            if throttle is not None:
+                await throttle.consume(direction, len(pending))
+            await loop.sock_sendall(dst, pending)
+            setattr(link, attr, getattr(link, attr) + len(pending))
+        while True:
+            n = await loop.sock_recv_into(src, view)
+            if not n:
+                break
+            if throttle is not None:
+                await throttle.consume(direction, n)
+            await loop.sock_sendall(dst, view[:n])
+            setattr(link, attr, getattr(link, attr) + n)
+    except OSError:
+        pass
+    finally:
+        _shutdown_write(dst)
+
+
+async def pipe_splice(src, dst, link, direction, pending=b'', throttle=None):
+    """
+    单向转发（splice 方式），数据经内核管道从一个套接字移到另一个，不复制到用户态
+    首次 splice 不被支持时（例如套接字类型不支持）退回 buffer 方式
+
+    Args:
+        同 pipe_buffer
+    """
+    loop = asyncio.get_running_loop()
+    attr = 'bytes_sent' if direction == 'sent' else 'bytes_recv'
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    pipe_r, pipe_w = os.pipe()
+    spliced = False
+    try:
+        if pending:
+            if throttle is not None:
+                await throttle.consume(direction, len(pending))
+            await loop.sock_sendall(dst, pending)
+            setattr(link, attr, getattr(link, attr) + len(pending))
+        while True:
+            try:
+                n = os.splice(src_fd, pipe_w, CHUNK_SIZE, flags=flags)
+            except BlockingIOError:
+                await _wait_fd(loop, src_fd)
+                continue
+            except OSError as e:
+                if e.errno != errno.EINVAL or spliced:
+                    raise
+                os.close(pipe_r)
+                os.close(pipe_w)
+                pipe_r = pipe_w = None
+                await pipe_buffer(src, dst, link, direction, throttle=throttle)
+                return
+            if not n:
+                break
+            if throttle is not None:
+                await throttle.consume(direction, n)
+            left = n
+            while left:
+                try:
+                    left -= os.splice(pipe_r, dst_fd, left, flags=flags)
+                except BlockingIOError:
+                    await _wait_fd(loop, dst_fd, writable=True)
+            spliced = True
+            setattr(link, attr, getattr(link, attr) + n)
+    except OSError:
+        pass
+    finally:
+        for fd in (pipe_r, pipe_w):
+            if fd is not None:
+                os.close(fd)
+        _shutdown_write(dst)
+
+
+async def _both(first, second):
+    """
+    同时运行两个方向的转发；任一方向异常或整体被取消时，先取消并等待另一方向结束，调用方才能安全地关闭套接字
+    """
+    tasks = [asyncio.ensure_future(first), asyncio.ensure_future(second)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def relay(client_reader, client_writer, remote_reader, remote_writer, link, mode="stream", throttle=None):
+    """
+    双向转发，两个方向都结束后关闭两端连接
+
+    Args:
+        mode: 转发方式，见 RELAY_MODES
+        throttle: shaper.Flow，None 表示不整形
+    """
+    mode = resolve_mode(mode)
+    if mode == 'stream':
+        try:
+            await _both(
+                pipe(client_reader, remote_writer, link, 'sent', throttle),
+                pipe(remote_reader, client_writer, link, 'recv', throttle),
+            )
+        finally:
+            for writer in (remote_writer, client_writer):
+                writer.close()
+        return
+
+    forward = pipe_splice if mode == 'splice' else pipe_buffer
+    sockets = []
+    try:
+        client, client_pending = _detach(client_reader, client_writer)
+        sockets.append(client)
+        remote, remote_pending = _detach(remote_reader, remote_writer)
+        sockets.append(remote)
+        await _both(
+            forward(client, remote, link, 'sent', client_pending, throttle),
+            forward(remote, client, link, 'recv', remote_pending, throttle),
+        )
+    finally:
+        for sock in sockets:
+            sock.close()
+        for writer in (remote_writer, client_writer):
+            writer.close()
@@ -0,0 +1,334 @@
+"""
+按接口解析域名
+多出口时如果域名经 A 运营商解析、连接却从 B 运营商发出，CDN 会按 A 的位置返回节点，
+连接绕远甚至被拒。这里的解析器把 DNS 查询从连接将要使用的同一条链路（绑定其源地址）发往该接口的 DNS 服务器，
+结果按链路分别缓存
+
+    - 缓存按 (链路, 域名, 地址族) 存放，遵守记录的 TTL，容量有上限，按 LRU 淘汰；解析失败短暂缓存
+    - 同一链路上对同一域名的并发查询合并为一次
+    - 只实现 A/AAAA 查询所需的最小 DNS 协议（UDP，RFC 1035），不依赖第三方库
+"""
+
+import asyncio
+import collections
+import ipaddress
+import logging
+import os
+import socket
+import struct
+
+
+log = logging.getLogger(__name__)
+
+DNS_PORT = 53
+QTYPE_A = 1
+QTYPE_AAAA = 28
+QCLASS_IN = 1
+RCODE_NXDOMAIN = 3
+
+HEADER = struct.Struct('!HHHHHH')
+RECORD = struct.Struct('!HHIH')
+
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_ATTEMPTS = 2
+CACHE_SIZE = 4096
+MAX_TTL = 3600
+NEGATIVE_TTL = 5
+FALLBACK_TTL = 30
+
+
+def system_servers(path='/etc/resolv.conf'):
+    """
+    读取系统配置的 DNS 服务器，用于没有接口专属 DNS 的链路；读取失败（如 Windows）时返回空列表
+    """
+    servers = []
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    servers.append(fields[1])
+    except OSError:
+        pass
+    return servers
+
+
+def server_address(spec):
+    """
+    解析 DNS 服务器地址，可带端口：1.2.3.4、1.2.3.4:5353、[::1]:5353
+
+    Returns:
+        (host, port)
+    """
+    port = DNS_PORT
+    if spec.startswith('['):
+        host, _, rest = spec[1:].partition(']')
+        if rest.startswith(':'):
+            port = int(rest[1:])
+    elif spec.count(':') == 1:
+        host, port = spec.split(':')
+        port = int(port)
+    else:
+        host = spec
+    ipaddress.ip_address(host)
+    return host, port
+
+
+def make_resolver(dns, interfaces):
+    """
+    由配置构造解析器
+
+    Args:
+        dns: DNS 配置列表：'auto' 表示各接口使用自己的 DNS 服务器（见 discovery），
+            其余条目为所有链路共用的服务器；只有 'auto' 时共用服务器取系统配置
+        interfaces: 接口字典列表
+
+    Returns:
+        Resolver，dns 为空时返回 None
+
+    Raises:
+        ValueError: 服务器地址无效
+    """
+    if not dns:
+        return None
+    servers = {}
+    if 'auto' in dns:
+        servers = {i['name']: i['dns'] for i in interfaces if i.get('dns')}
+    fallback = [s for s in dns if s != 'auto'] or system_servers()
+    return Resolver(servers, fallback)
+
+
+def build_query(qid, name, qtype):
+    """
+    构造一个递归查询报文
+    """
+    try:
+        labels = name.encode('idna').split(b'.')
+    except UnicodeError:
+        raise socket.gaierror(socket.EAI_NONAME, f"无效的域名: {name}") from None
+    if any(not label or len(label) > 63 for label in labels):
+        raise socket.gaierror(socket.EAI_NONAME, f"无效的域名: {name}")
+    qname = b''.join(bytes([len(label)]) + label for label in labels) + b'\x00'
+    return HEADER.pack(qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack('!HH', qtype, QCLASS_IN)
+
+
+def _skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += length + 1
+
+
+def parse_response(data, qtype):
+    """
+    解析应答，取出答案段中所有 qtype 类型的地址（CNAME 链由递归服务器展开，一并出现在答案段）
+
+    Returns:
+        (rcode, 地址列表, 最小 TTL)
+
+    Raises:
+        ValueError: 报文格式错误
+    """
+    try:
+        _, flags, qdcount, ancount, _, _ = HEADER.unpack_from(data)
+        offset = HEADER.size
+        for _ in range(qdcount):
+            offset = _skip_name(data, offset) + 4
+        addresses = []
+        ttl = MAX_TTL
+        for _ in range(ancount):
+            offset = _skip_name(data, offset)
+            rtype, _, record_ttl, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            rdata = data[offset:offset + length]
+            offset += length
+            if len(rdata) != length:
+                raise ValueError("记录被截断")
+            ttl = min(ttl, record_ttl)
+            if rtype == qtype == QTYPE_A and length == 4:
+                addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+            elif rtype == qtype == QTYPE_AAAA and length == 16:
+                addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+    except (IndexError, struct.error):
+        raise ValueError("DNS 应答格式错误") from None
+    return flags & 0xF, addresses, ttl
+
+
+class _Query(asyncio.DatagramProtocol):
+    def __init__(self, qid):
+        self.qid = qid
+        self.answer = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        # 套接字已连接到服务器，内核只交付来自服务器的报文；再核对事务号和应答标志
+        if len(data) >= HEADER.size and int.from_bytes(data[:2], 'big') == self.qid and data[2] & 0x80 \
+                and not self.answer.done():
+            self.answer.set_result(data)
+
+    def error_received(self, exc):
+        if not self.answer.done():
+            self.answer.set_exception(exc)
+
+
+class DnsCache:
+    """
+    带 TTL 的 LRU 缓存，值为地址列表或解析失败的异常
+
+    Args:
+        capacity: 最多缓存的条目数
+    """
+    def __init__(self, capacity=CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value, ttl, now):
+        if ttl <= 0:
+            return
+        self._entries[key] = (now + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class Resolver:
+    """
+    按链路解析域名
+
+    Args:
+        servers: {链路名: DNS 服务器列表}，每条链路优先使用自己的服务器
+        fallback: 链路没有专属服务器时使用的服务器列表；也为空时退回系统解析（不按链路）
+        timeout: 单次查询超时（秒）
+        attempts: 每个服务器的尝试次数
+        cache_size: 缓存条目上限
+    """
+    def __init__(self, servers=None, fallback=None, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS,
+                 cache_size=CACHE_SIZE):
+        self.servers = {name: [server_address(s) for s in specs] for name, specs in (servers or {}).items()}
+        self.fallback = [server_address(s) for s in (fallback or [])]
+        self.timeout = timeout
+        self.attempts = attempts
+        self.cache = DnsCache(cache_size)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._pending = {}
+
+    async def resolve(self, link, host, family=socket.AF_INET):
+        """
+        经指定链路解析域名，IP 字面量原样返回
+
+        Args:
+            link: 出口 Link，查询从其源地址发出
+            host: 域名
+            family: 需要的地址族，应与链路地址族一致
+
+        Returns:
+            地址字符串列表
+
+        Raises:
+            socket.gaierror: 域名不存在或所有服务器都无法解析
+        """
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        name = host.rstrip('.').lower()
+        key = (link.name, name, family)
+        loop = asyncio.get_running_loop()
+        cached = self.cache.get(key, loop.time())
+        if cached is not None:
+            self.hits += 1
+            if isinstance(cached, Exception):
+                raise socket.gaierror(*cached.args)
+            return cached
+
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._pending[key] = asyncio.ensure_future(self._lookup(key, link, name, family))
+            task.add_done_callback(lambda t: self._finished(key, t))
+        else:
+            self.coalesced += 1
+        # 一个等待者被取消不影响其它等待同一查询的连接
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        self._pending.pop(key, None)
+        # 所有等待者都已取消时也要取走异常，避免 asyncio 报告未处理的异常
+        if not task.cancelled():
+            task.exception()
+
+    async def _lookup(self, key, link, name, family):
+        loop = asyncio.get_running_loop()
+        try:
+            addresses, ttl = await self._query_servers(link, name, family)
+        except socket.gaierror as e:
+            self.cache.put(key, e, NEGATIVE_TTL, loop.time())
+            raise
+        self.cache.put(key, addresses, min(ttl, MAX_TTL), loop.time())
+        return addresses
+
+    async def _query_servers(self, link, name, family):
+        servers = [s for s in self.servers.get(link.name) or self.fallback
+                   if (':' in s[0]) == (family == socket.AF_INET6)]
+        if not servers:
+            infos = await asyncio.get_running_loop().getaddrinfo(name, None, family=family,
+                                                                  type=socket.SOCK_STREAM)
+            return list(dict.fromkeys(info[4][0] for info in infos)), FALLBACK_TTL
+
+        qtype = QTYPE_AAAA if family == socket.AF_INET6 else QTYPE_A
+        error = None
+        for _ in range(self.attempts):
+            for server in servers:
+                try:
+                    rcode, addresses, ttl = await self._query(link, server, name, qtype)
+                except (OSError, asyncio.TimeoutError, ValueError) as e:
+                    error = e
+                    log.debug("经 %s 向 %s 查询 %s 失败: %r", link.name, server[0], name, e)
+                    continue
+                if rcode == RCODE_NXDOMAIN or (rcode == 0 and not addresses):
+                    raise socket.gaierror(socket.EAI_NONAME, f"域名不存在或没有地址: {name}")
+                if rcode == 0:
+                    return addresses, ttl
+                error = OSError(f"DNS 服务器 {server[0]} 返回错误码 {rcode}")
+        raise socket.gaierror(socket.EAI_AGAIN, f"经 {link.name} 解析 {name} 失败: {error}")
+
+    async def _query(self, link, server, name, qtype):
+        loop = asyncio.get_running_loop()
+        qid = int.from_bytes(os.urandom(2), 'big')
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _Query(qid), local_addr=(link.ip, 0), remote_addr=server)
+        try:
+            transport.sendto(build_query(qid, name, qtype))
+            data = await asyncio.wait_for(protocol.answer, self.timeout)
+        finally:
+            transport.close()
+        return parse_response(data, qtype)
+
+    def stats(self):
+        return {
+            'cached': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,301 @@
+"""
+链路调度器
+根据负载均衡模式为每条新连接选择出口网络接口
+"""
+
+import heapq
+
+from .hashring import MaglevTable, hash_key
+
+
+MODES = ("round_robin", "source_hash", "dest_hash", "least_conn", "weighted")
+
+MBIT = 125000
+DEFAULT_CAPACITY = 10 * MBIT
+
+
+class Link:
+    """
+    出口链路
+    对应一个参与叠加的网络接口，出站连接会绑定到它的源地址
+    """
+    __slots__ = ('name', 'ip', 'gateway', 'speed', 'weight', 'effective_weight', 'throughput', 'peak',
+                 'up', 'suspect', 'rtt', 'loss', 'jitter', 'connect_time', 'races_won', 'races_lost',
+                 'capped', 'active', 'total', 'bytes_sent', 'bytes_recv')
+
+    def __init__(self, name, ip, gateway='', speed=None, weight=None):
+        self.name = name
+        self.ip = ip
+        self.gateway = gateway
+        self.speed = speed
+        self.weight = weight
+        self.effective_weight = float(weight * MBIT if weight else (speed * MBIT if speed else DEFAULT_CAPACITY))
+        self.throughput = 0.0
+        self.peak = 0.0
+        self.up = True
+        self.suspect = False
+        self.rtt = None
+        self.loss = 0.0
+        self.jitter = None
+        self.connect_time = None
+        self.races_won = 0
+        self.races_lost = 0
+        self.capped = False
+        self.active = 0
+        self.total = 0
+        self.bytes_sent = 0
+        self.bytes_recv = 0
+
+    @property
+    def load(self):
+        """
+        最小连接数模式比较的活动连接数，多进程模式下为所有工作进程之和
+        """
+        return self.active
+
+    @property
+    def usable(self):
+        """
+        是否适合承载新连接：在线、未判定故障且未接近流量配额（见 shaper.QuotaTracker）
+        """
+        return self.up and not self.suspect and not self.capped
+
+    @property
+    def latency(self):
+        """
+        低延迟选路使用的延迟估计：健康检查测得的 RTT，未启用健康检查时用连接握手耗时
+        """
+        return self.rtt if self.rtt is not None else self.connect_time
+
+    @classmethod
+    def from_interface(cls, interface):
+        """
+        由接口发现得到的接口字典构造链路
+
+        Args:
+            interface: 包含 'name' 和 'ip' 键的接口字典，'gateway'、'speed'、'weight' 可选
+
+        Returns:
+            Link 实例
+        """
+        return cls(interface['name'], interface['ip'], interface.get('gateway', ''),
+                   interface.get('speed'), interface.get('weight'))
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'ip': self.ip,
+            'up': self.up,
+            'rtt': self.rtt,
+            'loss': self.loss,
+            'jitter': self.jitter,
+            'connect_time': self.connect_time,
+            'races_won': self.races_won,
+            'races_lost': self.races_lost,
+            'capped': self.capped,
+            'weight': self.weight,
+            'effective_weight': self.effective_weight,
+            'throughput': self.throughput,
+            'active': self.active,
+            'total': self.total,
+            'bytes_sent': self.bytes_sent,
+            'bytes_recv': self.bytes_recv,
+        }
+
+    def __repr__(self):
+        return f"Link({self.name!r}, {self.ip!r})"
+
+
+class Scheduler:
+    """
+    负载均衡调度器
+    支持轮询、源IP哈希、目标IP哈希、最小连接数和加权五种模式
+
+    加权模式采用步长调度（平滑加权轮询的堆实现）：每条链路有一个通行值，
+    每次取通行值最小者并加上 1/权重，单次选择 O(log n)
+
+    两种哈希模式使用按链路容量加权的 Maglev 查找表，单次查找 O(1)；
+    链路上下线或权重变化后需调用 refresh() 重建，只有约 1/n 的会话会改变出口
+
+    传入 flows（flows.FlowTable）时按 (客户端地址, 目标) 记住每个流选中的链路，
+    流表项未超时且链路可用时后续连接沿用同一条链路
+
+    接近流量配额（capped）的链路与故障链路一样不再分配新连接，只有其它链路都不可用时才会被选中
+
+    Args:
+        links: Link 列表
+        mode: 负载均衡模式
+        flows: 流表，None 表示不保持流的链路
+    """
+    def __init__(self, links, mode="round_robin", flows=None):
+        if mode not in MODES:
+            raise ValueError(f"未知的负载均衡模式: {mode}")
+        if not links:
+            raise ValueError("至少需要一个网络接口")
+        self.links = list(links)
+        self.mode = mode
+        self.flows = flows
+        self._positions = {link.name: i for i, link in enumerate(self.links)}
+        self._rr_index = 0
+        self._heap = [[0.0, i, link] for i, link in enumerate(self.links)]
+        self._table = None
+
+    def select(self, src=None, dst=None):
+        """
+        为一条新连接选择出口链路
+
+        Args:
+            src: 发起连接的客户端地址（源IP哈希模式使用）
+            dst: 目标主机名或IP（目标IP哈希模式使用）
+
+        Returns:
+            选中的 Link
+        """
+        if self.flows is None:
+            return self._select(src, dst)
+        key = (src, dst)
+        index = self.flows.get(key)
+        if index is not None:
+            link = self.links[index]
+            if link.usable:
+                return link
+        link = self._select(src, dst)
+        self.flows.put(key, self._positions[link.name])
+        return link
+
+    def flow_counts(self):
+        """
+        返回 {链路名: 流表中使用该链路的流数}，未启用流表时返回空字典
+        """
+        if self.flows is None:
+            return {}
+        return {link.name: self.flows.count(i) for i, link in enumerate(self.links)}
+
+    def _select(self, src, dst):
+        if self.mode == "weighted":
+            return self._select_weighted()
+        if self.mode == "source_hash":
+            return self._select_hashed(src or '')
+        if self.mode == "dest_hash":
+            return self._select_hashed(dst or '')
+        links = self.candidates()
+        if self.mode == "round_robin":
+            link = links[self._rr_index % len(links)]
+            self._rr_index += 1
+            return link
+        return min(links, key=lambda l: l.load)
+
+    def refresh(self):
+        """
+        链路上下线或权重变化后调用，下次哈希选择时重建查找表
+        """
+        self._table = None
+
+    def hash_table(self):
+        """
+        返回当前的 Maglev 查找表，必要时按在线链路及其权重重建
+        """
+        if self._table is None:
+            links = [link for link in self.links if link.up] or self.links
+            self._table = MaglevTable([(link.name, link.effective_weight, link) for link in links])
+        return self._table
+
+    def _select_hashed(self, key):
+        table = self.hash_table()
+        slots = table.table
+        size = table.size
+        slot = hash_key(key) % size
+        link = slots[slot]
+        if link.usable:
+            return link
+        fallback = None
+        for step in range(1, size):
+            candidate = slots[(slot + step) % size]
+            if candidate.usable:
+                return candidate
+            if fallback is None and candidate.up and not candidate.suspect:
+                fallback = candidate
+        if link.up and not link.suspect:
+            return link
+        return fallback or link
+
+    def _select_weighted(self):
+        heap = self._heap
+        skipped = []
+        chosen = None
+        while heap:
+            entry = heapq.heappop(heap)
+            link = entry[2]
+            if link.usable:
+                chosen = entry
+                break
+            skipped.append(entry)
+
+        if chosen is None:
+            skipped.sort(key=lambda e: (not e[2].up, e[2].suspect, e[0], e[1]))
+            chosen = skipped.pop(0)
+
+        now = chosen[0]
+        chosen[0] = now + 1.0 / max(chosen[2].effective_weight, 1.0)
+        heapq.heappush(heap, chosen)
+        for entry in skipped:
+            entry[0] = max(entry[0], now)
+            heapq.heappush(heap, entry)
+        return chosen[2]
+
+    def fastest(self, count=1):
+        """
+        返回 RTT 最低的 count 条可用链路，供低延迟流量使用；尚无 RTT 测量的链路排在最后
+
+        Args:
+            count: 需要的链路数
+
+        Returns:
+            Link 列表，按 RTT 从低到高
+        """
+        return heapq.nsmallest(count, self.candidates(),
+                               key=lambda l: l.latency if l.latency is not None else float('inf'))
+
+    def record_connect(self, link, elapsed, completed=True, alpha=0.3):
+        """
+        记录一次出站连接的握手耗时，更新链路的 connect_time
+
+        Args:
+            link: 出口 Link
+            elapsed: 从发起连接到完成（或放弃）经过的秒数
+            completed: False 表示连接失败或在竞速中被取消，真实耗时只会比 elapsed 更长，
+                因此只会把估计值调高
+        """
+        current = link.connect_time
+        sample = elapsed if completed or current is None else max(elapsed, current)
+        link.connect_time = sample if current is None else (1 - alpha) * current + alpha * sample
+
+    def pin(self, src, dst, link):
+        """
+        把流改记到实际使用的链路上（未启用流表时不做任何事）
+        """
+        if self.flows is not None:
+            self.flows.put((src, dst), self._positions[link.name])
+
+    def candidates(self):
+        """
+        返回可用于新连接的链路
+        优先选择最近一次探测成功且未接近流量配额的链路，其次是探测成功的链路、尚未判定故障的链路，
+        全部故障时退回全部链路
+        """
+        up = [link for link in self.links if link.up]
+        healthy = [link for link in up if not link.suspect]
+        return [link for link in healthy if not link.capped] or healthy or up or self.links
+
+    def acquire(self, link):
+        """
+        记录一条连接开始使用该链路
+        """
+        link.active += 1
+        link.total += 1
+
+    def release(self, link):
+        """
+        记录一条连接结束
+        """
+        link.active -= 1
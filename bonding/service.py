@@ -0,0 +1,161 @@
+"""
+叠加服务
+在单个事件循环中管理叠加引擎的启停，供守护进程和控制接口使用
+"""
+
+import asyncio
+import logging
+
+from .engine import BondingEngine
+from .metrics import TRACE_SAMPLE
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LISTEN = "127.0.0.1:1080"
+DEFAULT_METRICS_PORT = 9108
+
+
+class ServiceError(Exception):
+    """
+    服务请求无法完成时抛出，消息会原样返回给控制端
+    """
+
+
+def parse_address(text, default_port):
+    """
+    解析 'host:port'、'host' 或 ':port' 形式的地址
+
+    Returns:
+        (host, port)
+    """
+    host, sep, port = text.rpartition(':')
+    if not sep:
+        return text or '127.0.0.1', default_port
+    if not port.isdigit():
+        raise ServiceError(f"无效的地址: {text}")
+    return host.strip('[]') or '127.0.0.1', int(port)
+
+
+def resolve_interfaces(specs):
+    """
+    把接口名称、IP、MAC 或 GUID 解析为接口字典
+    本机不存在但形如 IP 的值按原样作为源地址使用（便于用 127.0.0.x 测试）
+
+    Args:
+        specs: 字符串或接口字典列表
+
+    Returns:
+        接口字典列表
+
+    Raises:
+        ServiceError: 找不到接口或接口没有 IPv4 地址
+    """
+    import ipaddress
+
+    from .discovery import discover
+
+    records = None
+    result = []
+    for spec in specs:
+        if isinstance(spec, dict):
+            result.append(spec)
+            continue
+        if records is None:
+            records = [r.to_dict() for r in discover(include_loopback=True)]
+        key = spec.lower()
+        match = next((r for r in records
+                      if key in (r['name'].lower(), r['ip'], r['mac'].lower(), r['guid'].lower())), None)
+        if match is None:
+            try:
+                ipaddress.ip_address(spec)
+            except ValueError:
+                raise ServiceError(f"找不到网络接口: {spec}") from None
+            match = {'name': spec, 'ip': spec}
+        if not match['ip']:
+            raise ServiceError(f"{match['name']} 未连接，无法添加")
+        result.append(match)
+    return result
+
+
+class BondingService:
+    """
+    叠加服务
+    同一时间最多运行一个叠加引擎，enable 会替换正在运行的引擎
+    """
+    def __init__(self):
+        self.engine = None
+        self._task = None
+        self._stopped = asyncio.Event()
+
+    async def enable(self, interfaces, mode="round_robin", listen=DEFAULT_LISTEN,
+                     probe=None, probe_interval=0.5, relay="auto", workers=1, latency=None, sticky=0,
+                     dns=None, pool=0, race=0.0, metrics=None, trace=None, trace_sample=TRACE_SAMPLE,
+                     offload=False, mptcp=False, limits=None, quotas=None, fair=False):
+        """
+        启动叠加
+
+        Returns:
+            引擎状态字典
+        """
+        interfaces = resolve_interfaces(interfaces)
+        if len(interfaces) < 2:
+            raise ServiceError("请至少选择2个网络接口进行叠加")
+        host, port = parse_address(listen, 1080)
+        metrics = parse_address(metrics, DEFAULT_METRICS_PORT) if metrics else None
+        await self.disable()
+
+        try:
+            engine = BondingEngine(interfaces, mode, host, port, probe=probe, probe_interval=probe_interval,
+                                   relay=relay, workers=workers, latency=latency, sticky=sticky, dns=dns, pool=pool, race=race,
+                                   metrics=metrics, trace=trace, trace_sample=trace_sample, offload=offload,
+                                   mptcp=mptcp, limits=limits, quotas=quotas, fair=fair)
+        except ValueError as e:
+            raise ServiceError(str(e)) from None
+        started = asyncio.Event()
+        task = asyncio.ensure_future(engine.serve(started.set))
+        waiter = asyncio.ensure_future(started.wait())
+        await asyncio.wait([task, waiter], return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if task.done():
+            error = task.exception()
+            raise ServiceError(f"启动叠加代理失败: {error}")
+
+        self.engine = engine
+        self._task = task
+        log.info("叠加已启用: %s, 模式 %s, %s%s", ', '.join(i['name'] for i in interfaces), mode,
+                 "内核路由" if offload else f"监听 {host}:{engine.proxy.port}", ", MPTCP" if mptcp else "")
+        return engine.status()
+
+    async def disable(self):
+        """
+        停止叠加，未启用时什么也不做
+        """
+        if self.engine is None:
+            return
+        self.engine.shutdown()
+        await asyncio.gather(self._task, return_exceptions=True)
+        log.info("叠加已禁用")
+        self.engine = None
+        self._task = None
+
+    def status(self):
+        if self.engine is None:
+            return {'running': False, 'mode': None, 'listen': None, 'links': []}
+        return self.engine.status()
+
+    def set_weight(self, name, weight):
+        if self.engine is None:
+            raise ServiceError("叠加未启用")
+        self.engine.set_weight(name, weight)
+
+    def update_links(self, interfaces):
+        if self.engine is not None:
+            self.engine.update_links(interfaces)
+
+    def request_stop(self):
+        self._stopped.set()
+
+    async def wait_stopped(self):
+        await self._stopped.wait()
+        await self.disable()
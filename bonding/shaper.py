@@ -0,0 +1,361 @@
+"""
+流量整形与流量配额
+按接口限速的两级令牌桶：每条限速链路每个方向一个令牌桶，其下的各条连接轮流取用它的令牌，
+可选按连接公平排队，使一个大下载不会挤占同一链路上的交互连接；
+另按接口统计按日/按月的用量，接近配额的链路不再分配新连接
+
+等待令牌的连接不各自 sleep：唤醒时间按时间片向上取整合并，同一时间点只注册一个定时器，
+到期后一次处理该时间点上所有等待的队列，连接再多定时器数量也只与时间片有关
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import re
+
+from .profiles import UsageStore, interface_id
+from .scheduler import MBIT
+
+
+log = logging.getLogger(__name__)
+
+TICK = 0.01
+BURST_TIME = 0.05
+MIN_BURST = 16 * 1024
+
+PERIODS = ('day', 'month')
+PERIOD_NAMES = {'day': "今日", 'month': "本月"}
+QUOTA_NEAR = 0.95
+QUOTA_INTERVAL = 5.0
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text):
+    """
+    解析流量大小，如 500M、2G、1.5GB、1048576（字节），单位按 1024 进位
+
+    Raises:
+        ValueError: 格式无效
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"无效的流量大小: {text}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_quota(text):
+    """
+    解析流量配额 '大小/周期'，如 2G/day、30G/month
+
+    Returns:
+        (周期, 字节数)
+
+    Raises:
+        ValueError: 格式无效
+    """
+    size, sep, period = text.rpartition('/')
+    if not sep or period.lower() not in PERIODS:
+        raise ValueError(f"无效的流量配额: {text}（应为 大小/day 或 大小/month，如 2G/day）")
+    count = parse_size(size)
+    if count <= 0:
+        raise ValueError(f"流量配额必须大于0: {text}")
+    return period.lower(), count
+
+
+def format_size(count):
+    """
+    把字节数格式化为便于阅读的文本，如 1.5 GB
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TB"
+
+
+class TokenBucket:
+    """
+    令牌桶：以 rate 字节/秒补充令牌，最多积累 burst
+    令牌为正时放行任意大小的数据块并记下欠账（令牌变为负数），后续数据块等欠账还清后再放行，
+    这样数据块大小不受 burst 限制，长期速率仍是 rate
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst=None, now=0.0):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate * BURST_TIME, MIN_BURST))
+        self.tokens = self.burst
+        self.stamp = now
+
+    def refill(self, now):
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def take(self, count, now):
+        """
+        令牌为正时扣除 count 并返回 True，否则返回 False
+        """
+        self.refill(now)
+        if self.tokens <= 0:
+            return False
+        self.tokens -= count
+        return True
+
+    def delay(self):
+        """
+        令牌恢复为正还需要的秒数
+        """
+        return max(0.0, (1.0 - self.tokens) / self.rate)
+
+
+class LinkQueue:
+    """
+    一条链路一个方向的整形队列：令牌桶加上等待令牌的请求
+
+    fair 为假时按请求先后放行；为真时按起始时间公平排队（SFQ）：请求的标签是
+    max(队列虚拟时间, 该连接上一请求的标签) + 字节数，按标签从小到大放行。
+    持续占满链路的大流量标签增长得快，偶尔发送少量数据的交互连接总能排到前面
+    """
+    __slots__ = ('shaper', 'bucket', 'fair', 'waiting', 'vtime', 'scheduled', '_seq')
+
+    def __init__(self, shaper, rate, fair=False):
+        self.shaper = shaper
+        self.bucket = TokenBucket(rate, now=shaper.now())
+        self.fair = fair
+        self.waiting = []
+        self.vtime = 0.0
+        self.scheduled = False
+        self._seq = 0
+
+    def request(self, flow, direction, count):
+        """
+        为一个数据块申请令牌
+
+        Returns:
+            None 表示立即放行，否则为放行时完成的 Future
+        """
+        shaper = self.shaper
+        start = 0.0
+        if self.fair:
+            start = max(self.vtime, flow.finish[direction])
+            flow.finish[direction] = start + count
+        if not self.waiting and self.bucket.take(count, shaper.now()):
+            self.vtime = start
+            shaper.grants += 1
+            return None
+        self._seq += 1
+        future = shaper.loop.create_future()
+        tag = start + count if self.fair else self._seq
+        heapq.heappush(self.waiting, (tag, self._seq, count, start, future))
+        shaper.delayed += 1
+        if not self.scheduled:
+            self.scheduled = True
+            shaper.wake(self, self.bucket.delay())
+        return future
+
+    def dispatch(self, now):
+        """
+        由 Shaper 的定时器调用：令牌为正时按顺序放行等待的请求，仍有等待时再约定下次唤醒
+        """
+        self.scheduled = False
+        bucket = self.bucket
+        bucket.refill(now)
+        waiting = self.waiting
+        while waiting and bucket.tokens > 0:
+            _, _, count, start, future = heapq.heappop(waiting)
+            if future.done():
+                # 连接已关闭，等待被取消，不扣令牌
+                continue
+            bucket.tokens -= count
+            self.vtime = start
+            self.shaper.grants += 1
+            future.set_result(None)
+        if waiting:
+            self.scheduled = True
+            self.shaper.wake(self, bucket.delay())
+
+
+class Flow:
+    """
+    一条连接在整形器中的句柄，由 Shaper.flow() 创建，作为 relay.relay() 的 throttle
+    """
+    __slots__ = ('queues', 'finish')
+
+    def __init__(self, sent, recv):
+        self.queues = {'sent': sent, 'recv': recv}
+        self.finish = {'sent': 0.0, 'recv': 0.0}
+
+    async def consume(self, direction, count):
+        """
+        转发 count 字节前调用，令牌不足时等待
+
+        Args:
+            direction: 'sent' 或 'recv'
+        """
+        waiter = self.queues[direction].request(self, direction, count)
+        if waiter is not None:
+            await waiter
+
+
+class Shaper:
+    """
+    流量整形器
+    每条限速链路每个方向一个 LinkQueue，全部队列共用一组合并的定时器：
+    唤醒时间按 tick 向上取整，同一时间点只注册一次 loop.call_at，到期后依次处理该时间点上的全部队列，
+    每秒最多 1/tick 次唤醒，与连接数无关
+
+    Args:
+        limits: {接口名: 限速 Mbit/s}，上下行各自限速；未列出的接口不整形
+        fair: 为真时同一链路上的连接公平排队（见 LinkQueue），否则先到先得
+        tick: 定时器合并的时间片（秒）
+    """
+    def __init__(self, limits, fair=False, tick=TICK):
+        self.limits = {name: float(rate) for name, rate in limits.items()}
+        self.fair = fair
+        self.tick = tick
+        self.grants = 0
+        self.delayed = 0
+        self.wakeups = 0
+        self.loop = None
+        self._queues = {}
+        self._timers = {}
+
+    def now(self):
+        return self.loop.time()
+
+    def flow(self, link):
+        """
+        为经 link 转发的新连接创建 Flow，必须在事件循环中调用
+
+        Returns:
+            Flow，link 不限速时为 None
+        """
+        queues = self._queues.get(link.name)
+        if queues is None:
+            rate = self.limits.get(link.name)
+            if rate is None:
+                return None
+            if self.loop is None:
+                self.loop = asyncio.get_running_loop()
+            queues = self._queues[link.name] = (LinkQueue(self, rate * MBIT, self.fair),
+                                                LinkQueue(self, rate * MBIT, self.fair))
+        return Flow(*queues)
+
+    def wake(self, queue, delay):
+        """
+        约定在 delay 秒后（向上取整到时间片）调用 queue.dispatch()
+        """
+        slot = math.ceil((self.loop.time() + delay) / self.tick)
+        queues = self._timers.get(slot)
+        if queues is None:
+            queues = self._timers[slot] = []
+            self.loop.call_at(slot * self.tick, self._fire, slot)
+        queues.append(queue)
+
+    def _fire(self, slot):
+        self.wakeups += 1
+        now = self.loop.time()
+        for queue in self._timers.pop(slot):
+            queue.dispatch(now)
+
+    def stats(self):
+        """
+        返回 {'grants': 放行的数据块数, 'delayed': 其中需要等待的, 'wakeups': 定时器唤醒次数,
+        'waiting': 正在等待的请求数}
+        """
+        return {
+            'grants': self.grants,
+            'delayed': self.delayed,
+            'wakeups': self.wakeups,
+            'waiting': sum(len(queue.waiting) for queues in self._queues.values() for queue in queues),
+        }
+
+
+class QuotaTracker:
+    """
+    按日/按月的接口流量配额
+    在主进程中周期性采样各链路的流量计数（多进程模式下为各工作进程之和，内核路由模式下为接口计数器），
+    把增量计入 UsageStore；用量达到配额的 QUOTA_NEAR 时把链路标记为 capped，调度器不再为新连接选择它。
+    已有连接不受影响，全部链路都接近配额时照常使用；跨日或跨月用量归零后标记自动取消
+
+    Args:
+        links: Link 列表
+        interfaces: 与 links 顺序一致的接口字典列表，用量按接口稳定标识保存
+        quotas: {接口名: {'day': 字节, 'month': 字节}}，可以只给一个周期
+        on_change: 有链路的 capped 变化时调用 on_change()
+        store: UsageStore，默认保存在配置目录
+        interval: 采样间隔（秒）
+    """
+    def __init__(self, links, interfaces, quotas, on_change=None, store=None, interval=QUOTA_INTERVAL):
+        self.links = [link for link in links if link.name in quotas]
+        self.keys = {link.name: interface_id(i) for link, i in zip(links, interfaces)}
+        self.quotas = {name: dict(limits) for name, limits in quotas.items()}
+        self.on_change = on_change
+        self.store = store if store is not None else UsageStore()
+        self.interval = interval
+        self._last = {}
+        self._task = None
+
+    def start(self):
+        for link in self.links:
+            self._last[link.name] = link.bytes_sent + link.bytes_recv
+        self.sample()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self.sample()
+
+    def sample(self, now=None):
+        """
+        把各链路自上次采样以来的流量计入用量，并按配额更新 capped
+        """
+        added = False
+        changed = False
+        for link in self.links:
+            total = link.bytes_sent + link.bytes_recv
+            last = self._last.get(link.name, 0)
+            delta = total - last if total >= last else total
+            self._last[link.name] = total
+            added = added or delta > 0
+            usage = self.store.add(self.keys[link.name], delta, now)
+            full = [period for period, limit in self.quotas[link.name].items()
+                    if usage[f'{period}_bytes'] >= limit * QUOTA_NEAR]
+            if bool(full) != link.capped:
+                link.capped = bool(full)
+                changed = True
+                if full:
+                    period = full[0]
+                    log.warning("%s %s流量已用 %s / %s，新连接不再使用该接口", link.name, PERIOD_NAMES[period],
+                                format_size(usage[f'{period}_bytes']), format_size(self.quotas[link.name][period]))
+                else:
+                    log.info("%s 流量配额已重置，恢复分配新连接", link.name)
+        if added:
+            try:
+                self.store.save()
+            except OSError as e:
+                log.warning("保存流量用量失败: %s", e)
+        if changed and self.on_change is not None:
+            self.on_change()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sample()
+
+    def status(self):
+        """
+        返回 {接口名: {周期: {'used': 已用字节, 'limit': 配额字节}}}
+        """
+        result = {}
+        for link in self.links:
+            usage = self.store.get(self.keys[link.name])
+            result[link.name] = {period: {'used': usage[f'{period}_bytes'], 'limit': limit}
+                                 for period, limit in self.quotas[link.name].items()}
+        return result
@@ -0,0 +1,154 @@
+"""
+实时统计采样
+在后台线程中周期性采样各叠加接口的计数器，写入固定大小的环形缓冲区，供界面批量读取
+"""
+
+import array
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    定长浮点环形缓冲区
+    单写多读，写入不分配内存；读取方拿到的是按时间顺序排列的副本
+    """
+    __slots__ = ('_data', '_index', '_count')
+
+    def __init__(self, capacity):
+        self._data = array.array('d', bytes(8 * capacity))
+        self._index = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def append(self, value):
+        self._data[self._index] = value
+        self._index = (self._index + 1) % len(self._data)
+        if self._count < len(self._data):
+            self._count += 1
+
+    def last(self, default=0.0):
+        if not self._count:
+            return default
+        return self._data[self._index - 1]
+
+    def values(self):
+        """
+        返回从旧到新的数据列表
+        """
+        data = self._data
+        if self._count < len(data):
+            return data[:self._count].tolist()
+        return (data[self._index:] + data[:self._index]).tolist()
+
+
+def read_proc_net_dev(path='/proc/net/dev'):
+    """
+    读取 Linux 接口计数器
+
+    Returns:
+        {接口名: (接收字节, 接收包数, 发送字节, 发送包数)}，不可用时为空字典
+    """
+    counters = {}
+    try:
+        with open(path) as f:
+            lines = f.readlines()[2:]
+    except OSError:
+        return counters
+    for line in lines:
+        name, _, rest = line.partition(':')
+        fields = rest.split()
+        if len(fields) >= 10:
+            counters[name.strip()] = (int(fields[0]), int(fields[1]), int(fields[8]), int(fields[9]))
+    return counters
+
+
+SERIES = ('rx_bps', 'tx_bps', 'pps', 'flows', 'rtt', 'loss')
+
+
+class LinkSeries:
+    """
+    单条链路的历史序列
+    """
+    __slots__ = ('name',) + SERIES
+
+    def __init__(self, name, history):
+        self.name = name
+        for series in SERIES:
+            setattr(self, series, RingBuffer(history))
+
+
+class StatsSampler:
+    """
+    统计采样器
+    优先使用系统接口计数器（Linux 的 /proc/net/dev，包含包数），
+    否则退回叠加引擎自身的字节计数；活动连接数、RTT和丢包率来自引擎
+
+    Args:
+        source: 无参可调用对象，返回链路快照字典列表（Link.snapshot() 的格式），
+                可以读取本进程内的引擎，也可以通过控制接口查询守护进程
+        names: 要采样的链路名称列表
+    """
+    def __init__(self, source, names, interval=0.5, history=120, counters=read_proc_net_dev):
+        self.source = source
+        self.interval = interval
+        self.counters = counters
+        self.series = {name: LinkSeries(name, history) for name in names}
+        self.version = 0
+        self._last = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def sample(self, now=None):
+        now = time.monotonic() if now is None else now
+        system = self.counters() if self.counters is not None else {}
+        for link in self.source():
+            name = link['name']
+            series = self.series.get(name)
+            if series is None:
+                continue
+            if name in system:
+                rx_bytes, rx_packets, tx_bytes, tx_packets = system[name]
+            else:
+                rx_bytes, rx_packets, tx_bytes, tx_packets = link['bytes_recv'], 0, link['bytes_sent'], 0
+            previous = self._last.get(name)
+            self._last[name] = (now, rx_bytes, rx_packets, tx_bytes, tx_packets)
+            if previous is None or now <= previous[0]:
+                continue
+            elapsed = now - previous[0]
+            series.rx_bps.append((rx_bytes - previous[1]) / elapsed)
+            series.tx_bps.append((tx_bytes - previous[3]) / elapsed)
+            series.pps.append((rx_packets - previous[2] + tx_packets - previous[4]) / elapsed)
+            series.flows.append(link['active'])
+            series.rtt.append(link['rtt'] * 1000 if link['rtt'] is not None else 0.0)
+            series.loss.append(link['loss'])
+        self.version += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception:
+                log.exception("采样接口统计失败")
+            self._stop.wait(self.interval)
@@ -0,0 +1,925 @@
+"""
+UDP 隧道逐包叠加
+连接级的负载均衡只能让一条连接走一个接口；隧道模式把同一个流的每个数据包编号后
+轮流从各接口的 UDP 套接字发往对端，对端按序号在有界、限时的重排缓冲区中恢复顺序，
+单个流因此可以超过单条链路的带宽
+
+典型用法是在隧道里承载 WireGuard/OpenVPN 等 UDP 协议：本地程序把数据报发到 TunnelClient
+的本地端口，TunnelPeer 部署在远端服务器上，把重排后的数据报转发给真正的目标并把回包原路送回。
+丢包不做重传，由隧道内的协议（例如内层 TCP）负责；对无线等高丢包链路可开启 XOR 校验前向纠错，
+每组数据包附带一个校验包，组内丢失一个包时接收端直接恢复，组大小按对端报告的各路径丢包率自动调整。
+两端定期在每条路径上发测速请求测量往返时间；按分类规则识别出的交互式流量（见 classify）走 RTT 最低的路径，
+或在两条最快的路径上以同一序号重复发送，接收端按序号去重
+
+报文格式（网络字节序）:
+    2s  魔数 b'NB'
+    B   类型：0 数据，1 保活/测速请求，2 校验，3 丢包报告，4 测速应答，5 会话质询，6 质询应答
+    B   路径编号（客户端链路序号）
+    I   会话号，客户端每次启动随机生成，对端据此区分客户端
+    I   发送方纪元，每端每次启动随机生成；客户端发现对端纪元变化（对端重启）时重置接收状态
+    Q   数据序号，每个方向独立从 0 开始；校验包为组内第一个数据包的序号
+    I   路径序号，每条路径上发出的每个报文递增，用于测量各路径丢包率
+
+校验包在报头后跟 !HH（组内包数、各包长度的异或）和各包补零后的异或；
+丢包报告为 1 字节条数后跟若干 !BH（路径编号、丢包率万分比）；
+测速请求带 8 字节发送时刻，对端从同一路径原样回送
+
+对端正在服务一个会话时，新会话号必须先完成一次往返验证才能接管：对端对新会话的测速请求回送
+8 字节质询（由对端密钥、会话号和来源地址算出），客户端从同一路径原样发回质询应答后对端才重置状态，
+伪造源地址的报文收不到质询，无法打断正在使用的隧道；对端空闲（没有存活路径）时直接接受新会话
+"""
+
+import asyncio
+import collections
+import hashlib
+import heapq
+import hmac
+import logging
+import math
+import os
+import socket
+import struct
+import sys
+import time
+
+from .classify import BULK, DUPLICATE
+from .datagram import BATCH, HAS_MMSG, io_stats, open_endpoint
+from .proxy import link_family
+from .scheduler import Scheduler
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'NB'
+HEADER = struct.Struct('!2sBBIIQI')
+PARITY = struct.Struct('!HH')
+REPORT_ENTRY = struct.Struct('!BH')
+PING = struct.Struct('!d')
+TYPE_DATA = 0
+TYPE_PING = 1
+TYPE_PARITY = 2
+TYPE_REPORT = 3
+TYPE_PONG = 4
+TYPE_CHALLENGE = 5
+TYPE_RESPONSE = 6
+COOKIE_SIZE = 8
+
+DEFAULT_PORT = 1082
+
+REORDER_WINDOW = 512
+REORDER_DELAY = 0.05
+REPORT_INTERVAL = 1.0
+PATH_TIMEOUT = 5.0
+SOCKET_BUFFER = 4 * 1024 * 1024
+RTT_ALPHA = 0.25
+
+FEC_TARGET = 0.01
+FEC_MIN_LOSS = 0.001
+FEC_MAX_GROUP = 32
+FEC_FLUSH = 0.01
+FEC_CACHE = 4096
+FEC_PENDING = 64
+
+
+class ReorderBuffer:
+    """
+    有界、限时的重排缓冲区
+    按序号顺序调用 deliver(packet)；等待某个缺口的时间超过 delay，或缓存的乱序包超过 window 个时，
+    放弃缺口继续交付，缺口中的包计为丢失，之后才到的计为迟到丢弃
+
+    Args:
+        deliver: 按序交付回调 deliver(packet)
+        window: 最多缓存的乱序包数
+        delay: 等待缺口的最长时间（秒）
+    """
+    def __init__(self, deliver, window=REORDER_WINDOW, delay=REORDER_DELAY):
+        self.deliver = deliver
+        self.window = window
+        self.delay = delay
+        self.reset()
+
+    def reset(self):
+        """
+        清空缓冲区和统计，从序号 0 重新开始
+        """
+        self.next_seq = 0
+        self._pending = {}
+        self._heap = []
+        self.delivered = 0
+        self.reordered = 0
+        self.max_depth = 0
+        self.late = 0
+        self.duplicates = 0
+        self.lost = 0
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def push(self, seq, packet, now):
+        """
+        收到一个数据包
+        """
+        if seq < self.next_seq:
+            self.late += 1
+            return
+        if seq in self._pending:
+            self.duplicates += 1
+            return
+        if seq == self.next_seq:
+            self._deliver(packet)
+            self._flush()
+            return
+        self._pending[seq] = (packet, now)
+        heapq.heappush(self._heap, seq)
+        self.reordered += 1
+        self.max_depth = max(self.max_depth, len(self._pending))
+        if len(self._pending) > self.window:
+            self._skip()
+
+    def expire(self, now):
+        """
+        放弃等待超时的缺口
+
+        Returns:
+            下一次需要调用 expire 的时间，没有缓存的包时返回 None
+        """
+        while self._heap:
+            _, arrived = self._pending[self._heap[0]]
+            if now - arrived < self.delay:
+                return arrived + self.delay
+            self._skip()
+        return None
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'delivered': self.delivered,
+            'reordered': self.reordered,
+            'late': self.late,
+            'duplicates': self.duplicates,
+            'lost': self.lost,
+        }
+
+    def _deliver(self, packet):
+        self.next_seq += 1
+        self.delivered += 1
+        self.deliver(packet)
+
+    def _flush(self):
+        while self.next_seq in self._pending:
+            packet, _ = self._pending.pop(self.next_seq)
+            self._deliver(packet)
+        while self._heap and self._heap[0] < self.next_seq:
+            heapq.heappop(self._heap)
+
+    def _skip(self):
+        first = self._heap[0]
+        self.lost += first - self.next_seq
+        self.next_seq = first
+        self._flush()
+
+
+def fec_group(loss, target=FEC_TARGET):
+    """
+    根据丢包率选择 XOR 校验组大小（每组数据包数）
+    一组 n = k + 1 个包中丢 2 个以上就无法恢复，概率约为 n²p²/2，取使其不超过 target 的最大 k
+
+    Args:
+        loss: 丢包率 (0~1)
+        target: 可接受的整组无法恢复概率
+
+    Returns:
+        组大小，0 表示不需要校验；1 相当于每个包发两份
+    """
+    if loss < FEC_MIN_LOSS:
+        return 0
+    n = int(math.sqrt(2 * target) / loss)
+    return max(1, min(FEC_MAX_GROUP, n - 1))
+
+
+def xor_payloads(payloads):
+    """
+    对一组长度不一的数据做 XOR，短的在末尾补零
+    整包转成大整数后一次异或，由解释器内部按机器字批量完成，不逐字节循环
+
+    Returns:
+        (异或结果, 各长度的异或值)
+    """
+    acc = 0
+    lengths = 0
+    size = 0
+    for payload in payloads:
+        acc ^= int.from_bytes(payload, 'little')
+        lengths ^= len(payload)
+        size = max(size, len(payload))
+    return acc.to_bytes(size, 'little'), lengths
+
+
+class FecEncoder:
+    """
+    XOR 校验编码器
+    连续 group 个数据包为一组，组满（或 flush）时生成一个校验包，可恢复组内任意一个丢失的包
+
+    Args:
+        group: 组大小，0 表示关闭
+    """
+    def __init__(self, group=0):
+        self.group = group
+        self._reset()
+
+    def _reset(self):
+        self.base = None
+        self.count = 0
+        self._acc = 0
+        self._lengths = 0
+        self._size = 0
+
+    def add(self, seq, payload):
+        """
+        加入一个已发送的数据包
+
+        Returns:
+            组满时返回 (起始序号, 校验包内容)，否则返回 None
+        """
+        if not self.group:
+            return None
+        if self.base is None:
+            self.base = seq
+        self._acc ^= int.from_bytes(payload, 'little')
+        self._lengths ^= len(payload)
+        self._size = max(self._size, len(payload))
+        self.count += 1
+        if self.count >= self.group:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        为未满的组立即生成校验包（流量停顿时避免组内最后几个包得不到保护）
+        """
+        if not self.count:
+            return None
+        result = self.base, PARITY.pack(self.count, self._lengths) + self._acc.to_bytes(self._size, 'little')
+        self._reset()
+        return result
+
+
+class _PathStats:
+    """
+    单条路径的丢包统计，依据每条路径独立的序号计算
+    """
+    __slots__ = ('highest', 'received', 'last_highest', 'last_received', 'loss')
+
+    def __init__(self, path_seq):
+        self.highest = path_seq
+        self.received = 0
+        self.last_highest = path_seq - 1
+        self.last_received = 0
+        self.loss = None
+
+    def update(self, alpha=0.3):
+        expected = self.highest - self.last_highest
+        if expected > 0:
+            sample = max(0.0, 1.0 - (self.received - self.last_received) / expected)
+            self.loss = sample if self.loss is None else (1 - alpha) * self.loss + alpha * sample
+        self.last_highest = self.highest
+        self.last_received = self.received
+        return self.loss or 0.0
+
+
+class _Receiver:
+    """
+    隧道接收端公共部分：重排、XOR 校验恢复、每条路径的丢包统计，以及重排过期定时器
+    """
+    def __init__(self, deliver, window, delay):
+        self.reorder = ReorderBuffer(deliver, window, delay)
+        self.received = 0
+        self.recovered = 0
+        self.paths = {}
+        self._cache = {}
+        self._order = collections.deque()
+        self._parities = []
+        self._timer = None
+
+    def reset(self):
+        self.reorder.reset()
+        self.received = 0
+        self.recovered = 0
+        self.paths.clear()
+        self._cache.clear()
+        self._order.clear()
+        self._parities.clear()
+
+    def observe(self, path, path_seq):
+        stats = self.paths.get(path)
+        if stats is None:
+            stats = self.paths[path] = _PathStats(path_seq)
+        stats.highest = max(stats.highest, path_seq)
+        stats.received += 1
+
+    def path_loss(self):
+        """
+        结算本周期各路径的丢包率（平滑后）
+
+        Returns:
+            {路径编号: 丢包率}
+        """
+        return {path: stats.update() for path, stats in self.paths.items()}
+
+    def data(self, seq, payload):
+        self.received += 1
+        if seq in self._cache:
+            self.reorder.duplicates += 1
+            return
+        self._remember(seq, payload)
+        self._push(seq, payload)
+        for parity in list(self._parities):
+            if parity[0] <= seq < parity[0] + parity[1]:
+                self._try_recover(parity)
+
+    def parity(self, base, payload):
+        if len(payload) < PARITY.size:
+            return
+        count, lengths = PARITY.unpack_from(payload)
+        parity = (base, count, lengths, payload[PARITY.size:])
+        if not self._try_recover(parity):
+            self._parities.append(parity)
+            del self._parities[:-FEC_PENDING]
+
+    def _try_recover(self, parity):
+        """
+        组内恰好缺一个包时恢复它；整组已无法或无需恢复时丢弃该校验包
+
+        Returns:
+            该校验包是否已处理完毕
+        """
+        base, count, lengths, data = parity
+        if base + count <= self.reorder.next_seq:
+            self._discard(parity)
+            return True
+        missing = [seq for seq in range(base, base + count) if seq not in self._cache]
+        if len(missing) > 1:
+            return False
+        self._discard(parity)
+        if not missing or missing[0] < self.reorder.next_seq:
+            return True
+        payload, length = xor_payloads([data] + [self._cache[seq] for seq in range(base, base + count)
+                                                 if seq != missing[0]])
+        payload = payload[:length ^ len(data) ^ lengths]
+        self.recovered += 1
+        self._remember(missing[0], payload)
+        self._push(missing[0], payload)
+        return True
+
+    def _discard(self, parity):
+        try:
+            self._parities.remove(parity)
+        except ValueError:
+            pass
+
+    def _remember(self, seq, payload):
+        self._cache[seq] = payload
+        self._order.append(seq)
+        if len(self._order) > FEC_CACHE:
+            self._cache.pop(self._order.popleft(), None)
+
+    def _push(self, seq, payload):
+        loop = asyncio.get_running_loop()
+        self.reorder.push(seq, payload, loop.time())
+        if self.reorder.depth and self._timer is None:
+            self._schedule(loop, loop.time() + self.reorder.delay)
+
+    def _schedule(self, loop, when):
+        self._timer = loop.call_at(when, self._expire)
+
+    def _expire(self):
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        when = self.reorder.expire(loop.time())
+        if when is not None:
+            self._schedule(loop, when)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+HAS_RECVTOS = hasattr(socket.socket, 'recvmsg') and hasattr(socket, 'IP_RECVTOS')
+
+
+class _TosSocket:
+    """
+    能读出每个数据报 DSCP 的 UDP 套接字
+    asyncio 的数据报传输拿不到 IP 头，这里直接在事件循环上注册读回调，用 recvmsg 取 IP_TOS/IPV6_TCLASS 辅助数据；
+    只实现隧道本地一侧用到的 sendto、close 和 get_extra_info。
+    Linux 上批量收发的 datagram.BatchSocket 本身就能读出 DSCP，这里只在没有 recvmmsg 的平台或 batch 为 0 时使用
+    """
+    def __init__(self, loop, sock, on_datagram):
+        self._loop = loop
+        self._sock = sock
+        self._on_datagram = on_datagram
+        self._ancillary = socket.CMSG_SPACE(4)
+        loop.add_reader(sock.fileno(), self._read)
+
+    @classmethod
+    async def open(cls, on_datagram, local_addr=None, remote_addr=None):
+        loop = asyncio.get_running_loop()
+        host, port = (local_addr or remote_addr)[:2]
+        family, _, _, _, address = (await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM))[0]
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            if family == socket.AF_INET6:
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_RECVTCLASS, 1)
+            else:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_RECVTOS, 1)
+            for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER)
+            if local_addr:
+                sock.bind(address)
+            else:
+                sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return cls(loop, sock, on_datagram)
+
+    def get_extra_info(self, name, default=None):
+        if name == 'sockname':
+            return self._sock.getsockname()
+        if name == 'socket':
+            return self._sock
+        return default
+
+    def _read(self):
+        # 每次唤醒最多读一批，避免突发流量长时间占住事件循环
+        for _ in range(64):
+            try:
+                data, ancillary, _, addr = self._sock.recvmsg(65535, self._ancillary)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.debug("隧道套接字错误: %s", e)
+                return
+            tos = 0
+            for level, _, value in ancillary:
+                if value:
+                    tos = value[0] if level == socket.IPPROTO_IP else int.from_bytes(value[:4], sys.byteorder)
+            self._on_datagram(data, addr, tos >> 2)
+
+    def sendto(self, data, addr=None):
+        try:
+            if addr is None:
+                self._sock.send(data)
+            else:
+                self._sock.sendto(data, addr)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            log.debug("隧道套接字错误: %s", e)
+
+    def close(self):
+        if self._sock.fileno() >= 0:
+            self._loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+
+
+class _Endpoint:
+    """
+    隧道两端的公共部分：编号发送、XOR 校验、丢包报告、往返时间测量与接收处理
+    子类提供 _select_path()、_next_path(path)、_report_path()、_ping_paths() 和 _sendto(path, datagram)
+
+    Args:
+        fec: 'auto' 按对端报告的各路径丢包率自动选择校验组大小，'off' 关闭，整数为固定组大小
+        classifier: 低延迟流量分类器（classify.Classifier），None 时所有数据包都按调度模式分摊
+        batch: 每次系统调用最多收发的数据报数（Linux 上用 recvmmsg/sendmmsg，见 datagram），0 表示逐个收发
+    """
+    def __init__(self, window, delay, fec, classifier=None, batch=BATCH):
+        if fec not in ('auto', 'off') and not (isinstance(fec, int) and fec >= 0):
+            raise ValueError(f"无效的 FEC 设置: {fec}")
+        if batch < 0:
+            raise ValueError(f"无效的批量大小: {batch}")
+        self.fec = fec
+        self.classifier = classifier
+        self.batch = batch
+        self.session = None
+        self.epoch = int.from_bytes(os.urandom(4), 'big')
+        self.sent = 0
+        self.duplicated = 0
+        self.parity_sent = 0
+        self.encoder = FecEncoder(fec if isinstance(fec, int) else 0)
+        self.remote_loss = {}
+        self.path_rtt = {}
+        self._seq = 0
+        self._path_seq = {}
+        self._path_sent = {}
+        self._last_path = None
+        self._receiver = _Receiver(self._deliver, window, delay)
+        self._flush_timer = None
+        self._periodic = None
+
+    def _start_periodic(self):
+        self._periodic = asyncio.ensure_future(self._run_periodic())
+
+    async def _stop_periodic(self):
+        if self._periodic is not None:
+            self._periodic.cancel()
+            await asyncio.gather(self._periodic, return_exceptions=True)
+            self._periodic = None
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        self._receiver.close()
+
+    def _reset_session(self, session):
+        self.session = session
+        self._seq = 0
+        self._path_seq.clear()
+        self._path_sent.clear()
+        self._last_path = None
+        self.remote_loss.clear()
+        self.path_rtt.clear()
+        self.encoder = FecEncoder(self.fec if isinstance(self.fec, int) else 0)
+        self._receiver.reset()
+
+    def _transmit(self, path, kind, seq, payload=b''):
+        path_seq = self._path_seq.get(path, 0)
+        self._path_seq[path] = path_seq + 1
+        self._sendto(path, HEADER.pack(MAGIC, kind, path, self.session, self.epoch, seq, path_seq) + payload)
+
+    async def _open(self, on_datagram, tos=False, **addrs):
+        # 突发的小包很容易填满默认的接收缓冲区，隧道套接字统一放大收发缓冲
+        return await open_endpoint(on_datagram, batch=self.batch, buffer=SOCKET_BUFFER, tos=tos, **addrs)
+
+    async def _open_local(self, on_datagram, **addrs):
+        # 只有启用了分类才需要逐个数据报的 DSCP；不支持 recvmsg 的平台（Windows）只按端口分类
+        if self.classifier is not None and not (HAS_MMSG and self.batch) and HAS_RECVTOS:
+            return await _TosSocket.open(on_datagram, **addrs)
+        return await self._open(on_datagram, tos=self.classifier is not None, **addrs)
+
+    def _fastest(self, count):
+        # 还没有测到 RTT 的路径排在最后
+        return heapq.nsmallest(count, self._ping_paths(), key=lambda path: self.path_rtt.get(path, math.inf))
+
+    def send_data(self, payload, port=0, dscp=0):
+        """
+        编号后发出一个数据包，必要时紧跟一个校验包
+        普通流量从调度器选出的下一条路径发出；分类为低延迟的流量走 RTT 最低的路径，
+        DUPLICATE 以同一序号在两条最快的路径上各发一份
+
+        Args:
+            port, dscp: 交给分类器的端口和 DSCP
+        """
+        action = self.classifier.classify(port, dscp) if self.classifier is not None else BULK
+        if action == BULK:
+            path = self._select_path()
+            paths = () if path is None else (path,)
+        else:
+            paths = self._fastest(2 if action == DUPLICATE else 1)
+        if not paths:
+            return
+        seq = self._seq
+        self._seq += 1
+        for path in paths:
+            self._transmit(path, TYPE_DATA, seq, payload)
+            self._path_sent[path] = self._path_sent.get(path, 0) + 1
+            self._on_sent(path, len(payload))
+        path = self._last_path = paths[0]
+        self.sent += 1
+        self.duplicated += len(paths) - 1
+
+        parity = self.encoder.add(seq, payload)
+        if parity is not None:
+            self._send_parity(parity, path)
+        elif self.encoder.count == 1:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = asyncio.get_running_loop().call_later(FEC_FLUSH, self._flush_parity, seq)
+
+    def _send_parity(self, parity, after=None):
+        # 校验包不占用数据包的轮换位置，走最后一个数据包之后的下一条路径，避免和组内数据同路丢失
+        path = self._next_path(after) if after is not None else self._select_path()
+        if path is not None:
+            self._transmit(path, TYPE_PARITY, *parity)
+            self.parity_sent += 1
+
+    def _flush_parity(self, base):
+        self._flush_timer = None
+        if self.encoder.base == base:
+            self._send_parity(self.encoder.flush(), self._last_path)
+
+    def _tune_fec(self):
+        """
+        收到对端的丢包报告后调用：按各路径的发送份额加权报告的丢包率，得到整体丢包率并调整校验组大小
+        """
+        if self.fec != 'auto':
+            return
+        total = sum(self._path_sent.get(path, 0) for path in self.remote_loss)
+        if total:
+            loss = sum(loss * self._path_sent.get(path, 0) for path, loss in self.remote_loss.items()) / total
+        else:
+            loss = max(self.remote_loss.values(), default=0.0)
+        self._path_sent.clear()
+        group = fec_group(loss)
+        if group != self.encoder.group:
+            parity = self.encoder.flush()
+            if parity is not None:
+                self._send_parity(parity, self._last_path)
+            self.encoder.group = group
+
+    def _send_report(self):
+        losses = self._receiver.path_loss()
+        path = self._report_path()
+        if not losses or path is None:
+            return
+        payload = bytes([len(losses)]) + b''.join(REPORT_ENTRY.pack(p, min(int(l * 10000), 10000))
+                                                  for p, l in losses.items())
+        self._transmit(path, TYPE_REPORT, 0, payload)
+
+    def _on_datagram(self, data, addr):
+        if len(data) < HEADER.size:
+            return
+        magic, kind, path, session, epoch, seq, path_seq = HEADER.unpack_from(data)
+        payload = data[HEADER.size:]
+        if magic != MAGIC or not self._accept(kind, session, epoch, path, addr, payload):
+            return
+        self._receiver.observe(path, path_seq)
+        if kind == TYPE_DATA:
+            self._receiver.data(seq, payload)
+            self._on_received(path, len(payload))
+        elif kind == TYPE_PARITY:
+            self._receiver.parity(seq, payload)
+        elif kind == TYPE_REPORT and payload:
+            for i in range(min(payload[0], (len(payload) - 1) // REPORT_ENTRY.size)):
+                reported, loss = REPORT_ENTRY.unpack_from(payload, 1 + i * REPORT_ENTRY.size)
+                self.remote_loss[reported] = loss / 10000
+                self._on_loss(reported, loss / 10000)
+            self._tune_fec()
+        elif kind == TYPE_PING and len(payload) >= PING.size:
+            self._transmit(path, TYPE_PONG, 0, payload[:PING.size])
+        elif kind == TYPE_PONG and len(payload) >= PING.size:
+            sample = asyncio.get_running_loop().time() - PING.unpack_from(payload)[0]
+            rtt = self.path_rtt.get(path)
+            rtt = sample if rtt is None else (1 - RTT_ALPHA) * rtt + RTT_ALPHA * sample
+            self.path_rtt[path] = rtt
+            self._on_rtt(path, rtt)
+        elif kind == TYPE_CHALLENGE and len(payload) >= COOKIE_SIZE:
+            self._transmit(path, TYPE_RESPONSE, 0, payload[:COOKIE_SIZE])
+
+    def _ping(self):
+        # 测速请求同时充当保活：让对端学到每条链路的地址并维持 NAT 映射，也是空闲时测量丢包的样本
+        payload = PING.pack(asyncio.get_running_loop().time())
+        for path in self._ping_paths():
+            self._transmit(path, TYPE_PING, 0, payload)
+
+    async def _run_periodic(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            self._ping()
+            self._send_report()
+
+    def stats(self):
+        """
+        返回隧道统计：发送/接收包数、校验开销、恢复数、接收方向的重排统计，
+        以及批量收发的系统调用统计 'io'（见 datagram.BatchSocket.stats，逐个收发时为 None）
+        """
+        return {
+            'session': self.session,
+            'sent': self.sent,
+            'duplicated': self.duplicated,
+            'received': self._receiver.received,
+            'fec_group': self.encoder.group,
+            'parity_sent': self.parity_sent,
+            'recovered': self._receiver.recovered,
+            'path_loss': {path: stats.loss or 0.0 for path, stats in self._receiver.paths.items()},
+            'path_rtt': dict(self.path_rtt),
+            'reorder': self._receiver.reorder.stats(),
+            'io': io_stats(self._transports()),
+        }
+
+    def _on_sent(self, path, size):
+        pass
+
+    def _on_received(self, path, size):
+        pass
+
+    def _on_loss(self, path, loss):
+        pass
+
+    def _on_rtt(self, path, rtt):
+        pass
+
+
+class TunnelClient(_Endpoint):
+    """
+    隧道客户端
+    本地程序发到 listen 的数据报被编号后按调度模式分摊到各链路发往对端，对端回包重排后发回给最近的本地发送方。
+    对端报告的各链路丢包率写入 Link.loss，测得的往返时间写入 Link.rtt
+
+    Args:
+        links: 参与叠加的 Link 列表
+        peer: 对端地址 (host, port)
+        listen: 本地数据报入口地址，端口为 0 时由系统分配并回写
+        mode: 逐包分摊所用的调度模式，round_robin 或 weighted
+        window, delay: 重排缓冲区参数
+        fec: 前向纠错设置，见 _Endpoint
+        classifier: 低延迟流量分类器，按本地程序的源端口和数据报的 DSCP 分类
+        batch: 批量收发设置，见 _Endpoint
+    """
+    def __init__(self, links, peer, listen=("127.0.0.1", 0), mode="round_robin",
+                 window=REORDER_WINDOW, delay=REORDER_DELAY, fec='auto', classifier=None, batch=BATCH):
+        super().__init__(window, delay, fec, classifier, batch)
+        self.links = list(links)
+        self.peer = peer
+        self.listen = listen
+        self.scheduler = Scheduler(self.links, mode)
+        self.session = int.from_bytes(os.urandom(4), 'big')
+        self.peer_epoch = None
+        self._app = None
+        self._local = None
+        self._paths = {}
+        self._index = {link.name: i for i, link in enumerate(self.links)}
+        self._report_rr = 0
+
+    async def start(self):
+        self._local = await self._open_local(self._from_app, local_addr=self.listen)
+        self.listen = self._local.get_extra_info('sockname')[:2]
+        for index, link in enumerate(self.links):
+            self._paths[index] = await self._open(self._on_datagram, local_addr=(link.ip, 0), remote_addr=self.peer,
+                                                  family=link_family(link.ip))
+        self._ping()
+        self._start_periodic()
+        log.info("隧道客户端已监听 %s:%d，对端 %s:%d", self.listen[0], self.listen[1], *self.peer)
+
+    async def stop(self):
+        await self._stop_periodic()
+        for transport in self._paths.values():
+            transport.close()
+        self._paths.clear()
+        if self._local is not None:
+            self._local.close()
+            self._local = None
+
+    def stats(self):
+        stats = super().stats()
+        stats['links'] = [link.snapshot() for link in self.links]
+        return stats
+
+    def _transports(self):
+        return [self._local, *self._paths.values()]
+
+    def _from_app(self, data, addr, dscp=0):
+        self._app = addr
+        self.send_data(data, addr[1], dscp)
+
+    def _deliver(self, packet):
+        if self._app is not None and self._local is not None:
+            self._local.sendto(packet, self._app)
+
+    def _accept(self, kind, session, epoch, path, addr, payload):
+        if session != self.session or path >= len(self.links):
+            return False
+        if epoch != self.peer_epoch:
+            # 对端重启后从序号 0 重新编号，旧的重排位置和校验缓存会把它的包全部当成迟到或重复
+            if self.peer_epoch is not None:
+                log.info("隧道对端已重启，重置接收状态")
+                self._receiver.reset()
+                self.remote_loss.clear()
+            self.peer_epoch = epoch
+        return True
+
+    def _select_path(self):
+        return self._index[self.scheduler.select().name] if self._paths else None
+
+    def _next_path(self, path):
+        return (path + 1) % len(self._paths) if self._paths else None
+
+    def _report_path(self):
+        if not self._paths:
+            return None
+        self._report_rr += 1
+        return self._report_rr % len(self._paths)
+
+    def _ping_paths(self):
+        return list(self._paths)
+
+    def _sendto(self, path, datagram):
+        self._paths[path].sendto(datagram)
+
+    def _on_sent(self, path, size):
+        self.links[path].bytes_sent += size
+
+    def _on_received(self, path, size):
+        self.links[path].bytes_recv += size
+
+    def _on_loss(self, path, loss):
+        if path < len(self.links):
+            self.links[path].loss = loss
+
+    def _on_rtt(self, path, rtt):
+        if path < len(self.links):
+            self.links[path].rtt = rtt
+
+
+class TunnelPeer(_Endpoint):
+    """
+    隧道对端
+    重排客户端发来的数据包后转发给 target，target 的回包编号后轮流从客户端各链路的地址发回；
+    客户端链路地址从收到的报文中学习（因此可穿过 NAT），超过 PATH_TIMEOUT 未收到的路径不再使用。
+    同一时间只服务一个客户端会话；空闲时直接接受新会话号，正在服务时新会话须先通过质询（见模块说明）才重置全部状态
+
+    Args:
+        listen: 隧道监听地址 (host, port)，端口为 0 时由系统分配并回写
+        target: 重排后数据报的去向 (host, port)
+        window, delay: 重排缓冲区参数
+        fec: 前向纠错设置，见 _Endpoint
+        classifier: 低延迟流量分类器，按 target 的端口和回包的 DSCP 分类
+        batch: 批量收发设置，见 _Endpoint
+    """
+    def __init__(self, listen, target, window=REORDER_WINDOW, delay=REORDER_DELAY, fec='auto', classifier=None,
+                 batch=BATCH):
+        super().__init__(window, delay, fec, classifier, batch)
+        self.listen = listen
+        self.target = target
+        self._rr = 0
+        self._paths = {}
+        self._tunnel = None
+        self._upstream = None
+        self._secret = os.urandom(16)
+
+    async def start(self):
+        self._tunnel = await self._open(self._on_datagram, local_addr=self.listen)
+        self.listen = self._tunnel.get_extra_info('sockname')[:2]
+        self._upstream = await self._open_local(self._from_target, remote_addr=self.target)
+        self._start_periodic()
+        log.info("隧道对端已监听 %s:%d，转发到 %s:%d", self.listen[0], self.listen[1], *self.target)
+
+    async def stop(self):
+        await self._stop_periodic()
+        for transport in (self._tunnel, self._upstream):
+            if transport is not None:
+                transport.close()
+        self._tunnel = self._upstream = None
+
+    def stats(self):
+        stats = super().stats()
+        stats['paths'] = len(self._live_paths())
+        return stats
+
+    def _transports(self):
+        return [self._tunnel, self._upstream]
+
+    def _accept(self, kind, session, epoch, path, addr, payload):
+        if session != self.session:
+            if self._live_paths() and not (kind == TYPE_RESPONSE and hmac.compare_digest(
+                    payload[:COOKIE_SIZE], self._cookie(session, addr))):
+                # 只回应测速请求：质询不比请求大，也随客户端的测速间隔限速，不会被用来放大流量
+                if kind == TYPE_PING:
+                    self._tunnel.sendto(HEADER.pack(MAGIC, TYPE_CHALLENGE, path, session, self.epoch, 0, 0)
+                                        + self._cookie(session, addr), addr)
+                return False
+            log.info("隧道对端切换到新会话 %08x", session)
+            self._reset_session(session)
+            self._paths.clear()
+        self._paths[path] = (addr, time.monotonic())
+        return True
+
+    def _cookie(self, session, addr):
+        message = struct.pack('!I', session) + f"{addr[0]}:{addr[1]}".encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()[:COOKIE_SIZE]
+
+    def _live_paths(self):
+        now = time.monotonic()
+        return sorted(path for path, (_, seen) in self._paths.items() if now - seen < PATH_TIMEOUT)
+
+    def _select_path(self):
+        paths = self._live_paths()
+        if not paths or self._tunnel is None:
+            return None
+        self._rr += 1
+        return paths[self._rr % len(paths)]
+
+    def _next_path(self, path):
+        paths = self._live_paths()
+        if not paths or self._tunnel is None:
+            return None
+        later = [p for p in paths if p > path]
+        return later[0] if later else paths[0]
+
+    _report_path = _select_path
+
+    def _ping_paths(self):
+        return self._live_paths() if self._tunnel is not None else []
+
+    def _sendto(self, path, datagram):
+        self._tunnel.sendto(datagram, self._paths[path][0])
+
+    def _deliver(self, packet):
+        if self._upstream is not None:
+            self._upstream.sendto(packet)
+
+    def _from_target(self, data, addr, dscp=0):
+        self.send_data(data, self.target[1], dscp)
@@ -0,0 +1,397 @@
+"""
+多进程工作模式
+N 个工作进程各自运行事件循环，在同一端口上以 SO_REUSEPORT 监听，由内核分发新连接；
+链路状态放在共享内存中：主进程负责健康检查和权重估计并写入上下线/权重，
+各工作进程写入自己那一列的连接与流量计数，读取时跨进程求和
+"""
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+
+from .classify import Classifier
+from .flows import FlowTable
+from .metrics import TRACE_SAMPLE, Metrics, Tracer
+from .proxy import BondingProxy
+from .resolver import make_resolver
+from .scheduler import Link, Scheduler
+from .shaper import Shaper
+
+
+log = logging.getLogger(__name__)
+
+HAS_REUSEPORT = sys.platform.startswith('linux') and hasattr(socket, 'SO_REUSEPORT')
+
+IP_SIZE = 64
+
+# 每条链路的全局字段（主进程写）
+_UP, _SUSPECT, _WEIGHT, _RTT, _CAPPED = range(5)
+_GLOBAL_FIELDS = 5
+
+# 每个工作进程每条链路的计数（工作进程写）
+_COUNTERS = ('active', 'total', 'bytes_sent', 'bytes_recv')
+
+# 控制字段
+_GENERATION, _STOPPING = range(2)
+
+POLL_INTERVAL = 0.2
+SUPERVISE_INTERVAL = 0.5
+READY_TIMEOUT = 10.0
+
+
+class LinkTable:
+    """
+    跨进程共享的链路状态表
+    只用无锁的 RawArray：每个字段只有一个写者（主进程或对应的工作进程），对齐的 8 字节读写在各平台上都是原子的；
+    各工作进程的运行指标（见 metrics.Metrics）也各占 metrics 中的一段
+    """
+    def __init__(self, count, workers, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.count = count
+        self.workers = workers
+        self.state = context.RawArray('d', count * _GLOBAL_FIELDS)
+        self.counters = context.RawArray('q', workers * count * len(_COUNTERS))
+        self.ips = context.RawArray('c', count * IP_SIZE)
+        self.control = context.RawArray('q', 2)
+        self.metrics = context.RawArray('d', workers * Metrics.size(count))
+
+    @property
+    def generation(self):
+        return self.control[_GENERATION]
+
+    def bump(self):
+        """
+        上下线、权重或地址变化后调用，工作进程看到代数变化时重建调度表
+        """
+        self.control[_GENERATION] += 1
+
+    @property
+    def stopping(self):
+        return bool(self.control[_STOPPING])
+
+    def request_stop(self):
+        self.control[_STOPPING] = 1
+
+    def get_state(self, slot, field):
+        return self.state[slot * _GLOBAL_FIELDS + field]
+
+    def set_state(self, slot, field, value):
+        self.state[slot * _GLOBAL_FIELDS + field] = value
+
+    def get_ip(self, slot):
+        return self.ips[slot * IP_SIZE:(slot + 1) * IP_SIZE].rstrip(b'\0').decode('ascii')
+
+    def set_ip(self, slot, ip):
+        data = ip.encode('ascii')
+        if len(data) >= IP_SIZE:
+            raise ValueError(f"地址过长: {ip}")
+        self.ips[slot * IP_SIZE:(slot + 1) * IP_SIZE] = data.ljust(IP_SIZE, b'\0')
+
+    def _counter_index(self, worker, slot, field):
+        return (worker * self.count + slot) * len(_COUNTERS) + field
+
+    def get_counter(self, worker, slot, field):
+        return self.counters[self._counter_index(worker, slot, field)]
+
+    def set_counter(self, worker, slot, field, value):
+        self.counters[self._counter_index(worker, slot, field)] = value
+
+    def sum_counter(self, slot, field):
+        return sum(self.get_counter(w, slot, field) for w in range(self.workers))
+
+    def metrics_buffer(self, worker):
+        """
+        返回某个工作进程的指标段，可直接作为 Metrics 的 buffer
+        """
+        size = Metrics.size(self.count)
+        return memoryview(self.metrics).cast('B').cast('d')[worker * size:(worker + 1) * size]
+
+    def reset_worker(self, worker):
+        """
+        工作进程退出后清零其活动连接数，它的连接已随进程关闭；累计计数保留
+        """
+        for slot in range(self.count):
+            self.set_counter(worker, slot, 0, 0)
+
+
+def _state_property(field, convert):
+    def fget(self):
+        return convert(self._table.get_state(self._slot, field))
+
+    def fset(self, value):
+        self._table.set_state(self._slot, field, float(value))
+
+    return property(fget, fset)
+
+
+def _rtt_fget(self):
+    value = self._table.get_state(self._slot, _RTT)
+    return None if math.isnan(value) else value
+
+
+def _rtt_fset(self, value):
+    self._table.set_state(self._slot, _RTT, math.nan if value is None else float(value))
+
+
+def _counter_property(field):
+    def fget(self):
+        if self._worker is None:
+            return self._table.sum_counter(self._slot, field)
+        return self._table.get_counter(self._worker, self._slot, field)
+
+    def fset(self, value):
+        if self._worker is None:
+            raise AttributeError("连接与流量计数由工作进程维护")
+        self._table.set_counter(self._worker, self._slot, field, value)
+
+    return property(fget, fset)
+
+
+class SharedLink(Link):
+    """
+    存放在 LinkTable 中的链路
+    worker 为工作进程编号时，计数字段读写该进程自己的一列；为 None 时（主进程视图）读取所有进程之和且只读
+    地址、上下线、有效权重、RTT（低延迟流量选路用）和配额标记所有进程共享；丢包等其它探测结果只在主进程中使用，仍是普通属性
+    """
+    __slots__ = ('_table', '_slot', '_worker')
+
+    def __init__(self, table, slot, worker, name, gateway='', speed=None, weight=None):
+        self._table = table
+        self._slot = slot
+        self._worker = worker
+        self.name = name
+        self.gateway = gateway
+        self.speed = speed
+        self.weight = weight
+        self.throughput = 0.0
+        self.peak = 0.0
+        self.loss = 0.0
+        self.jitter = None
+        self.connect_time = None
+        self.races_won = 0
+        self.races_lost = 0
+
+    ip = property(lambda self: self._table.get_ip(self._slot),
+                  lambda self, value: self._table.set_ip(self._slot, value))
+    up = _state_property(_UP, bool)
+    suspect = _state_property(_SUSPECT, bool)
+    effective_weight = _state_property(_WEIGHT, float)
+    capped = _state_property(_CAPPED, bool)
+    rtt = property(_rtt_fget, _rtt_fset)
+    active = _counter_property(0)
+    total = _counter_property(1)
+    bytes_sent = _counter_property(2)
+    bytes_recv = _counter_property(3)
+
+    @property
+    def load(self):
+        return self._table.sum_counter(self._slot, 0)
+
+
+def shared_links(table, interfaces, worker=None):
+    """
+    构造某个进程视角下的链路列表，worker 为 None 时是主进程视角
+    """
+    return [SharedLink(table, slot, worker, i['name'], i.get('gateway', ''), i.get('speed'), i.get('weight'))
+            for slot, i in enumerate(interfaces)]
+
+
+def init_table(table, interfaces):
+    """
+    用接口列表初始化共享表中的地址、上线状态和初始权重
+    """
+    for slot, interface in enumerate(interfaces):
+        link = Link.from_interface(interface)
+        table.set_ip(slot, link.ip)
+        table.set_state(slot, _UP, 1.0)
+        table.set_state(slot, _SUSPECT, 0.0)
+        table.set_state(slot, _WEIGHT, link.effective_weight)
+        table.set_state(slot, _RTT, math.nan)
+        table.set_state(slot, _CAPPED, 0.0)
+
+
+def worker_main(index, table, interfaces, mode, host, port, relay_mode, latency, sticky, dns, pool,
+                race, trace, trace_sample, mptcp, limits, fair, ready, log_level):
+    """
+    工作进程入口
+    忽略 SIGINT（由主进程统一停止），主进程退出或请求停止时关闭监听并退出
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level, format=f"%(asctime)s [worker {index}] %(levelname)s %(name)s: %(message)s")
+    asyncio.run(_worker_loop(index, table, interfaces, mode, host, port, relay_mode, latency, sticky, dns, pool,
+                             race, trace, trace_sample, mptcp, limits, fair, ready))
+
+
+async def _worker_loop(index, table, interfaces, mode, host, port, relay_mode, latency, sticky, dns, pool, race,
+                       trace, trace_sample, mptcp, limits, fair, ready):
+    parent = os.getppid()
+    links = shared_links(table, interfaces, index)
+    scheduler = Scheduler(links, mode, FlowTable(sticky) if sticky else None)
+    # 内核按连接在工作进程间均匀分发，每个进程分得限速的 1/N
+    shaper = Shaper({name: rate / table.workers for name, rate in limits.items()}, fair) if limits else None
+    proxy = BondingProxy(scheduler, host, port, relay_mode=relay_mode, reuse_port=True,
+                         classifier=Classifier(latency) if latency else None,
+                         resolver=make_resolver(dns, interfaces), pool_size=pool, race_delay=race,
+                         metrics=Metrics([link.name for link in links], mode, table.metrics_buffer(index)),
+                         tracer=Tracer(f"{trace}.{index}", trace_sample) if trace else None, mptcp=mptcp,
+                         shaper=shaper)
+    try:
+        await proxy.start()
+    except OSError as e:
+        ready.send(str(e))
+        ready.close()
+        return
+    ready.send(None)
+    ready.close()
+
+    generation = table.generation
+    try:
+        while not table.stopping and os.getppid() == parent:
+            await asyncio.sleep(POLL_INTERVAL)
+            if table.generation != generation:
+                generation = table.generation
+                scheduler.refresh()
+    finally:
+        await proxy.stop()
+
+
+class WorkerPool:
+    """
+    工作进程池，对叠加引擎提供与 BondingProxy 相同的 start()/stop()/host/port/relay_mode 接口
+    主进程先以 SO_REUSEPORT 绑定（不监听）占住端口，工作进程在同一端口监听；
+    监督任务定期检查工作进程，意外退出的会被清零活动计数后重新启动
+
+    Args:
+        table: LinkTable
+        interfaces: 接口字典列表，顺序与 table 中的槽位一致
+        mode: 负载均衡模式
+        host, port: 监听地址，port 为 0 时由系统分配
+        relay_mode: 数据转发方式
+        workers: 工作进程数
+        latency: 低延迟分类规则字符串列表（见 classify.Classifier），在各工作进程中编译
+        sticky: 流保持的空闲超时（秒），每个工作进程各建一张流表，0 表示不保持
+        dns: DNS 配置列表（见 resolver.make_resolver），每个工作进程各有一份解析缓存
+        pool: 每个工作进程预连接池的空闲连接上限，0 表示不预连接
+        race: 多链路竞速连接的错开时间（秒），0 表示不竞速
+        trace: 连接跟踪文件路径，工作进程 i 写入 路径.i；None 表示不跟踪
+        trace_sample: 被跟踪连接的抽样比例
+        mptcp: 出站连接使用 MPTCP 套接字；路径管理器由主进程配置
+        limits: {接口名: 限速 Mbit/s}，每个工作进程各有一个整形器，分得限速的 1/workers
+        fair: 同一链路上的连接公平排队（见 shaper.LinkQueue）
+    """
+    def __init__(self, table, interfaces, mode, host, port, relay_mode, workers, latency=None, sticky=0,
+                 dns=None, pool=0, race=0.0, trace=None, trace_sample=TRACE_SAMPLE, mptcp=False, limits=None,
+                 fair=False):
+        if not HAS_REUSEPORT:
+            raise ValueError("多进程模式需要 SO_REUSEPORT 负载分发（仅支持 Linux）")
+        self.table = table
+        self.interfaces = [dict(i) for i in interfaces]
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.relay_mode = relay_mode
+        self.workers = workers
+        self.latency = list(latency or [])
+        self.sticky = sticky
+        self.dns = list(dns or [])
+        self.pool = pool
+        self.race = race
+        self.trace = trace
+        self.trace_sample = trace_sample
+        self.mptcp = mptcp
+        self.limits = dict(limits or {})
+        self.fair = fair
+        self.restarts = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = [None] * workers
+        self._reserve = None
+        self._task = None
+
+    async def start(self):
+        """
+        占住端口并启动全部工作进程，全部开始监听后返回
+
+        Raises:
+            OSError: 绑定端口或工作进程监听失败
+        """
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self._reserve = socket.socket(family, socket.SOCK_STREAM)
+        self._reserve.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            self._reserve.bind((self.host, self.port))
+            self.port = self._reserve.getsockname()[1]
+            await asyncio.gather(*(self._spawn(i) for i in range(self.workers)))
+        except BaseException:
+            await self.stop()
+            raise
+        self._task = asyncio.ensure_future(self._supervise())
+        log.info("叠加代理已监听 %s:%d（%d 个工作进程）", self.host, self.port, self.workers)
+
+    async def stop(self):
+        """
+        通知所有工作进程退出并等待，超时未退出的强制结束
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.table.request_stop()
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, 5.0)
+                if process.is_alive():
+                    process.terminate()
+                    await loop.run_in_executor(None, process.join)
+        self._processes = [None] * self.workers
+        if self._reserve is not None:
+            self._reserve.close()
+            self._reserve = None
+
+    def pids(self):
+        return [p.pid if p is not None else None for p in self._processes]
+
+    async def _spawn(self, index):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=worker_main, name=f"bonding-worker-{index}", daemon=True,
+            args=(index, self.table, self.interfaces, self.mode, self.host, self.port, self.relay_mode,
+                  self.latency, self.sticky, self.dns, self.pool, self.race, self.trace,
+                  self.trace_sample, self.mptcp, self.limits, self.fair, sender, logging.getLogger().getEffectiveLevel()),
+        )
+        process.start()
+        sender.close()
+        self._processes[index] = process
+        try:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, receiver.poll, READY_TIMEOUT):
+                raise OSError(f"工作进程 {index} 启动超时")
+            try:
+                error = receiver.recv()
+            except EOFError:
+                raise OSError(f"工作进程 {index} 启动失败（退出码 {process.exitcode}）") from None
+            if error is not None:
+                raise OSError(f"工作进程 {index} 监听失败: {error}")
+        finally:
+            receiver.close()
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is None or process.is_alive() or self.table.stopping:
+                    continue
+                log.warning("工作进程 %d (PID %d) 意外退出，退出码 %s，正在重启",
+                            index, process.pid, process.exitcode)
+                process.join()
+                self.table.reset_worker(index)
+                self.restarts += 1
+                try:
+                    await self._spawn(index)
+                except OSError as e:
+                    log.error("重启工作进程 %d 失败: %s", index, e)
@@ -3,11 +3,16 @@
 支持Windows系统的网络接口管理，实现多网卡负载均衡、提升网络速度和稳定性
 """
 
+import sys
 import tkinter as tk
-from tkinter import ttk, messagebox, font
-import subprocess
-import time
-import threading
+from tkinter import ttk, messagebox, simpledialog, font
+
+from bonding.control import ControlClient, ControlError
+from bonding.engine import BondingEngine
+from bonding.monitor import InterfaceMonitor
+from bonding.profiles import DEFAULT_PROFILE, ProfileStore, interface_id, make_profile, resolve_profile
+from bonding.shaper import PERIOD_NAMES, format_size, parse_quota
+from bonding.stats import StatsSampler
 
 
 class ModernButton(ttk.Frame):
@@ -54,6 +59,112 @@ class ModernButton(ttk.Frame):
         return f"#{r:02x}{g:02x}{b:02x}"
 
 
+def format_rate(value):
+    """
+    把字节/秒格式化为易读的速率字符串
+    """
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GB/s"
+
+
+def format_quota(count):
+    """
+    把配额字节数格式化为可再次解析的文本，如 2G、500M
+    """
+    for unit, size in (("G", 1 << 30), ("M", 1 << 20), ("K", 1 << 10)):
+        if count >= size:
+            return f"{count / size:g}{unit}"
+    return str(count)
+
+
+class DashboardWindow:
+    """
+    实时监控窗口
+    显示每个叠加接口的速率、包速率、活动连接、延迟和丢包，并绘制速率迷你折线图；
+    数据由后台采样线程写入环形缓冲区，这里按固定帧率批量读取重绘，不阻塞主循环
+    """
+    FPS = 4
+    ROW_HEIGHT = 72
+    CHART_WIDTH = 200
+
+    def __init__(self, root, sampler):
+        self.sampler = sampler
+        self.window = tk.Toplevel(root)
+        self.window.title("实时监控")
+        self.window.configure(bg="white")
+        self.window.geometry(f"560x{len(sampler.series) * self.ROW_HEIGHT + 20}")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.canvas = tk.Canvas(self.window, bg="white", highlightthickness=0)
+        self.canvas.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        self.rows = {}
+        for i, name in enumerate(sampler.series):
+            top = i * self.ROW_HEIGHT
+            self.canvas.create_text(0, top + 4, text=name, anchor=tk.NW,
+                                    font=("Microsoft YaHei", 10, "bold"), fill="#2c3e50")
+            stats = self.canvas.create_text(0, top + 26, text="", anchor=tk.NW,
+                                            font=("Arial", 9), fill="#7f8c8d")
+            chart_left = 540 - self.CHART_WIDTH
+            self.canvas.create_rectangle(chart_left, top + 4, 540, top + self.ROW_HEIGHT - 8,
+                                         outline="#ecf0f1")
+            rx_line = self.canvas.create_line(0, 0, 0, 0, fill="#3498db", width=1.5)
+            tx_line = self.canvas.create_line(0, 0, 0, 0, fill="#27ae60", width=1.5)
+            self.rows[name] = (top, stats, rx_line, tx_line)
+
+        self._version = -1
+        self._after_id = None
+        self._schedule()
+
+    def _schedule(self):
+        self._after_id = self.window.after(int(1000 / self.FPS), self._tick)
+
+    def _tick(self):
+        if self.sampler.version != self._version:
+            self._version = self.sampler.version
+            self.redraw()
+        self._schedule()
+
+    def redraw(self):
+        """
+        用采样器中的最新数据一次性刷新所有行
+        """
+        for name, (top, stats, rx_line, tx_line) in self.rows.items():
+            series = self.sampler.series[name]
+            self.canvas.itemconfigure(stats, text=(
+                f"↓ {format_rate(series.rx_bps.last())}   ↑ {format_rate(series.tx_bps.last())}   "
+                f"{series.pps.last():.0f} 包/秒\n"
+                f"活动连接 {series.flows.last():.0f}   延迟 {series.rtt.last():.0f} ms   "
+                f"丢包 {series.loss.last():.0%}"
+            ))
+            rx = series.rx_bps.values()
+            tx = series.tx_bps.values()
+            peak = max(rx + tx + [1.0])
+            for line, values in ((rx_line, rx), (tx_line, tx)):
+                self.canvas.coords(line, *self._sparkline(values, series.rx_bps.capacity, top, peak))
+
+    def _sparkline(self, values, capacity, top, peak):
+        if len(values) < 2:
+            return (0, 0, 0, 0)
+        left = 540 - self.CHART_WIDTH
+        bottom = top + self.ROW_HEIGHT - 10
+        height = self.ROW_HEIGHT - 16
+        step = self.CHART_WIDTH / (capacity - 1)
+        start = 540 - step * (len(values) - 1)
+        points = []
+        for i, value in enumerate(values):
+            points.append(max(left, start + i * step))
+            points.append(bottom - value / peak * height)
+        return points
+
+    def close(self):
+        if self._after_id is not None:
+            self.window.after_cancel(self._after_id)
+            self._after_id = None
+        self.window.destroy()
 
 
 class NetworkBondingApp:
@@ -61,18 +172,36 @@ class NetworkBondingApp:
     网络叠加工具主应用类
     提供图形界面来管理和配置多网络接口的负载均衡
     """
+    DEFAULT_PROBE = "tcp:223.5.5.5:53"
+    PROBE_INTERVAL = 1.0
+    # 界面上可编辑的档案字段；其余字段（探测、监听地址、流保持、DNS 等，可能由命令行设置）保存时沿用档案中的值
+    GUI_FIELDS = ('mode', 'interfaces', 'enabled', 'offload', 'mptcp', 'limits', 'quotas', 'fair')
     def __init__(self, root):
         self.root = root
         self.root.title("网络叠加工具 v0.1")
-        self.root.geometry("650x530")
+        self.root.geometry("650x600")
         self.root.resizable(True, True)
         self.root.configure(bg="#f5f5f5")
 
-        self.interfaces = []
+        self.interfaces = {}
+        self.selected_interfaces = []
+        self.engine = None
+        self.client = self._attach_daemon()
+        self.sampler = None
+        self.dashboard = None
         self.tooltip_label = None
+        self.profiles = ProfileStore()
         self.setup_styles()
         self.create_widgets()
-        self.refresh_interfaces()
+
+        cached, _ = self.profiles.load_cache()
+        if cached:
+            self.apply_interface_changes(cached, list(cached), [], [])
+        self.restore_profile()
+
+        self.monitor = InterfaceMonitor(self._on_interfaces_changed, on_error=self._on_monitor_error, initial=cached)
+        self.monitor.start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def setup_styles(self):
         """
@@ -260,6 +389,44 @@ class NetworkBondingApp:
         Args:
             parent: 父容器组件
         """
+        profile_frame = tk.Frame(parent, bg="white")
+        profile_frame.pack(fill=tk.X, pady=(0, 10))
+
+        tk.Label(
+            profile_frame,
+            text="配置档案",
+            font=("Arial", 9),
+            bg="white",
+            fg="#2c3e50"
+        ).pack(side=tk.LEFT, padx=(0, 5))
+
+        self.profile_var = tk.StringVar(value=self.profiles.last or "")
+        self.profile_box = ttk.Combobox(
+            profile_frame,
+            textvariable=self.profile_var,
+            values=self.profiles.names(),
+            state="readonly",
+            width=10
+        )
+        self.profile_box.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.profile_box.bind('<<ComboboxSelected>>', lambda e: self.restore_profile(self.profile_var.get()))
+
+        save_btn = tk.Button(
+            profile_frame,
+            text="💾 保存",
+            command=self.save_profile_as,
+            bg="#95a5a6",
+            fg="white",
+            font=("Arial", 9),
+            cursor="hand2",
+            relief="flat",
+            padx=8,
+            pady=2,
+            borderwidth=0
+        )
+        save_btn.pack(side=tk.LEFT, padx=(5, 0))
+        self.add_hover_effect(save_btn, "#95a5a6", "#7f8c8d")
+
         tk.Label(
             parent,
             text="选择的网络接口",
@@ -278,6 +445,8 @@ class NetworkBondingApp:
             bg="#f9f9f9"
         )
         self.selected_list.pack(fill=tk.X, padx=10, pady=10)
+        self.selected_list.bind('<Double-Button-1>', lambda e: self.edit_weight())
+        self.selected_list.bind('<Button-3>', self._on_selected_right_click)
 
         btn_frame = tk.Frame(parent, bg="white")
         btn_frame.pack(fill=tk.X, pady=(0, 15))
@@ -328,14 +497,16 @@ class NetworkBondingApp:
             "round_robin": "轮询模式：按顺序轮流使用各网络接口，适合带宽相近的情况",
             "source_hash": "源IP哈希：根据发起请求的IP路由，保持会话连接",
             "dest_hash": "目标IP哈希：根据目标服务器IP路由，连接稳定",
-            "least_conn": "最小连接数：动态选择负载最小的接口，智能分配"
+            "least_conn": "最小连接数：动态选择负载最小的接口，智能分配",
+            "weighted": "加权模式：按实测带宽和延迟分配连接，适合带宽差异大的情况，双击已选接口可手动设置权重"
         }
 
         modes = [
             ("⭕ 轮询模式 (Round Robin)", "round_robin"),
             ("⭕ 源IP哈希", "source_hash"),
             ("⭕ 目标IP哈希", "dest_hash"),
-            ("⭕ 最小连接数", "least_conn")
+            ("⭕ 最小连接数", "least_conn"),
+            ("⭕ 加权模式", "weighted")
         ]
 
         for text, value in modes:
@@ -360,6 +531,59 @@ class NetworkBondingApp:
             radio.bind('<Enter>', make_enter_handler(value, mode_descriptions[value]))
             radio.bind('<Leave>', lambda e: self._hide_tooltip())
 
+        self.offload_var = tk.BooleanVar(value=False)
+        if sys.platform.startswith('linux'):
+            offload = tk.Checkbutton(
+                parent,
+                text="内核路由（不经代理，需要 root）",
+                variable=self.offload_var,
+                bg="white",
+                fg="#2c3e50",
+                font=("Arial", 9),
+                activebackground="white",
+                selectcolor="white",
+                cursor="hand2"
+            )
+            offload.pack(anchor=tk.W, pady=(8, 3))
+            offload.bind('<Enter>', lambda e: self._show_tooltip(
+                'offload', "由内核策略路由按链路分流所有流量，无需设置代理；健康检查仍会在链路故障时改写路由"))
+            offload.bind('<Leave>', lambda e: self._hide_tooltip())
+
+        self.mptcp_var = tk.BooleanVar(value=False)
+        if sys.platform.startswith('linux'):
+            mptcp = tk.Checkbutton(
+                parent,
+                text="MPTCP（单条连接使用全部接口）",
+                variable=self.mptcp_var,
+                bg="white",
+                fg="#2c3e50",
+                font=("Arial", 9),
+                activebackground="white",
+                selectcolor="white",
+                cursor="hand2"
+            )
+            mptcp.pack(anchor=tk.W, pady=3)
+            mptcp.bind('<Enter>', lambda e: self._show_tooltip(
+                'mptcp', "代理的出站连接使用 Multipath TCP，在每个接口上建立子流；对端不支持时自动退回普通 TCP"))
+            mptcp.bind('<Leave>', lambda e: self._hide_tooltip())
+
+        self.fair_var = tk.BooleanVar(value=False)
+        fair = tk.Checkbutton(
+            parent,
+            text="公平排队（限速接口上大下载不挤占交互流量）",
+            variable=self.fair_var,
+            bg="white",
+            fg="#2c3e50",
+            font=("Arial", 9),
+            activebackground="white",
+            selectcolor="white",
+            cursor="hand2"
+        )
+        fair.pack(anchor=tk.W, pady=3)
+        fair.bind('<Enter>', lambda e: self._show_tooltip(
+            'fair', "右键已选接口可设置限速和按日/按月的流量配额；勾选后同一限速接口上的连接轮流发送"))
+        fair.bind('<Leave>', lambda e: self._hide_tooltip())
+
         tk.Label(parent, text="", bg="white").pack(pady=5)
 
         btn_container = tk.Frame(parent, bg="white")
@@ -413,6 +637,22 @@ class NetworkBondingApp:
         status_btn.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(3, 0))
         self.add_hover_effect(status_btn, "#34495e", "#2c3e50")
 
+        dashboard_btn = tk.Button(
+            parent,
+            text="📈 实时监控",
+            command=self.show_dashboard,
+            bg="#16a085",
+            fg="white",
+            font=("Arial", 9),
+            cursor="hand2",
+            relief="flat",
+            padx=10,
+            pady=5,
+            borderwidth=0
+        )
+        dashboard_btn.pack(fill=tk.X)
+        self.add_hover_effect(dashboard_btn, "#16a085", "#138d75")
+
     def add_hover_effect(self, button, normal_color, hover_color):
         """
         为按钮添加鼠标悬停效果
@@ -477,89 +717,200 @@ class NetworkBondingApp:
     def refresh_interfaces(self):
         """
         刷新网络接口列表
-        在后台线程中重新扫描所有网络接口
+        接口变化由后台监视器实时推送，这里只请求立即重新比对一次
         """
-        self.tree.delete(*self.tree.get_children())
+        self.monitor.rescan()
 
-        thread = threading.Thread(target=self._refresh_networks_bg, daemon=True)
-        thread.start()
-
-    def _refresh_networks_bg(self):
+    def _on_interfaces_changed(self, snapshot, added, changed, removed):
         try:
-            result = subprocess.run(
-                ['ipconfig'],
-                capture_output=True,
-                text=True,
-                encoding='gbk',
-                timeout=5
-            )
+            self.profiles.save_cache(snapshot)
+        except OSError:
+            pass
+        self.root.after(0, lambda: self.apply_interface_changes(snapshot, added, changed, removed))
 
-            self.root.after(0, lambda: self.parse_network_config(result.stdout))
-        except subprocess.TimeoutExpired:
-            self.root.after(0, lambda: messagebox.showwarning("警告", "获取网络接口超时，请重试"))
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("错误", f"获取网络接口失败: {e}"))
+    def _on_monitor_error(self, error):
+        self.root.after(0, lambda: messagebox.showerror("错误", f"获取网络接口失败: {error}"))
 
-    def parse_network_config(self, output):
+    def apply_interface_changes(self, snapshot, added, changed, removed):
         """
-        解析ipconfig命令输出
-        提取各网络接口的名称、类型、IP地址、网关和连接状态
+        把接口变化增量应用到网络接口列表
+        只插入、更新或删除发生变化的行，显示状态、类型、IP地址和网关
 
         Args:
-            output: ipconfig命令的输出文本
-        """
-        self.interfaces = []
-        current_interface = None
-
-        for line in output.split('\n'):
-            line = line.strip()
-
-            if line.startswith('以太网适配器') or line.startswith('无线局域网适配器') or line.startswith('Wi-Fi'):
-                if current_interface:
-                    self.interfaces.append(current_interface)
-                current_interface = {
-                    'name': line.split(' ')[-1],
-                    'type': '有线' if '以太网' in line else '无线',
-                    'ip': '',
-                    'gateway': '',
-                    'status': '未连接'
-                }
-
-            elif current_interface and 'IPv4 地址' in line:
-                parts = line.split(':')
-                if len(parts) > 1:
-                    current_interface['ip'] = parts[1].strip()
-                    current_interface['status'] = '已连接'
-
-            elif current_interface and '默认网关' in line:
-                parts = line.split(':')
-                if len(parts) > 1:
-                    current_interface['gateway'] = parts[1].strip()
-
-        if current_interface:
-            self.interfaces.append(current_interface)
-
-        for i, interface in enumerate(self.interfaces):
-            self.tree.insert('', 'end', iid=str(i), values=(
+            snapshot: {key: 接口字典} 最新完整状态
+            added: 新增接口的key列表
+            changed: 属性变化接口的key列表
+            removed: 已移除接口的key列表
+        """
+        for key in removed:
+            self.interfaces.pop(key, None)
+            if self.tree.exists(key):
+                self.tree.delete(key)
+
+        for key in added + changed:
+            interface = snapshot[key]
+            self.interfaces[key] = interface
+            values = (
                 interface['status'],
                 interface['type'],
                 interface['ip'] or '-',
                 interface['gateway'] or '-'
-            ))
+            )
+            if self.tree.exists(key):
+                self.tree.item(key, values=values)
+            else:
+                self.tree.insert('', 'end', iid=key, values=values)
+
+        self._refresh_selected([snapshot[key] for key in changed])
+
+    def _refresh_selected(self, interfaces):
+        """
+        已选接口的地址发生变化时（例如启动时使用的缓存已过期），同步到已选列表和运行中的引擎
+        """
+        updated = []
+        by_id = {interface_id(i): i for i in interfaces}
+        for index, selected in enumerate(self.selected_interfaces):
+            current = by_id.get(interface_id(selected))
+            if current is None or (current['ip'], current['gateway']) == (selected['ip'], selected['gateway']):
+                continue
+            if not current['ip']:
+                continue
+            self.selected_interfaces[index] = dict(current, weight=selected.get('weight'), limit=selected.get('limit'),
+                                                   quota=selected.get('quota'))
+            self.selected_list.delete(index)
+            self.selected_list.insert(index, self._selected_text(self.selected_interfaces[index]))
+            updated.append(self.selected_interfaces[index])
+
+        if not updated:
+            return
+        if self.client is not None:
+            try:
+                self.client.call('update_links', interfaces=updated)
+            except ControlError:
+                pass
+        elif self.engine is not None:
+            self.engine.update_links(updated)
 
     def add_to_selected(self):
         selected_items = self.tree.selection()
         for item_id in selected_items:
-            index = int(item_id)
-            if index < len(self.interfaces):
-                interface = self.interfaces[index]
+            interface = self.interfaces.get(item_id)
+            if interface is not None:
                 if interface['status'] == '已连接':
-                    text = f"{interface['name']} ({interface['ip']})"
-                    if text not in self.selected_list.get(0, tk.END):
-                        self.selected_list.insert(tk.END, text)
+                    if not any(s['name'] == interface['name'] for s in self.selected_interfaces):
+                        self.selected_interfaces.append(dict(interface, weight=None))
+                        self.selected_list.insert(tk.END, self._selected_text(self.selected_interfaces[-1]))
                 else:
                     messagebox.showwarning("警告", f"{interface['name']} 未连接，无法添加")
 
+    def _selected_text(self, interface):
+        text = f"{interface['name']} ({interface['ip']})"
+        if interface.get('weight'):
+            text += f" 权重 {interface['weight']:g}"
+        if interface.get('limit'):
+            text += f" 限速 {interface['limit']:g}M"
+        for period, count in (interface.get('quota') or {}).items():
+            text += f" {PERIOD_NAMES[period]}配额 {format_size(count)}"
+        return text
+
+    def edit_weight(self):
+        """
+        为已选接口设置手动权重（Mbit/s）
+        留空表示按实测带宽自动计算，启用中的叠加会立即生效
+        """
+        selection = self.selected_list.curselection()
+        if not selection:
+            return
+        index = selection[0]
+        interface = self.selected_interfaces[index]
+        weight = simpledialog.askstring(
+            "设置权重",
+            f"{interface['name']} 的权重（Mbit/s），留空为自动：",
+            initialvalue=f"{interface['weight']:g}" if interface.get('weight') else "",
+            parent=self.root
+        )
+        if weight is None:
+            return
+        try:
+            weight = float(weight) if weight.strip() else None
+        except ValueError:
+            messagebox.showwarning("警告", "权重必须是数字")
+            return
+        if weight is not None and weight <= 0:
+            messagebox.showwarning("警告", "权重必须大于0")
+            return
+
+        interface['weight'] = weight
+        self.selected_list.delete(index)
+        self.selected_list.insert(index, self._selected_text(interface))
+        if self.client is not None:
+            try:
+                self.client.call('set_weight', name=interface['name'], weight=weight)
+            except ControlError:
+                pass
+        elif self.engine is not None:
+            self.engine.set_weight(interface['name'], weight)
+
+    def _on_selected_right_click(self, event):
+        index = self.selected_list.nearest(event.y)
+        if index < 0 or index >= len(self.selected_interfaces):
+            return
+        self.selected_list.selection_clear(0, tk.END)
+        self.selected_list.selection_set(index)
+        self.edit_shaping()
+
+    def edit_shaping(self):
+        """
+        为已选接口设置限速（Mbit/s）和流量配额（如 2G/day、30G/month），留空表示不限
+        在下次启用叠加时生效
+        """
+        selection = self.selected_list.curselection()
+        if not selection:
+            return
+        index = selection[0]
+        interface = self.selected_interfaces[index]
+        limit = simpledialog.askstring(
+            "设置限速",
+            f"{interface['name']} 的限速（Mbit/s，上下行各自计算），留空为不限：",
+            initialvalue=f"{interface['limit']:g}" if interface.get('limit') else "",
+            parent=self.root
+        )
+        if limit is None:
+            return
+        try:
+            limit = float(limit) if limit.strip() else None
+        except ValueError:
+            messagebox.showwarning("警告", "限速必须是数字")
+            return
+        if limit is not None and limit <= 0:
+            messagebox.showwarning("警告", "限速必须大于0")
+            return
+
+        current = interface.get('quota') or {}
+        quota = simpledialog.askstring(
+            "设置流量配额",
+            f"{interface['name']} 的流量配额，如 2G/day 或 30G/month，多个用逗号分隔，留空为不限：",
+            initialvalue=', '.join(f"{format_quota(count)}/{period}" for period, count in current.items()),
+            parent=self.root
+        )
+        if quota is None:
+            return
+        try:
+            quota = dict(parse_quota(item.strip()) for item in quota.split(',') if item.strip())
+        except ValueError as e:
+            messagebox.showwarning("警告", str(e))
+            return
+
+        interface['limit'] = limit
+        interface['quota'] = quota or None
+        self.selected_list.delete(index)
+        self.selected_list.insert(index, self._selected_text(interface))
+
+    def _shaping_params(self):
+        limits = {i['name']: i['limit'] for i in self.selected_interfaces if i.get('limit')}
+        quotas = {i['name']: i['quota'] for i in self.selected_interfaces if i.get('quota')}
+        return limits, quotas
+
     def remove_from_selected(self):
         """
         从已选列表中移除选中的接口
@@ -568,27 +919,214 @@ class NetworkBondingApp:
         selection = self.selected_list.curselection()
         for index in reversed(selection):
             self.selected_list.delete(index)
+            del self.selected_interfaces[index]
 
-    def enable_bonding(self):
+    def enable_bonding(self, quiet=False):
+        """
+        启用网络叠加
+        启动叠加代理并把当前选择保存到配置档案，quiet 为真时不弹出成功提示（用于启动时自动恢复）
+        """
         selected_count = self.selected_list.size()
         if selected_count < 2:
             messagebox.showwarning("警告", "请至少选择2个网络接口进行叠加")
             return
 
         mode = self.mode_var.get()
+        offload = self.offload_var.get()
+        use_mptcp = self.mptcp_var.get() and not offload
+        limits, quotas = self._shaping_params()
+        fair = self.fair_var.get()
+        probe, probe_interval = self._probe_settings()
+
+        self._stop_engine()
+
+        if self.client is not None:
+            try:
+                status = self.client.call('enable', interfaces=self.selected_interfaces, mode=mode,
+                                          probe=probe, probe_interval=probe_interval,
+                                          offload=offload, mptcp=use_mptcp, limits=limits, quotas=quotas,
+                                          fair=fair)
+            except ControlError as e:
+                messagebox.showerror("错误", f"启动叠加代理失败: {e}")
+                return
+            self._start_remote_sampler(status)
+        else:
+            try:
+                engine = BondingEngine(self.selected_interfaces, mode, probe=probe,
+                                       probe_interval=probe_interval, offload=offload, mptcp=use_mptcp,
+                                       limits=limits, quotas=quotas, fair=fair)
+                engine.start()
+            except (OSError, ValueError) as e:
+                messagebox.showerror("错误", f"启动叠加代理失败: {e}")
+                return
+            self.engine = engine
+            status = engine.status()
+            self.sampler = StatsSampler(lambda: [link.snapshot() for link in engine.links],
+                                        [link.name for link in engine.links])
+            self.sampler.start()
+        self.save_profile(enabled=True)
+
+        if quiet:
+            return
+        if offload:
+            messagebox.showinfo("成功", "网络叠加已启用！\n\n"
+                                "流量由内核按链路分流，应用程序无需设置代理。")
+            return
+        messagebox.showinfo("成功", "网络叠加已启用！\n\n"
+                            f"代理地址: {status['listen']}\n"
+                            "支持 SOCKS5 和 HTTP CONNECT，\n"
+                            "请将应用程序的代理设置为该地址。")
 
-        for i in range(selected_count):
-            self.root.update()
-            time.sleep(0.3)
-        messagebox.showinfo("成功", "网络叠加配置完成！\n\n注意：这是模拟配置。\n实际的网络叠加需要管理员权限和\n额外的网络驱动支持。")
+    def _probe_settings(self):
+        """
+        当前档案中的健康检查探测和间隔，档案未设置时使用界面的默认值
+        """
+        profile = self.profiles.get(self.profile_var.get() or DEFAULT_PROFILE) or {}
+        return (profile.get('probe') or self.DEFAULT_PROBE,
+                profile.get('probe_interval') or self.PROBE_INTERVAL)
 
     def disable_bonding(self):
         """
         禁用网络叠加功能
-        恢复默认网络配置
+        停止叠加代理，恢复默认网络配置
         """
+        self._stop_engine()
+        if self.client is not None:
+            try:
+                self.client.call('disable')
+            except ControlError as e:
+                messagebox.showerror("错误", f"禁用叠加失败: {e}")
+                return
+        self.save_profile(enabled=False)
         messagebox.showinfo("成功", "网络叠加已禁用！")
 
+    def save_profile(self, name=None, enabled=None):
+        """
+        把当前已选接口、模式、权重、整形设置保存到配置档案，界面不编辑的字段沿用档案中原有的值
+
+        Args:
+            name: 档案名，默认为当前档案
+            enabled: 是否处于启用状态，None 表示沿用档案中的值
+        """
+        name = name or self.profile_var.get() or DEFAULT_PROFILE
+        previous = self.profiles.get(name) or {}
+        if enabled is None:
+            enabled = previous.get('enabled', False)
+        limits, quotas = self._shaping_params()
+        fields = make_profile(self.selected_interfaces, self.mode_var.get(), enabled=enabled,
+                              offload=self.offload_var.get(), mptcp=self.mptcp_var.get(),
+                              limits=limits, quotas=quotas, fair=self.fair_var.get())
+        profile = dict(fields, **{key: value for key, value in previous.items() if key not in self.GUI_FIELDS})
+        try:
+            self.profiles.put(name, profile)
+        except OSError as e:
+            messagebox.showerror("错误", f"保存配置档案失败: {e}")
+            return
+        self.profile_var.set(name)
+        self.profile_box.configure(values=self.profiles.names())
+
+    def save_profile_as(self):
+        """
+        以新名称保存配置档案
+        """
+        name = simpledialog.askstring("保存配置档案", "档案名称：",
+                                      initialvalue=self.profile_var.get() or DEFAULT_PROFILE,
+                                      parent=self.root)
+        if name and name.strip():
+            self.save_profile(name.strip())
+
+    def restore_profile(self, name=None):
+        """
+        恢复配置档案
+        按稳定标识在当前（或缓存的）接口中找回已选接口，档案处于启用状态时立即重新启用叠加
+
+        Args:
+            name: 档案名，默认为最近使用的档案
+        """
+        profile = self.profiles.get(name)
+        if profile is None:
+            return
+        self.mode_var.set(profile.get('mode', 'round_robin'))
+        self.offload_var.set(bool(profile.get('offload')))
+        self.mptcp_var.set(bool(profile.get('mptcp')))
+        self.fair_var.set(bool(profile.get('fair')))
+        matched, missing = resolve_profile(profile, list(self.interfaces.values()))
+        for interface in matched:
+            interface['limit'] = profile.get('limits', {}).get(interface['name'])
+            interface['quota'] = profile.get('quotas', {}).get(interface['name'])
+        self.selected_interfaces = matched
+        self.selected_list.delete(0, tk.END)
+        for interface in matched:
+            self.selected_list.insert(tk.END, self._selected_text(interface))
+        if name:
+            self.profiles.last = name
+        if missing and name:
+            messagebox.showwarning("警告", f"以下接口当前不可用: {', '.join(missing)}")
+        status = self._engine_status()
+        if status is not None and status['running']:
+            if self.client is not None and self.sampler is None:
+                self._start_remote_sampler(status)
+        elif profile.get('enabled') and len(matched) >= 2:
+            self.enable_bonding(quiet=True)
+
+    def on_close(self):
+        """
+        关闭窗口前保存当前选择，下次启动时直接恢复
+        """
+        if self.selected_interfaces:
+            self.save_profile()
+        self.monitor.stop()
+        self._stop_engine()
+        self.root.destroy()
+
+    def _attach_daemon(self):
+        """
+        检测后台叠加服务（python -m bonding run --daemon）
+        服务在运行时界面作为瘦客户端，通过控制接口操作，否则在本进程内运行引擎
+        """
+        client = ControlClient(timeout=1.0)
+        return client if client.alive() else None
+
+    def _start_remote_sampler(self, status):
+        sampler_client = ControlClient(self.client.address)
+        self.sampler = StatsSampler(lambda: sampler_client.call('status')['links'],
+                                    [link['name'] for link in status['links']])
+        self.sampler.start()
+
+    def _engine_status(self):
+        if self.client is not None:
+            try:
+                return self.client.call('status')
+            except ControlError:
+                return None
+        if self.engine is not None and self.engine.running:
+            return self.engine.status()
+        return None
+
+    def _stop_engine(self):
+        if self.dashboard is not None:
+            self.dashboard.close()
+            self.dashboard = None
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+
+    def show_dashboard(self):
+        """
+        打开实时监控窗口
+        显示各叠加接口的速率、包速率、活动连接、延迟和丢包
+        """
+        if self.sampler is None:
+            messagebox.showwarning("警告", "请先启用网络叠加")
+            return
+        if self.dashboard is not None and self.dashboard.window.winfo_exists():
+            self.dashboard.window.lift()
+            return
+        self.dashboard = DashboardWindow(self.root, self.sampler)
+
     def show_status(self):
         """
         显示网络叠加状态信息
@@ -601,7 +1139,8 @@ class NetworkBondingApp:
             "round_robin": "轮询模式",
             "source_hash": "源IP哈希",
             "dest_hash": "目标IP哈希",
-            "least_conn": "最小连接数"
+            "least_conn": "最小连接数",
+            "weighted": "加权模式"
         }
         mode_display = mode_names.get(mode, mode)
 
@@ -624,18 +1163,55 @@ class NetworkBondingApp:
                 status_text += f"\n⚠️  当前只选择了 {selected_count} 个接口\n" \
                             "建议至少选择 2 个接口以获得最佳效果"
 
+        status = self._engine_status()
+        if status is not None and status['running']:
+            if status.get('offload'):
+                status_text += f"\n🟢 内核路由运行中（多路径表 {status['offload']['table']}）\n"
+            else:
+                status_text += f"\n🟢 叠加代理运行中: {status['listen']}" \
+                               f"{'（MPTCP）' if status.get('mptcp') else ''}\n"
+            shaping = status.get('shaping') or {}
+            for link in status['links']:
+                state = "正常" if link['up'] else "故障"
+                if link.get('capped'):
+                    state += "（流量将满，不再分配新连接）"
+                rtt = f"{link['rtt'] * 1000:.0f}ms" if link['rtt'] is not None else "-"
+                status_text += f"  {link['name']}: {state} 延迟 {rtt} 丢包 {link['loss']:.0%}，" \
+                               f"活动 {link['active']} / 累计 {link['total']} 连接\n"
+                if status.get('mptcp'):
+                    subflows = status['metrics']['links'][link['name']]['mptcp']
+                    status_text += f"     MPTCP 子流 {subflows['subflows']} 条，" \
+                                   f"↑ {subflows['bytes_sent'] / 1048576:.1f} MB ↓ {subflows['bytes_recv'] / 1048576:.1f} MB\n"
+                for period, entry in shaping.get('quotas', {}).get(link['name'], {}).items():
+                    status_text += f"     {PERIOD_NAMES[period]}流量 {format_size(entry['used'])} / " \
+                                   f"{format_size(entry['limit'])}\n"
+                if link['name'] in shaping.get('limits', {}):
+                    status_text += f"     限速 {shaping['limits'][link['name']]:g} Mbit/s" \
+                                   f"{'，公平排队' if shaping['fair'] else ''}\n"
+                if status['mode'] == "weighted":
+                    status_text += f"     权重 {link['effective_weight'] / 125000:.1f} Mbit/s，" \
+                                   f"吞吐 {link['throughput'] / 1024:.0f} KB/s\n"
+            if status.get('pool'):
+                pool = status['pool']
+                status_text += f"\n预连接池: 空闲 {pool['idle']} / {pool['size']}，命中率 {pool['hit_rate']:.0%}" \
+                               f"（{pool['hits']} / {pool['hits'] + pool['misses']} 次请求）\n"
+
         messagebox.showinfo("网络叠加状态", status_text)
 
 
 def main():
     """
     程序入口函数
-    创建主窗口并启动应用
+    带子命令运行时转交命令行界面，否则创建主窗口并启动应用
     """
+    if len(sys.argv) > 1:
+        from bonding.cli import main as cli_main
+        return cli_main()
+
     root = tk.Tk()
     app = NetworkBondingApp(root)
     root.mainloop()
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
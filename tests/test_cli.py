@@ -0,0 +1,45 @@
+from bonding import cli
+from bonding.profiles import ProfileStore, make_profile
+
+
+def _params(monkeypatch, tmp_path, argv):
+    monkeypatch.setenv('NETWORK_BONDING_HOME', str(tmp_path))
+    monkeypatch.setattr(cli, '_profile_interfaces', lambda store, profile: ['eth0'])
+    return cli._enable_params(cli.build_parser().parse_args(['enable'] + argv))
+
+
+def test_defaults_without_profile(monkeypatch, tmp_path):
+    params = _params(monkeypatch, tmp_path, ['--iface', 'eth0'])
+    assert params['mode'] == 'round_robin'
+    assert params['listen'] == '127.0.0.1:1080'
+    assert params['probe_interval'] == 0.5
+    assert params['race'] == 0.0
+    assert params['offload'] is False
+    assert params['limits'] == {} and params['quotas'] == {}
+
+
+def test_explicit_flags_override_profile(monkeypatch, tmp_path):
+    monkeypatch.setenv('NETWORK_BONDING_HOME', str(tmp_path))
+    ProfileStore().put('home', make_profile([], mode='weighted', listen='127.0.0.1:1090', sticky=10,
+                                            limits={'eth0': 5.0}, fair=True))
+    params = _params(monkeypatch, tmp_path, ['--profile', 'home', '--mode', 'least_conn',
+                                             '--listen', '127.0.0.1:2000', '--dns', 'auto',
+                                             '--limit', 'wlan0=3', '--race', '250'])
+    assert params['interfaces'] == ['eth0']
+    assert params['mode'] == 'least_conn'
+    assert params['listen'] == '127.0.0.1:2000'
+    assert params['dns'] == ['auto']
+    assert params['race'] == 0.25
+    # 未在命令行给出的沿用档案，限速按接口合并
+    assert params['sticky'] == 10
+    assert params['fair'] is True
+    assert params['limits'] == {'eth0': 5.0, 'wlan0': 3.0}
+
+
+def test_profile_values_used_when_flags_absent(monkeypatch, tmp_path):
+    monkeypatch.setenv('NETWORK_BONDING_HOME', str(tmp_path))
+    ProfileStore().put('home', make_profile([], mode='weighted', probe_interval=2.0, race=0.3))
+    params = _params(monkeypatch, tmp_path, ['--profile', 'home'])
+    assert params['mode'] == 'weighted'
+    assert params['probe_interval'] == 2.0
+    assert params['race'] == 0.3
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import socket
+import stat
+
+import pytest
+
+from bonding.control import ControlClient, ControlError, ControlServer, token_path
+
+
+class Service:
+    """
+    记录被调用命令的假服务
+    """
+    def __init__(self):
+        self.calls = []
+
+    def status(self):
+        self.calls.append('status')
+        return {'enabled': False}
+
+    def request_stop(self):
+        self.calls.append('shutdown')
+
+
+def _exchange(port, *lines):
+    """
+    在一个连接上依次发送各行，返回每行之后读到的应答（对端关闭时为 b''）
+    """
+    replies = []
+    with socket.create_connection(('127.0.0.1', port), 2.0) as sock:
+        f = sock.makefile('rb')
+        for line in lines:
+            try:
+                sock.sendall(line)
+            except OSError:
+                replies.append(b'')
+                continue
+            try:
+                replies.append(f.readline())
+            except OSError:
+                replies.append(b'')
+    return replies
+
+
+def _request(token=None, **request):
+    if token is not None:
+        request['token'] = token
+    return json.dumps(request).encode('utf-8') + b'\n'
+
+
+def _run(tmp_path, check):
+    async def main():
+        service = Service()
+        server = ControlServer(service, '127.0.0.1', 0, token_dir=str(tmp_path))
+        await server.start()
+        try:
+            await asyncio.to_thread(check, server, service)
+        finally:
+            await server.stop()
+        return server
+
+    return asyncio.run(main())
+
+
+def test_correct_token(tmp_path):
+    def check(server, service):
+        path = token_path(server.port, str(tmp_path))
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        client = ControlClient(('127.0.0.1', server.port), token_dir=str(tmp_path))
+        try:
+            assert client.call('ping') == 'pong'
+            assert client.call('status') == {'enabled': False}
+            assert client.alive()
+        finally:
+            client.close()
+        assert service.calls == ['status']
+
+    server = _run(tmp_path, check)
+    assert not os.path.exists(token_path(server.port, str(tmp_path)))
+    assert not ControlClient(('127.0.0.1', server.port), 1.0, token_dir=str(tmp_path)).alive()
+
+
+@pytest.mark.parametrize('token', [None, 'wrong', 1234])
+def test_bad_token_is_rejected_and_disconnected(tmp_path, token):
+    def check(server, service):
+        reply, after = _exchange(server.port, _request(token, cmd='shutdown'),
+                                 _request(server.token, cmd='shutdown'))
+        assert json.loads(reply) == {'ok': False, 'error': "控制接口令牌无效"}
+        # 拒绝后连接即关闭，同一连接上的后续请求不会被执行
+        assert after == b''
+        assert service.calls == []
+
+    _run(tmp_path, check)
+
+
+def test_non_json_line_drops_connection(tmp_path):
+    def check(server, service):
+        request = b'POST / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' + _request(server.token, cmd='shutdown')
+        assert _exchange(server.port, request) == [b'']
+        assert service.calls == []
+
+    _run(tmp_path, check)
+
+
+def test_client_without_token_file(tmp_path):
+    client = ControlClient(('127.0.0.1', 1), token_dir=str(tmp_path))
+    with pytest.raises(ControlError):
+        client.call('ping')
+    assert not client.alive()
@@ -0,0 +1,36 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bonding.engine import BondingEngine
+
+
+INTERFACES = [{'name': 'a', 'ip': '127.0.0.1'}, {'name': 'b', 'ip': '127.0.0.1'}]
+
+
+def test_start_and_stop():
+    engine = BondingEngine(INTERFACES, port=0)
+    engine.start()
+    try:
+        assert engine.status()['listen'].startswith('127.0.0.1:')
+    finally:
+        engine.stop()
+
+
+def test_start_times_out_and_engine_exits():
+    engine = BondingEngine(INTERFACES, port=0)
+    listen = engine.proxy.start
+
+    async def slow_start():
+        await asyncio.sleep(0.3)
+        await listen()
+
+    engine.proxy.start = slow_start
+    with pytest.raises(TimeoutError):
+        engine.start(timeout=0.05)
+    deadline = time.monotonic() + 5
+    while any(thread.name == 'bonding-engine' for thread in threading.enumerate()):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
@@ -0,0 +1,36 @@
+import pytest
+
+from bonding.estimator import LinkEstimator
+from bonding.scheduler import MBIT, Link
+
+
+def test_links_sharing_an_address_are_sampled_separately():
+    links = [Link('eth0', '10.0.0.2'), Link('eth0.100', '10.0.0.2')]
+    estimator = LinkEstimator(links, alpha=1.0)
+    estimator.sample(0.0)
+    links[0].bytes_recv = 1000000
+    links[1].bytes_recv = 200000
+    estimator.sample(1.0)
+    assert links[0].throughput == pytest.approx(1000000)
+    assert links[1].throughput == pytest.approx(200000)
+
+
+def test_address_change_keeps_history():
+    link = Link('wlan0', '10.0.0.2')
+    estimator = LinkEstimator([link], alpha=1.0)
+    estimator.sample(0.0)
+    link.ip = '10.0.0.3'
+    link.bytes_sent = 500000
+    estimator.sample(1.0)
+    assert link.throughput == pytest.approx(500000)
+    assert list(estimator._last) == ['wlan0']
+
+
+def test_weight():
+    link = Link('a', '10.0.0.2', speed=100)
+    estimator = LinkEstimator([link])
+    assert estimator.weight(link) == 100 * MBIT
+    link.rtt = 0.05
+    assert estimator.weight(link) == 50 * MBIT
+    link.weight = 20
+    assert estimator.weight(link) == 20 * MBIT
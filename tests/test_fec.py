@@ -0,0 +1,94 @@
+import asyncio
+
+from bonding.tunnel import FEC_MAX_GROUP, PARITY, FecEncoder, _Receiver, fec_group, xor_payloads
+
+
+PAYLOADS = [b'alpha', b'bravo-charlie', b'', b'd' * 1200, b'echo']
+
+
+def _recover(parity, survivors):
+    count, lengths = PARITY.unpack_from(parity)
+    data = parity[PARITY.size:]
+    payload, length = xor_payloads([data] + survivors)
+    return payload[:length ^ len(data) ^ lengths]
+
+
+def test_xor_payloads_pads_short_payloads():
+    payload, lengths = xor_payloads([b'\x01\x02', b'\x04'])
+    assert payload == b'\x05\x02'
+    assert lengths == 2 ^ 1
+
+
+def test_encoder_emits_parity_when_group_is_full():
+    encoder = FecEncoder(3)
+    assert encoder.add(10, b'a') is None
+    assert encoder.add(11, b'b') is None
+    base, parity = encoder.add(12, b'c')
+    assert base == 10
+    assert PARITY.unpack_from(parity)[0] == 3
+    assert encoder.base is None and encoder.count == 0
+
+
+def test_encoder_disabled_and_flush():
+    assert FecEncoder(0).add(0, b'a') is None
+    encoder = FecEncoder(8)
+    assert encoder.flush() is None
+    encoder.add(5, b'x')
+    encoder.add(6, b'yy')
+    base, parity = encoder.flush()
+    assert base == 5 and PARITY.unpack_from(parity)[0] == 2
+
+
+def test_any_single_loss_is_recovered():
+    encoder = FecEncoder(len(PAYLOADS))
+    for seq, payload in enumerate(PAYLOADS):
+        result = encoder.add(seq, payload)
+    _, parity = result
+    for lost in range(len(PAYLOADS)):
+        survivors = [p for i, p in enumerate(PAYLOADS) if i != lost]
+        assert _recover(parity, survivors) == PAYLOADS[lost]
+
+
+def test_fec_group():
+    assert fec_group(0.0) == 0
+    assert fec_group(0.0005) == 0
+    assert fec_group(0.002) == FEC_MAX_GROUP
+    assert fec_group(0.05) == 1
+    assert fec_group(0.5) == 1
+    assert fec_group(0.01) > fec_group(0.02) > 1
+
+
+def test_receiver_recovers_lost_packet_in_order():
+    async def main():
+        delivered = []
+        receiver = _Receiver(delivered.append, 64, 0.05)
+        encoder = FecEncoder(4)
+        packets = [b'p0', b'p1-longer', b'p2', b'p3']
+        for seq, payload in enumerate(packets):
+            parity = encoder.add(seq, payload)
+        for seq, payload in enumerate(packets):
+            if seq != 1:
+                receiver.data(seq, payload)
+        assert delivered == [b'p0']
+        receiver.parity(*parity)
+        receiver.close()
+        return delivered, receiver.recovered
+
+    delivered, recovered = asyncio.run(main())
+    assert delivered == [b'p0', b'p1-longer', b'p2', b'p3']
+    assert recovered == 1
+
+
+def test_receiver_waits_for_group_when_parity_arrives_first():
+    async def main():
+        delivered = []
+        receiver = _Receiver(delivered.append, 64, 0.05)
+        encoder = FecEncoder(2)
+        encoder.add(0, b'a')
+        parity = encoder.add(1, b'bc')
+        receiver.parity(*parity)
+        receiver.data(1, b'bc')
+        receiver.close()
+        return delivered, receiver.recovered
+
+    assert asyncio.run(main()) == ([b'a', b'bc'], 1)
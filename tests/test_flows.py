@@ -0,0 +1,91 @@
+import pytest
+
+from bonding.flows import WHEEL_SIZE, FlowTable
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_put_get_and_counts():
+    table = FlowTable(timeout=10, clock=Clock())
+    table.put('a', 0)
+    table.put('b', 1)
+    table.put('c', 1)
+    assert table.get('a') == 0
+    assert table.get('missing') is None
+    assert table.counts() == [1, 2]
+    table.put('c', 0)
+    assert table.counts() == [2, 1]
+    assert table.remove('a') and not table.remove('a')
+    assert table.count(0) == 1 and table.count(5) == 0
+    assert len(table) == 2
+
+
+def test_idle_entries_expire():
+    clock = Clock()
+    table = FlowTable(timeout=10, tick=1, clock=clock)
+    table.put('idle', 0)
+    table.put('busy', 1)
+    for _ in range(4):
+        clock.now += 3
+        assert table.get('busy') == 1
+    assert 'idle' not in table
+    assert table.stats()['evicted_idle'] == 1
+    clock.now += 12
+    assert table.expire() == 1
+    assert len(table) == 0 and table.counts() == [0, 0]
+
+
+def test_timeout_longer_than_one_wheel_turn():
+    clock = Clock()
+    table = FlowTable(timeout=WHEEL_SIZE * 3, tick=1, clock=clock)
+    table.put('a', 0)
+    clock.now += WHEEL_SIZE * 2
+    assert table.expire() == 0 and 'a' in table
+    clock.now += WHEEL_SIZE + 2
+    assert table.expire() == 1
+
+
+def test_lru_eviction_when_full():
+    table = FlowTable(timeout=10, capacity=3, clock=Clock())
+    for key in 'abc':
+        table.put(key, 0)
+    table.get('a')
+    table.put('d', 1)
+    assert 'b' not in table
+    assert all(key in table for key in 'acd')
+    assert table.stats()['evicted_lru'] == 1
+    assert table.counts() == [2, 1]
+
+
+def test_slots_are_reused():
+    clock = Clock()
+    table = FlowTable(timeout=10, capacity=2, tick=1, clock=clock)
+    for i in range(100):
+        table.put(i, i % 2)
+        clock.now += 1
+    assert len(table._keys) <= 3
+    assert len(table) == 2 and set(table._index) == {98, 99}
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        FlowTable(capacity=0)
+
+
+def test_expiry_with_advances_spanning_several_ticks():
+    for step in (3, 5, 7):
+        clock = Clock(0.0)
+        table = FlowTable(timeout=1000, tick=1, clock=clock)
+        table.put('a', 0)
+        clock.now = 2.0
+        while clock.now < 1500:
+            table.expire()
+            clock.now += step
+        assert len(table) == 0, step
+        assert table.stats()['evicted_idle'] == 1
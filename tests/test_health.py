@@ -0,0 +1,94 @@
+import asyncio
+
+from bonding.health import HealthChecker, UdpEchoProbe, start_udp_echo_server
+from bonding.scheduler import Link, Scheduler
+
+
+class EchoStandIn:
+    """
+    127.0.0.1 上可随时停止、重新启动（端口不变）的 UDP 回显服务
+    """
+    async def start(self, port=0):
+        self.transport = await start_udp_echo_server('127.0.0.1', port)
+        self.port = self.transport.get_extra_info('sockname')[1]
+        return self
+
+    def stop(self):
+        self.transport.close()
+
+    async def restart(self):
+        await self.start(self.port)
+
+
+async def _checker(**options):
+    echo = await EchoStandIn().start()
+    links = [Link('a', '127.0.0.2'), Link('b', '127.0.0.3')]
+    changes = []
+    checker = HealthChecker(links, UdpEchoProbe('127.0.0.1', echo.port), interval=0.1, timeout=0.2,
+                            on_change=lambda link, up: changes.append((link.name, up)), **options)
+    return echo, links, checker, changes
+
+
+async def _probe(checker, link, times=1):
+    for _ in range(times):
+        await checker.probe_once(checker.health[link.name])
+
+
+def test_up_suspect_down_up():
+    async def main():
+        echo, links, checker, changes = await _checker(rise=3, fall=2, window=6)
+        a, b = links
+        scheduler = Scheduler(links, 'round_robin')
+        try:
+            await _probe(checker, a, 2)
+            await _probe(checker, b)
+            assert a.up and not a.suspect and a.loss == 0.0 and a.rtt is not None
+
+            echo.stop()
+            await _probe(checker, a)
+            # 一次失败：仍在线，但新连接避开它
+            assert a.up and a.suspect
+            assert {scheduler.select().name for _ in range(10)} == {'b'}
+            assert changes == []
+
+            await _probe(checker, a)
+            assert not a.up and checker.health['a'].failures == 2
+            assert changes == [('a', False)]
+
+            await echo.restart()
+            await _probe(checker, a, 2)
+            # 连续成功次数不足 rise，仍保持下线
+            assert not a.up and not a.suspect and checker.health['a'].successes == 2
+            await _probe(checker, a)
+            assert a.up
+            assert changes == [('a', False), ('a', True)]
+            assert abs(a.loss - 2 / 6) < 1e-9
+            assert b.up and checker.health['b'].failures == 0
+        finally:
+            await checker.stop()
+            echo.stop()
+
+    asyncio.run(main())
+
+
+def test_loss_over_window_takes_link_down():
+    async def main():
+        echo, links, checker, changes = await _checker(rise=3, fall=3, window=4, max_loss=0.3)
+        a = links[0]
+        try:
+            await _probe(checker, a)
+            echo.stop()
+            await _probe(checker, a)
+            await echo.restart()
+            await _probe(checker, a)
+            # 从未连续失败 fall 次，但窗口丢包率 1/3 超过 max_loss
+            assert checker.health['a'].failures == 0
+            assert not a.up and changes == [('a', False)]
+            await _probe(checker, a, 2)
+            assert a.up and a.loss == 0.25
+            assert changes == [('a', False), ('a', True)]
+        finally:
+            await checker.stop()
+            echo.stop()
+
+    asyncio.run(main())
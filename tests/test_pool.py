@@ -0,0 +1,109 @@
+import asyncio
+
+from bonding.pool import ConnectionPool
+from bonding.scheduler import Link
+
+
+class FakeReader:
+    def __init__(self):
+        self.eof = False
+
+    def at_eof(self):
+        return self.eof
+
+
+class FakeWriter:
+    def __init__(self):
+        self.closed = False
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def _links():
+    return [Link('fast', '10.0.0.1', weight=30), Link('slow', '10.0.0.2', weight=10)]
+
+
+def test_targets_follow_link_weight_and_demand():
+    pool = ConnectionPool(None, _links(), size=8)
+    pool.demand[('a.example', 443)] = 30
+    pool.demand[('b.example', 443)] = 10
+    pool.demand[('rare.example', 443)] = 0.5
+    targets = pool.targets()
+    assert targets == {('fast', 'a.example', 443): 5, ('fast', 'b.example', 443): 1,
+                       ('slow', 'a.example', 443): 2}
+
+
+def test_targets_skip_down_links():
+    links = _links()
+    links[0].up = False
+    pool = ConnectionPool(None, links, size=8)
+    pool.demand[('a.example', 443)] = 5
+    assert set(pool.targets()) == {('slow', 'a.example', 443)}
+    assert ConnectionPool(None, links).targets() == {}
+
+
+def test_maintain_warms_and_take_hands_out_once():
+    async def main():
+        links = _links()
+        connected = []
+
+        async def connect(link, host, port):
+            connected.append((link.name, host, port))
+            return FakeReader(), FakeWriter()
+
+        pool = ConnectionPool(connect, links, size=2)
+        assert pool.take(links[0], 'a.example', 443) is None
+        pool.demand[('a.example', 443)] = 5
+        pool.maintain()
+        await asyncio.sleep(0)
+        assert sorted(connected) == [('fast', 'a.example', 443), ('slow', 'a.example', 443)]
+        assert pool.take(links[0], 'a.example', 443) is not None
+        assert pool.take(links[0], 'a.example', 443) is None
+        await pool.close()
+        return pool.stats()
+
+    stats = asyncio.run(main())
+    assert stats['hits'] == 1 and stats['misses'] == 2
+    assert stats['idle'] == 0
+
+
+def test_take_discards_closed_connections():
+    async def main():
+        link = _links()[0]
+
+        async def connect(link, host, port):
+            return FakeReader(), FakeWriter()
+
+        pool = ConnectionPool(connect, [link], size=1)
+        pool.demand[('a.example', 443)] = 5
+        pool.maintain()
+        await asyncio.sleep(0)
+        (_, reader, _), = pool._idle[('fast', 'a.example', 443)]
+        reader.eof = True
+        return pool.take(link, 'a.example', 443)
+
+    assert asyncio.run(main()) is None
+
+
+def test_failed_target_backs_off():
+    async def main():
+        link = _links()[0]
+        attempts = []
+
+        async def connect(link, host, port):
+            attempts.append(host)
+            raise OSError("refused")
+
+        pool = ConnectionPool(connect, [link], size=1)
+        pool.demand[('a.example', 443)] = 5
+        pool.maintain()
+        await asyncio.sleep(0)
+        pool.maintain()
+        await asyncio.sleep(0)
+        return attempts, pool.stats()['warming']
+
+    assert asyncio.run(main()) == (['a.example'], 0)
@@ -0,0 +1,70 @@
+import asyncio
+import errno
+import socket
+import struct
+
+import pytest
+
+from bonding.relay import HAS_SPLICE, pipe, relay
+from bonding.scheduler import Link
+
+
+class FailingReader:
+    def __init__(self, error):
+        self.error = error
+
+    async def read(self, size):
+        raise self.error
+
+
+class Writer:
+    def __init__(self):
+        self.eof = False
+
+    def can_write_eof(self):
+        return True
+
+    def write_eof(self):
+        self.eof = True
+
+
+@pytest.mark.parametrize('error', [TimeoutError(errno.ETIMEDOUT, "timed out"),
+                                   OSError(errno.EHOSTUNREACH, "no route"), ConnectionResetError()])
+def test_pipe_treats_socket_errors_as_end_of_stream(error):
+    writer = Writer()
+    asyncio.run(pipe(FailingReader(error), writer, Link('a', '127.0.0.1'), 'sent'))
+    assert writer.eof
+
+
+async def _connection():
+    """
+    返回回环上一条 TCP 连接两端的 (reader, writer)
+    """
+    accepted = asyncio.get_running_loop().create_future()
+    server = await asyncio.start_server(lambda r, w: accepted.set_result((r, w)), '127.0.0.1', 0)
+    near = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+    far = await accepted
+    server.close()
+    return near, far
+
+
+@pytest.mark.parametrize('mode', ['stream', 'buffer'] + (['splice'] if HAS_SPLICE else []))
+def test_relay_forwards_and_ends_quietly_on_reset(mode):
+    async def main():
+        link = Link('a', '127.0.0.1')
+        (app_r, app_w), (client_r, client_w) = await _connection()
+        (remote_r, remote_w), (server_r, server_w) = await _connection()
+        task = asyncio.ensure_future(relay(client_r, client_w, remote_r, remote_w, link, mode))
+        app_w.write(b'hello')
+        assert await server_r.readexactly(5) == b'hello'
+        server_w.write(b'world')
+        assert await app_r.readexactly(5) == b'world'
+        # 远端异常断开（RST），转发应正常结束而不是抛出异常
+        server_w.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        server_w.close()
+        await asyncio.wait_for(app_r.read(), 5)
+        app_w.close()
+        await asyncio.wait_for(task, 5)
+        return link.bytes_sent, link.bytes_recv
+
+    assert asyncio.run(main()) == (5, 5)
@@ -0,0 +1,80 @@
+import socket
+import struct
+
+import pytest
+
+from bonding.resolver import (HEADER, QTYPE_A, QTYPE_AAAA, RCODE_NXDOMAIN, RECORD, DnsCache, build_query,
+                              parse_response, server_address)
+
+
+def _answer(query, records, rcode=0):
+    """
+    由查询构造应答：答案段的名称用指向问题段的压缩指针
+    """
+    qid = HEADER.unpack_from(query)[0]
+    body = b''.join(b'\xc0\x0c' + RECORD.pack(rtype, 1, ttl, len(rdata)) + rdata for rtype, ttl, rdata in records)
+    return HEADER.pack(qid, 0x8180 | rcode, 1, len(records), 0, 0) + query[HEADER.size:] + body
+
+
+def test_build_query():
+    query = build_query(0x1234, 'www.example.com', QTYPE_A)
+    assert HEADER.unpack_from(query) == (0x1234, 0x0100, 1, 0, 0, 0)
+    assert query[HEADER.size:] == b'\x03www\x07example\x03com\x00' + struct.pack('!HH', QTYPE_A, 1)
+
+
+def test_build_query_idna():
+    assert b'xn--' in build_query(1, '例子.测试', QTYPE_A)
+
+
+@pytest.mark.parametrize('name', ['a..b', 'x' * 64 + '.com', ''])
+def test_build_query_rejects_invalid_names(name):
+    with pytest.raises(socket.gaierror):
+        build_query(1, name, QTYPE_A)
+
+
+def test_parse_a_records_with_cname():
+    query = build_query(7, 'example.com', QTYPE_A)
+    cname = b'\x03cdn\xc0\x0c'
+    data = _answer(query, [(5, 600, cname), (QTYPE_A, 120, bytes([1, 2, 3, 4])), (QTYPE_A, 60, bytes([5, 6, 7, 8]))])
+    assert parse_response(data, QTYPE_A) == (0, ['1.2.3.4', '5.6.7.8'], 60)
+
+
+def test_parse_aaaa_ignores_other_types():
+    query = build_query(7, 'example.com', QTYPE_AAAA)
+    data = _answer(query, [(QTYPE_A, 30, bytes(4)), (QTYPE_AAAA, 300, socket.inet_pton(socket.AF_INET6, '2001:db8::1'))])
+    assert parse_response(data, QTYPE_AAAA) == (0, ['2001:db8::1'], 30)
+
+
+def test_parse_nxdomain():
+    query = build_query(7, 'missing.example', QTYPE_A)
+    rcode, addresses, _ = parse_response(_answer(query, [], rcode=RCODE_NXDOMAIN), QTYPE_A)
+    assert rcode == RCODE_NXDOMAIN and addresses == []
+
+
+@pytest.mark.parametrize('cut', [4, 20, -2])
+def test_parse_truncated(cut):
+    query = build_query(7, 'example.com', QTYPE_A)
+    data = _answer(query, [(QTYPE_A, 60, bytes([1, 2, 3, 4]))])
+    with pytest.raises(ValueError):
+        parse_response(data[:cut], QTYPE_A)
+
+
+def test_server_address():
+    assert server_address('223.5.5.5') == ('223.5.5.5', 53)
+    assert server_address('127.0.0.1:5353') == ('127.0.0.1', 5353)
+    assert server_address('[::1]:5353') == ('::1', 5353)
+    assert server_address('2001:db8::53') == ('2001:db8::53', 53)
+    with pytest.raises(ValueError):
+        server_address('dns.example')
+
+
+def test_cache_ttl_and_lru():
+    cache = DnsCache(capacity=2)
+    cache.put('a', ['1.1.1.1'], 10, now=0)
+    cache.put('b', ['2.2.2.2'], 10, now=0)
+    cache.put('zero', ['3.3.3.3'], 0, now=0)
+    assert cache.get('a', 5) == ['1.1.1.1']
+    cache.put('c', ['4.4.4.4'], 10, now=5)
+    assert cache.get('b', 5) is None
+    assert cache.get('a', 11) is None
+    assert len(cache) == 1
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from bonding.shaper import MIN_BURST, Flow, LinkQueue, TokenBucket, format_size, parse_quota, parse_size
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1048576', 1048576),
+    ('500M', 500 << 20),
+    ('2g', 2 << 30),
+    ('1.5GB', 3 << 29),
+    ('10 KiB', 10 << 10),
+    (' 1T ', 1 << 40),
+])
+def test_parse_size(text, expected):
+    assert parse_size(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', 'G', '-1G', '2X', '1.5.2M'])
+def test_parse_size_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        parse_size(text)
+
+
+def test_parse_quota():
+    assert parse_quota('2G/day') == ('day', 2 << 30)
+    assert parse_quota('30G/Month') == ('month', 30 << 30)
+    for text in ('2G', '2G/week', '0/day', '/day'):
+        with pytest.raises(ValueError):
+            parse_quota(text)
+
+
+def test_format_size():
+    assert format_size(512) == "512 B"
+    assert format_size(1536) == "1.5 KB"
+    assert format_size(3 << 30) == "3.0 GB"
+
+
+def test_token_bucket_debt_and_refill():
+    bucket = TokenBucket(1000, burst=2000, now=0.0)
+    assert bucket.take(5000, 0.0)
+    assert bucket.tokens == -3000
+    assert not bucket.take(1, 1.0)
+    assert bucket.delay() == pytest.approx(2.001)
+    assert bucket.take(100, 3.5)
+    bucket.refill(100.0)
+    assert bucket.tokens == 2000
+
+
+def test_token_bucket_default_burst():
+    assert TokenBucket(1000).burst == MIN_BURST
+    assert TokenBucket(1e9).burst == 1e9 * 0.05
+
+
+class FakeShaper:
+    """
+    只记录唤醒请求的整形器，由测试手动推进时间并调用 dispatch
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.clock = 0.0
+        self.grants = 0
+        self.delayed = 0
+        self.wakes = []
+
+    def now(self):
+        return self.clock
+
+    def wake(self, queue, delay):
+        self.wakes.append(delay)
+
+
+def _order(fair):
+    shaper = FakeShaper()
+    try:
+        queue = LinkQueue(shaper, 1000, fair)
+        bulk, interactive = Flow(queue, queue), Flow(queue, queue)
+        assert queue.request(bulk, 'sent', MIN_BURST + 4000) is None
+        done = []
+        for name, flow, count in (('bulk1', bulk, 10000), ('bulk2', bulk, 10000), ('ssh', interactive, 100)):
+            queue.request(flow, 'sent', count).add_done_callback(lambda _, name=name: done.append(name))
+        assert shaper.wakes == [pytest.approx(4.001)]
+        shaper.clock = 100.0
+        queue.dispatch(shaper.now())
+        shaper.loop.run_until_complete(asyncio.sleep(0))
+        return done, shaper, len(queue.waiting)
+    finally:
+        shaper.loop.close()
+
+
+def test_fifo_queue_keeps_small_flow_behind_bulk():
+    done, shaper, waiting = _order(fair=False)
+    # 两个大块放行后令牌又变为负数，交互连接的小块还要继续等
+    assert done == ['bulk1', 'bulk2']
+    assert waiting == 1
+    assert shaper.grants == 3 and shaper.delayed == 3
+
+
+def test_fair_queue_lets_small_flow_jump_ahead():
+    done, _, waiting = _order(fair=True)
+    assert done == ['ssh', 'bulk1', 'bulk2']
+    assert waiting == 0
+
+
+def test_cancelled_request_does_not_consume_tokens():
+    shaper = FakeShaper()
+    try:
+        queue = LinkQueue(shaper, 1000)
+        flow = Flow(queue, queue)
+        queue.request(flow, 'sent', MIN_BURST + 1)
+        waiter = queue.request(flow, 'sent', 500)
+        waiter.cancel()
+        shaper.clock = 100.0
+        queue.dispatch(shaper.now())
+        assert queue.bucket.tokens == MIN_BURST
+        assert not queue.waiting
+    finally:
+        shaper.loop.close()
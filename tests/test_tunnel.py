@@ -0,0 +1,165 @@
+import asyncio
+import socket
+
+from bonding import datagram
+from bonding.health import start_udp_echo_server
+from bonding.scheduler import Link
+from bonding.tunnel import (HEADER, MAGIC, PING, TYPE_CHALLENGE, TYPE_DATA, TYPE_PING, ReorderBuffer, TunnelClient,
+                            TunnelPeer)
+
+
+def _buffer(window=8, delay=0.05):
+    delivered = []
+    return ReorderBuffer(delivered.append, window, delay), delivered
+
+
+def test_reorder_in_order():
+    buffer, delivered = _buffer()
+    for seq in range(5):
+        buffer.push(seq, seq, 0.0)
+    assert delivered == [0, 1, 2, 3, 4]
+    assert buffer.stats()['reordered'] == 0
+
+
+def test_reorder_restores_order_and_counts_duplicates():
+    buffer, delivered = _buffer()
+    for seq in (1, 2, 2, 0, 1, 3):
+        buffer.push(seq, seq, 0.0)
+    assert delivered == [0, 1, 2, 3]
+    stats = buffer.stats()
+    assert stats['reordered'] == 2
+    assert stats['duplicates'] == 1
+    assert stats['late'] == 1
+    assert stats['max_depth'] == 2
+
+
+def test_reorder_gap_expires_after_delay():
+    buffer, delivered = _buffer(delay=0.05)
+    buffer.push(0, 0, 0.0)
+    buffer.push(2, 2, 1.0)
+    assert buffer.expire(1.01) == 1.05
+    assert delivered == [0]
+    assert buffer.expire(1.06) is None
+    assert delivered == [0, 2]
+    buffer.push(1, 1, 1.07)
+    assert buffer.stats()['lost'] == 1
+    assert buffer.stats()['late'] == 1
+
+
+def test_reorder_window_overflow_skips_gap():
+    buffer, delivered = _buffer(window=2)
+    for seq in (1, 2, 3):
+        buffer.push(seq, seq, 0.0)
+    assert delivered == [1, 2, 3]
+    assert buffer.stats()['lost'] == 1
+    assert buffer.depth == 0
+
+
+def test_reorder_reset():
+    buffer, delivered = _buffer()
+    buffer.push(0, 0, 0.0)
+    buffer.push(5, 5, 0.0)
+    buffer.reset()
+    buffer.push(0, 'again', 0.0)
+    assert delivered == [0, 'again']
+    assert buffer.depth == 0
+
+
+class _Harness:
+    """
+    本地程序 -> 隧道客户端（两条回环链路）-> 对端 -> UDP 回显，统计原路返回的数据报
+    """
+    async def start(self):
+        self.echo = await start_udp_echo_server('127.0.0.1', 0)
+        self.peer = await self.start_peer(('127.0.0.1', 0))
+        self.client = await self.start_client()
+        return self
+
+    async def start_peer(self, listen):
+        peer = TunnelPeer(listen, self.echo.get_extra_info('sockname')[:2], fec='off')
+        await peer.start()
+        return peer
+
+    async def start_client(self):
+        self.replies = []
+        client = TunnelClient([Link('lo-a', '127.0.0.2'), Link('lo-b', '127.0.0.3')], self.peer.listen, fec='off')
+        await client.start()
+        self.app = await datagram.open_endpoint(lambda data, addr: self.replies.append(data),
+                                                remote_addr=client.listen)
+        return client
+
+    async def exchange(self, tag, count=20):
+        """
+        发出 count 个数据报，返回收到的回包数
+        """
+        before = len(self.replies)
+        for i in range(count):
+            self.app.sendto(f'{tag}-{i}'.encode())
+            await asyncio.sleep(0.002)
+        for _ in range(50):
+            if len(self.replies) - before >= count:
+                break
+            await asyncio.sleep(0.01)
+        return len(self.replies) - before
+
+    async def stop(self):
+        self.app.close()
+        await self.client.stop()
+        await self.peer.stop()
+        self.echo.close()
+
+
+def test_peer_restart_resets_client_receiver():
+    async def main():
+        h = await _Harness().start()
+        try:
+            assert await h.exchange('before') == 20
+            listen = h.peer.listen
+            await h.peer.stop()
+            h.peer = await h.start_peer(listen)
+            assert await h.exchange('after') == 20
+            assert h.client.peer_epoch == h.peer.epoch
+            assert h.client.stats()['reorder']['duplicates'] == 0
+        finally:
+            await h.stop()
+
+    asyncio.run(main())
+
+
+def test_new_client_takes_over_after_challenge():
+    async def main():
+        h = await _Harness().start()
+        try:
+            assert await h.exchange('first') == 20
+            old = h.client.session
+            h.app.close()
+            await h.client.stop()
+            h.client = await h.start_client()
+            await asyncio.sleep(0.1)
+            assert await h.exchange('second') == 20
+            assert h.peer.session == h.client.session != old
+        finally:
+            await h.stop()
+
+    asyncio.run(main())
+
+
+def test_spoofed_session_does_not_interrupt_tunnel():
+    async def main():
+        h = await _Harness().start()
+        spoofer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        spoofer.settimeout(1.0)
+        try:
+            assert await h.exchange('first') == 20
+            session = h.peer.session
+            spoofer.sendto(HEADER.pack(MAGIC, TYPE_DATA, 0, session ^ 1, 0, 0, 0) + b'x', h.peer.listen)
+            spoofer.sendto(HEADER.pack(MAGIC, TYPE_PING, 0, session ^ 1, 0, 0, 0) + PING.pack(0.0), h.peer.listen)
+            challenge = await asyncio.get_running_loop().run_in_executor(None, spoofer.recv, 2048)
+            assert HEADER.unpack_from(challenge)[1] == TYPE_CHALLENGE
+            assert h.peer.session == session
+            assert await h.exchange('second') == 20
+        finally:
+            spoofer.close()
+            await h.stop()
+
+    asyncio.run(main())